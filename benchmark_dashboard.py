@@ -0,0 +1,485 @@
+"""
+Banc de performance du dashboard SAP sur des données synthétiques.
+
+Génère les huit sources (hitlist_db, usertcode, memory, times, tasktimes, performance,
+sql_trace_summary, usr02) au schéma des extractions réelles, à des volumes configurables,
+puis chronomètre chaque étape : lecture, nettoyage, index précalculés, filtres, agrégations
+et construction des figures par section. Le pic d'allocation de chaque étape est mesuré avec
+tracemalloc. Les résultats sont écrits en JSON pour suivre les régressions entre versions.
+
+Exemples :
+    python benchmark_dashboard.py --sizes 10k,100k
+    python benchmark_dashboard.py --sizes 1M,10M --no-files --output bench_1M_10M.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.figure_factory as ff
+
+import sap_analytics as sa
+import sap_retention as sr
+
+# Nombre de lignes de chaque source pour une taille nominale N (les extractions TIMES, TASKTIMES,
+# AL_GET_PERFORMANCE ou USR02 sont naturellement bien plus petites que les pas de dialogue).
+SOURCE_ROW_RATIOS = {
+    'hitlist_db': 1.0,
+    'usertcode': 1.0,
+    'memory': 0.5,
+    'sql_trace_summary': 0.2,
+    'times': 0.05,
+    'usr02': 0.02,
+    'tasktimes': 0.01,
+    'performance': 0.001,
+}
+MIN_SOURCE_ROWS = 20
+
+BENCH_TASKTYPES = ['DIALOG', 'BACKGROUND', 'RFC', 'UPDATE', 'UPDATE2', 'SPOOL', 'HTTP', 'AUTOCCMS',
+                   'BUFFER SYNC', 'AUTO ABAP', 'ALE', 'BGRFC']
+BENCH_SERVERS = ['ECC-VE7-00', 'ECC-VE7-01', 'ECC-VE7-02', 'ECC-VE7-03']
+BENCH_CONCURRENT_SESSIONS = 8
+BENCH_WP_TYPES = ['DIA', 'BTC', 'UPD', 'UP2', 'SPO']
+BENCH_WP_STATUS = ['Waiting', 'Running', 'On Hold', 'Stopped']
+BENCH_SQL_TEMPLATES = [
+    'SELECT WHERE "MANDT"=:A0 AND "{col}"=\'{val}\'',
+    'SELECT WHERE "{col}" IN ({val},{val2},{val3})',
+    'SELECT WHERE "{col}"=:A0 AND "DDLANGUAGE"=:A1 AND "AS4LOCAL"=:A2',
+    'UPDATE SET "{col}"=\'{val}\' WHERE "MANDT"=:A0',
+    'INSERT INTO "{col}" VALUES ({val},{val2})',
+    'DELETE WHERE "{col}" < {val}',
+]
+BENCH_SQL_COLUMNS = ['ROLLNAME', 'TABNAME', 'VBELN', 'MATNR', 'KUNNR', 'BUKRS', 'EBELN', 'OBJNR']
+
+def parse_size(text):
+    """'10k', '1M', '50M' ou '2500' -> nombre de lignes."""
+    text = text.strip().lower()
+    factor = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+def source_rows(n_rows):
+    return {key: max(MIN_SOURCE_ROWS, int(n_rows * ratio)) for key, ratio in SOURCE_ROW_RATIOS.items()}
+
+# --- Générateurs synthétiques (colonnes brutes, avant nettoyage) ---
+
+def _pick(rng, pool, n):
+    """Tirage de n valeurs d'un pool de chaînes, distribution de Zipf tronquée (quelques valeurs dominantes)."""
+    pool = np.asarray(pool, dtype=object)
+    codes = (rng.zipf(1.3, n) - 1) % len(pool)
+    return pool[codes]
+
+def _durations_ms(rng, n, median):
+    return rng.lognormal(np.log(median), 1.2, n).astype(np.int64)
+
+def _counts(rng, n, mean):
+    return rng.poisson(mean, n).astype(np.int64)
+
+def _end_date_time(rng, n, days):
+    seconds = np.sort(rng.integers(0, days * 86400, n))
+    stamps = pd.Timestamp('2025-06-01') + pd.to_timedelta(seconds, unit='s')
+    return (stamps.year * 10000 + stamps.month * 100 + stamps.day).to_numpy(), \
+           (stamps.hour * 10000 + stamps.minute * 100 + stamps.second).to_numpy()
+
+def _accounts(n_rows):
+    return [f"USR{i:05d}" for i in range(int(np.clip(n_rows // 2000, 50, 20000)))]
+
+def _numeric_columns(rng, n, columns):
+    """Colonnes numériques génériques : temps (*TI, *TIME) log-normaux, le reste en comptages."""
+    data = {}
+    for col in columns:
+        if col.endswith(('TI', 'TIME')):
+            data[col] = _durations_ms(rng, n, 50)
+        elif col in ('USEDBYTES', 'MAXBYTES', 'MAXBYTESDI', 'MEMSUM', 'PRIVSUM', 'MAXROLL'):
+            data[col] = _durations_ms(rng, n, 4_000_000)
+        else:
+            data[col] = _counts(rng, n, 20)
+    return data
+
+def generate_dialog_steps(rng, n, days, numeric_columns):
+    """hitlist_db / usertcode : pas de dialogue horodatés par compte, rapport et type de tâche."""
+    end_date, end_time = _end_date_time(rng, n, days)
+    data = {'ENDDATE': end_date, 'ENDTIME': end_time,
+            'TASKTYPE': _pick(rng, BENCH_TASKTYPES, n),
+            'ACCOUNT': _pick(rng, _accounts(n), n),
+            'REPORT': _pick(rng, [f"Z_REPORT_{i:04d}" for i in range(500)], n),
+            'ENTRY_ID': _pick(rng, [f"TCODE{i:04d}" for i in range(800)], n),
+            'WPID': rng.integers(0, 60, n).astype(str).astype(object)}
+    data.update(_numeric_columns(rng, n, numeric_columns))
+    data['RESPTI'] = _durations_ms(rng, n, 400)
+    data['CPUTI'] = (data['RESPTI'] * rng.uniform(0.05, 0.6, n)).astype(np.int64)
+    return pd.DataFrame(data)
+
+def generate_memory(rng, n, days):
+    data = {'TASKTYPE': _pick(rng, BENCH_TASKTYPES, n),
+            'ENTRY_ID': _pick(rng, [f"TCODE{i:04d}" for i in range(800)], n),
+            'ACCOUNT': _pick(rng, _accounts(n * 2), n),
+            'MANDT': _pick(rng, ['100', '200', '620'], n)}
+    data.update(_numeric_columns(rng, n, sa.SOURCE_NUMERIC_COLUMNS['memory']))
+    return pd.DataFrame(data)
+
+def generate_times(rng, n, days, numeric_columns, with_entry_id=True):
+    data = {'TASKTYPE': _pick(rng, BENCH_TASKTYPES, n),
+            'TIME': _pick(rng, sa.TIMES_HOURLY_CATEGORIES, n)}
+    if with_entry_id:
+        data['ENTRY_ID'] = _pick(rng, [f"TCODE{i:04d}" for i in range(800)], n)
+    data.update(_numeric_columns(rng, n, numeric_columns))
+    return pd.DataFrame(data)
+
+def generate_performance(rng, n, days):
+    cpu_seconds = rng.integers(0, 3600, n)
+    return pd.DataFrame({
+        'WP_NO': np.arange(n), 'WP_SEMSTAT': 0, 'WP_IACTION': 0,
+        'WP_CPU': [f"{s // 60}:{s % 60:02d}" for s in cpu_seconds],
+        'WP_ITYPE': rng.integers(1, 6, n), 'WP_RESTART': _pick(rng, ['Yes', 'No'], n),
+        'WP_IRESTRT': rng.integers(0, 3, n), 'WP_IWAIT': rng.integers(0, 5000, n),
+        'WP_STATUS': _pick(rng, BENCH_WP_STATUS, n), 'WP_ISTATUS': rng.integers(1, 5, n),
+        'WP_PID': rng.integers(10000, 99999, n), 'WP_TYP': _pick(rng, BENCH_WP_TYPES, n),
+        'WP_INDEX': np.arange(n),
+    })
+
+def _sap_number(values):
+    """Nombres au format des extractions SAP : séparateur décimal ',' et cadrage à droite."""
+    return pd.Series(np.round(values, 3)).map('{:>10.3f}'.format).str.replace('.', ',', regex=False)
+
+def generate_sql_trace_summary(rng, n, days):
+    # Peu de formes distinctes, beaucoup de littéraux : c'est ce que la normalisation doit regrouper.
+    template = rng.integers(0, len(BENCH_SQL_TEMPLATES), n)
+    column = rng.integers(0, len(BENCH_SQL_COLUMNS), n)
+    literal = rng.integers(0, 1_000_000, n)
+    statements = [BENCH_SQL_TEMPLATES[t].format(col=BENCH_SQL_COLUMNS[c], val=v, val2=v + 1, val3=v + 2)
+                  for t, c, v in zip(template, column, literal)]
+    total_exec = rng.integers(1, 5000, n)
+    exec_time = _durations_ms(rng, n, 50_000)
+    records = total_exec * rng.integers(1, 20, n)
+    return pd.DataFrame({
+        'SQLSTATEM': statements, 'TOTALEXEC': total_exec, 'IDENTSEL': rng.integers(0, 100, n),
+        'EXECTIME': exec_time, 'RECPROCNUM': records,
+        'TIMEPEREXE': _sap_number(exec_time / total_exec), 'RECPEREXE': records / total_exec,
+        'AVGTPERREC': _sap_number(exec_time / records), 'MINTPERREC': _sap_number(rng.uniform(1, 50, n)),
+        'SERVERNAME': _pick(rng, BENCH_SERVERS, n),
+        'TRANS_ID': [f"{x:032X}" for x in rng.integers(0, 2**62, n)],
+    })
+
+def generate_usr02(rng, n, days):
+    last_logon = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 900, n), unit='D')
+    gltgb = (last_logon.year * 10000 + last_logon.month * 100 + last_logon.day).to_numpy()
+    gltgb[rng.random(n) < 0.3] = 0
+    return pd.DataFrame({'BNAME': [f"USR{i:05d}    " for i in range(n)], 'GLTGB': gltgb,
+                         'USTYP': _pick(rng, ['A', 'B', 'C', 'S'], n)})
+
+SOURCE_GENERATORS = {
+    'hitlist_db': lambda rng, n, days: generate_dialog_steps(rng, n, days, sa.SOURCE_NUMERIC_COLUMNS['hitlist_db']),
+    'usertcode': lambda rng, n, days: generate_dialog_steps(rng, n, days, sa.SOURCE_NUMERIC_COLUMNS['usertcode']),
+    'memory': generate_memory,
+    'times': lambda rng, n, days: generate_times(rng, n, days, sa.SOURCE_NUMERIC_COLUMNS['times']),
+    'tasktimes': lambda rng, n, days: generate_times(rng, n, days, sa.SOURCE_NUMERIC_COLUMNS['tasktimes'], with_entry_id=False),
+    'performance': generate_performance,
+    'sql_trace_summary': generate_sql_trace_summary,
+    'usr02': generate_usr02,
+}
+
+def generate_sources(n_rows, seed=0, days=7):
+    """Huit DataFrames bruts au schéma des extractions, dimensionnés par SOURCE_ROW_RATIOS."""
+    rng = np.random.default_rng(seed)
+    return {key: SOURCE_GENERATORS[key](rng, rows, days) for key, rows in source_rows(n_rows).items()}
+
+# --- Mesure ---
+
+def measure(fn, repeat=1):
+    """Exécute fn `repeat` fois ; retourne (dernier résultat, {'seconds': min, 'peak_mb': max}) via tracemalloc."""
+    timings, peaks, result = [], [], None
+    for _ in range(repeat):
+        result = None
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+        peaks.append(max(tracemalloc.get_traced_memory()[1] - baseline, 0))
+    return result, {'seconds': round(min(timings), 6), 'peak_mb': round(max(peaks) / 2**20, 3)}
+
+def figure_payload(figures):
+    """Sérialise les figures comme le fait st.plotly_chart ; retourne la taille totale en octets."""
+    return sum(len(fig.to_json()) for fig in figures if fig is not None)
+
+def _density_figure(series):
+    density = sa.density_input(series)
+    if density is None:
+        return None
+    values, bin_size = density
+    return ff.create_distplot([values], ['x'], bin_size=bin_size, show_rug=False, show_hist=False)
+
+# Chaque section : agrégations (DataFrames) puis figures construites à partir de ces agrégats,
+# comme dans mon_dashboard_sap2.py.
+def _memory_section(dfs):
+    df_mem = dfs['memory']
+    return {'top_accounts': sa.memory_top_accounts(df_mem), 'avg_by_account': sa.memory_avg_by_account(df_mem),
+            'top_tasktypes': sa.top_n_by(df_mem, 'TASKTYPE', 'USEDBYTES', n=3), 'density': df_mem['USEDBYTES']}
+
+def _memory_figures(agg):
+    return [px.bar(agg['top_accounts'], x='ACCOUNT', y='USEDBYTES', hover_data=['MAXBYTES', 'PRIVSUM']),
+            px.bar(agg['avg_by_account'], x='ACCOUNT_DISPLAY', y='USEDBYTES'),
+            _density_figure(agg['density']),
+            px.bar(agg['top_accounts'], x='ACCOUNT', y=sa.MEMORY_METRICS, barmode='group'),
+            px.bar(agg['top_tasktypes'], x='TASKTYPE', y='USEDBYTES')]
+
+def _user_section(dfs):
+    df_user = dfs['usertcode']
+    return {'top_tasktypes': sa.top_tasktypes_by_mean(df_user, 'RESPTI', 6),
+            'totals': sa.user_transaction_totals(df_user),
+            'long_response': sa.long_response_breakdown(df_user),
+            'hourly': sa.hourly_mean(df_user, 'RESPTI', scale=1000.0),
+            'io_counts': sa.top_n_by(df_user, 'TASKTYPE', ['READDIRCNT', 'READSEQCNT', 'CHNGCNT', 'PHYREADCNT'], n=10, order_by='PHYREADCNT'),
+            'scatter': df_user[['CPUTI', 'RESPTI', 'TASKTYPE', 'ACCOUNT', 'ENTRY_ID']]}
+
+def _user_figures(agg):
+    figures = [px.bar(agg['top_tasktypes'], x='TASKTYPE', y='RESPTI'),
+               px.bar(agg['long_response']['accounts'], x='ACCOUNT', y='Occurrences'),
+               px.bar(agg['long_response']['entries'], x='ENTRY_ID', y='Occurrences'),
+               px.bar(agg['io_counts'], x='TASKTYPE', y=['READDIRCNT', 'READSEQCNT', 'CHNGCNT', 'PHYREADCNT'], barmode='group'),
+               px.scatter(agg['scatter'], x='CPUTI', y='RESPTI', color='TASKTYPE', hover_data=['ACCOUNT', 'ENTRY_ID'], log_x=True, log_y=True)]
+    if agg['hourly'] is not None:
+        figures.append(px.line(agg['hourly'].reset_index(), x='FULL_DATETIME', y='RESPTI'))
+    return figures
+
+def _times_section(dfs):
+    df_times = dfs['times']
+    return {'phycalls': sa.phycalls_by_hour(df_times), 'top_io': sa.top_io_time_slots(df_times),
+            'avg_times': sa.avg_times_by_slot(df_times)}
+
+def _times_figures(agg):
+    return [px.line(agg['phycalls'], x='HOUR_OF_DAY', y='PHYCALLS', markers=True),
+            px.bar(agg['top_io'], x='TIME', y='TOTAL_IO'),
+            px.line(agg['avg_times'], x='TIME', y=['RESPTI', 'CPUTI', 'PROCTI'], markers=True)]
+
+def _tasktimes_section(dfs):
+    df_task = dfs['tasktimes']
+    return {'distribution': sa.tasktype_distribution(df_task),
+            'perf': sa.top_tasktypes_by_mean(df_task, ['RESPTI', 'CPUTI'], 10),
+            'wait_gui': sa.top_n_by(df_task, 'TASKTYPE', ['QUEUETI', 'ROLLWAITTI', 'GUITIME', 'GUINETTIME'], n=10)}
+
+def _tasktimes_figures(agg):
+    return [px.pie(agg['distribution'], values='Count', names='TASKTYPE', hole=0.3),
+            px.bar(agg['perf'], x='TASKTYPE', y=['RESPTI', 'CPUTI'], barmode='group'),
+            px.bar(agg['wait_gui'], x='TASKTYPE', y=['QUEUETI', 'ROLLWAITTI', 'GUITIME', 'GUINETTIME'], barmode='group')]
+
+def _hitlist_section(dfs):
+    df_hitlist = dfs['hitlist_db']
+    return {'top_reports': sa.top_n_by(df_hitlist, 'REPORT', 'RESPTI', n=10, agg='mean'),
+            'top_accounts': sa.top_n_by(df_hitlist, 'ACCOUNT', 'DBCALLS', n=10),
+            'hourly': sa.hourly_mean(df_hitlist, 'RESPTI', scale=1000.0), 'density': df_hitlist['RESPTI']}
+
+def _hitlist_figures(agg):
+    return [px.bar(agg['top_reports'], x='REPORT', y='RESPTI'), px.bar(agg['top_accounts'], x='ACCOUNT', y='DBCALLS'),
+            _density_figure(agg['density']), px.line(agg['hourly'].reset_index(), x='FULL_DATETIME', y='RESPTI')]
+
+def _performance_section(dfs):
+    df_perf = dfs['performance']
+    return {'status': sa.value_counts_frame(df_perf, 'WP_STATUS', ['Statut', 'Count']),
+            'types': sa.value_counts_frame(df_perf, 'WP_TYP', ['Type', 'Count']),
+            'avg_cpu': sa.top_n_by(df_perf, 'WP_TYP', 'WP_CPU_SECONDS', n=None, agg='mean'),
+            'restarts': sa.top_n_by(df_perf, 'WP_TYP', 'WP_IRESTRT', n=10), 'density': df_perf['WP_CPU_SECONDS']}
+
+def _performance_figures(agg):
+    return [_density_figure(agg['density']), px.pie(agg['status'], values='Count', names='Statut'),
+            px.bar(agg['types'], x='Type', y='Count'), px.bar(agg['avg_cpu'], x='WP_TYP', y='WP_CPU_SECONDS'),
+            px.bar(agg['restarts'], x='WP_TYP', y='WP_IRESTRT')]
+
+def _sql_section(dfs, snapshot):
+    df_sql = dfs['sql_trace_summary']
+    lookup = snapshot['sql_fingerprint_lookup']
+    return {metric: sa.top_sql_by_fingerprint(df_sql, lookup, metric, agg)
+            for metric, agg in (('EXECTIME', 'sum'), ('TOTALEXEC', 'sum'), ('TIMEPEREXE', 'mean'), ('RECPROCNUM', 'sum'))} | \
+           {'density': df_sql['TIMEPEREXE'], 'server_totals': snapshot['sql_server_stats']['totals']}
+
+def _sql_figures(agg):
+    figures = [px.bar(agg[metric], y='SQLSTATEM_SHORT', x=metric, orientation='h')
+               for metric in ('EXECTIME', 'TOTALEXEC', 'TIMEPEREXE', 'RECPROCNUM')]
+    figures.append(_density_figure(agg['density']))
+    figures.append(px.bar(agg['server_totals'].reset_index(), x='SERVERNAME', y='AVGTPERREC_SUM'))
+    return figures
+
+def _usr02_section(dfs):
+    df_usr02 = dfs['usr02']
+    return {'types': sa.value_counts_frame(df_usr02, 'USTYP', ['Type', 'Nombre']), 'logons': sa.logon_counts_by_date(df_usr02)}
+
+def _usr02_figures(agg):
+    return [px.pie(agg['types'], values='Nombre', names='Type'),
+            px.line(agg['logons'], x='Date de Dernier Logon', y="Nombre d'Utilisateurs", markers=True)]
+
+def _cross_source_section(dfs, snapshot, filters):
+    df_steps = sa.filter_cross_source_steps(snapshot['cross_source_index']['steps'], filters['accounts'], None, filters['tasktypes'])
+    return {'worst': df_steps.head(20), 'matched': df_steps.dropna(subset=['USERTCODE_RESPTI']) if 'USERTCODE_RESPTI' in df_steps.columns else df_steps.iloc[0:0]}
+
+def _cross_source_figures(agg):
+    return [px.bar(agg['worst'], x=agg['worst']['ACCOUNT'].astype(str), y='RESPTI'),
+            px.scatter(agg['matched'], x='RESPTI', y='USERTCODE_RESPTI', color='TASKTYPE')]
+
+def _anomaly_section(dfs, snapshot, filters):
+    df_windows = sa.filter_anomaly_windows(snapshot['anomaly_report']['windows'], filters['accounts'], filters['tasktypes'])
+    return {'counts': df_windows.groupby(['SOURCE', 'DIRECTION'], as_index=False).size(),
+            'timeline': df_windows.dropna(subset=['PEAK_HOUR'])}
+
+def _anomaly_figures(agg):
+    return [px.bar(agg['counts'], x='SOURCE', y='size', color='DIRECTION'),
+            px.scatter(agg['timeline'], x='PEAK_HOUR', y='PEAK_Z', color='SOURCE')]
+
+SECTION_BENCHMARKS = {
+    "Analyse Mémoire": (lambda dfs, snapshot, filters: _memory_section(dfs), _memory_figures),
+    "Transactions Utilisateurs": (lambda dfs, snapshot, filters: _user_section(dfs), _user_figures),
+    "Statistiques Horaires": (lambda dfs, snapshot, filters: _times_section(dfs), _times_figures),
+    "Décomposition des Tâches": (lambda dfs, snapshot, filters: _tasktimes_section(dfs), _tasktimes_figures),
+    "Insights Hitlist DB": (lambda dfs, snapshot, filters: _hitlist_section(dfs), _hitlist_figures),
+    "Performance des Processus de Travail": (lambda dfs, snapshot, filters: _performance_section(dfs), _performance_figures),
+    "Résumé des Traces de Performance SQL": (lambda dfs, snapshot, filters: _sql_section(dfs, snapshot), _sql_figures),
+    "Analyse des Utilisateurs": (lambda dfs, snapshot, filters: _usr02_section(dfs), _usr02_figures),
+    "Corrélations Inter-Sources": (_cross_source_section, _cross_source_figures),
+    "Détection d'Anomalies": (_anomaly_section, _anomaly_figures),
+}
+
+def benchmark_filters(options, rng):
+    """Sélection représentative : ~10 % des comptes et la moitié des types de tâches."""
+    accounts = options['accounts']
+    tasktypes = options['tasktypes']
+    return {
+        'accounts': list(rng.choice(accounts, size=max(1, len(accounts) // 10), replace=False)) if accounts else [],
+        'reports': [],
+        'tasktypes': list(rng.choice(tasktypes, size=max(1, len(tasktypes) // 2), replace=False)) if tasktypes else [],
+        'wp_types': [],
+    }
+
+def run_size(n_rows, seed=0, days=7, use_files=True, repeat=1, workdir=None):
+    """Banc complet pour une taille nominale ; retourne un dictionnaire sérialisable en JSON."""
+    result = {'rows': n_rows, 'source_rows': source_rows(n_rows), 'sources': {}, 'stages': {}, 'sections': {}}
+    raw, result['stages']['generate'] = measure(lambda: generate_sources(n_rows, seed=seed, days=days))
+
+    dfs = {}
+    for key, df_raw in raw.items():
+        source = {}
+        if use_files:
+            path = os.path.join(workdir, f"{key}.csv")
+            df_raw.to_csv(path, index=False)
+            source['file_mb'] = round(os.path.getsize(path) / 2**20, 3)
+            df_raw, source['load'] = measure(lambda: sa.read_source_file(path), repeat)
+        dfs[key], source['clean'] = measure(lambda: sa.clean_source_frame(key, df_raw), repeat)
+        source['rows_clean'] = len(dfs[key])
+        result['sources'][key] = source
+    del raw
+
+    stages = result['stages']
+    snapshot = {}
+    snapshot['cross_source_index'], stages['cross_source_index'] = measure(lambda: sa.build_cross_source_index(dfs), repeat)
+    snapshot['sql_fingerprint_lookup'], stages['sql_fingerprint_lookup'] = measure(
+        lambda: sa.build_sql_fingerprint_lookup(dfs['sql_trace_summary']), repeat)
+    snapshot['sql_server_stats'], stages['sql_server_stats'] = measure(lambda: sa.build_server_stats(dfs['sql_trace_summary']), repeat)
+    snapshot['anomaly_report'], stages['anomaly_report'] = measure(lambda: sa.build_anomaly_report(dfs), repeat)
+    snapshot['comparison_aggregates'], stages['comparison_aggregates'] = measure(lambda: sa.build_comparison_aggregates(dfs), repeat)
+    time_range = sa.comparison_time_range(snapshot['comparison_aggregates'])
+    if time_range is not None:
+        split = (time_range[0] + (time_range[1] - time_range[0]) / 2).floor('h')
+        _, stages['compare_periods'] = measure(lambda: sa.compare_snapshots(
+            snapshot['comparison_aggregates'], snapshot['comparison_aggregates'], (time_range[0], split), (split, time_range[1])), repeat)
+    # Historique hiérarchisé en mémoire : fenêtre brute d'un jour et horaire de trois jours pour exercer les deux compactages.
+    def build_history():
+        history = sr.TieredHistory(raw_retention=pd.Timedelta(days=1), hourly_retention=pd.Timedelta(days=3))
+        for source in history.sources:
+            history.ingest(source, dfs[source])
+        history.compact()
+        return history
+    history, stages['history_compact'] = measure(build_history, repeat)
+    _, stages['history_trend'] = measure(lambda: sa.trend_mean(history, 'hitlist_db', None, 'RESPTI', 1000.0), repeat)
+
+    options, stages['filter_options'] = measure(lambda: sa.filter_options(dfs), repeat)
+    filters = benchmark_filters(options, np.random.default_rng(seed))
+    stages['filter_selection'] = {key: len(values) for key, values in filters.items()}
+    dfs_filtered, stages['apply_global_filters'] = measure(lambda: sa.apply_global_filters(dfs, **filters), repeat)
+    # Affluence : sessions simultanées demandant la même sélection, regroupées en un seul filtrage.
+    def concurrent_filters(sessions=BENCH_CONCURRENT_SESSIONS):
+        fresh = {'dfs': dfs, 'version': 1, 'loaded_at': pd.Timestamp.now()}
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(lambda _: sa.filter_snapshot(fresh, **filters), range(sessions)))
+    flights_before = sa.REQUEST_FLIGHTS.stats().get('filter', {})
+    _, stages['concurrent_filters'] = measure(concurrent_filters, repeat)
+    flights_after = sa.REQUEST_FLIGHTS.stats()['filter']
+    stages['concurrent_filters'].update({key: flights_after[key] - flights_before.get(key, 0)
+                                         for key in ('executions', 'coalesced')})
+    _, stages['compute_global_kpis'] = measure(lambda: sa.compute_global_kpis(dfs_filtered), repeat)
+    kpi_summary, stages['build_kpi_summary'] = measure(lambda: sa.build_kpi_summary(dfs), repeat)
+    _, stages['kpis_from_summary'] = measure(lambda: sa.kpis_from_summary(kpi_summary, **filters), repeat)
+    # Ingestion en continu : 1 % de pas hitlist_db supplémentaires intégrés au snapshot par ajout.
+    base_snapshot = {'dfs': dfs, 'kpi_summary': kpi_summary, 'filter_options': options, 'history': history, 'live_rows': 0,
+                     'response_breakdown': sa.build_response_breakdown(dfs['hitlist_db']),
+                     'db_access': sa.build_db_access_matrix(dfs['hitlist_db'])}
+    live_rows = dfs['hitlist_db'].sample(frac=0.01, random_state=seed)
+    _, stages['extend_snapshot'] = measure(lambda: sa.extend_data_snapshot(base_snapshot, {'hitlist_db': [(None, live_rows)]}, 2), repeat)
+
+    for section, (aggregate, build_figures) in SECTION_BENCHMARKS.items():
+        entry = {}
+        agg, entry['aggregate'] = measure(lambda: aggregate(dfs_filtered, snapshot, filters), repeat)
+        figures, entry['figure_build'] = measure(lambda: build_figures(agg), repeat)
+        payload, entry['figure_serialize'] = measure(lambda: figure_payload(figures), repeat)
+        entry['payload_bytes'] = payload
+        entry['figures'] = sum(fig is not None for fig in figures)
+        result['sections'][section] = entry
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de performance du dashboard SAP sur données synthétiques.")
+    parser.add_argument('--sizes', default='10k,100k', help="Tailles nominales séparées par des virgules (ex. 10k,1M,50M).")
+    parser.add_argument('--output', default='benchmark_results.json', help="Fichier JSON de résultats.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--days', type=int, default=7, help="Période couverte par les pas de dialogue synthétiques.")
+    parser.add_argument('--repeat', type=int, default=1, help="Répétitions par étape (meilleur temps retenu).")
+    parser.add_argument('--no-files', action='store_true',
+                        help="Ne pas écrire/relire de CSV : le nettoyage part des DataFrames générés (gros volumes).")
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'versions': {'pandas': pd.__version__, 'numpy': np.__version__, 'plotly': plotly.__version__},
+            'seed': args.seed, 'days': args.days, 'repeat': args.repeat, 'files': not args.no_files,
+        },
+        'runs': [],
+    }
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory(prefix='sap_bench_') as workdir:
+        for size in [parse_size(s) for s in args.sizes.split(',') if s.strip()]:
+            print(f"[bench] {size:,} lignes...", file=sys.stderr)
+            run = run_size(size, seed=args.seed, days=args.days, use_files=not args.no_files,
+                           repeat=args.repeat, workdir=workdir)
+            run['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            report['runs'].append(run)
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+    tracemalloc.stop()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[bench] résultats écrits dans {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
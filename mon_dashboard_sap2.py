@@ -1,384 +1,386 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import numpy as np
 import io
-import re
+import os
+import tracemalloc
 import plotly.figure_factory as ff
 import scipy # Ajouté pour résoudre ImportError avec create_distplot
 
-# --- Chemins vers vos fichiers de données ---
-# ATTENTION : Ces chemins ont été mis à jour pour être RELATIFS.
-# Cela signifie que les fichiers Excel/CSV doivent se trouver dans le MÊME dossier
-# que ce script Python lorsque vous le déployez (par exemple, sur GitHub pour Streamlit Community Cloud).
-DATA_PATHS = {
-    "memory": "memory_final_cleaned_clean.xlsx",
-    "hitlist_db": "HITLIST_DATABASE_final_cleaned_clean.xlsx",
-    "times": "Times_final_cleaned_clean.xlsx",
-    "tasktimes": "TASKTIMES_final_cleaned_clean.xlsx",
-    "usertcode": "USERTCODE_cleaned.xlsx",
-    "performance": "AL_GET_PERFORMANCE_final_cleaned_clean.xlsx",
-    "sql_trace_summary": "performance_trace_summary_final_cleaned_clean.xlsx",
-    "usr02": "usr02_data.xlsx",
-}
+# Chargement, nettoyage et agrégations : voir sap_analytics (aucune dépendance à Streamlit).
+# Ce script ne fait que le rendu.
+from sap_analytics import (
+    DATA_REFRESH_INTERVAL_SECONDS, configured_data_paths, kpis_by_system, DataSnapshotStore, FigureCache, REQUEST_FLIGHTS, SERVER_STATS_METRICS,
+    MEMORY_METRICS, ANOMALY_Z_THRESHOLD, filter_snapshot, filter_cross_source_steps, filter_anomaly_windows, kpis_from_summary, has_positive_total, top_n_by, value_counts_frame, density_input,
+    hourly_mean, trend_mean, memory_top_accounts, memory_avg_by_account, top_tasktypes_by_mean,
+    user_transaction_totals, long_response_breakdown, phycalls_by_hour, top_io_time_slots,
+    avg_times_by_slot, tasktype_distribution, top_sql_by_fingerprint, logon_counts_by_date, table_page,
+    EXPORT_FORMATS, export_frame, export_frames_zip,
+    COMPARISON_ALPHA, COMPARISON_BASELINE_DIR, baseline_data_paths, data_files_signature, load_comparison_snapshot,
+    comparison_time_range, compare_snapshots, RESPONSE_COMPONENT_NAMES, response_breakdown,
+    DB_UNBUFFERED_MIN_SEQ_READS, DB_UNBUFFERED_MAX_HIT_RATIO, db_access_by_report, db_access_pattern,
+    SYSTEM_COLUMN, CAPACITY_MAX_SERVERS, wp_load_profile, wp_capacity, wp_capacity_model,
+    memory_forecast, memory_growth_drivers,
+)
+from sap_wp_history import wp_cpu_rate, wp_busy_counts, wp_activity, wp_restart_events
+from sap_instrumentation import StageRecorder, stages_frame, stages_summary, to_chrome_trace, to_json
+from sap_live_tail import SPOOL_DIR, SPOOL_POLL_SECONDS
 
 # --- Configuration de la page Streamlit ---
 st.set_page_config(layout="wide", page_title="Dashboard SAP Complet Multi-Sources")
 
-# --- Fonctions de Nettoyage et Chargement des Données (avec cache) ---
+@st.cache_resource(show_spinner="Chargement initial des données...")
+def get_data_store():
+    """Store unique par processus, partagé par toutes les sessions."""
+    return DataSnapshotStore(configured_data_paths(), DATA_REFRESH_INTERVAL_SECONDS)
+
+@st.cache_resource(max_entries=2, show_spinner="Chargement du jeu de référence...")
+def get_comparison_snapshot(directory, signature):
+    """Agrégats de comparaison d'un jeu de référence ; la signature recharge le jeu quand ses fichiers changent."""
+    return load_comparison_snapshot(directory, get_data_store().data_paths)
+
+@st.cache_resource
+def get_figure_cache():
+    """Cache LRU des figures Plotly, partagé par toutes les sessions du processus."""
+    return FigureCache()
 
-def clean_string_column(series, default_value="Non défini"):
+def cached_figure(build, data_frame, xaxes=None, yaxes=None, cache_key=None, **kwargs):
     """
-    Nettoie une série de type string : supprime espaces, remplace NaN/vides/caractères non imprimables.
+    Figure `build(data_frame, **kwargs)` (fonction Plotly Express) reprise du cache tant que l'agrégat
+    et les options sont inchangés. `xaxes`/`yaxes` sont appliqués avant la mise en cache :
+    la figure retournée est partagée et ne doit plus être modifiée.
+    Graphique de lignes brutes : `cache_key` (ex. version du snapshot et filtres, qui déterminent les lignes)
+    remplace l'empreinte de `data_frame`, et ces lignes ne figurent pas dans l'export des agrégats.
     """
-    cleaned_series = series.astype(str).str.strip()
-    cleaned_series = cleaned_series.apply(lambda x: re.sub(r'[^\x20-\x7E\s]+', ' ', x).strip())
-    cleaned_series = cleaned_series.replace({'nan': default_value, '': default_value, ' ': default_value})
-    return cleaned_series
-
-def clean_column_names(df):
+    def build_figure():
+        fig = build(data_frame, **kwargs)
+        if xaxes:
+            fig.update_xaxes(**xaxes)
+        if yaxes:
+            fig.update_yaxes(**yaxes)
+        return fig
+
+    with recorder.stage(f"{build.__name__}[{kwargs.get('title', 'sans titre')}]", 'figure') as stage:
+        fig, stage['cache_hit'] = figure_cache.get_or_build(
+            (build.__module__, build.__name__, data_frame if cache_key is None else cache_key, xaxes, yaxes, kwargs),
+            build_figure)
+    # Agrégat conservé pour l'export de la section (voir render_section_exports).
+    if cache_key is None:
+        chart_frames[kwargs.get('title') or f"{build.__name__}_{len(chart_frames) + 1}"] = data_frame
+    return fig
+
+def render_density_chart(series, label, title, xaxis_title, line_color, empty_message):
+    """Courbe de densité (create_distplot) d'une série, ou message si elle n'a qu'une valeur distincte."""
+    density = density_input(series)
+    if density is None:
+        st.info(empty_message)
+        return
+    values, bin_size = density
+
+    def build_density_figure():
+        fig = ff.create_distplot([values], [label], bin_size=bin_size, show_rug=False, show_hist=False)
+        fig.update_layout(title_text=title, xaxis_title=xaxis_title, yaxis_title='Densité')
+        fig.data[0].line.color = line_color
+        return fig
+
+    with recorder.stage('ff.create_distplot', 'figure', rows=len(values)) as stage:
+        fig_density, stage['cache_hit'] = figure_cache.get_or_build(
+            ('create_distplot', values, label, bin_size, title, xaxis_title, line_color), build_density_figure)
+    render_chart(fig_density)
+
+def render_chart(fig):
+    """st.plotly_chart chronométré ; avec l'instrumentation, la taille du payload Plotly est aussi mesurée."""
+    with recorder.stage(f"st.plotly_chart[{fig.layout.title.text or 'sans titre'}]", 'chart') as stage:
+        if recorder.enabled:
+            stage['payload_kb'] = round(len(fig.to_json()) / 1024, 1)
+        st.plotly_chart(fig, use_container_width=True)
+
+@st.fragment
+def render_section_exports(df, key, frames):
     """
-    Nettoyage des noms de colonnes : supprime les espaces, les caractères invisibles,
-    et s'assure qu'ils sont valides pour l'accès.
+    Téléchargement des lignes filtrées d'une source et des agrégats des graphiques de la section.
+    Les fichiers ne sont générés qu'au clic (données différées) ; Streamlit sert le contenu entier depuis la mémoire.
     """
-    new_columns = []
-    for col in df.columns:
-        cleaned_col = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', str(col)).strip()
-        cleaned_col = re.sub(r'[^a-zA-Z0-9_]', '_', cleaned_col)
-        cleaned_col = re.sub(r'_+', '_', cleaned_col)
-        cleaned_col = cleaned_col.strip('_')
-        new_columns.append(cleaned_col)
-    df.columns = new_columns
-    return df
-
-def convert_mm_ss_to_seconds(time_str):
+    with st.expander("⬇️ Exporter les données filtrées et les agrégats des graphiques"):
+        fmt = st.radio("Format", list(EXPORT_FORMATS), format_func=str.upper, horizontal=True, key=f"export_format_{key}")
+        extension, mime = EXPORT_FORMATS[fmt]
+        export_cols = st.columns(2)
+        export_cols[0].download_button(f"Lignes filtrées ({len(df):,} lignes)".replace(",", " "),
+                                       data=lambda: export_frame(df, fmt), file_name=f"{key}_filtre{extension}",
+                                       mime=mime, on_click="ignore", key=f"export_rows_{key}")
+        export_cols[1].download_button(f"Agrégats des graphiques ({len(frames)} tableaux, ZIP)",
+                                       data=lambda: export_frames_zip(frames, fmt), file_name=f"{key}_agregats.zip",
+                                       mime="application/zip", on_click="ignore", disabled=not frames,
+                                       key=f"export_aggregates_{key}")
+
+EXPLORER_PAGE_SIZES = [50, 100, 500, 1000]
+
+@st.fragment
+def render_data_explorer(df, key):
     """
-    Convertit une chaîne de caractères au format MM:SS en secondes.
-    Gère les cas où les minutes ou secondes sont manquantes ou invalides.
+    Explorateur paginé d'une source : filtre, tri et pagination sont faits côté serveur (table_page),
+    seule la page courante est envoyée au navigateur. Fragment : changer de page ne relance que l'explorateur.
     """
-    if pd.isna(time_str) or not isinstance(time_str, str):
-        return 0
-    try:
-        parts = time_str.split(':')
-        if len(parts) == 2:
-            minutes = float(parts[0])
-            seconds = float(parts[1])
-            return int(minutes * 60 + seconds)
-        elif len(parts) == 1:
-            return int(float(parts[0]))
-        else:
-            return 0
-    except ValueError:
-        return 0
-
-def clean_numeric_with_comma(series):
+    columns = list(df.columns)
+    control_cols = st.columns([3, 1, 3, 3, 1])
+    sort_by = control_cols[0].selectbox("Trier par", ["(ordre d'origine)"] + columns, key=f"explorer_sort_{key}")
+    descending = control_cols[1].checkbox("Décroissant", key=f"explorer_desc_{key}")
+    filter_column = control_cols[2].selectbox("Filtrer la colonne", columns, key=f"explorer_filter_col_{key}")
+    filter_text = control_cols[3].text_input("Contient", key=f"explorer_filter_text_{key}")
+    page_size = control_cols[4].selectbox("Lignes", EXPLORER_PAGE_SIZES, index=1, key=f"explorer_page_size_{key}")
+
+    # Le nombre de pages dépend du filtre : la page demandée est bornée après coup.
+    page = st.session_state.get(f"explorer_page_{key}", 1)
+    sort_column = sort_by if sort_by in columns else None
+    with recorder.stage(f"table_page[{key}]", 'explorer', rows_in=len(df)) as stage:
+        page_df, total = table_page(df, page - 1, page_size, sort_column, not descending, filter_column, filter_text)
+        n_pages = max(1, -(-total // page_size))
+        if page > n_pages:
+            page = n_pages
+            page_df, total = table_page(df, page - 1, page_size, sort_column, not descending, filter_column, filter_text)
+        stage['frame'] = page_df
+
+    st.dataframe(page_df)
+    nav_cols = st.columns([1, 3])
+    nav_cols[0].number_input("Page", min_value=1, max_value=n_pages, value=page, step=1, key=f"explorer_page_{key}")
+    first_row = (page - 1) * page_size + 1 if total else 0
+    nav_cols[1].caption(f"Lignes {first_row:,} à {first_row + len(page_df) - 1 if total else 0:,} sur {total:,} "
+                        f"(page {page}/{n_pages})".replace(",", " "))
+
+def trend_xaxes():
+    """Graduation horaire pour une tendance sur les seuls exports ; automatique sur l'historique (mois, années)."""
+    return dict(dtick="H1", tickformat="%H:%M") if history is None else None
+
+@st.fragment
+def render_memory_forecast(df_mem):
     """
-    Nettoyage d'une série de chaînes numériques qui peuvent contenir des virgules
-    comme séparateurs de milliers ou décimaux, et conversion en float.
+    Prévision de la mémoire par compte et type de tâche (tendance + saisonnalité, ajustement groupé de toutes
+    les séries). Fragment : changer la métrique, l'horizon ou la limite ne relance que ce bloc.
     """
-    cleaned_series = series.astype(str).str.replace(' ', '').str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
-    return pd.to_numeric(cleaned_series, errors='coerce').fillna(0)
-
-
-@st.cache_data
-def load_and_process_data(file_key, path):
-    """Charge et nettoie un fichier Excel/CSV."""
-    df = pd.DataFrame()
-    try:
-        if path.lower().endswith('.xlsx'):
-            df = pd.read_excel(path)
-        elif path.lower().endswith('.csv'):
-            df = pd.read_csv(path)
-        else:
-            st.error(f"Format de fichier non supporté pour {file_key}: {path}")
-            return pd.DataFrame()
-
-        df = clean_column_names(df.copy())
-
-        # --- Gestion spécifique des types de données et valeurs manquantes ---
-        if file_key == "memory":
-            numeric_cols = ['MEMSUM', 'PRIVSUM', 'USEDBYTES', 'MAXBYTES', 'MAXBYTESDI', 'PRIVCOUNT', 'RESTCOUNT', 'COUNTER']
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            if 'ACCOUNT' in df.columns:
-                df['ACCOUNT'] = clean_string_column(df['ACCOUNT'], 'Compte Inconnu')
-            if 'MANDT' in df.columns:
-                df['MANDT'] = clean_string_column(df['MANDT'], 'MANDT Inconnu')
-            if 'TASKTYPE' in df.columns:
-                df['TASKTYPE'] = clean_string_column(df['TASKTYPE'], 'Type de Tâche Inconnu')
-
-            if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
-                df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
-                df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
-                df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
-            elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
-                df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
-            
-            subset_cols_memory = []
-            if 'USEDBYTES' in df.columns:
-                subset_cols_memory.append('USEDBYTES')
-            if 'ACCOUNT' in df.columns:
-                subset_cols_memory.append('ACCOUNT')
-            if subset_cols_memory:
-                df.dropna(subset=subset_cols_memory, inplace=True)
-
-
-        elif file_key == "hitlist_db":
-            numeric_cols = [
-                'GENERATETI', 'REPLOADTI', 'CUALOADTI', 'DYNPLOADTI', 'QUETI', 'DDICTI', 'CPICTI',
-                'LOCKCNT', 'LOCKTI', 'BTCSTEPNR', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI',
-                'GUITIME', 'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'DSQLCNT', 'QUECNT',
-                'CPICCNT', 'SLI_CNT', 'TAB1DIRCNT', 'TAB1SEQCNT', 'TAB1UPDCNT', 'TAB2DIRCNT',
-                'TAB2SEQCNT', 'TAB2UPDCNT', 'TAB3DIRCNT', 'TAB3SEQCNT', 'TAB3UPDCNT', 'TAB4DIRCNT',
-                'TAB4SEQCNT', 'TAB4UPDCNT', 'TAB5DIRCNT', 'TAB5SEQCNT', 'TAB5UPDCNT',
-                'READDIRCNT', 'READDIRTI', 'READDIRBUF', 'READDIRREC', 'READSEQCNT', 'READSEQTI',
-                'READSEQBUF', 'READSEQREC', 'PHYREADCNT', 'INSCNT', 'INSTI', 'INSREC', 'PHYINSCNT',
-                'UPDCNT', 'UPDTI', 'UPDREC', 'PHYUPDCNT', 'DELCNT', 'DELTI', 'DELREC', 'PHYDELCNT',
-                'DBCALLS', 'COMMITTI', 'INPUTLEN', 'OUTPUTLEN', 'MAXROLL', 'MAXPAGE',
-                'ROLLINCNT', 'ROLLINTI', 'ROLLOUTCNT', 'ROLLOUTTI', 'ROLLED_OUT', 'PRIVSUM',
-                'USEDBYTES', 'MAXBYTES', 'MAXBYTESDI', 'RFCRECEIVE', 'RFCSEND',
-                'RFCEXETIME', 'RFCCALLTIM', 'RFCCALLS', 'VMC_CALL_COUNT', 'VMC_CPU_TIME', 'VMC_ELAP_TIME'
-            ]
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
-                df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
-                df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
-                df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
-            elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
-                df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
-
-            subset_cols_hitlist = []
-            if 'RESPTI' in df.columns: subset_cols_hitlist.append('RESPTI')
-            if 'PROCTI' in df.columns: subset_cols_hitlist.append('PROCTI')
-            if 'CPUTI' in df.columns: subset_cols_hitlist.append('CPUTI')
-            if 'DBCALLS' in df.columns: subset_cols_hitlist.append('DBCALLS')
-            if subset_cols_hitlist:
-                df.dropna(subset=subset_cols_hitlist, inplace=True)
-            if 'FULL_DATETIME' in df.columns:
-                df.dropna(subset=['FULL_DATETIME'], inplace=True)
-
-            for col in ['WPID', 'ACCOUNT', 'REPORT', 'ROLLKEY', 'PRIVMODE', 'WPRESTART', 'TASKTYPE']:
-                if col in df.columns:
-                    df[col] = clean_string_column(df[col])
-
-
-        elif file_key == "times":
-            numeric_cols = [
-                'COUNT', 'LUW_COUNT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI',
-                'GUITIME', 'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'READDIRCNT',
-                'READDIRTI', 'READDIRBUF', 'READDIRREC', 'READSEQCNT', 'READSEQTI',
-                'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI', 'CHNGREC', 'PHYREADCNT',
-                'PHYCHNGREC', 'PHYCALLS', 'VMC_CALL_COUNT', 'VMC_CPU_TIME', 'VMC_ELAP_TIME'
-            ]
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            subset_cols_times = []
-            if 'RESPTI' in df.columns: subset_cols_times.append('RESPTI')
-            if 'PHYCALLS' in df.columns: subset_cols_times.append('PHYCALLS')
-            if 'COUNT' in df.columns: subset_cols_times.append('COUNT')
-            if subset_cols_times:
-                df.dropna(subset=subset_cols_times, inplace=True)
-            
-            if 'TIME' in df.columns:
-                df['TIME'] = clean_string_column(df['TIME'])
-            if 'TASKTYPE' in df.columns:
-                df['TASKTYPE'] = clean_string_column(df['TASKTYPE'])
-            if 'ENTRY_ID' in df.columns:
-                df['ENTRY_ID'] = clean_string_column(df[col])
-
-        elif file_key == "tasktimes":
-            numeric_cols = [
-                'COUNT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI', 'GUITIME',
-                'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'READDIRCNT', 'READDIRTI',
-                'READDIRBUF', 'READDIRREC', 'READSEQCNT', 'READSEQTI',
-                'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI', 'CHNGREC', 'PHYREADCNT',
-                'PHYCHNGREC', 'PHYCALLS', 'CNT001', 'CNT002', 'CNT003', 'CNT004', 'CNT005', 'CNT006', 'CNT007', 'CNT008', 'CNT009'
-            ]
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            subset_cols_tasktimes = []
-            if 'COUNT' in df.columns: subset_cols_tasktimes.append('COUNT')
-            if 'RESPTI' in df.columns: subset_cols_tasktimes.append('RESPTI')
-            if 'CPUTI' in df.columns: subset_cols_tasktimes.append('CPUTI')
-            if subset_cols_tasktimes:
-                df.dropna(subset=subset_cols_tasktimes, inplace=True)
-            
-            if 'TASKTYPE' in df.columns:
-                df['TASKTYPE'] = clean_string_column(df['TASKTYPE'], 'Type de tâche non spécifié')
-            if 'TIME' in df.columns:
-                df['TIME'] = clean_string_column(df['TIME'])
-
-
-        elif file_key == "usertcode":
-            numeric_cols = [
-                'COUNT', 'DCOUNT', 'UCOUNT', 'BCOUNT', 'ECOUNT', 'SCOUNT', 'LUW_COUNT',
-                'TMBYTESIN', 'TMBYTESOUT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI',
-                'ROLLWAITTI', 'GUITIME', 'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME',
-                'READDIRCNT', 'READDIRTI', 'READDIRBUF', 'READDIRREC', 'READSEQCNT',
-                'READSEQTI', 'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI', 'CHNGREC',
-                'PHYREADCNT', 'PHYCHNGREC', 'PHYCALLS', 'DSQLCNT', 'QUECNT', 'CPICCNT',
-                'SLI_CNT', 'VMC_CALL_COUNT', 'VMC_CPU_TIME', 'VMC_ELAP_TIME'
-            ]
-            for col in numeric_cols:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            # Add FULL_DATETIME creation for usertcode
-            if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
-                df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
-                df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
-                df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
-            elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
-                df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
-
-            critical_usertcode_cols = []
-            if 'RESPTI' in df.columns: critical_usertcode_cols.append('RESPTI')
-            if 'ACCOUNT' in df.columns: critical_usertcode_cols.append('ACCOUNT')
-            if 'COUNT' in df.columns: critical_usertcode_cols.append('COUNT')
-            
-            if critical_usertcode_cols:
-                df.dropna(subset=critical_usertcode_cols, inplace=True)
-            
-            for col in ['TASKTYPE', 'ENTRY_ID', 'ACCOUNT']:
-                if col in df.columns:
-                    df[col] = clean_string_column(df[col])
-
-        elif file_key == "performance": # Nouveau bloc pour AL_GET_PERFORMANCE
-            # Convertir WP_CPU de MM:SS en secondes
-            if 'WP_CPU' in df.columns:
-                df['WP_CPU_SECONDS'] = df['WP_CPU'].apply(convert_mm_ss_to_seconds).astype(float) # Convertir en float
-            
-            # Convertir WP_IWAIT en secondes (s'il est en ms, diviser par 1000)
-            if 'WP_IWAIT' in df.columns:
-                df['WP_IWAIT'] = pd.to_numeric(df['WP_IWAIT'], errors='coerce').fillna(0)
-                df['WP_IWAIT_SECONDS'] = df['WP_IWAIT'] / 1000.0
-            else:
-                df['WP_IWAIT_SECONDS'] = 0
-
-            # Nettoyage des colonnes string
-            for col in ['WP_SEMSTAT', 'WP_IACTION', 'WP_ITYPE', 'WP_RESTART', 'WP_ISTATUS', 'WP_TYP', 'WP_STATUS']:
-                if col in df.columns:
-                    df[col] = clean_string_column(df[col])
-            
-            # Nettoyage des colonnes numériques
-            numeric_cols_perf = ['WP_NO', 'WP_IRESTRT', 'WP_PID', 'WP_INDEX']
-            for col in numeric_cols_perf:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
-            
-            # Supprimer les lignes avec des valeurs critiques manquantes si nécessaire
-            subset_cols_perf = []
-            if 'WP_CPU_SECONDS' in df.columns: subset_cols_perf.append('WP_CPU_SECONDS')
-            if 'WP_STATUS' in df.columns: subset_cols_perf.append('WP_STATUS')
-            if subset_cols_perf:
-                df.dropna(subset=subset_cols_perf, inplace=True)
-        
-        elif file_key == "sql_trace_summary": # Nouveau bloc pour performance_trace_summary
-            # Nettoyage des colonnes numériques avec virgule/espace
-            numeric_cols_sql = ['TOTALEXEC', 'IDENTSEL', 'EXECTIME', 'RECPROCNUM', 'TIMEPEREXE', 'RECPEREXE', 'AVGTPERREC', 'MINTPERREC']
-            for col in numeric_cols_sql:
-                if col in df.columns:
-                    df[col] = clean_numeric_with_comma(df[col]).astype(float) # Ajout .astype(float)
-            
-            # Nettoyage des colonnes string
-            for col in ['SQLSTATEM', 'SERVERNAME', 'TRANS_ID']:
-                if col in df.columns:
-                    df[col] = clean_string_column(df[col])
-            
-            # Supprimer les lignes avec des valeurs critiques manquantes si nécessaire
-            subset_cols_sql = []
-            if 'EXECTIME' in df.columns: subset_cols_sql.append('EXECTIME')
-            if 'TOTALEXEC' in df.columns: subset_cols_sql.append('TOTALEXEC')
-            if 'SQLSTATEM' in df.columns: subset_cols_sql.append('SQLSTATEM')
-            if subset_cols_sql:
-                df.dropna(subset=subset_cols_sql, inplace=True)
-
-        elif file_key == "usr02": # Nouveau bloc pour usr02_data.xlsx
-            # Nettoyage des colonnes string
-            for col in ['BNAME', 'USTYP']:
-                if col in df.columns:
-                    df[col] = clean_string_column(df[col])
-            
-            # Conversion de GLTGB en datetime
-            if 'GLTGB' in df.columns:
-                df['GLTGB'] = df['GLTGB'].astype(str).replace('00000000', np.nan)
-                df['GLTGB_DATE'] = pd.to_datetime(df['GLTGB'], format='%Y%m%d', errors='coerce')
-            else:
-                df['GLTGB_DATE'] = pd.NaT
-
-        return df
-
-    except FileNotFoundError:
-        st.error(f"Erreur: Le fichier '{path}' pour '{file_key}' est introuvable. Veuillez vérifier le chemin.")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Une erreur est survenue lors du traitement du fichier '{file_key}' : {e}. Détails : {e}")
-        return pd.DataFrame()
+    if 'FULL_DATETIME' not in df_mem.columns:
+        st.info("L'extrait mémoire chargé n'est pas horodaté (pas de colonnes ENDDATE / ENDTIME ni FULL_DATETIME) : "
+                "la prévision demande un extrait mémoire avec la date et l'heure de chaque mesure.")
+        return
+    control_cols = st.columns(3)
+    metric = control_cols[0].selectbox("Métrique", MEMORY_METRICS, key="memory_forecast_metric")
+    horizon_days = control_cols[1].slider("Horizon (jours)", 1, 30, 7, key="memory_forecast_horizon")
+    limit_mb = control_cols[2].number_input("Limite par série (Mo, 0 = aucune)", min_value=0.0, value=0.0, step=64.0,
+                                            key="memory_forecast_limit")
+    forecast = memory_forecast(df_mem, metric, horizon_days * 24, limit=limit_mb * 1024 ** 2)
+    if forecast is None:
+        st.info("Colonnes 'FULL_DATETIME', 'ACCOUNT' ou de la métrique mémoire manquantes : prévision impossible.")
+        return
+    series = forecast['series']
+    if series.empty:
+        st.info("Aucune série compte / type de tâche ne couvre assez d'heures pour une prévision après filtrage.")
+        return
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Séries ajustées", f"{len(series):,}".replace(",", " "))
+    metric_cols[1].metric("Pic projeté le plus haut (Mo)", f"{series['PROJECTED_PEAK'].max() / 1024 ** 2:,.1f}".replace(",", " "))
+    if 'EXHAUSTION_AT' in series.columns:
+        exhausted = series.dropna(subset=['EXHAUSTION_AT'])
+        metric_cols[2].metric("Séries au-delà de la limite", len(exhausted))
+        if not exhausted.empty:
+            first = exhausted.nsmallest(1, 'EXHAUSTION_AT').iloc[0]
+            st.warning(f"Première limite atteinte le {first['EXHAUSTION_AT']:%d/%m/%Y %H:%M} : compte {first['ACCOUNT']}"
+                       + (f", type de tâche {first['TASKTYPE']}" if 'TASKTYPE' in series.columns else "") + ".")
+
+    fig_total = cached_figure(px.line, forecast['total'], x='PERIOD', y=metric, color='SERIE',
+                              title=f"Moyenne Horaire {metric} : Observée, Ajustée et Prévue sur {horizon_days} Jour(s)",
+                              labels={'PERIOD': 'Heure', metric: f'{metric} (Octets)', 'SERIE': 'Série'},
+                              color_discrete_map={'Observé': 'purple', 'Ajusté': 'grey', 'Prévu': 'darkorange', 'Borne haute': 'firebrick'})
+    render_chart(fig_total)
+    drivers = memory_growth_drivers(series)
+    fig_drivers = cached_figure(px.bar, drivers, x='ACCOUNT', y='GROWTH_PER_DAY',
+                                title=f"Comptes Portant la Croissance de {metric} (Somme des Tendances par Jour)",
+                                labels={'ACCOUNT': 'Compte Utilisateur', 'GROWTH_PER_DAY': 'Croissance (Octets / jour)'},
+                                hover_data=['GROWTH_SHARE', 'PROJECTED_PEAK', 'SERIES'],
+                                color='GROWTH_PER_DAY', color_continuous_scale=px.colors.sequential.OrRd, xaxes=dict(type='category'))
+    render_chart(fig_drivers)
+    st.markdown("**Pics projetés par série (compte, type de tâche)**")
+    render_data_explorer(series, 'memory_forecast')
+
+@st.fragment
+def render_capacity_model(df_task, df_perf):
+    """
+    Scénario M/M/c d'un type de processus de travail : charge par tranche horaire (tasktimes), nombre de WPs
+    configurés (AL_GET_PERFORMANCE). Fragment : changer le scénario ne relance que ce bloc.
+    """
+    profile = wp_load_profile(df_task)
+    if profile is None:
+        st.info("Colonnes 'TASKTYPE', 'TIME', 'COUNT' ou 'RESPTI' manquantes dans les temps par type de tâche.")
+        return
+    if profile.empty:
+        st.info("Aucune tranche horaire des temps par type de tâche ne correspond à un type de processus de travail après filtrage.")
+        return
+    capacity = wp_capacity(df_perf)
+    control_cols = st.columns(4)
+    systems = sorted(profile[SYSTEM_COLUMN].unique()) if SYSTEM_COLUMN in profile.columns else []
+    system = control_cols[0].selectbox("Système", systems, key="capacity_system") if len(systems) > 1 else None
+    wp_types = sorted(profile['WP_TYP'].unique())
+    wp_type = control_cols[1].selectbox("Type de processus", wp_types, index=wp_types.index('DIA') if 'DIA' in wp_types else 0,
+                                        key="capacity_wp_type")
+    configured = 0
+    if capacity is not None:
+        configured_rows = capacity[capacity['WP_TYP'] == wp_type]
+        if system is not None and SYSTEM_COLUMN in configured_rows.columns:
+            configured_rows = configured_rows[configured_rows[SYSTEM_COLUMN] == system]
+        configured = int(configured_rows['WORK_PROCESSES'].sum())
+    servers = control_cols[2].number_input("Processus de travail (scénario)", min_value=1, max_value=CAPACITY_MAX_SERVERS,
+                                           value=min(max(configured, 1), CAPACITY_MAX_SERVERS), key=f"capacity_servers_{wp_type}")
+    target_wait = control_cols[3].number_input("Attente cible en file (ms)", min_value=0.0, value=100.0, step=10.0, key="capacity_target_wait")
+
+    model = wp_capacity_model(profile, wp_type, servers, target_wait, system)
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("WPs configurés", configured if capacity is not None else "N/A")
+    required_peak = model['REQUIRED_WPS'].max()
+    metric_cols[1].metric("WPs nécessaires (tranche la plus chargée)",
+                          int(required_peak) if required_peak == required_peak else f"> {CAPACITY_MAX_SERVERS}")
+    metric_cols[2].metric("Utilisation maximale (scénario)", f"{model['UTILIZATION'].max():.1%}")
+    if model['SATURATED'].any():
+        st.warning(f"Avec {servers} processus, la charge dépasse la capacité sur {int(model['SATURATED'].sum())} tranche(s) : la file croît sans limite.")
+
+    fig_utilization = cached_figure(px.bar, model, x='TIME', y='UTILIZATION',
+                                    title=f"Utilisation Prévue des WPs {wp_type} par Tranche Horaire ({servers} processus)",
+                                    labels={'TIME': 'Tranche Horaire', 'UTILIZATION': 'Utilisation'},
+                                    color='UTILIZATION', color_continuous_scale=px.colors.sequential.YlOrRd, yaxes=dict(tickformat='.0%'))
+    render_chart(fig_utilization)
+    fig_wait = cached_figure(px.line, model, x='TIME', y=['PREDICTED_WAIT_MS', 'OBSERVED_WAIT_MS'], markers=True,
+                             title=f"Attente en File Prévue (M/M/c) et Observée (QUEUETI) - WPs {wp_type}",
+                             labels={'TIME': 'Tranche Horaire', 'value': 'Attente moyenne par pas (ms)', 'variable': 'Série'})
+    render_chart(fig_wait)
+    fig_required = cached_figure(px.bar, model, x='TIME', y='REQUIRED_WPS',
+                                 title=f"WPs {wp_type} Nécessaires pour une Attente sous {target_wait:g} ms",
+                                 labels={'TIME': 'Tranche Horaire', 'REQUIRED_WPS': 'Processus nécessaires'},
+                                 hover_data=['OFFERED_LOAD', 'SERVICE_MS', 'COUNT'])
+    render_chart(fig_required)
+    st.dataframe(model)
+
+WP_HISTORY_PERIODS = {"1 minute": "1min", "5 minutes": "5min", "15 minutes": "15min", "1 heure": "1h"}
+
+@st.fragment
+def render_wp_history(wp_history, wp_types, systems):
+    """
+    Évolution des processus de travail sur les snapshots AL_GET_PERFORMANCE successifs : WPs occupés par type,
+    débit CPU par WP et redémarrages. Fragment : changer la période ou le nombre de WPs ne relance que ce bloc.
+    """
+    snapshots = wp_history.snapshots
+    if systems:
+        snapshots = snapshots[snapshots['INSTANCE'].isin(systems)]
+    if snapshots.empty:
+        st.info("Aucun snapshot de performance dans l'historique pour la sélection actuelle.")
+        return
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Snapshots", f"{len(snapshots):,}".replace(",", " "))
+    metric_cols[1].metric("Changements de WP enregistrés", f"{len(wp_history.changes):,}".replace(",", " "))
+    metric_cols[2].metric("Période couverte", f"{snapshots['TIMESTAMP'].min():%d/%m %H:%M} → {snapshots['TIMESTAMP'].max():%d/%m %H:%M}")
+    control_cols = st.columns(2)
+    period = WP_HISTORY_PERIODS[control_cols[0].selectbox("Période d'agrégation du CPU", list(WP_HISTORY_PERIODS), index=1, key="wp_history_period")]
+    top_wps = control_cols[1].slider("WPs affichés (les plus consommateurs de CPU)", 5, 100, 30, key="wp_history_top")
+
+    busy = wp_busy_counts(wp_history, systems, wp_types)
+    if not busy.empty:
+        fig_busy = cached_figure(px.area, busy, x='TIMESTAMP', y='BUSY', color='WP_TYP',
+                                 facet_row='INSTANCE' if busy['INSTANCE'].nunique() > 1 else None,
+                                 title="WPs Occupés par Type de Processus au Fil des Snapshots",
+                                 labels={'TIMESTAMP': 'Snapshot', 'BUSY': 'WPs occupés', 'WP_TYP': 'Type de Processus'})
+        render_chart(fig_busy)
+    else:
+        st.info("Aucun WP occupé dans les snapshots enregistrés pour la sélection actuelle.")
+
+    activity = wp_activity(wp_history, systems, wp_types)
+    rate = wp_cpu_rate(wp_history, period, systems, wp_types)
+    if not rate.empty:
+        top = activity.head(top_wps)[['INSTANCE', 'WP_NO']]
+        rate = rate.merge(top, on=['INSTANCE', 'WP_NO'])
+        rate['WP'] = rate['INSTANCE'].str.cat(rate['WP_TYP'] + ' ' + rate['WP_NO'].astype(str), sep=' ').str.strip()
+        fig_rate = cached_figure(px.density_heatmap, rate, x='PERIOD', y='WP', z='CPU_RATE', histfunc='sum',
+                                 nbinsx=int(rate['PERIOD'].nunique()), color_continuous_scale=px.colors.sequential.YlOrRd,
+                                 title=f"Débit CPU par WP (secondes CPU par seconde, {top_wps} WPs les plus consommateurs)",
+                                 labels={'PERIOD': 'Période', 'WP': 'Processus de travail', 'CPU_RATE': 'Débit CPU'})
+        render_chart(fig_rate)
+    else:
+        st.info("Aucune consommation CPU entre deux snapshots pour la sélection actuelle.")
+
+    restarts = wp_restart_events(wp_history, systems, wp_types)
+    if not restarts.empty:
+        restarts = restarts.assign(WP=restarts['INSTANCE'].str.cat(restarts['WP_NO'].astype(str), sep=' ').str.strip(),
+                                   CAUSE=restarts['PID_CHANGED'].map({True: 'Nouveau PID', False: 'Compteur WP_IRESTRT'}))
+        fig_restarts = cached_figure(px.scatter, restarts, x='TIMESTAMP', y='WP', color='WP_TYP', symbol='CAUSE',
+                                     title="Redémarrages de Processus de Travail", hover_data=['WP_PID', 'RESTART_DELTA'],
+                                     labels={'TIMESTAMP': 'Snapshot', 'WP': 'Processus de travail', 'WP_TYP': 'Type de Processus'})
+        render_chart(fig_restarts)
+    else:
+        st.success("Aucun redémarrage de processus de travail dans l'historique pour la sélection actuelle.")
+
+    st.markdown("**Bilan par processus de travail sur l'historique**")
+    render_data_explorer(activity, 'wp_activity')
+
+def render_history_caption(source):
+    """Volume de chaque niveau de l'historique hiérarchisé lu pour une tendance."""
+    if history is None:
+        return
+    tiers = history.stats().set_index('SOURCE').loc[source]
+    st.caption(f"Historique : {tiers['RAW']:,} lignes brutes récentes, {tiers['HOURLY']:,} agrégats horaires, "
+               f"{tiers['DAILY']:,} agrégats journaliers.".replace(",", " ")
+               + (f" {tiers['REJECTED']:,} lignes antérieures au niveau brut écartées au total (relues ou arrivées après compactage).".replace(",", " ")
+                  if tiers['REJECTED'] else ""))
+
+# Instrumentation opt-in par session (case de la barre latérale) : étapes de cette exécution du script.
+recorder = StageRecorder(enabled=st.session_state.get("instrumentation_enabled", False), name="render")
+figure_cache = get_figure_cache()
+# Agrégats des graphiques affichés par la section courante (titre -> DataFrame), pour l'export.
+chart_frames = {}
 
 # --- Chargement de TOUTES les données ---
-dfs = {}
-for key, path in DATA_PATHS.items():
-    dfs[key] = load_and_process_data(key, path)
+data_store = get_data_store()
+data_snapshot = data_store.current()
+dfs = data_snapshot['dfs']
+for load_error in data_snapshot['errors'].values():
+    st.error(load_error)
+
+cross_source_index = data_snapshot['cross_source_index']
+sql_fingerprint_lookup = data_snapshot['sql_fingerprint_lookup']
+sql_server_stats = data_snapshot['sql_server_stats']
+anomaly_report = data_snapshot['anomaly_report']
+comparison_aggregates = data_snapshot['comparison_aggregates']
+history = data_snapshot['history']
+wp_history = data_snapshot['wp_history']
+response_breakdown_summary = data_snapshot['response_breakdown']
+db_access = data_snapshot['db_access']
 
 # --- Contenu principal du Dashboard ---
 st.title("📊 Tableau de Bord SAP Complet Multi-Sources")
 st.markdown("Explorez les performances, l'utilisation mémoire, les transactions utilisateurs et la santé du système à travers différentes sources de données.")
 
 # --- Affichage des KPIs ---
+# Emplacement réservé : les KPIs sont remplis une fois les filtres de la barre latérale connus,
+# à partir du résumé précalculé du snapshot (O(groupes), sans parcourir les DataFrames).
 st.markdown("---")
-kpi_cols = st.columns(5)
-
-# KPI 1: Temps de Réponse Moyen Global (Hitlist DB)
-avg_resp_time = 0
-if not dfs['hitlist_db'].empty and 'RESPTI' in dfs['hitlist_db'].columns:
-    # Ensure RESPTI is numeric before mean calculation
-    if pd.api.types.is_numeric_dtype(dfs['hitlist_db']['RESPTI']):
-        avg_resp_time = dfs['hitlist_db']['RESPTI'].mean() / 1000
-kpi_cols[0].metric("Temps de Réponse Moyen (s)", f"{avg_resp_time:.2f}")
-
-# KPI 2: Utilisation Mémoire Moyenne (USEDBYTES)
-avg_memory_usage = 0
-if not dfs['memory'].empty and 'USEDBYTES' in dfs['memory'].columns:
-    # Ensure USEDBYTES is numeric before mean calculation
-    if pd.api.types.is_numeric_dtype(dfs['memory']['USEDBYTES']):
-        avg_memory_usage = dfs['memory']['USEDBYTES'].mean() / (1024 * 1024)
-kpi_cols[1].metric("Mémoire Moyenne (Mo)", f"{avg_memory_usage:.2f}")
-
-# KPI 3: Total des Appels Base de Données (Hitlist DB)
-total_db_calls = 0
-if not dfs['hitlist_db'].empty and 'DBCALLS' in dfs['hitlist_db'].columns:
-    # Ensure DBCALLS is numeric before sum calculation
-    if pd.api.types.is_numeric_dtype(dfs['hitlist_db']['DBCALLS']):
-        total_db_calls = dfs['hitlist_db']['DBCALLS'].sum()
-kpi_cols[2].metric("Total Appels DB", f"{int(total_db_calls):,}".replace(",", " "))
-
-# KPI 4: Total des Exécutions SQL (performance_trace_summary) - NOUVEAU KPI
-total_sql_executions = 0
-if not dfs['sql_trace_summary'].empty and 'TOTALEXEC' in dfs['sql_trace_summary'].columns:
-    # Ensure TOTALEXEC is numeric before sum calculation
-    if pd.api.types.is_numeric_dtype(dfs['sql_trace_summary']['TOTALEXEC']):
-        total_sql_executions = dfs['sql_trace_summary']['TOTALEXEC'].sum()
-kpi_cols[3].metric("Total Exécutions SQL", f"{int(total_sql_executions):,}".replace(",", " "))
-
-# KPI 5: Temps CPU Moyen Global (Hitlist DB)
-avg_cpu_time = 0
-if not dfs['hitlist_db'].empty and 'CPUTI' in dfs['hitlist_db'].columns:
-    # Ensure CPUTI is numeric before mean calculation
-    if pd.api.types.is_numeric_dtype(dfs['hitlist_db']['CPUTI']):
-        avg_cpu_time = dfs['hitlist_db']['CPUTI'].mean() / 1000
-kpi_cols[4].metric("Temps CPU Moyen (s)", f"{avg_cpu_time:.2f}")
-
+kpi_strip = st.container()
 st.markdown("---")
 
+def render_kpi_strip(accounts=None, reports=None, tasktypes=None, wp_types=None, systems=None):
+    """Bandeau des cinq KPIs d'en-tête pour la sélection courante des filtres globaux."""
+    with recorder.stage('kpis_from_summary', 'kpi'):
+        kpis = kpis_from_summary(data_snapshot['kpi_summary'], accounts, reports, tasktypes, wp_types, systems)
+    kpi_cols = kpi_strip.columns(5)
+    kpi_cols[0].metric("Temps de Réponse Moyen (s)", f"{kpis['avg_resp_time_s']:.2f}")
+    kpi_cols[1].metric("Mémoire Moyenne (Mo)", f"{kpis['avg_memory_mb']:.2f}")
+    kpi_cols[2].metric("Total Appels DB", f"{int(kpis['total_db_calls']):,}".replace(",", " "))
+    kpi_cols[3].metric("Total Exécutions SQL", f"{int(kpis['total_sql_executions']):,}".replace(",", " "))
+    kpi_cols[4].metric("Temps CPU Moyen (s)", f"{kpis['avg_cpu_time_s']:.2f}")
+
+    # Mode paysage : mêmes KPIs ventilés par système, déduits du même résumé.
+    landscape_systems = systems or data_snapshot['filter_options'].get('systems', [])
+    if len(landscape_systems) > 1:
+        with kpi_strip.expander(f"KPIs par système ({len(landscape_systems)} systèmes)"):
+            df_system_kpis = kpis_by_system(data_snapshot['kpi_summary'], landscape_systems, accounts, reports, tasktypes, wp_types)
+            st.dataframe(df_system_kpis.rename(columns={
+                'avg_resp_time_s': 'Temps de Réponse Moyen (s)', 'avg_memory_mb': 'Mémoire Moyenne (Mo)',
+                'total_db_calls': 'Total Appels DB', 'total_sql_executions': 'Total Exécutions SQL',
+                'avg_cpu_time_s': 'Temps CPU Moyen (s)'}))
+
 # --- Barre de navigation flexible ---
 tab_titles = [
     "Analyse Mémoire",
@@ -388,7 +390,12 @@ tab_titles = [
     "Insights Hitlist DB",
     "Performance des Processus de Travail",
     "Résumé des Traces de Performance SQL",
-    "Analyse des Utilisateurs"
+    "Analyse des Utilisateurs",
+    "Corrélations Inter-Sources",
+    "Détection d'Anomalies",
+    "Comparaison de Régression",
+    "Décomposition du Temps de Réponse",
+    "Accès Base de Données et Buffers"
 ]
 
 if 'current_section' not in st.session_state:
@@ -403,348 +410,252 @@ selected_section = st.sidebar.radio(
 
 st.session_state.current_section = selected_section
 
+st.sidebar.caption(f"Données chargées le {data_snapshot['loaded_at']:%d/%m/%Y %H:%M:%S} (version {data_snapshot['version']})")
+if data_store.last_error:
+    st.sidebar.warning(data_store.last_error)
+if st.sidebar.button("Rafraîchir les données"):
+    data_store.request_refresh()
+
+@st.fragment(run_every=SPOOL_POLL_SECONDS)
+def follow_live_data(version):
+    """Relance le script dès que le store publie un snapshot plus récent (lignes reçues du dossier de dépôt)."""
+    if data_store.current()['version'] != version:
+        st.rerun()
+
+if data_store.live_enabled:
+    with st.sidebar:
+        st.caption(f"Suivi de {SPOOL_DIR} : {data_snapshot['live_rows']:,} lignes reçues".replace(",", " ")
+                   + (" (corrélations et anomalies en cours de recalcul)" if data_snapshot['stale_indexes'] else "")
+                   + (f" ; {data_store.live_rows_dropped:,} lignes anciennes ne seront pas réappliquées après un "
+                      "rechargement des exports".replace(",", " ") if data_store.live_rows_dropped else ""))
+        follow_live_data(data_snapshot['version'])
+st.sidebar.checkbox("Instrumentation des performances (débogage)", key="instrumentation_enabled",
+                    help="Chronomètre filtres, sections et graphiques ; résultats dans le panneau en bas de page.")
+
 if all(df.empty for df in dfs.values()):
     st.error("Aucune source de données n'a pu être chargée. Le dashboard ne peut pas s'afficher. Veuillez vérifier les chemins et les fichiers.")
+    render_kpi_strip()
 else:
     # --- Sidebar pour les filtres globaux ---
     st.sidebar.header("Filtres")
+    options = data_snapshot['filter_options']
+
+    # Mode paysage : le filtre système élague les partitions avant tous les autres filtres.
+    selected_systems = []
+    if options['systems']:
+        selected_systems = st.sidebar.multiselect("Sélectionner des Systèmes SAP (SID / instance)", options=options['systems'], default=[])
 
-    all_accounts = pd.Index([])
-    if not dfs['memory'].empty and 'ACCOUNT' in dfs['memory'].columns:
-        all_accounts = all_accounts.union(dfs['memory']['ACCOUNT'].dropna().unique())
-    if not dfs['usertcode'].empty and 'ACCOUNT' in dfs['usertcode'].columns:
-        all_accounts = all_accounts.union(dfs['usertcode']['ACCOUNT'].dropna().unique())
-    if not dfs['hitlist_db'].empty and 'ACCOUNT' in dfs['hitlist_db'].columns:
-        all_accounts = all_accounts.union(dfs['hitlist_db']['ACCOUNT'].dropna().unique())
-    
     selected_accounts = []
-    if not all_accounts.empty:
-        selected_accounts = st.sidebar.multiselect(
-            "Sélectionner des Comptes",
-            options=sorted(all_accounts.tolist()),
-            default=[]
-        )
-        if selected_accounts:
-            for key in ['memory', 'usertcode', 'hitlist_db']:
-                if not dfs[key].empty and 'ACCOUNT' in dfs[key].columns:
-                    dfs[key] = dfs[key][dfs[key]['ACCOUNT'].isin(selected_accounts)]
+    if options['accounts']:
+        selected_accounts = st.sidebar.multiselect("Sélectionner des Comptes", options=options['accounts'], default=[])
 
     selected_reports = []
-    if not dfs['hitlist_db'].empty and 'REPORT' in dfs['hitlist_db'].columns:
-        all_reports = dfs['hitlist_db']['REPORT'].dropna().unique().tolist()
-        selected_reports = st.sidebar.multiselect(
-            "Sélectionner des Rapports (Hitlist DB)",
-            options=sorted(all_reports),
-            default=[]
-        )
-        if selected_reports:
-            dfs['hitlist_db'] = dfs['hitlist_db'][dfs['hitlist_db']['REPORT'].isin(selected_reports)]
-    
-    all_tasktypes = pd.Index([])
-    if not dfs['usertcode'].empty and 'TASKTYPE' in dfs['usertcode'].columns:
-        all_tasktypes = all_tasktypes.union(dfs['usertcode']['TASKTYPE'].dropna().unique())
-    if not dfs['times'].empty and 'TASKTYPE' in dfs['times'].columns:
-        all_tasktypes = all_tasktypes.union(dfs['times']['TASKTYPE'].dropna().unique())
-    if not dfs['tasktimes'].empty and 'TASKTYPE' in dfs['tasktimes'].columns:
-        all_tasktypes = all_tasktypes.union(dfs['tasktimes']['TASKTYPE'].dropna().unique())
-    if not dfs['hitlist_db'].empty and 'TASKTYPE' in dfs['hitlist_db'].columns:
-        all_tasktypes = all_tasktypes.union(dfs['hitlist_db']['TASKTYPE'].dropna().unique())
+    if options['reports']:
+        selected_reports = st.sidebar.multiselect("Sélectionner des Rapports (Hitlist DB)", options=options['reports'], default=[])
 
     selected_tasktypes = []
-    if not all_tasktypes.empty:
-        selected_tasktypes = st.sidebar.multiselect(
-            "Sélectionner des Types de Tâches",
-            options=sorted(all_tasktypes.tolist()),
-            default=[]
-        )
-        if selected_tasktypes:
-            for key in ['usertcode', 'times', 'tasktimes', 'hitlist_db']:
-                if not dfs[key].empty and 'TASKTYPE' in dfs[key].columns:
-                    dfs[key] = dfs[key][dfs[key]['TASKTYPE'].isin(selected_tasktypes)]
-    
+    if options['tasktypes']:
+        selected_tasktypes = st.sidebar.multiselect("Sélectionner des Types de Tâches", options=options['tasktypes'], default=[])
+
     selected_wp_types = []
-    if not dfs['performance'].empty and 'WP_TYP' in dfs['performance'].columns:
-        all_wp_types = dfs['performance']['WP_TYP'].dropna().unique().tolist()
-        selected_wp_types = st.sidebar.multiselect(
-            "Sélectionner des Types de Processus de Travail (Performance)",
-            options=sorted(all_wp_types),
-            default=[]
-        )
-        if selected_wp_types:
-            dfs['performance'] = dfs['performance'][dfs['performance']['WP_TYP'].isin(selected_wp_types)]
+    if options['wp_types']:
+        selected_wp_types = st.sidebar.multiselect("Sélectionner des Types de Processus de Travail (Performance)", options=options['wp_types'], default=[])
 
-    df_hitlist_filtered = dfs['hitlist_db'].copy()
+    # Nouveau dictionnaire : le snapshot partagé n'est jamais modifié.
+    dfs = filter_snapshot(data_snapshot, selected_accounts, selected_reports, selected_tasktypes, selected_wp_types,
+                          systems=selected_systems, recorder=recorder)
+    # Détermine entièrement les lignes filtrées : clé de cache des graphiques de lignes brutes.
+    selection_key = (data_snapshot['version'], data_snapshot['loaded_at'], selected_accounts, selected_reports,
+                     selected_tasktypes, selected_wp_types, selected_systems)
+    render_kpi_strip(selected_accounts, selected_reports, selected_tasktypes, selected_wp_types, selected_systems)
 
 
     # --- Contenu des sections basé sur la sélection de la barre latérale ---
-    if st.session_state.current_section == "Analyse Mémoire":
+    # Chaque section est un fragment recevant ses propres entrées : un widget interne à la section
+    # (sélecteur de serveur, curseur, etc.) ne relance que cette section, sans filtres ni KPIs.
+    @st.fragment
+    def render_memory_section(dfs):
         # --- Onglet 1: Analyse Mémoire (memory_final_cleaned_clean.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header(" Analyse de l'Utilisation Mémoire")
-        df_mem = dfs['memory'].copy()
-        if selected_accounts:
-            df_mem = df_mem[df_mem['ACCOUNT'].isin(selected_accounts)]
+        df_mem = dfs['memory']
 
         if not df_mem.empty:
             st.subheader("Top 10 Utilisateurs par Utilisation Mémoire (USEDBYTES)")
-            if all(col in df_mem.columns for col in ['ACCOUNT', 'USEDBYTES', 'MAXBYTES', 'PRIVSUM']) and df_mem['USEDBYTES'].sum() > 0:
-                # Ensure numeric types before aggregation
-                df_mem['USEDBYTES'] = pd.to_numeric(df_mem['USEDBYTES'], errors='coerce').fillna(0).astype(float)
-                df_mem['MAXBYTES'] = pd.to_numeric(df_mem['MAXBYTES'], errors='coerce').fillna(0).astype(float)
-                df_mem['PRIVSUM'] = pd.to_numeric(df_mem['PRIVSUM'], errors='coerce').fillna(0).astype(float)
-
-                top_users_mem = df_mem.groupby('ACCOUNT', as_index=False)[['USEDBYTES', 'MAXBYTES', 'PRIVSUM']].sum().nlargest(10, 'USEDBYTES')
-                if not top_users_mem.empty and top_users_mem['USEDBYTES'].sum() > 0:
-                    fig_top_users_mem = px.bar(top_users_mem,
-                                                x='ACCOUNT', y='USEDBYTES',
-                                                title="Top 10 Comptes par USEDBYTES Total",
-                                                labels={'USEDBYTES': 'Utilisation Mémoire (Octets)', 'ACCOUNT': 'Compte Utilisateur'},
-                                                hover_data=['MAXBYTES', 'PRIVSUM'],
-                                                color='USEDBYTES', color_continuous_scale=px.colors.sequential.Plasma)
-                    st.plotly_chart(fig_top_users_mem, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour les Top 10 Utilisateurs par Utilisation Mémoire après filtrage.")
-            else:
+            top_users_mem = memory_top_accounts(df_mem)
+            if top_users_mem is None:
                 st.info("Colonnes nécessaires (ACCOUNT, USEDBYTES, MAXBYTES, PRIVSUM) manquantes ou USEDBYTES total est zéro/vide après filtrage.")
+            elif not top_users_mem.empty and top_users_mem['USEDBYTES'].sum() > 0:
+                fig_top_users_mem = cached_figure(px.bar, top_users_mem,
+                                                  x='ACCOUNT', y='USEDBYTES',
+                                                  title="Top 10 Comptes par USEDBYTES Total",
+                                                  labels={'USEDBYTES': 'Utilisation Mémoire (Octets)', 'ACCOUNT': 'Compte Utilisateur'},
+                                                  hover_data=['MAXBYTES', 'PRIVSUM'],
+                                                  color='USEDBYTES', color_continuous_scale=px.colors.sequential.Plasma)
+                render_chart(fig_top_users_mem)
+            else:
+                st.info("Pas de données valides pour les Top 10 Utilisateurs par Utilisation Mémoire après filtrage.")
 
             st.subheader("Moyenne de USEDBYTES par Client (ACCOUNT)")
-            if 'ACCOUNT' in df_mem.columns and 'USEDBYTES' in df_mem.columns and df_mem['USEDBYTES'].sum() > 0:
-                df_mem_account_clean = df_mem[df_mem['ACCOUNT'] != 'Compte Inconnu'].copy()
-                
-                if not df_mem_account_clean.empty:
-                    # Ensure USEDBYTES is numeric here
-                    df_mem_account_clean['USEDBYTES'] = pd.to_numeric(df_mem_account_clean['USEDBYTES'], errors='coerce').fillna(0).astype(float)
-                    df_mem_account_clean['ACCOUNT_DISPLAY'] = df_mem_account_clean['ACCOUNT'].astype(str)
-
-                    account_counts = df_mem_account_clean['ACCOUNT_DISPLAY'].nunique()
-                    if account_counts > 6:
-                        top_accounts = df_mem_account_clean['ACCOUNT_DISPLAY'].value_counts().nlargest(6).index
-                        df_mem_account_filtered_for_plot = df_mem_account_clean.loc[df_mem_account_clean['ACCOUNT_DISPLAY'].isin(top_accounts)].copy()
-                    else:
-                        df_mem_account_filtered_for_plot = df_mem_account_clean.copy()
-
-                    avg_mem_account = df_mem_account_filtered_for_plot.groupby('ACCOUNT_DISPLAY', as_index=False)['USEDBYTES'].mean().sort_values(by='USEDBYTES', ascending=False)
-                    if not avg_mem_account.empty and not avg_mem_account['USEDBYTES'].sum() == 0:
-                        fig_avg_mem_account = px.bar(avg_mem_account,
-                                                     x='ACCOUNT_DISPLAY', y='USEDBYTES',
-                                                     title="Moyenne de USEDBYTES par Client SAP (Top 6 ou tous)",
-                                                     labels={'USEDBYTES': 'Moyenne USEDBYTES (Octets)', 'ACCOUNT_DISPLAY': 'Client SAP'},
-                                                     color='USEDBYTES', color_continuous_scale=px.colors.sequential.Viridis)
-                        fig_avg_mem_account.update_xaxes(type='category')
-                        st.plotly_chart(fig_avg_mem_account, use_container_width=True)
-                    else:
-                        st.info("Pas de données valides pour la moyenne de USEDBYTES par Client SAP après filtrage (peut-être tous 'Compte Inconnu' ou USEDBYTES est zéro).")
-                else:
-                    st.info("Aucune donnée valide pour les clients (ACCOUNT) après filtrage.")
-            else:
+            avg_mem_account = memory_avg_by_account(df_mem)
+            if avg_mem_account is None:
                 st.info("Colonnes 'ACCOUNT' ou 'USEDBYTES' manquantes ou USEDBYTES total est zéro/vide après filtrage.")
+            elif not avg_mem_account.empty and not avg_mem_account['USEDBYTES'].sum() == 0:
+                fig_avg_mem_account = cached_figure(px.bar, avg_mem_account,
+                                                    x='ACCOUNT_DISPLAY', y='USEDBYTES',
+                                                    title="Moyenne de USEDBYTES par Client SAP (Top 6 ou tous)",
+                                                    labels={'USEDBYTES': 'Moyenne USEDBYTES (Octets)', 'ACCOUNT_DISPLAY': 'Client SAP'},
+                                                    color='USEDBYTES', color_continuous_scale=px.colors.sequential.Viridis,
+                                                    xaxes=dict(type='category'))
+                render_chart(fig_avg_mem_account)
+            else:
+                st.info("Pas de données valides pour la moyenne de USEDBYTES par Client SAP après filtrage (peut-être tous 'Compte Inconnu' ou USEDBYTES est zéro).")
 
             st.subheader("Distribution de l'Utilisation Mémoire (USEDBYTES) - Courbe de Densité")
-            if 'USEDBYTES' in df_mem.columns and df_mem['USEDBYTES'].sum() > 0:
-                # Ensure USEDBYTES is numeric here
-                df_mem['USEDBYTES'] = pd.to_numeric(df_mem['USEDBYTES'], errors='coerce').fillna(0).astype(float)
-                if df_mem['USEDBYTES'].nunique() > 1:
-                    fig_dist_mem = ff.create_distplot([df_mem['USEDBYTES'].dropna()], ['USEDBYTES'],
-                                                      bin_size=df_mem['USEDBYTES'].std()/5 if df_mem['USEDBYTES'].std() > 0 else 1,
-                                                      show_rug=False, show_hist=False)
-                    fig_dist_mem.update_layout(title_text="Distribution de l'Utilisation Mémoire (USEDBYTES) - Courbe de Densité",
-                                               xaxis_title='Utilisation Mémoire (Octets)',
-                                               yaxis_title='Densité')
-                    fig_dist_mem.data[0].line.color = 'lightcoral'
-                    st.plotly_chart(fig_dist_mem, use_container_width=True)
-                else:
-                    st.info("La colonne 'USEDBYTES' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
+            if has_positive_total(df_mem, 'USEDBYTES'):
+                render_density_chart(df_mem['USEDBYTES'], 'USEDBYTES',
+                                     "Distribution de l'Utilisation Mémoire (USEDBYTES) - Courbe de Densité",
+                                     'Utilisation Mémoire (Octets)', 'lightcoral',
+                                     "La colonne 'USEDBYTES' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
             else:
                 st.info("Colonne 'USEDBYTES' manquante ou total est zéro/vide après filtrage.")
 
-            if 'FULL_DATETIME' in df_mem.columns and pd.api.types.is_datetime64_any_dtype(df_mem['FULL_DATETIME']) and not df_mem['FULL_DATETIME'].isnull().all() and 'USEDBYTES' in df_mem.columns and df_mem['USEDBYTES'].sum() > 0:
-                # Ensure USEDBYTES is numeric here
-                df_mem['USEDBYTES'] = pd.to_numeric(df_mem['USEDBYTES'], errors='coerce').fillna(0).astype(float)
-                hourly_mem_usage = df_mem.set_index('FULL_DATETIME')['USEDBYTES'].resample('H').mean().dropna()
-                if not hourly_mem_usage.empty:
-                    fig_hourly_mem = px.line(hourly_mem_usage.reset_index(), x='FULL_DATETIME', y='USEDBYTES',
-                                             title="Tendance Moyenne USEDBYTES par Heure",
-                                             labels={'FULL_DATETIME': 'Heure', 'USEDBYTES': 'Moyenne USEDBYTES'},
-                                             color_discrete_sequence=['purple'])
-                    fig_hourly_mem.update_xaxes(dtick="H1", tickformat="%H:%M")
-                    st.plotly_chart(fig_hourly_mem, use_container_width=True)
-                else:
-                    pass
-            else:
-                pass
-            
+            hourly_mem_usage = hourly_mean(df_mem, 'USEDBYTES')
+            if hourly_mem_usage is not None and not hourly_mem_usage.empty:
+                fig_hourly_mem = cached_figure(px.line, hourly_mem_usage.reset_index(), x='FULL_DATETIME', y='USEDBYTES',
+                                               title="Tendance Moyenne USEDBYTES par Heure",
+                                               labels={'FULL_DATETIME': 'Heure', 'USEDBYTES': 'Moyenne USEDBYTES'},
+                                               color_discrete_sequence=['purple'],
+                                               xaxes=dict(dtick="H1", tickformat="%H:%M"))
+                render_chart(fig_hourly_mem)
+
+            st.subheader("Prévision de Capacité Mémoire par Compte et Type de Tâche")
+            st.markdown("""
+                Chaque série horaire compte / type de tâche est ajustée par une tendance linéaire et une saisonnalité
+                journalière (hebdomadaire au-delà de deux semaines d'extrait), toutes séries ensemble. Le pic projeté
+                est le maximum prévu sur l'horizon ; la borne haute ajoute la dispersion des résidus de la série.
+                """)
+            render_memory_forecast(df_mem)
+
             st.subheader("Comparaison des Métriques Mémoire (USEDBYTES, MAXBYTES, PRIVSUM) par Compte Utilisateur")
-            mem_metrics_cols = ['USEDBYTES', 'MAXBYTES', 'PRIVSUM']
-            if all(col in df_mem.columns for col in mem_metrics_cols) and 'ACCOUNT' in df_mem.columns and df_mem[mem_metrics_cols].sum().sum() > 0:
-                # Ensure numeric types before aggregation
-                for col in mem_metrics_cols:
-                    df_mem[col] = pd.to_numeric(df_mem[col], errors='coerce').fillna(0).astype(float)
-
-                account_mem_summary = df_mem.groupby('ACCOUNT', as_index=False)[mem_metrics_cols].sum().nlargest(10, 'USEDBYTES')
-                
-                if not account_mem_summary.empty and account_mem_summary[mem_metrics_cols].sum().sum() > 0:
-                    fig_mem_comparison = px.bar(account_mem_summary,
-                                                x='ACCOUNT', y=mem_metrics_cols,
-                                                title="Comparaison des Métriques Mémoire par Compte Utilisateur (Top 10 USEDBYTES)",
-                                                labels={'value': 'Quantité (Octets)', 'variable': 'Métrique Mémoire', 'ACCOUNT': 'Compte Utilisateur'},
-                                                barmode='group',
-                                                color_discrete_sequence=px.colors.qualitative.Pastel)
-                    st.plotly_chart(fig_mem_comparison, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour la comparaison des métriques mémoire par compte utilisateur après filtrage.")
-            else:
+            # Même agrégat que le Top 10 ci-dessus (somme par compte, tri sur USEDBYTES).
+            account_mem_summary = top_users_mem
+            if account_mem_summary is None:
                 st.info("Colonnes nécessaires (ACCOUNT, USEDBYTES, MAXBYTES, PRIVSUM) manquantes ou leurs totaux sont zéro/vides après filtrage pour la comparaison des métriques mémoire.")
+            elif not account_mem_summary.empty and account_mem_summary[MEMORY_METRICS].sum().sum() > 0:
+                fig_mem_comparison = cached_figure(px.bar, account_mem_summary,
+                                                   x='ACCOUNT', y=MEMORY_METRICS,
+                                                   title="Comparaison des Métriques Mémoire par Compte Utilisateur (Top 10 USEDBYTES)",
+                                                   labels={'value': 'Quantité (Octets)', 'variable': 'Métrique Mémoire', 'ACCOUNT': 'Compte Utilisateur'},
+                                                   barmode='group',
+                                                   color_discrete_sequence=px.colors.qualitative.Pastel)
+                render_chart(fig_mem_comparison)
+            else:
+                st.info("Pas de données valides pour la comparaison des métriques mémoire par compte utilisateur après filtrage.")
 
             st.subheader("Top Types de Tâches (TASKTYPE) par Utilisation Mémoire (USEDBYTES)")
-            if 'TASKTYPE' in df_mem.columns and 'USEDBYTES' in df_mem.columns and df_mem['USEDBYTES'].sum() > 0:
-                # Ensure USEDBYTES is numeric here
-                df_mem['USEDBYTES'] = pd.to_numeric(df_mem['USEDBYTES'], errors='coerce').fillna(0).astype(float)
-                top_tasktype_mem = df_mem.groupby('TASKTYPE', as_index=False)['USEDBYTES'].sum().nlargest(3, 'USEDBYTES') # Ajout de 'USEDBYTES' comme critère
-                if not top_tasktype_mem.empty and top_tasktype_mem['USEDBYTES'].sum() > 0:
-                    fig_top_tasktype_mem = px.bar(top_tasktype_mem,
-                                                x='TASKTYPE', y='USEDBYTES',
-                                                title="Top 3 Types de Tâches par Utilisation Mémoire (USEDBYTES)",
-                                                labels={'USEDBYTES': 'Utilisation Mémoire Totale (Octets)', 'TASKTYPE': 'Type de Tâche'},
-                                                color='USEDBYTES', color_continuous_scale=px.colors.sequential.Greys)
-                    st.plotly_chart(fig_top_tasktype_mem, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour les Top Types de Tâches par Utilisation Mémoire après filtrage.")
-            else:
+            top_tasktype_mem = top_n_by(df_mem, 'TASKTYPE', 'USEDBYTES', n=3)
+            if top_tasktype_mem is None:
                 st.info("Colonnes 'TASKTYPE' ou 'USEDBYTES' manquantes ou USEDBYTES total est zéro/vide après filtrage pour les types de tâches mémoire.")
+            elif not top_tasktype_mem.empty and top_tasktype_mem['USEDBYTES'].sum() > 0:
+                fig_top_tasktype_mem = cached_figure(px.bar, top_tasktype_mem,
+                                                     x='TASKTYPE', y='USEDBYTES',
+                                                     title="Top 3 Types de Tâches par Utilisation Mémoire (USEDBYTES)",
+                                                     labels={'USEDBYTES': 'Utilisation Mémoire Totale (Octets)', 'TASKTYPE': 'Type de Tâche'},
+                                                     color='USEDBYTES', color_continuous_scale=px.colors.sequential.Greys)
+                render_chart(fig_top_tasktype_mem)
+            else:
+                st.info("Pas de données valides pour les Top Types de Tâches par Utilisation Mémoire après filtrage.")
 
 
-            st.subheader("Aperçu des Données Mémoire Filtrées")
-            st.dataframe(df_mem.head())
+            st.subheader("Explorateur des Données Mémoire Filtrées")
+            render_data_explorer(df_mem, 'memory')
+            render_section_exports(df_mem, 'memory', dict(chart_frames))
         else:
             st.warning("Données mémoire non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Transactions Utilisateurs":
+    @st.fragment
+    def render_user_transactions_section(dfs, read_trend):
         # --- Onglet 2: Transactions Utilisateurs (USERTCODE_cleaned.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("👤 Analyse des Transactions Utilisateurs")
-        df_user = dfs['usertcode'].copy()
-        if selected_accounts:
-            if 'ACCOUNT' in df_user.columns:
-                df_user = df_user[df_user['ACCOUNT'].isin(selected_accounts)]
-            else:
-                st.warning("La colonne 'ACCOUNT' est manquante dans les données utilisateurs pour le filtrage.")
-        if selected_tasktypes:
-            if 'TASKTYPE' in df_user.columns:
-                df_user = df_user[df_user['TASKTYPE'].isin(selected_tasktypes)]
-            else:
-                st.warning("La colonne 'TASKTYPE' est manquante dans les données utilisateurs pour le filtrage.")
+        df_user = dfs['usertcode']
 
         if not df_user.empty:
             st.subheader("Top Types de Tâches (TASKTYPE) par Temps de Réponse Moyen")
-            if 'TASKTYPE' in df_user.columns and 'RESPTI' in df_user.columns and df_user['RESPTI'].sum() > 0:
-                # Ensure RESPTI is numeric before aggregation
-                df_user['RESPTI'] = pd.to_numeric(df_user['RESPTI'], errors='coerce').fillna(0).astype(float)
-
-                temp_top_tasktype_resp = df_user.groupby('TASKTYPE', as_index=False)['RESPTI'].mean()
-                
-                if not temp_top_tasktype_resp.empty and 'RESPTI' in temp_top_tasktype_resp.columns and pd.api.types.is_numeric_dtype(temp_top_tasktype_resp['RESPTI']):
-                    # Check if there are enough non-NaN values to perform nlargest
-                    if temp_top_tasktype_resp['RESPTI'].dropna().count() >= 6: # Check if at least 6 non-NaN values
-                        top_tasktype_resp_intermediate = temp_top_tasktype_resp.nlargest(6, 'RESPTI').sort_values(by='RESPTI', ascending=False)
-                        
-                        # Apply division only to the 'RESPTI' column
-                        if not top_tasktype_resp_intermediate.empty and 'RESPTI' in top_tasktype_resp_intermediate.columns:
-                            # Ensure the column is numeric before division
-                            top_tasktype_resp_intermediate['RESPTI'] = pd.to_numeric(top_tasktype_resp_intermediate['RESPTI'], errors='coerce').fillna(0).astype(float)
-                            
-                            # Apply division only to the numeric column
-                            top_tasktype_resp = top_tasktype_resp_intermediate.copy() # Create a copy to avoid SettingWithCopyWarning
-                            top_tasktype_resp['RESPTI'] = top_tasktype_resp['RESPTI'] / 1000.0
-                            
-                            if not top_tasktype_resp.empty and top_tasktype_resp['RESPTI'].sum() > 0:
-                                fig_top_tasktype_resp = px.bar(top_tasktype_resp,
-                                                                x='TASKTYPE', y='RESPTI',
-                                                                title="Top 6 TASKTYPE par Temps de Réponse Moyen (s)",
-                                                                labels={'RESPTI': 'Temps de Réponse Moyen (s)', 'TASKTYPE': 'Type de Tâche'},
-                                                                color='RESPTI', color_continuous_scale=px.colors.sequential.Oranges)
-                                st.plotly_chart(fig_top_tasktype_resp, use_container_width=True)
-                            else:
-                                st.info("Pas de données valides pour les Top Types de Tâches par Temps de Réponse Moyen après filtrage et sélection des 6 plus grandes valeurs (résultat vide ou zéro après division).")
-                        else:
-                            st.info("Pas de données valides pour les Top Types de Tâches par Temps de Réponse Moyen après filtrage et sélection des 6 plus grandes valeurs (résultat intermédiaire vide).")
-                    else:
-                        st.info("Pas assez de données valides dans 'RESPTI' pour déterminer les Top 6 Types de Tâches après filtrage.")
-                else:
-                    st.info("Pas de données valides pour les Top Types de Tâches par Temps de Réponse Moyen après filtrage (la moyenne est vide ou non-numérique).")
-            else:
+            top_tasktype_resp = top_tasktypes_by_mean(df_user, 'RESPTI', 6)
+            if top_tasktype_resp is None:
                 st.info("Colonnes 'TASKTYPE' ou 'RESPTI' manquantes ou RESPTI total est zéro/vide après filtrage.")
-            
-            transaction_types = ['COUNT', 'DCOUNT', 'UCOUNT', 'BCOUNT', 'ECOUNT', 'SCOUNT']
-            available_trans_types = [col for col in transaction_types if col in df_user.columns]
-
-            if available_trans_types and not df_user.empty and df_user[available_trans_types].sum().sum() > 0:
-                # Ensure numeric types for transaction counts
-                for col in available_trans_types:
-                    df_user[col] = pd.to_numeric(df_user[col], errors='coerce').fillna(0).astype(float)
-                transactions_sum = df_user[available_trans_types].sum().sort_values(ascending=False)
+            elif top_tasktype_resp.empty:
+                st.info("Pas assez de données valides dans 'RESPTI' pour déterminer les Top 6 Types de Tâches après filtrage.")
+            elif top_tasktype_resp['RESPTI'].sum() > 0:
+                fig_top_tasktype_resp = cached_figure(px.bar, top_tasktype_resp,
+                                                      x='TASKTYPE', y='RESPTI',
+                                                      title="Top 6 TASKTYPE par Temps de Réponse Moyen (s)",
+                                                      labels={'RESPTI': 'Temps de Réponse Moyen (s)', 'TASKTYPE': 'Type de Tâche'},
+                                                      color='RESPTI', color_continuous_scale=px.colors.sequential.Oranges)
+                render_chart(fig_top_tasktype_resp)
+            else:
+                st.info("Pas de données valides pour les Top Types de Tâches par Temps de Réponse Moyen après filtrage et sélection des 6 plus grandes valeurs (résultat vide ou zéro après division).")
+
+            transactions_sum = user_transaction_totals(df_user)
+            if transactions_sum is not None:
                 if not transactions_sum.empty and transactions_sum.sum() > 0:
-                    fig_transactions_sum = px.bar(transactions_sum.reset_index(),
-                                                    x='index', y=0,
-                                                    title="Nombre Total de Transactions par Type",
-                                                    labels={'index': 'Type de Transaction', '0': 'Nombre Total'},
-                                                    color=0, color_continuous_scale=px.colors.sequential.Blues)
-                    st.plotly_chart(fig_transactions_sum, use_container_width=True)
+                    fig_transactions_sum = cached_figure(px.bar, transactions_sum.reset_index(),
+                                                         x='index', y=0,
+                                                         title="Nombre Total de Transactions par Type",
+                                                         labels={'index': 'Type de Transaction', '0': 'Nombre Total'},
+                                                         color=0, color_continuous_scale=px.colors.sequential.Blues)
+                    render_chart(fig_transactions_sum)
                 else:
                     st.info("Pas de données valides pour le nombre total de transactions par type après filtrage.")
-            else:
-                pass
-            
-            if 'RESPTI' in df_user.columns and 'ACCOUNT' in df_user.columns and 'ENTRY_ID' in df_user.columns and df_user['RESPTI'].sum() > 0:
+
+            long_response = long_response_breakdown(df_user)
+            if long_response is not None:
                 st.subheader("Top Comptes Utilisateurs et Opérations Associées aux Longues Durées")
-                # Ensure RESPTI is numeric here
-                df_user['RESPTI'] = pd.to_numeric(df_user['RESPTI'], errors='coerce').fillna(0).astype(float)
-                response_time_threshold = df_user['RESPTI'].quantile(0.90)
-                long_duration_users = df_user[df_user['RESPTI'] > response_time_threshold]
-
-                if not long_duration_users.empty:
-                    st.write(f"Seuil de temps de réponse élevé (90ème percentile) : {response_time_threshold / 1000:.2f} secondes")
-                    
+                if long_response['rows'] > 0:
+                    st.write(f"Seuil de temps de réponse élevé (90ème percentile) : {long_response['threshold'] / 1000:.2f} secondes")
+
                     st.markdown("**Top Comptes (ACCOUNT) avec temps de réponse élevé :**")
-                    top_accounts_long_resp = long_duration_users['ACCOUNT'].value_counts().nlargest(10).reset_index()
-                    top_accounts_long_resp.columns = ['ACCOUNT', 'Occurrences']
+                    top_accounts_long_resp = long_response['accounts']
                     if not top_accounts_long_resp.empty and top_accounts_long_resp['Occurrences'].sum() > 0:
-                        fig_top_acc_long = px.bar(top_accounts_long_resp, x='ACCOUNT', y='Occurrences',
-                                                    title="Top Comptes avec Temps de Réponse Élevé",
-                                                    color='Occurrences', color_continuous_scale=px.colors.sequential.Greens)
-                        st.plotly_chart(fig_top_acc_long, use_container_width=True)
+                        fig_top_acc_long = cached_figure(px.bar, top_accounts_long_resp, x='ACCOUNT', y='Occurrences',
+                                                         title="Top Comptes avec Temps de Réponse Élevé",
+                                                         color='Occurrences', color_continuous_scale=px.colors.sequential.Greens)
+                        render_chart(fig_top_acc_long)
                     else:
                         st.info("Pas de données pour les Top Comptes avec temps de réponse élevé après filtrage.")
-                    
+
                     st.markdown("**Top Opérations (ENTRY_ID) avec temps de réponse élevé :**")
-                    top_entry_id_long_resp = long_duration_users['ENTRY_ID'].value_counts().nlargest(10).reset_index()
-                    top_entry_id_long_resp.columns = ['ENTRY_ID', 'Occurrences']
+                    top_entry_id_long_resp = long_response['entries']
                     if not top_entry_id_long_resp.empty and top_entry_id_long_resp['Occurrences'].sum() > 0:
-                        fig_top_entry_long = px.bar(top_entry_id_long_resp, x='ENTRY_ID', y='Occurrences',
-                                                    title="Top ENTRY_ID avec Temps de Réponse Élevé",
-                                                    color='Occurrences', color_continuous_scale=px.colors.sequential.Teal)
-                        st.plotly_chart(fig_top_entry_long, use_container_width=True)
+                        fig_top_entry_long = cached_figure(px.bar, top_entry_id_long_resp, x='ENTRY_ID', y='Occurrences',
+                                                           title="Top ENTRY_ID avec Temps de Réponse Élevé",
+                                                           color='Occurrences', color_continuous_scale=px.colors.sequential.Teal)
+                        render_chart(fig_top_entry_long)
                     else:
                         st.info("Pas de données pour les Top Opérations avec temps de réponse élevé après filtrage.")
                 else:
                     st.info("Aucune transaction avec un temps de réponse élevé (au-dessus du 90ème percentile) après filtrage.")
-            else:
-                pass
-            
-            if 'FULL_DATETIME' in df_user.columns and pd.api.types.is_datetime64_any_dtype(df_user['FULL_DATETIME']) and not df_user['FULL_DATETIME'].isnull().all() and 'RESPTI' in df_user.columns and df_user['RESPTI'].sum() > 0:
+
+            hourly_resp_time = read_trend('usertcode', df_user, 'RESPTI', scale=1000.0)
+            if hourly_resp_time is not None:
                 st.subheader("Tendance du Temps de Réponse Moyen par Heure")
-                # Ensure RESPTI is numeric here
-                df_user['RESPTI'] = pd.to_numeric(df_user['RESPTI'], errors='coerce').fillna(0).astype(float)
-                hourly_resp_time = df_user.set_index('FULL_DATETIME')['RESPTI'].resample('H').mean().dropna() / 1000.0
                 if not hourly_resp_time.empty:
-                    fig_hourly_resp = px.line(hourly_resp_time.reset_index(), x='FULL_DATETIME', y='RESPTI',
-                                                title="Tendance du Temps de Réponse Moyen par Heure (s)",
-                                                labels={'FULL_DATETIME': 'Heure', 'RESPTI': 'Temps de Réponse Moyen (s)'},
-                                                color_discrete_sequence=['red'])
-                    fig_hourly_resp.update_xaxes(dtick="H1", tickformat="%H:%M")
-                    st.plotly_chart(fig_hourly_resp, use_container_width=True)
+                    fig_hourly_resp = cached_figure(px.line, hourly_resp_time.reset_index(), x='FULL_DATETIME', y='RESPTI',
+                                                    title="Tendance du Temps de Réponse Moyen par Heure (s)",
+                                                    labels={'FULL_DATETIME': 'Heure', 'RESPTI': 'Temps de Réponse Moyen (s)'},
+                                                    color_discrete_sequence=['red'],
+                                                  xaxes=trend_xaxes())
+                    render_chart(fig_hourly_resp)
+                    render_history_caption('usertcode')
                 else:
                     st.info("Pas de données valides pour la tendance horaire du temps de réponse après filtrage.")
             else:
                 st.info("Colonnes 'FULL_DATETIME' ou 'RESPTI' manquantes/invalides ou RESPTI total est zéro/vide après filtrage pour la tendance.")
-            
+
             st.subheader("Corrélation entre Temps de Réponse et Temps CPU")
             st.markdown("""
                 Ce graphique explore la relation entre le temps de réponse total d'une transaction et le temps CPU qu'elle consomme.
@@ -753,34 +664,26 @@ else:
                 * Les points éloignés de la tendance peuvent indiquer d'autres facteurs influençant le temps de réponse (par exemple, des attentes E/S, des verrous, etc.).
                 * La couleur des points indique le type de tâche, aidant à identifier les catégories de transactions qui se comportent différemment.
                 """)
-            
-            hover_data_cols = []
-            if 'ACCOUNT' in df_user.columns:
-                hover_data_cols.append('ACCOUNT')
-            if 'TASKTYPE' in df_user.columns:
-                hover_data_cols.append('TASKTYPE')
-            if 'ENTRY_ID' in df_user.columns:
-                hover_data_cols.append('ENTRY_ID')
-
-            if 'RESPTI' in df_user.columns and 'CPUTI' in df_user.columns and df_user['CPUTI'].sum() > 0 and df_user['RESPTI'].sum() > 0:
-                # Ensure numeric types here
-                df_user['RESPTI'] = pd.to_numeric(df_user['RESPTI'], errors='coerce').fillna(0).astype(float)
-                df_user['CPUTI'] = pd.to_numeric(df_user['CPUTI'], errors='coerce').fillna(0).astype(float)
-                fig_resp_cpu_corr = px.scatter(df_user, x='CPUTI', y='RESPTI',
-                                                title="Temps de Réponse vs. Temps CPU",
-                                                labels={'CPUTI': 'Temps CPU (ms)', 'RESPTI': 'Temps de Réponse (ms)'},
-                                                hover_data=hover_data_cols,
-                                                color='TASKTYPE' if 'TASKTYPE' in df_user.columns else None,
-                                                log_x=True,
-                                                log_y=True,
-                                                # Removed: trendline="ols" - requires 'statsmodels' which causes installation issues
-                                                color_discrete_sequence=px.colors.qualitative.Alphabet)
-                st.plotly_chart(fig_resp_cpu_corr, use_container_width=True)
+
+            hover_data_cols = [col for col in ['ACCOUNT', 'TASKTYPE', 'ENTRY_ID'] if col in df_user.columns]
+
+            if has_positive_total(df_user, 'CPUTI') and has_positive_total(df_user, 'RESPTI'):
+                fig_resp_cpu_corr = cached_figure(px.scatter, df_user, cache_key=('usertcode', selection_key), x='CPUTI', y='RESPTI',
+                                                  title="Temps de Réponse vs. Temps CPU",
+                                                  labels={'CPUTI': 'Temps CPU (ms)', 'RESPTI': 'Temps de Réponse (ms)'},
+                                                  hover_data=hover_data_cols,
+                                                  color='TASKTYPE' if 'TASKTYPE' in df_user.columns else None,
+                                                  log_x=True,
+                                                  log_y=True,
+                                                  # Removed: trendline="ols" - requires 'statsmodels' which causes installation issues
+                                                  color_discrete_sequence=px.colors.qualitative.Alphabet)
+                render_chart(fig_resp_cpu_corr)
             else:
                 st.info("Colonnes 'RESPTI' ou 'CPUTI' manquantes ou leurs totaux sont zéro/vide après filtrage pour la corrélation.")
-            
+
             io_detailed_metrics_counts = ['READDIRCNT', 'READSEQCNT', 'CHNGCNT', 'PHYREADCNT']
-            if 'TASKTYPE' in df_user.columns and all(col in df_user.columns for col in io_detailed_metrics_counts) and df_user[io_detailed_metrics_counts].sum().sum() > 0:
+            df_io_counts = top_n_by(df_user, 'TASKTYPE', io_detailed_metrics_counts, n=10, order_by='PHYREADCNT')
+            if df_io_counts is not None:
                 st.subheader("Total des Opérations de Lecture/Écriture (Comptes) par Type de Tâche")
                 st.markdown("""
                     Ce graphique présente le total des opérations de lecture et d'écriture par type de tâche.
@@ -790,23 +693,18 @@ else:
                     * **PHYREADCNT** : Nombre total de lectures physiques (lectures réelles depuis le disque).
                     Ces métriques sont cruciales pour comprendre l'intensité des interactions de chaque tâche avec la base de données ou le système de fichiers.
                     """)
-                # Ensure numeric types here
-                for col in io_detailed_metrics_counts:
-                    df_user[col] = pd.to_numeric(df_user[col], errors='coerce').fillna(0).astype(float)
-                df_io_counts = df_user.groupby('TASKTYPE', as_index=False)[io_detailed_metrics_counts].sum().nlargest(10, 'PHYREADCNT')
                 if not df_io_counts.empty and df_io_counts['PHYREADCNT'].sum() > 0: # Check sum of the column used for nlargest
-                    fig_io_counts = px.bar(df_io_counts, x='TASKTYPE', y=io_detailed_metrics_counts,
-                                           title="Total des Opérations de Lecture/Écriture (Comptes) par Type de Tâche (Top 10)",
-                                           labels={'value': 'Nombre d\'Opérations', 'variable': 'Type d\'Opération', 'TASKTYPE': 'Type de Tâche'},
-                                           barmode='group', color_discrete_sequence=px.colors.sequential.Blues)
-                    st.plotly_chart(fig_io_counts, use_container_width=True)
+                    fig_io_counts = cached_figure(px.bar, df_io_counts, x='TASKTYPE', y=io_detailed_metrics_counts,
+                                                  title="Total des Opérations de Lecture/Écriture (Comptes) par Type de Tâche (Top 10)",
+                                                  labels={'value': 'Nombre d\'Opérations', 'variable': 'Type d\'Opération', 'TASKTYPE': 'Type de Tâche'},
+                                                  barmode='group', color_discrete_sequence=px.colors.sequential.Blues)
+                    render_chart(fig_io_counts)
                 else:
                     st.info("Données insuffisantes pour les opérations de lecture/écriture (comptes) après filtrage.")
-            else:
-                pass
 
             io_detailed_metrics_buffers_records = ['READDIRBUF', 'READDIRREC', 'READSEQBUF', 'READSEQREC', 'CHNGREC', 'PHYCHNGREC']
-            if 'TASKTYPE' in df_user.columns and all(col in df_user.columns for col in io_detailed_metrics_buffers_records) and df_user[io_detailed_metrics_buffers_records].sum().sum() > 0:
+            df_io_buffers_records = top_n_by(df_user, 'TASKTYPE', io_detailed_metrics_buffers_records, n=10, order_by='READDIRREC')
+            if df_io_buffers_records is not None:
                 st.subheader("Utilisation des Buffers et Enregistrements par Type de Tâche")
                 st.markdown("""
                     Ce graphique détaille l'efficacité des opérations d'E/S en montrant l'utilisation des tampons et le nombre d'enregistrements traités.
@@ -818,24 +716,19 @@ else:
                     * **PHYCHNGREC** : Nombre total d'enregistrements physiquement modifiés.
                     Ces métriques aident à évaluer si les tâches tirent parti de la mise en cache (buffers) et l'ampleur des données traitées.
                     """)
-                # Ensure numeric types here
-                for col in io_detailed_metrics_buffers_records:
-                    df_user[col] = pd.to_numeric(df_user[col], errors='coerce').fillna(0).astype(float)
-                df_io_buffers_records = df_user.groupby('TASKTYPE', as_index=False)[io_detailed_metrics_buffers_records].sum().nlargest(10, 'READDIRREC')
                 if not df_io_buffers_records.empty and df_io_buffers_records['READDIRREC'].sum() > 0: # Check sum of the column used for nlargest
-                    fig_io_buffers_records = px.bar(df_io_buffers_records, x='TASKTYPE', y=io_detailed_metrics_buffers_records,
-                                                    title="Utilisation des Buffers et Enregistrements par Type de Tâche (Top 10)",
-                                                    labels={'value': 'Nombre', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
-                                                    barmode='group', color_discrete_sequence=px.colors.sequential.Plasma)
-                    st.plotly_chart(fig_io_buffers_records, use_container_width=True)
+                    fig_io_buffers_records = cached_figure(px.bar, df_io_buffers_records, x='TASKTYPE', y=io_detailed_metrics_buffers_records,
+                                                           title="Utilisation des Buffers et Enregistrements par Type de Tâche (Top 10)",
+                                                           labels={'value': 'Nombre', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
+                                                           barmode='group', color_discrete_sequence=px.colors.sequential.Plasma)
+                    render_chart(fig_io_buffers_records)
                 else:
                     st.info("Données insuffisantes pour l'utilisation des buffers et enregistrements après filtrage.")
-            else:
-                pass
 
 
             comm_metrics_filtered = ['DSQLCNT', 'SLI_CNT']
-            if 'TASKTYPE' in df_user.columns and all(col in df_user.columns for col in comm_metrics_filtered) and df_user[comm_metrics_filtered].sum().sum() > 0:
+            df_comm_metrics = top_n_by(df_user, 'TASKTYPE', comm_metrics_filtered, n=4, order_by='DSQLCNT')
+            if df_comm_metrics is not None:
                 st.subheader("Analyse des Communications et Appels Système par Type de Tâche (DSQLCNT et SLI_CNT)")
                 st.markdown("""
                     Ce graphique se concentre sur deux métriques clés pour les interactions des tâches avec d'autres systèmes :
@@ -843,208 +736,120 @@ else:
                     * **SLI_CNT** : Nombre d'appels SLI (System Level Interface). Ces appels représentent les interactions de bas niveau avec le système d'exploitation ou d'autres composants système.
                     Ces métriques sont essentielles pour diagnostiquer les problèmes de communication ou les dépendances externes.
                     """)
-                # Ensure numeric types here
-                for col in comm_metrics_filtered:
-                    df_user[col] = pd.to_numeric(df_user[col], errors='coerce').fillna(0).astype(float)
-                df_comm_metrics = df_user.groupby('TASKTYPE', as_index=False)[comm_metrics_filtered].sum().nlargest(4, 'DSQLCNT')
                 if not df_comm_metrics.empty and df_comm_metrics['DSQLCNT'].sum() > 0: # Check sum of the column used for nlargest
-                    fig_comm_metrics = px.bar(df_comm_metrics, x='TASKTYPE', y=comm_metrics_filtered,
-                                                title="Communications et Appels Système par Type de Tâche (Top 4)",
-                                                labels={'value': 'Nombre / Temps (ms)', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
-                                                barmode='group', color_discrete_sequence=px.colors.qualitative.Bold)
-                    st.plotly_chart(fig_comm_metrics, use_container_width=True)
+                    fig_comm_metrics = cached_figure(px.bar, df_comm_metrics, x='TASKTYPE', y=comm_metrics_filtered,
+                                                     title="Communications et Appels Système par Type de Tâche (Top 4)",
+                                                     labels={'value': 'Nombre / Temps (ms)', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
+                                                     barmode='group', color_discrete_sequence=px.colors.qualitative.Bold)
+                    render_chart(fig_comm_metrics)
                 else:
                     st.info("Données insuffisantes pour les métriques de communication et d'appels système après filtrage.")
             else:
                 st.info("Colonnes de communication (DSQLCNT, SLI_CNT) manquantes ou leurs sommes sont zéro/vides après filtrage.")
 
 
-            st.subheader("Aperçu des Données Utilisateurs Filtrées")
-            st.dataframe(df_user.head())
+            st.subheader("Explorateur des Données Utilisateurs Filtrées")
+            render_data_explorer(df_user, 'usertcode')
+            render_section_exports(df_user, 'usertcode', dict(chart_frames))
         else:
             st.warning("Données utilisateurs non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Statistiques Horaires":
+    @st.fragment
+    def render_hourly_stats_section(dfs):
         # --- Onglet 3: Statistiques Horaires (Times_final_cleaned_clean.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("⏰ Statistiques Horaires du Système")
-        df_times_data = dfs['times'].copy()
-        if selected_tasktypes:
-            if 'TASKTYPE' in df_times_data.columns:
-                df_times_data = df_times_data[df_times_data['TASKTYPE'].isin(selected_tasktypes)]
-            else:
-                st.warning("La colonne 'TASKTYPE' est manquante dans les données horaires pour le filtrage.")
-            
+        df_times_data = dfs['times']
+
         if not df_times_data.empty:
             st.subheader("Évolution du Nombre Total d'Appels Physiques (PHYCALLS) par Tranche Horaire")
-            if 'TIME' in df_times_data.columns and 'PHYCALLS' in df_times_data.columns and df_times_data['PHYCALLS'].sum() > 0:
-                # Ensure PHYCALLS is numeric here
-                df_times_data['PHYCALLS'] = pd.to_numeric(df_times_data['PHYCALLS'], errors='coerce').fillna(0).astype(float)
-                df_times_data['HOUR_OF_DAY'] = df_times_data['TIME'].apply(lambda x: str(x).split(':')[0].zfill(2) if ':' in str(x) else str(x).zfill(2)[:2])
-                
-                # Appliquer fillna(0) sur la colonne numérique avant de grouper et de convertir en catégorie
-                hourly_counts = df_times_data.groupby('HOUR_OF_DAY', as_index=False)['PHYCALLS'].sum().fillna(0)
-                
-                hourly_categories = [str(i).zfill(2) for i in range(24)] # Générer toutes les heures de 00 à 23
-                hourly_counts['HOUR_OF_DAY'] = pd.Categorical(hourly_counts['HOUR_OF_DAY'], categories=hourly_categories, ordered=True)
-                hourly_counts = hourly_counts.sort_values('HOUR_OF_DAY')
-
-                if not hourly_counts.empty and hourly_counts['PHYCALLS'].sum() > 0:
-                    fig_phycalls = px.line(hourly_counts,
-                                            x='HOUR_OF_DAY', y='PHYCALLS',
-                                            title="Total Appels Physiques par Tranche Horaire",
-                                            labels={'HOUR_OF_DAY': 'Tranche Horaire', 'PHYCALLS': 'Total Appels Physiques'},
-                                            color_discrete_sequence=px.colors.sequential.Cividis,
-                                            markers=True)
-                    st.plotly_chart(fig_phycalls, use_container_width=True)
-                else:
-                    pass
-            else:
+            hourly_counts = phycalls_by_hour(df_times_data)
+            if hourly_counts is None:
                 st.info("Colonnes 'TIME' ou 'PHYCALLS' manquantes ou PHYCALLS total est zéro/vide après filtrage.")
+            elif not hourly_counts.empty and hourly_counts['PHYCALLS'].sum() > 0:
+                fig_phycalls = cached_figure(px.line, hourly_counts,
+                                             x='HOUR_OF_DAY', y='PHYCALLS',
+                                             title="Total Appels Physiques par Tranche Horaire",
+                                             labels={'HOUR_OF_DAY': 'Tranche Horaire', 'PHYCALLS': 'Total Appels Physiques'},
+                                             color_discrete_sequence=px.colors.sequential.Cividis,
+                                             markers=True)
+                render_chart(fig_phycalls)
 
             st.subheader("Top 5 Tranches Horaires les plus Chargées (Opérations d'E/S)")
-            io_cols = ['READDIRCNT', 'READSEQCNT', 'CHNGCNT']
-            if all(col in df_times_data.columns for col in io_cols) and df_times_data[io_cols].sum().sum() > 0:
-                # Ensure numeric types here
-                for col in io_cols:
-                    df_times_data[col] = pd.to_numeric(df_times_data[col], errors='coerce').fillna(0).astype(float)
-                df_times_data['TOTAL_IO'] = df_times_data['READDIRCNT'] + df_times_data['READSEQCNT'] + df_times_data['CHNGCNT']
-                top_io_times = df_times_data.groupby('TIME', as_index=False)['TOTAL_IO'].sum().nlargest(5, 'TOTAL_IO').sort_values(by='TOTAL_IO', ascending=False)
-                if not top_io_times.empty and top_io_times['TOTAL_IO'].sum() > 0:
-                    fig_top_io = px.bar(top_io_times,
-                                        x='TIME', y='TOTAL_IO',
-                                        title="Top 5 Tranches Horaires par Total Opérations I/O",
-                                        labels={'TIME': 'Tranche Horaire', 'TOTAL_IO': 'Total Opérations I/O'},
-                                        color='TOTAL_IO', color_continuous_scale=px.colors.sequential.Inferno)
-                    st.plotly_chart(fig_top_io, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour les opérations I/O après filtrage.")
-            else:
+            top_io_times = top_io_time_slots(df_times_data)
+            if top_io_times is None:
                 st.info("Colonnes I/O manquantes (READDIRCNT, READSEQCNT, CHNGCNT) ou leur somme est zéro/vide après filtrage.")
+            elif not top_io_times.empty and top_io_times['TOTAL_IO'].sum() > 0:
+                fig_top_io = cached_figure(px.bar, top_io_times,
+                                           x='TIME', y='TOTAL_IO',
+                                           title="Top 5 Tranches Horaires par Total Opérations I/O",
+                                           labels={'TIME': 'Tranche Horaire', 'TOTAL_IO': 'Total Opérations I/O'},
+                                           color='TOTAL_IO', color_continuous_scale=px.colors.sequential.Inferno)
+                render_chart(fig_top_io)
+            else:
+                st.info("Pas de données valides pour les opérations I/O après filtrage.")
 
             st.subheader("Temps Moyen de Réponse / CPU / Traitement par Tranche Horaire")
             perf_cols = ["RESPTI", "CPUTI", "PROCTI"]
-            if all(col in df_times_data.columns for col in perf_cols) and df_times_data[perf_cols].sum().sum() > 0:
-                # Ensure columns are numeric here too
-                for col in perf_cols:
-                    df_times_data[col] = pd.to_numeric(df_times_data[col], errors='coerce').fillna(0).astype(float)
-
-                avg_times_by_hour_temp = df_times_data.groupby("TIME", as_index=False)[perf_cols].mean()
-                
-                if not avg_times_by_hour_temp.empty and avg_times_by_hour_temp[perf_cols].sum().sum() > 0: # Check before division
-                    # Apply division and fillna(0) only to the numeric columns
-                    avg_times_by_hour = avg_times_by_hour_temp.copy() # Create a copy
-                    for col in perf_cols:
-                        avg_times_by_hour[col] = (avg_times_by_hour[col] / 1000.0).fillna(0) # Apply fillna here
-                    
-                    hourly_categories_times = [
-                        '00--06', '06--07', '07--08', '08--09', '09--10', '10--11', '11--12', '12--13',
-                        '13--14', '14--15', '15--16', '16--17', '17--18', '18--19', '19--20', '20--21',
-                        '21--22', '22--23', '23--00'
-                    ]
-                    # Convert 'TIME' to categorical AFTER numeric columns are handled
-                    avg_times_by_hour['TIME'] = pd.Categorical(avg_times_by_hour['TIME'], categories=hourly_categories_times, ordered=True)
-                    avg_times_by_hour = avg_times_by_hour.sort_values('TIME') # Removed .fillna(0) from here
-
-                    if not avg_times_by_hour.empty and avg_times_by_hour[perf_cols].sum().sum() > 0:
-                        fig_avg_times = px.line(avg_times_by_hour,
-                                                x='TIME', y=perf_cols,
-                                                title="Temps Moyen (s) par Tranche Horaire",
-                                                labels={'value': 'Temps Moyen (s)', 'variable': 'Métrique', 'TIME': 'Tranche Horaire'},
-                                                color_discrete_sequence=px.colors.qualitative.Set1,
-                                                markers=True)
-                        st.plotly_chart(fig_avg_times, use_container_width=True)
-                    else:
-                        st.info("Pas de données valides pour les temps moyens après filtrage.")
-                else:
-                    st.info("Pas de données valides pour les temps moyens après filtrage (la moyenne est vide ou zéro).")
-            else:
+            avg_times_by_hour = avg_times_by_slot(df_times_data, perf_cols)
+            if avg_times_by_hour is None:
                 st.info("Colonnes nécessaires (RESPTI, CPUTI, PROCTI, TIME) manquantes ou leur somme est zéro/vide après filtrage.")
-            
-            st.subheader("Aperçu des Données Horaires Filtrées")
-            st.dataframe(df_times_data.head())
+            elif not avg_times_by_hour.empty and avg_times_by_hour[perf_cols].sum().sum() > 0:
+                fig_avg_times = cached_figure(px.line, avg_times_by_hour,
+                                              x='TIME', y=perf_cols,
+                                              title="Temps Moyen (s) par Tranche Horaire",
+                                              labels={'value': 'Temps Moyen (s)', 'variable': 'Métrique', 'TIME': 'Tranche Horaire'},
+                                              color_discrete_sequence=px.colors.qualitative.Set1,
+                                              markers=True)
+                render_chart(fig_avg_times)
+            else:
+                st.info("Pas de données valides pour les temps moyens après filtrage.")
+
+            st.subheader("Explorateur des Données Horaires Filtrées")
+            render_data_explorer(df_times_data, 'times')
+            render_section_exports(df_times_data, 'times', dict(chart_frames))
         else:
             st.warning("Données horaires (Times) non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Décomposition des Tâches":
+    @st.fragment
+    def render_task_breakdown_section(dfs):
         # --- Onglet 4: Décomposition des Tâches (TASKTIMES_final_cleaned_clean.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("⚙️ Décomposition des Types de Tâches")
-        df_task = dfs['tasktimes'].copy()
-        if selected_tasktypes:
-            if 'TASKTYPE' in df_task.columns:
-                df_task = df_task[df_task['TASKTYPE'].isin(selected_tasktypes)]
-            else:
-                st.warning("La colonne 'TASKTYPE' est manquante dans les données de temps de tâches pour le filtrage.")
-
+        df_task = dfs['tasktimes']
 
         if not df_task.empty:
             st.subheader("Répartition des Types de Tâches (TASKTYPE)")
-            if 'TASKTYPE' in df_task.columns and 'COUNT' in df_task.columns and df_task['COUNT'].sum() > 0:
-                # Ensure COUNT is numeric here
-                df_task['COUNT'] = pd.to_numeric(df_task['COUNT'], errors='coerce').fillna(0).astype(float)
-                task_counts = df_task.groupby('TASKTYPE', as_index=False)['COUNT'].sum()
-                task_counts.columns = ['TASKTYPE', 'Count']
-                
-                min_count_for_pie = task_counts['Count'].sum() * 0.01
-                significant_tasks = pd.DataFrame() # Initialize as empty DataFrame
-                other_tasks_count = 0
-
-                if not task_counts.empty:
-                    significant_tasks = task_counts[task_counts['Count'] >= min_count_for_pie]
-                    other_tasks_count = task_counts[task_counts['Count'] < min_count_for_pie]['Count'].sum()
-
-                if other_tasks_count > 0:
-                    significant_tasks = pd.concat([significant_tasks, pd.DataFrame([{'TASKTYPE': 'Autres Petites Tâches', 'Count': other_tasks_count}])])
-
-                if not significant_tasks.empty and significant_tasks['Count'].sum() > 0:
-                    fig_task_dist = px.pie(significant_tasks, values='Count', names='TASKTYPE',
-                                            title="Répartition des Types de Tâches",
-                                            hole=0.3,
-                                            color_discrete_sequence=px.colors.sequential.RdBu)
-                    st.plotly_chart(fig_task_dist, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour la répartition des types de tâches après filtrage.")
-            else:
+            significant_tasks = tasktype_distribution(df_task)
+            if significant_tasks is None:
                 st.info("Colonnes 'TASKTYPE' ou 'COUNT' manquantes ou COUNT total est zéro/vide après filtrage.")
+            elif not significant_tasks.empty and significant_tasks['Count'].sum() > 0:
+                fig_task_dist = cached_figure(px.pie, significant_tasks, values='Count', names='TASKTYPE',
+                                              title="Répartition des Types de Tâches",
+                                              hole=0.3,
+                                              color_discrete_sequence=px.colors.sequential.RdBu)
+                render_chart(fig_task_dist)
+            else:
+                st.info("Pas de données valides pour la répartition des types de tâches après filtrage.")
 
             st.subheader("Top 10 TASKTYPE par Temps de Réponse (RESPTI) et CPU (CPUTI)")
             perf_cols_task = ['RESPTI', 'CPUTI']
-            if 'TASKTYPE' in df_task.columns and all(col in df_task.columns for col in perf_cols_task) and df_task[perf_cols_task].sum().sum() > 0:
-                # Ensure columns are numeric here too
-                for col in perf_cols_task:
-                    df_task[col] = pd.to_numeric(df_task[col], errors='coerce').fillna(0).astype(float)
-
-                temp_task_perf = df_task.groupby('TASKTYPE', as_index=False)[perf_cols_task].mean()
-                
-                if not temp_task_perf.empty and 'RESPTI' in temp_task_perf.columns and pd.api.types.is_numeric_dtype(temp_task_perf['RESPTI']): # Check before nlargest and division
-                    if temp_task_perf['RESPTI'].dropna().count() >= 10: # Check if at least 10 non-NaN values
-                        top_task_perf_intermediate = temp_task_perf.nlargest(10, 'RESPTI').sort_values(by='RESPTI', ascending=False)
-                        if not top_task_perf_intermediate.empty and top_task_perf_intermediate['RESPTI'].sum() > 0:
-                            # Ensure columns are numeric before division
-                            for col in perf_cols_task:
-                                top_task_perf_intermediate[col] = pd.to_numeric(top_task_perf_intermediate[col], errors='coerce').fillna(0).astype(float)
-                            
-                            # Apply division only to the numeric column
-                            task_perf = top_task_perf_intermediate.copy() # Create a copy
-                            for col in perf_cols_task:
-                                task_perf[col] = task_perf[col] / 1000.0
-                            
-                            if not task_perf.empty and task_perf['RESPTI'].sum() > 0:
-                                fig_task_perf = px.bar(task_perf,
-                                                        x='TASKTYPE', y=perf_cols_task,
-                                                        title="Top 10 TASKTYPE par Temps de Réponse et CPU (s)",
-                                                        labels={'value': 'Temps Moyen (s)', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
-                                                        barmode='group', color_discrete_sequence=px.colors.qualitative.Bold)
-                                st.plotly_chart(fig_task_perf, use_container_width=True)
-                            else:
-                                st.info("Pas de données valides pour les temps de performance des tâches après filtrage et sélection des 10 plus grandes valeurs (résultat vide ou zéro après division).")
-                        else:
-                            st.info("Pas de données valides pour les temps de performance des tâches après filtrage et sélection des 10 plus grandes valeurs (résultat intermédiaire vide).")
-                    else:
-                        st.info("Pas assez de données valides dans 'RESPTI' pour déterminer les Top 10 Types de Tâches après filtrage.")
-                else:
-                    st.info("Pas de données valides pour les temps de performance des tâches après filtrage (la moyenne est vide ou non-numérique).")
-            else:
+            task_perf = top_tasktypes_by_mean(df_task, perf_cols_task, 10)
+            if task_perf is None:
                 st.info("Colonnes 'TASKTYPE', 'RESPTI' ou 'CPUTI' manquantes ou leur somme est zéro/vide après filtrage.")
+            elif task_perf.empty:
+                st.info("Pas assez de données valides dans 'RESPTI' pour déterminer les Top 10 Types de Tâches après filtrage.")
+            elif task_perf['RESPTI'].sum() > 0:
+                fig_task_perf = cached_figure(px.bar, task_perf,
+                                              x='TASKTYPE', y=perf_cols_task,
+                                              title="Top 10 TASKTYPE par Temps de Réponse et CPU (s)",
+                                              labels={'value': 'Temps Moyen (s)', 'variable': 'Métrique', 'TASKTYPE': 'Type de Tâche'},
+                                              barmode='group', color_discrete_sequence=px.colors.qualitative.Bold)
+                render_chart(fig_task_perf)
+            else:
+                st.info("Pas de données valides pour les temps de performance des tâches après filtrage et sélection des 10 plus grandes valeurs (résultat vide ou zéro après division).")
 
             st.subheader("Décomposition des Temps d'Attente et GUI par Type de Tâche")
             st.markdown("""
@@ -1056,22 +861,18 @@ else:
                 Ces métriques aident à identifier les causes de lenteur qui ne sont pas directement liées au CPU, comme les attentes de ressources ou les problèmes réseau.
                 """)
             wait_gui_metrics = ['QUEUETI', 'ROLLWAITTI', 'GUITIME', 'GUINETTIME']
-            if 'TASKTYPE' in df_task.columns and all(col in df_task.columns for col in wait_gui_metrics) and df_task[wait_gui_metrics].sum().sum() > 0:
-                # Ensure numeric types here
-                for col in wait_gui_metrics:
-                    df_task[col] = pd.to_numeric(df_task[col], errors='coerce').fillna(0).astype(float)
-                df_wait_gui = df_task.groupby('TASKTYPE', as_index=False)[wait_gui_metrics].sum().nlargest(10, 'QUEUETI')
-                if not df_wait_gui.empty and df_wait_gui['QUEUETI'].sum() > 0:
-                    fig_wait_gui = px.bar(df_wait_gui, x='TASKTYPE',
-                                          y=wait_gui_metrics,
-                                          title="Temps d'Attente et GUI par Type de Tâche (Top 10)",
-                                          labels={'value': 'Temps (ms)', 'variable': 'Métrique de Temps', 'TASKTYPE': 'Type de Tâche'},
-                                          barmode='group', color_discrete_sequence=px.colors.qualitative.Pastel)
-                    st.plotly_chart(fig_wait_gui, use_container_width=True)
-                else:
-                    st.info("Données insuffisantes pour la décomposition des temps d'attente et GUI après filtrage.")
-            else:
+            df_wait_gui = top_n_by(df_task, 'TASKTYPE', wait_gui_metrics, n=10, order_by='QUEUETI')
+            if df_wait_gui is None:
                 st.info("Colonnes d'attente/GUI manquantes ou leurs sommes sont zéro/vides après filtrage.")
+            elif not df_wait_gui.empty and df_wait_gui['QUEUETI'].sum() > 0:
+                fig_wait_gui = cached_figure(px.bar, df_wait_gui, x='TASKTYPE',
+                                             y=wait_gui_metrics,
+                                             title="Temps d'Attente et GUI par Type de Tâche (Top 10)",
+                                             labels={'value': 'Temps (ms)', 'variable': 'Métrique de Temps', 'TASKTYPE': 'Type de Tâche'},
+                                             barmode='group', color_discrete_sequence=px.colors.qualitative.Pastel)
+                render_chart(fig_wait_gui)
+            else:
+                st.info("Données insuffisantes pour la décomposition des temps d'attente et GUI après filtrage.")
 
             st.subheader("Analyse des Opérations d'E/S (Lectures/Écritures) par Type de Tâche")
             st.markdown("""
@@ -1086,239 +887,186 @@ else:
                 """)
             # FIX: Added 'READDIRREC' to the list so it's available for nlargest
             io_metrics_tasktimes = ['READDIRCNT', 'READSEQCNT', 'CHNGCNT', 'PHYREADCNT', 'PHYCHNGREC', 'READDIRREC']
-            if 'TASKTYPE' in df_task.columns and all(col in df_task.columns for col in io_metrics_tasktimes) and df_task[io_metrics_tasktimes].sum().sum() > 0:
-                # Ensure numeric types here
-                for col in io_metrics_tasktimes:
-                    df_task[col] = pd.to_numeric(df_task[col], errors='coerce').fillna(0).astype(float)
-                df_io_tasktimes = df_task.groupby('TASKTYPE', as_index=False)[io_metrics_tasktimes].sum().nlargest(10, 'READDIRREC')
+            df_io_tasktimes = top_n_by(df_task, 'TASKTYPE', io_metrics_tasktimes, n=10, order_by='READDIRREC')
+            if df_io_tasktimes is not None:
                 if not df_io_tasktimes.empty and df_io_tasktimes['READDIRREC'].sum() > 0:
-                    fig_io_tasktimes = px.bar(df_io_tasktimes, x='TASKTYPE', y=io_metrics_tasktimes,
-                                              title="Opérations d'E/S par Type de Tâche (Top 10)",
-                                              labels={'value': 'Nombre d\'Opérations', 'variable': 'Métrique E/S', 'TASKTYPE': 'Type de Tâche'},
-                                              barmode='group', color_discrete_sequence=px.colors.sequential.Greens)
-                    st.plotly_chart(fig_io_tasktimes, use_container_width=True)
+                    fig_io_tasktimes = cached_figure(px.bar, df_io_tasktimes, x='TASKTYPE', y=io_metrics_tasktimes,
+                                                     title="Opérations d'E/S par Type de Tâche (Top 10)",
+                                                     labels={'value': 'Nombre d\'Opérations', 'variable': 'Métrique E/S', 'TASKTYPE': 'Type de Tâche'},
+                                                     barmode='group', color_discrete_sequence=px.colors.sequential.Greens)
+                    render_chart(fig_io_tasktimes)
                 else:
                     st.info("Données insuffisantes pour l'analyse des opérations d'E/S après filtrage.")
-            else:
-                pass
 
 
-            st.subheader("Aperçu des Données des Temps de Tâches Filtrées")
-            st.dataframe(df_task.head())
+            st.subheader("Explorateur des Données des Temps de Tâches Filtrées")
+            render_data_explorer(df_task, 'tasktimes')
+            render_section_exports(df_task, 'tasktimes', dict(chart_frames))
         else:
             st.warning("Données des temps de tâches non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Insights Hitlist DB":
+    @st.fragment
+    def render_hitlist_section(dfs, read_trend):
         # --- NOUVEL ONGLET: Insights Détaillés de la Base de Données (Hitlist DB) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("🔍 Insights Détaillés de la Base de Données (Hitlist DB)")
-        df_hitlist = dfs['hitlist_db'].copy()
-        
-        # Appliquer les filtres globaux si disponibles
-        if selected_accounts:
-            if 'ACCOUNT' in df_hitlist.columns:
-                df_hitlist = df_hitlist[df_hitlist['ACCOUNT'].isin(selected_accounts)]
-            else:
-                st.warning("La colonne 'ACCOUNT' est manquante dans les données Hitlist DB pour le filtrage.")
-        if selected_reports:
-            if 'REPORT' in df_hitlist.columns:
-                df_hitlist = df_hitlist[df_hitlist['REPORT'].isin(selected_reports)]
-            else:
-                st.warning("La colonne 'REPORT' est manquante dans les données Hitlist DB pour le filtrage.")
-        if selected_tasktypes:
-            if 'TASKTYPE' in df_hitlist.columns:
-                df_hitlist = df_hitlist[df_hitlist['TASKTYPE'].isin(selected_tasktypes)]
-            else:
-                st.warning("La colonne 'TASKTYPE' est manquante dans les données Hitlist DB pour le filtrage.")
+        df_hitlist = dfs['hitlist_db']
 
         if not df_hitlist.empty:
             st.subheader("Top 10 Rapports par Temps de Réponse Moyen (RESPTI)")
-            if 'REPORT' in df_hitlist.columns and 'RESPTI' in df_hitlist.columns and df_hitlist['RESPTI'].sum() > 0:
-                df_hitlist['RESPTI'] = pd.to_numeric(df_hitlist['RESPTI'], errors='coerce').fillna(0).astype(float)
-                top_reports_resp = df_hitlist.groupby('REPORT', as_index=False)['RESPTI'].mean().nlargest(10, 'RESPTI')
-                if not top_reports_resp.empty and top_reports_resp['RESPTI'].sum() > 0:
-                    fig_top_reports_resp = px.bar(top_reports_resp,
-                                                  x='REPORT', y='RESPTI',
-                                                  title="Top 10 Rapports par Temps de Réponse Moyen (ms)",
-                                                  labels={'RESPTI': 'Temps de Réponse Moyen (ms)', 'REPORT': 'Rapport'},
-                                                  color='RESPTI', color_continuous_scale=px.colors.sequential.Sunset)
-                    st.plotly_chart(fig_top_reports_resp, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour les Top 10 Rapports par Temps de Réponse Moyen après filtrage.")
-            else:
+            top_reports_resp = top_n_by(df_hitlist, 'REPORT', 'RESPTI', n=10, agg='mean')
+            if top_reports_resp is None:
                 st.info("Colonnes 'REPORT' ou 'RESPTI' manquantes ou RESPTI total est zéro/vide après filtrage.")
+            elif not top_reports_resp.empty and top_reports_resp['RESPTI'].sum() > 0:
+                fig_top_reports_resp = cached_figure(px.bar, top_reports_resp,
+                                                     x='REPORT', y='RESPTI',
+                                                     title="Top 10 Rapports par Temps de Réponse Moyen (ms)",
+                                                     labels={'RESPTI': 'Temps de Réponse Moyen (ms)', 'REPORT': 'Rapport'},
+                                                     color='RESPTI', color_continuous_scale=px.colors.sequential.Sunset)
+                render_chart(fig_top_reports_resp)
+            else:
+                st.info("Pas de données valides pour les Top 10 Rapports par Temps de Réponse Moyen après filtrage.")
 
             st.subheader("Top 10 Comptes par Nombre d'Appels Base de Données (DBCALLS)")
-            if 'ACCOUNT' in df_hitlist.columns and 'DBCALLS' in df_hitlist.columns and df_hitlist['DBCALLS'].sum() > 0:
-                df_hitlist['DBCALLS'] = pd.to_numeric(df_hitlist['DBCALLS'], errors='coerce').fillna(0).astype(float)
-                top_accounts_db_calls = df_hitlist.groupby('ACCOUNT', as_index=False)['DBCALLS'].sum().nlargest(10, 'DBCALLS')
-                if not top_accounts_db_calls.empty and top_accounts_db_calls['DBCALLS'].sum() > 0:
-                    fig_top_accounts_db_calls = px.bar(top_accounts_db_calls,
-                                                       x='ACCOUNT', y='DBCALLS',
-                                                       title="Top 10 Comptes par Nombre d'Appels Base de Données",
-                                                       labels={'DBCALLS': 'Nombre Total d\'Appels DB', 'ACCOUNT': 'Compte Utilisateur'},
-                                                       color='DBCALLS', color_continuous_scale=px.colors.sequential.Mint)
-                    st.plotly_chart(fig_top_accounts_db_calls, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour les Top 10 Comptes par Nombre d'Appels Base de Données après filtrage.")
-            else:
+            top_accounts_db_calls = top_n_by(df_hitlist, 'ACCOUNT', 'DBCALLS', n=10)
+            if top_accounts_db_calls is None:
                 st.info("Colonnes 'ACCOUNT' ou 'DBCALLS' manquantes ou DBCALLS total est zéro/vide après filtrage.")
+            elif not top_accounts_db_calls.empty and top_accounts_db_calls['DBCALLS'].sum() > 0:
+                fig_top_accounts_db_calls = cached_figure(px.bar, top_accounts_db_calls,
+                                                          x='ACCOUNT', y='DBCALLS',
+                                                          title="Top 10 Comptes par Nombre d'Appels Base de Données",
+                                                          labels={'DBCALLS': 'Nombre Total d\'Appels DB', 'ACCOUNT': 'Compte Utilisateur'},
+                                                          color='DBCALLS', color_continuous_scale=px.colors.sequential.Mint)
+                render_chart(fig_top_accounts_db_calls)
+            else:
+                st.info("Pas de données valides pour les Top 10 Comptes par Nombre d'Appels Base de Données après filtrage.")
 
             st.subheader("Distribution du Temps de Réponse (RESPTI) - Courbe de Densité")
-            if 'RESPTI' in df_hitlist.columns and df_hitlist['RESPTI'].sum() > 0:
-                df_hitlist['RESPTI'] = pd.to_numeric(df_hitlist['RESPTI'], errors='coerce').fillna(0).astype(float)
-                if df_hitlist['RESPTI'].nunique() > 1:
-                    fig_dist_resp_time = ff.create_distplot([df_hitlist['RESPTI'].dropna()], ['RESPTI'],
-                                                            bin_size=df_hitlist['RESPTI'].std()/5 if df_hitlist['RESPTI'].std() > 0 else 1,
-                                                            show_rug=False, show_hist=False)
-                    fig_dist_resp_time.update_layout(title_text="Distribution du Temps de Réponse (RESPTI)",
-                                                     xaxis_title='Temps de Réponse (ms)',
-                                                     yaxis_title='Densité')
-                    fig_dist_resp_time.data[0].line.color = 'darkred'
-                    st.plotly_chart(fig_dist_resp_time, use_container_width=True)
-                else:
-                    st.info("La colonne 'RESPTI' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
+            if has_positive_total(df_hitlist, 'RESPTI'):
+                render_density_chart(df_hitlist['RESPTI'], 'RESPTI',
+                                     "Distribution du Temps de Réponse (RESPTI)",
+                                     'Temps de Réponse (ms)', 'darkred',
+                                     "La colonne 'RESPTI' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
             else:
                 st.info("Colonne 'RESPTI' manquante ou total est zéro/vide après filtrage.")
 
-            # --- DÉBUT DU BLOC SUPPRIMÉ ---
-            # st.subheader("Corrélation entre Temps de Réponse (RESPTI) et Temps CPU (CPUTI)")
-            # if 'RESPTI' in df_hitlist.columns and 'CPUTI' in df_hitlist.columns and df_hitlist['RESPTI'].sum() > 0 and df_hitlist['CPUTI'].sum() > 0:
-            #     df_hitlist['RESPTI'] = pd.to_numeric(df_hitlist['RESPTI'], errors='coerce').fillna(0).astype(float)
-            #     df_hitlist['CPUTI'] = pd.to_numeric(df_hitlist['CPUTI'], errors='coerce').fillna(0).astype(float)
-            #     fig_resp_cpu_hitlist = px.scatter(df_hitlist, x='CPUTI', y='RESPTI',
-            #                                       title="Temps de Réponse vs. Temps CPU (Hitlist DB)",
-            #                                       labels={'CPUTI': 'Temps CPU (ms)', 'RESPTI': 'Temps de Réponse (ms)'},
-            #                                       hover_data=['ACCOUNT', 'REPORT', 'TASKTYPE'],
-            #                                       color='TASKTYPE' if 'TASKTYPE' in df_hitlist.columns else None,
-            #                                       log_x=True,
-            #                                       log_y=True,
-            #                                       color_discrete_sequence=px.colors.qualitative.Plotly)
-            #     st.plotly_chart(fig_resp_cpu_hitlist, use_container_width=True)
-            # else:
-            #     st.info("Colonnes 'RESPTI' ou 'CPUTI' manquantes ou leurs totaux sont zéro/vides après filtrage pour la corrélation.")
-            # --- FIN DU BLOC SUPPRIMÉ ---
-
             st.subheader("Tendance du Temps de Réponse Moyen par Heure (Hitlist DB)")
-            if 'FULL_DATETIME' in df_hitlist.columns and pd.api.types.is_datetime64_any_dtype(df_hitlist['FULL_DATETIME']) and not df_hitlist['FULL_DATETIME'].isnull().all() and 'RESPTI' in df_hitlist.columns and df_hitlist['RESPTI'].sum() > 0:
-                df_hitlist['RESPTI'] = pd.to_numeric(df_hitlist['RESPTI'], errors='coerce').fillna(0).astype(float)
-                hourly_resp_time_hitlist = df_hitlist.set_index('FULL_DATETIME')['RESPTI'].resample('H').mean().dropna() / 1000.0
-                if not hourly_resp_time_hitlist.empty:
-                    fig_hourly_resp_hitlist = px.line(hourly_resp_time_hitlist.reset_index(), x='FULL_DATETIME', y='RESPTI',
-                                                      title="Tendance du Temps de Réponse Moyen par Heure (s) - Hitlist DB",
-                                                      labels={'FULL_DATETIME': 'Heure', 'RESPTI': 'Temps de Réponse Moyen (s)'},
-                                                      color_discrete_sequence=['blue'])
-                    fig_hourly_resp_hitlist.update_xaxes(dtick="H1", tickformat="%H:%M")
-                    st.plotly_chart(fig_hourly_resp_hitlist, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour la tendance horaire du temps de réponse après filtrage.")
-            else:
+            hourly_resp_time_hitlist = read_trend('hitlist_db', df_hitlist, 'RESPTI', scale=1000.0)
+            if hourly_resp_time_hitlist is None:
                 st.info("Colonnes 'FULL_DATETIME' ou 'RESPTI' manquantes/invalides ou RESPTI total est zéro/vide après filtrage pour la tendance.")
+            elif not hourly_resp_time_hitlist.empty:
+                fig_hourly_resp_hitlist = cached_figure(px.line, hourly_resp_time_hitlist.reset_index(), x='FULL_DATETIME', y='RESPTI',
+                                                        title="Tendance du Temps de Réponse Moyen par Heure (s) - Hitlist DB",
+                                                        labels={'FULL_DATETIME': 'Heure', 'RESPTI': 'Temps de Réponse Moyen (s)'},
+                                                        color_discrete_sequence=['blue'],
+                                                        xaxes=trend_xaxes())
+                render_chart(fig_hourly_resp_hitlist)
+                render_history_caption('hitlist_db')
+            else:
+                st.info("Pas de données valides pour la tendance horaire du temps de réponse après filtrage.")
 
-            st.subheader("Aperçu des Données Hitlist DB Filtrées")
-            st.dataframe(df_hitlist.head())
+            st.subheader("Explorateur des Données Hitlist DB Filtrées")
+            render_data_explorer(df_hitlist, 'hitlist_db')
+            render_section_exports(df_hitlist, 'hitlist_db', dict(chart_frames))
         else:
             st.warning("Données Hitlist DB non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Performance des Processus de Travail":
+    @st.fragment
+    def render_work_process_section(dfs, wp_history, selected_wp_types, selected_systems):
         # --- Onglet 6: Performance des Processus de Travail (AL_GET_PERFORMANCE) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("⚡ Performance des Processus de Travail")
-        df_perf = dfs['performance'].copy()
-
-        if selected_wp_types:
-            if 'WP_TYP' in df_perf.columns:
-                df_perf = df_perf[df_perf['WP_TYP'].isin(selected_wp_types)]
-            else:
-                st.warning("La colonne 'WP_TYP' est manquante dans les données de performance pour le filtrage.")
+        df_perf = dfs['performance']
 
         if not df_perf.empty:
             st.subheader("Distribution du Temps CPU des Processus de Travail (en secondes)")
-            if 'WP_CPU_SECONDS' in df_perf.columns and df_perf['WP_CPU_SECONDS'].sum() > 0:
-                # Ensure WP_CPU_SECONDS is numeric here
-                df_perf['WP_CPU_SECONDS'] = pd.to_numeric(df_perf['WP_CPU_SECONDS'], errors='coerce').fillna(0).astype(float)
-                if df_perf['WP_CPU_SECONDS'].nunique() > 1:
-                    fig_cpu_dist = ff.create_distplot([df_perf['WP_CPU_SECONDS'].dropna()], ['Temps CPU (s)'],
-                                                      bin_size=df_perf['WP_CPU_SECONDS'].std()/5 if df_perf['WP_CPU_SECONDS'].std() > 0 else 1,
-                                                      show_rug=False, show_hist=False)
-                    fig_cpu_dist.update_layout(title_text="Distribution du Temps CPU des Processus de Travail",
-                                               xaxis_title='Temps CPU (secondes)',
-                                               yaxis_title='Densité')
-                    fig_cpu_dist.data[0].line.color = 'darkblue'
-                    st.plotly_chart(fig_cpu_dist, use_container_width=True)
-                else:
-                    st.info("La colonne 'WP_CPU_SECONDS' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
+            if has_positive_total(df_perf, 'WP_CPU_SECONDS'):
+                render_density_chart(df_perf['WP_CPU_SECONDS'], 'Temps CPU (s)',
+                                     "Distribution du Temps CPU des Processus de Travail",
+                                     'Temps CPU (secondes)', 'darkblue',
+                                     "La colonne 'WP_CPU_SECONDS' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
             else:
                 st.info("Colonne 'WP_CPU_SECONDS' manquante ou total est zéro/vide après filtrage.")
 
             st.subheader("Répartition des Processus de Travail par Statut (WP_STATUS)")
-            if 'WP_STATUS' in df_perf.columns and not df_perf['WP_STATUS'].empty:
-                status_counts = df_perf['WP_STATUS'].value_counts().reset_index()
-                status_counts.columns = ['Statut', 'Count']
-                if not status_counts.empty and status_counts['Count'].sum() > 0:
-                    fig_status_pie = px.pie(status_counts, values='Count', names='Statut',
-                                            title="Répartition des Processus de Travail par Statut",
-                                            hole=0.3, color_discrete_sequence=px.colors.qualitative.Pastel)
-                    st.plotly_chart(fig_status_pie, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour la répartition par statut des processus de travail après filtrage.")
-            else:
+            status_counts = value_counts_frame(df_perf, 'WP_STATUS', ['Statut', 'Count'])
+            if status_counts is None:
                 st.info("Colonne 'WP_STATUS' manquante ou vide après filtrage.")
+            elif not status_counts.empty and status_counts['Count'].sum() > 0:
+                fig_status_pie = cached_figure(px.pie, status_counts, values='Count', names='Statut',
+                                               title="Répartition des Processus de Travail par Statut",
+                                               hole=0.3, color_discrete_sequence=px.colors.qualitative.Pastel)
+                render_chart(fig_status_pie)
+            else:
+                st.info("Pas de données valides pour la répartition par statut des processus de travail après filtrage.")
 
             st.subheader("Nombre de Processus de Travail par Type (WP_TYP)")
-            if 'WP_TYP' in df_perf.columns and not df_perf['WP_TYP'].empty:
-                type_counts = df_perf['WP_TYP'].value_counts().reset_index()
-                type_counts.columns = ['Type', 'Count']
-                if not type_counts.empty and type_counts['Count'].sum() > 0:
-                    fig_type_bar = px.bar(type_counts, x='Type', y='Count',
-                                            title="Nombre de Processus de Travail par Type",
-                                            labels={'Type': 'Type de Processus', 'Count': 'Nombre'},
-                                            color='Count', color_continuous_scale=px.colors.sequential.Viridis)
-                    st.plotly_chart(fig_type_bar, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour le nombre de processus de travail par type après filtrage.")
-            else:
+            type_counts = value_counts_frame(df_perf, 'WP_TYP', ['Type', 'Count'])
+            if type_counts is None:
                 st.info("Colonne 'WP_TYP' manquante ou vide après filtrage.")
+            elif not type_counts.empty and type_counts['Count'].sum() > 0:
+                fig_type_bar = cached_figure(px.bar, type_counts, x='Type', y='Count',
+                                             title="Nombre de Processus de Travail par Type",
+                                             labels={'Type': 'Type de Processus', 'Count': 'Nombre'},
+                                             color='Count', color_continuous_scale=px.colors.sequential.Viridis)
+                render_chart(fig_type_bar)
+            else:
+                st.info("Pas de données valides pour le nombre de processus de travail par type après filtrage.")
 
             st.subheader("Temps CPU Moyen par Type de Processus de Travail (en secondes)")
-            if 'WP_TYP' in df_perf.columns and 'WP_CPU_SECONDS' in df_perf.columns and df_perf['WP_CPU_SECONDS'].sum() > 0:
-                # Ensure WP_CPU_SECONDS is numeric here
-                df_perf['WP_CPU_SECONDS'] = pd.to_numeric(df_perf['WP_CPU_SECONDS'], errors='coerce').fillna(0).astype(float)
-                avg_cpu_by_type = df_perf.groupby('WP_TYP', as_index=False)['WP_CPU_SECONDS'].mean()
-                if not avg_cpu_by_type.empty and avg_cpu_by_type['WP_CPU_SECONDS'].sum() > 0:
-                    fig_avg_cpu_type = px.bar(avg_cpu_by_type, x='WP_TYP', y='WP_CPU_SECONDS',
-                                                title="Temps CPU Moyen par Type de Processus de Travail",
-                                                labels={'WP_TYP': 'Type de Processus', 'WP_CPU_SECONDS': 'Temps CPU Moyen (s)'},
-                                                color='WP_CPU_SECONDS', color_continuous_scale=px.colors.sequential.Plasma)
-                    st.plotly_chart(fig_avg_cpu_type, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour le temps CPU moyen par type de processus de travail après filtrage.")
-            else:
+            avg_cpu_by_type = top_n_by(df_perf, 'WP_TYP', 'WP_CPU_SECONDS', n=None, agg='mean')
+            if avg_cpu_by_type is None:
                 st.info("Colonnes 'WP_TYP' ou 'WP_CPU_SECONDS' manquantes ou total est zéro/vide après filtrage.")
+            elif not avg_cpu_by_type.empty and avg_cpu_by_type['WP_CPU_SECONDS'].sum() > 0:
+                fig_avg_cpu_type = cached_figure(px.bar, avg_cpu_by_type, x='WP_TYP', y='WP_CPU_SECONDS',
+                                                 title="Temps CPU Moyen par Type de Processus de Travail",
+                                                 labels={'WP_TYP': 'Type de Processus', 'WP_CPU_SECONDS': 'Temps CPU Moyen (s)'},
+                                                 color='WP_CPU_SECONDS', color_continuous_scale=px.colors.sequential.Plasma)
+                render_chart(fig_avg_cpu_type)
+            else:
+                st.info("Pas de données valides pour le temps CPU moyen par type de processus de travail après filtrage.")
 
             st.subheader("Nombre Total de Redémarrages par Type de Processus de Travail (WP_IRESTRT)")
-            if 'WP_TYP' in df_perf.columns and 'WP_IRESTRT' in df_perf.columns and df_perf['WP_IRESTRT'].sum() > 0:
-                # Ensure WP_IRESTRT is numeric here
-                df_perf['WP_IRESTRT'] = pd.to_numeric(df_perf['WP_IRESTRT'], errors='coerce').fillna(0).astype(float)
-                restarts_by_type = df_perf.groupby('WP_TYP', as_index=False)['WP_IRESTRT'].sum().nlargest(10, 'WP_IRESTRT')
-                if not restarts_by_type.empty and restarts_by_type['WP_IRESTRT'].sum() > 0:
-                    fig_restarts_type = px.bar(restarts_by_type, x='WP_TYP', y='WP_IRESTRT',
-                                                title="Nombre Total de Redémarrages par Type de Processus de Travail",
-                                                labels={'WP_TYP': 'Type de Processus', 'WP_IRESTRT': 'Nombre Total de Redémarrages'},
-                                                color='WP_IRESTRT', color_continuous_scale=px.colors.sequential.OrRd)
-                    st.plotly_chart(fig_restarts_type, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour le nombre de redémarrages par type de processus de travail après filtrage.")
-            else:
+            restarts_by_type = top_n_by(df_perf, 'WP_TYP', 'WP_IRESTRT', n=10)
+            if restarts_by_type is None:
                 st.info("Colonnes 'WP_TYP' ou 'WP_IRESTRT' manquantes ou total est zéro/vide après filtrage.")
+            elif not restarts_by_type.empty and restarts_by_type['WP_IRESTRT'].sum() > 0:
+                fig_restarts_type = cached_figure(px.bar, restarts_by_type, x='WP_TYP', y='WP_IRESTRT',
+                                                  title="Nombre Total de Redémarrages par Type de Processus de Travail",
+                                                  labels={'WP_TYP': 'Type de Processus', 'WP_IRESTRT': 'Nombre Total de Redémarrages'},
+                                                  color='WP_IRESTRT', color_continuous_scale=px.colors.sequential.OrRd)
+                render_chart(fig_restarts_type)
+            else:
+                st.info("Pas de données valides pour le nombre de redémarrages par type de processus de travail après filtrage.")
 
-            st.subheader("Aperçu des Données de Performance Filtrées")
-            st.dataframe(df_perf.head())
+            st.subheader("Modèle de Capacité des Processus de Travail (File M/M/c)")
+            st.markdown("""
+                Pour chaque tranche horaire, les pas des temps par type de tâche donnent le taux d'arrivée et la durée
+                d'occupation d'un WP (RESPTI - QUEUETI - ROLLWAITTI) ; une file M/M/c (Erlang C) en déduit l'utilisation
+                et l'attente en file pour un nombre de processus donné, et le nombre minimal de processus pour tenir
+                une attente cible. Les traitements d'arrière-plan sont approximés par la même file.
+                """)
+            render_capacity_model(dfs['tasktimes'], df_perf)
+
+            if wp_history is not None:
+                st.subheader("Historique des Processus de Travail (Snapshots Successifs)")
+                render_wp_history(wp_history, selected_wp_types, selected_systems)
+
+            st.subheader("Explorateur des Données de Performance Filtrées")
+            render_data_explorer(df_perf, 'performance')
+            render_section_exports(df_perf, 'performance', dict(chart_frames))
         else:
             st.warning("Données de performance non disponibles ou filtrées à vide.")
-    
-    elif st.session_state.current_section == "Résumé des Traces de Performance SQL":
+
+    @st.fragment
+    def render_sql_trace_section(dfs, sql_fingerprint_lookup, sql_server_stats):
         # --- Onglet 7: Résumé des Traces de Performance SQL (performance_trace_summary_final_cleaned_clean.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("📊 Résumé des Traces de Performance SQL")
-        df_sql_trace = dfs['sql_trace_summary'].copy()
+        df_sql_trace = dfs['sql_trace_summary']
 
         if not df_sql_trace.empty:
             st.subheader("Top 10 Requêtes SQL par Temps d'Exécution Total (EXECTIME)")
@@ -1326,18 +1074,15 @@ else:
                 Ce graphique identifie les 10 requêtes SQL qui ont consommé le plus de temps d'exécution cumulé.
                 Il est crucial pour repérer les goulots d'étranglement globaux en termes de performance.
                 """)
-            if 'SQLSTATEM' in df_sql_trace.columns and 'EXECTIME' in df_sql_trace.columns and df_sql_trace['EXECTIME'].sum() > 0:
-                # Ensure EXECTIME is numeric here
-                df_sql_trace['EXECTIME'] = pd.to_numeric(df_sql_trace['EXECTIME'], errors='coerce').fillna(0).astype(float)
-                top_sql_by_exectime = df_sql_trace.groupby('SQLSTATEM', as_index=False)['EXECTIME'].sum().nlargest(10, 'EXECTIME')
-                top_sql_by_exectime['SQLSTATEM_SHORT'] = top_sql_by_exectime['SQLSTATEM'].apply(lambda x: x[:70] + '...' if len(x) > 70 else x)
+            if 'SQL_FINGERPRINT' in df_sql_trace.columns and has_positive_total(df_sql_trace, 'EXECTIME'):
+                top_sql_by_exectime = top_sql_by_fingerprint(df_sql_trace, sql_fingerprint_lookup, 'EXECTIME', 'sum')
                 if not top_sql_by_exectime.empty and top_sql_by_exectime['EXECTIME'].sum() > 0:
-                    fig_top_sql_exectime = px.bar(top_sql_by_exectime, y='SQLSTATEM_SHORT', x='EXECTIME', orientation='h',
-                                                    title="Top 10 Requêtes SQL par Temps d'Exécution Total",
-                                                    labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'EXECTIME': 'Temps d\'Exécution Total'},
-                                                    color='EXECTIME', color_continuous_scale=px.colors.sequential.Blues)
-                    fig_top_sql_exectime.update_yaxes(autorange="reversed")
-                    st.plotly_chart(fig_top_sql_exectime, use_container_width=True)
+                    fig_top_sql_exectime = cached_figure(px.bar, top_sql_by_exectime, y='SQLSTATEM_SHORT', x='EXECTIME', orientation='h',
+                                                         title="Top 10 Requêtes SQL par Temps d'Exécution Total",
+                                                         labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'EXECTIME': 'Temps d\'Exécution Total'},
+                                                         color='EXECTIME', color_continuous_scale=px.colors.sequential.Blues,
+                                                       yaxes=dict(autorange="reversed"))
+                    render_chart(fig_top_sql_exectime)
                 else:
                     st.info("Pas de données valides pour les Top 10 Requêtes SQL par Temps d'Exécution Total après filtrage.")
             else:
@@ -1349,18 +1094,15 @@ else:
                 Il est utile pour identifier les requêtes qui, même si elles ne sont pas individuellement lentes,
                 peuvent avoir un impact significatif sur la performance globale en raison de leur volume d'exécution élevé.
                 """)
-            if 'SQLSTATEM' in df_sql_trace.columns and 'TOTALEXEC' in df_sql_trace.columns and df_sql_trace['TOTALEXEC'].sum() > 0:
-                # Ensure TOTALEXEC is numeric here
-                df_sql_trace['TOTALEXEC'] = pd.to_numeric(df_sql_trace['TOTALEXEC'], errors='coerce').fillna(0).astype(float)
-                top_sql_by_totalexec = df_sql_trace.groupby('SQLSTATEM', as_index=False)['TOTALEXEC'].sum().nlargest(10, 'TOTALEXEC')
-                top_sql_by_totalexec['SQLSTATEM_SHORT'] = top_sql_by_totalexec['SQLSTATEM'].apply(lambda x: x[:70] + '...' if len(x) > 70 else x)
+            if 'SQL_FINGERPRINT' in df_sql_trace.columns and has_positive_total(df_sql_trace, 'TOTALEXEC'):
+                top_sql_by_totalexec = top_sql_by_fingerprint(df_sql_trace, sql_fingerprint_lookup, 'TOTALEXEC', 'sum')
                 if not top_sql_by_totalexec.empty and top_sql_by_totalexec['TOTALEXEC'].sum() > 0:
-                    fig_top_sql_totalexec = px.bar(top_sql_by_totalexec, y='SQLSTATEM_SHORT', x='TOTALEXEC', orientation='h',
-                                                    title="Top 10 Requêtes SQL par Nombre Total d'Exécutions",
-                                                    labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'TOTALEXEC': 'Nombre Total d\'Exécutions'},
-                                                    color='TOTALEXEC', color_continuous_scale=px.colors.sequential.Greens)
-                    fig_top_sql_totalexec.update_yaxes(autorange="reversed")
-                    st.plotly_chart(fig_top_sql_totalexec, use_container_width=True)
+                    fig_top_sql_totalexec = cached_figure(px.bar, top_sql_by_totalexec, y='SQLSTATEM_SHORT', x='TOTALEXEC', orientation='h',
+                                                          title="Top 10 Requêtes SQL par Nombre Total d'Exécutions",
+                                                          labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'TOTALEXEC': 'Nombre Total d\'Exécutions'},
+                                                          color='TOTALEXEC', color_continuous_scale=px.colors.sequential.Greens,
+                                                         yaxes=dict(autorange="reversed"))
+                    render_chart(fig_top_sql_totalexec)
                 else:
                     st.info("Pas de données valides pour les Top 10 Requêtes SQL par Nombre Total d'Exécutions après filtrage.")
             else:
@@ -1372,69 +1114,69 @@ else:
                 Elle permet de comprendre si la plupart des exécutions sont rapides ou si certaines sont significativement plus lentes,
                 indiquant des performances inégales.
                 """)
-            if 'TIMEPEREXE' in df_sql_trace.columns and df_sql_trace['TIMEPEREXE'].sum() > 0:
-                # Ensure TIMEPEREXE is numeric here
-                df_sql_trace['TIMEPEREXE'] = pd.to_numeric(df_sql_trace['TIMEPEREXE'], errors='coerce').fillna(0).astype(float)
-                if df_sql_trace['TIMEPEREXE'].nunique() > 1:
-                    fig_time_per_exe_dist = ff.create_distplot([df_sql_trace['TIMEPEREXE'].dropna()], ['TIMEPEREXE'],
-                                                                bin_size=df_sql_trace['TIMEPEREXE'].std()/5 if df_sql_trace['TIMEPEREXE'].std() > 0 else 1,
-                                                                show_rug=False, show_hist=False)
-                    fig_time_per_exe_dist.update_layout(title_text="Distribution du Temps par Exécution",
-                                                        xaxis_title='Temps par Exécution',
-                                                        yaxis_title='Densité')
-                    fig_time_per_exe_dist.data[0].line.color = 'darkgreen'
-                    st.plotly_chart(fig_time_per_exe_dist, use_container_width=True)
-                else:
-                    st.info("La colonne 'TIMEPEREXE' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
+            if has_positive_total(df_sql_trace, 'TIMEPEREXE'):
+                render_density_chart(df_sql_trace['TIMEPEREXE'], 'TIMEPEREXE',
+                                     "Distribution du Temps par Exécution",
+                                     'Temps par Exécution', 'darkgreen',
+                                     "La colonne 'TIMEPEREXE' contient des valeurs uniques ou est vide après filtrage, impossible de créer une courbe de densité.")
             else:
                 st.info("Colonne 'TIMEPEREXE' manquante ou total est zéro/vide après filtrage.")
 
-            st.subheader("Distribution du Temps Moyen par Enregistrement (AVGTPERREC) pour le serveur 'ECC-VE7-00'")
+            st.subheader("Analyse par Serveur d'Application (SERVERNAME)")
             st.markdown("""
-                Cette courbe de densité montre la répartition du temps moyen par enregistrement spécifiquement pour le serveur "ECC-VE7-00".
-                Elle permet d'analyser la cohérence des performances de ce serveur en termes de traitement des enregistrements.
+                Ces graphiques comparent les serveurs d'application et montrent, pour le serveur sélectionné,
+                la distribution d'une métrique (EXECTIME, TIMEPEREXE ou AVGTPERREC) et ses quantiles.
+                Les statistiques par serveur sont précalculées au chargement.
                 """)
-            if 'SERVERNAME' in df_sql_trace.columns and 'AVGTPERREC' in df_sql_trace.columns:
-                # Ensure AVGTPERREC is numeric here
-                df_sql_trace['AVGTPERREC'] = pd.to_numeric(df_sql_trace['AVGTPERREC'], errors='coerce').fillna(0).astype(float)
-                df_ecc_ve7_00 = df_sql_trace[df_sql_trace['SERVERNAME'].astype(str).str.contains('ECC-VE7-00', na=False, case=False)].copy()
-                
-                if not df_ecc_ve7_00.empty and df_ecc_ve7_00['AVGTPERREC'].sum() > 0:
-                    avg_t_per_rec_data = df_ecc_ve7_00['AVGTPERREC'].dropna()
-                    
-                    if avg_t_per_rec_data.nunique() > 1:
-                        fig_ecc_ve7_00_avg_time_dist = ff.create_distplot([avg_t_per_rec_data], ['AVGTPERREC'],
-                                                                          bin_size=avg_t_per_rec_data.std()/5 if avg_t_per_rec_data.std() > 0 else 1,
-                                                                          show_rug=False, show_hist=False)
-                        fig_ecc_ve7_00_avg_time_dist.update_layout(title_text="Distribution du Temps Moyen par Enregistrement (AVGTPERREC) pour 'ECC-VE7-00'",
-                                                                   xaxis_title='Temps Moyen par Enregistrement',
-                                                                   yaxis_title='Densité')
-                        fig_ecc_ve7_00_avg_time_dist.data[0].line.color = 'darkblue'
-                        st.plotly_chart(fig_ecc_ve7_00_avg_time_dist, use_container_width=True)
-                    else:
-                        st.info("Données insuffisantes ou valeurs uniques pour créer une courbe de densité pour 'ECC-VE7-00' (AVGTPERREC).")
+            df_server_totals = sql_server_stats['totals']
+            if not df_server_totals.empty:
+                server_metrics = [col for col in SERVER_STATS_METRICS if f"{col}_SUM" in df_server_totals.columns]
+                server_metric = st.selectbox("Métrique à analyser par serveur", server_metrics,
+                                             index=server_metrics.index('AVGTPERREC') if 'AVGTPERREC' in server_metrics else 0)
+                server_names = df_server_totals.index.tolist()
+                selected_server = st.selectbox("Sélectionner un serveur d'application", server_names,
+                                               index=server_names.index('ECC-VE7-00') if 'ECC-VE7-00' in server_names else 0)
+
+                df_server_totals_plot = df_server_totals.reset_index()
+                fig_server_totals = cached_figure(px.bar, df_server_totals_plot, x='SERVERNAME', y=f"{server_metric}_SUM",
+                                                  title=f"{server_metric} Total par Serveur d'Application",
+                                                  labels={'SERVERNAME': 'Serveur', f"{server_metric}_SUM": f"{server_metric} Total"},
+                                                  hover_data=['ROWS', f"{server_metric}_MEAN"],
+                                                  color=f"{server_metric}_SUM", color_continuous_scale=px.colors.sequential.Blues,
+                                                  xaxes=dict(type='category'))
+                render_chart(fig_server_totals)
+
+                server_histogram = sql_server_stats['histograms'].get((selected_server, server_metric))
+                if server_histogram is not None:
+                    densities, bin_edges = server_histogram
+                    df_server_hist = pd.DataFrame({server_metric: (bin_edges[:-1] + bin_edges[1:]) / 2, 'Densité': densities})
+                    fig_server_dist = cached_figure(px.line, df_server_hist, x=server_metric, y='Densité',
+                                                    title=f"Distribution de {server_metric} pour '{selected_server}'",
+                                                    color_discrete_sequence=['darkblue'])
+                    render_chart(fig_server_dist)
                 else:
-                    st.info("Aucune donnée valide pour le serveur 'ECC-VE7-00' ou la colonne 'AVGTPERREC' est vide/zéro après filtrage.")
+                    st.info(f"Données insuffisantes ou valeurs uniques pour créer une distribution pour '{selected_server}' ({server_metric}).")
+
+                df_server_quantiles = sql_server_stats['quantiles'].loc[selected_server, [server_metric]].T
+                df_server_quantiles.columns = [f"P{int(q * 100)}" for q in df_server_quantiles.columns]
+                st.dataframe(df_server_quantiles)
             else:
-                st.info("Colonnes 'SERVERNAME' ou 'AVGTPERREC' manquantes dans les données de traces SQL.")
+                st.info("Colonnes 'SERVERNAME' ou métriques (EXECTIME, TIMEPEREXE, AVGTPERREC) manquantes dans les données de traces SQL.")
 
             st.subheader("Top 10 Requêtes SQL par Temps Moyen par Exécution (TIMEPEREXE)")
             st.markdown("""
                 Ce graphique identifie les 10 requêtes SQL qui prennent le plus de temps en moyenne à chaque exécution.
                 Ceci est utile pour cibler les requêtes intrinsèquement lentes, même si elles ne sont pas exécutées très fréquemment.
                 """)
-            if 'SQLSTATEM' in df_sql_trace.columns and 'TIMEPEREXE' in df_sql_trace.columns and df_sql_trace['TIMEPEREXE'].sum() > 0:
-                # Ensure TIMEPEREXE is numeric here
-                df_sql_trace['TIMEPEREXE'] = pd.to_numeric(df_sql_trace['TIMEPEREXE'], errors='coerce').fillna(0).astype(float)
-                top_sql_by_time_per_exe = df_sql_trace.groupby('SQLSTATEM', as_index=False)['TIMEPEREXE'].mean().nlargest(10, 'TIMEPEREXE')
-                top_sql_by_time_per_exe['SQLSTATEM_SHORT'] = top_sql_by_time_per_exe['SQLSTATEM'].apply(lambda x: x[:70] + '...' if len(x) > 70 else x)
+            if 'SQL_FINGERPRINT' in df_sql_trace.columns and has_positive_total(df_sql_trace, 'TIMEPEREXE'):
+                top_sql_by_time_per_exe = top_sql_by_fingerprint(df_sql_trace, sql_fingerprint_lookup, 'TIMEPEREXE', 'mean')
                 if not top_sql_by_time_per_exe.empty and top_sql_by_time_per_exe['TIMEPEREXE'].sum() > 0:
-                    fig_top_sql_time_per_exe = px.bar(top_sql_by_time_per_exe, y='SQLSTATEM_SHORT', x='TIMEPEREXE', orientation='h',
-                                                    title="Top 10 Requêtes SQL par Temps Moyen par Exécution",
-                                                    labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'TIMEPEREXE': 'Temps Moyen par Exécution'},
-                                                    color='TIMEPEREXE', color_continuous_scale=px.colors.sequential.Oranges)
-                    fig_top_sql_time_per_exe.update_yaxes(autorange="reversed")
-                    st.plotly_chart(fig_top_sql_time_per_exe, use_container_width=True)
+                    fig_top_sql_time_per_exe = cached_figure(px.bar, top_sql_by_time_per_exe, y='SQLSTATEM_SHORT', x='TIMEPEREXE', orientation='h',
+                                                             title="Top 10 Requêtes SQL par Temps Moyen par Exécution",
+                                                             labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'TIMEPEREXE': 'Temps Moyen par Exécution'},
+                                                             color='TIMEPEREXE', color_continuous_scale=px.colors.sequential.Oranges,
+                                                               yaxes=dict(autorange="reversed"))
+                    render_chart(fig_top_sql_time_per_exe)
                 else:
                     st.info("Pas de données valides pour les Top 10 Requêtes SQL par Temps Moyen par Exécution après filtrage.")
             else:
@@ -1446,102 +1188,464 @@ else:
                 Cela peut indiquer des requêtes qui accèdent à de grandes quantités de données, potentiellement optimisables
                 par l'ajout d'index ou la refonte de la logique de récupération des données.
                 """)
-            if 'SQLSTATEM' in df_sql_trace.columns and 'RECPROCNUM' in df_sql_trace.columns and df_sql_trace['RECPROCNUM'].sum() > 0:
-                # Ensure RECPROCNUM is numeric here
-                df_sql_trace['RECPROCNUM'] = pd.to_numeric(df_sql_trace['RECPROCNUM'], errors='coerce').fillna(0).astype(float)
-                top_sql_by_recprocnum = df_sql_trace.groupby('SQLSTATEM', as_index=False)['RECPROCNUM'].sum().nlargest(10, 'RECPROCNUM')
-                top_sql_by_recprocnum['SQLSTATEM_SHORT'] = top_sql_by_recprocnum['SQLSTATEM'].apply(lambda x: x[:70] + '...' if len(x) > 70 else x)
+            if 'SQL_FINGERPRINT' in df_sql_trace.columns and has_positive_total(df_sql_trace, 'RECPROCNUM'):
+                top_sql_by_recprocnum = top_sql_by_fingerprint(df_sql_trace, sql_fingerprint_lookup, 'RECPROCNUM', 'sum')
                 if not top_sql_by_recprocnum.empty and top_sql_by_recprocnum['RECPROCNUM'].sum() > 0:
-                    fig_top_sql_recprocnum = px.bar(top_sql_by_recprocnum, y='SQLSTATEM_SHORT', x='RECPROCNUM', orientation='h',
-                                                    title="Top 10 Requêtes SQL par Nombre d'Enregistrements Traités",
-                                                    labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'RECPROCNUM': 'Nombre d\'Enregistrements Traités'},
-                                                    color='RECPROCNUM', color_continuous_scale=px.colors.sequential.Purples)
-                    fig_top_sql_recprocnum.update_yaxes(autorange="reversed")
-                    st.plotly_chart(fig_top_sql_recprocnum, use_container_width=True)
+                    fig_top_sql_recprocnum = cached_figure(px.bar, top_sql_by_recprocnum, y='SQLSTATEM_SHORT', x='RECPROCNUM', orientation='h',
+                                                           title="Top 10 Requêtes SQL par Nombre d'Enregistrements Traités",
+                                                           labels={'SQLSTATEM_SHORT': 'Instruction SQL', 'RECPROCNUM': 'Nombre d\'Enregistrements Traités'},
+                                                           color='RECPROCNUM', color_continuous_scale=px.colors.sequential.Purples,
+                                                           yaxes=dict(autorange="reversed"))
+                    render_chart(fig_top_sql_recprocnum)
                 else:
                     st.info("Colonnes 'SQLSTATEM' ou 'RECPROCNUM' manquantes ou leur total est zéro/vide après filtrage.")
 
-            st.subheader("Aperçu des Données de Traces SQL Filtrées")
-            st.dataframe(df_sql_trace.head())
+            st.subheader("Explorateur des Données de Traces SQL Filtrées")
+            render_data_explorer(df_sql_trace, 'sql_trace_summary')
+            render_section_exports(df_sql_trace, 'sql_trace_summary', dict(chart_frames))
         else:
             st.warning("Données de traces SQL non disponibles ou filtrées à vide.")
 
-    elif st.session_state.current_section == "Analyse des Utilisateurs":
+    @st.fragment
+    def render_users_section(dfs):
         # --- Nouvelle section: Analyse des Utilisateurs (usr02_data.xlsx) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
         st.header("👥 Analyse des Utilisateurs")
-        df_usr02 = dfs['usr02'].copy()
+        df_usr02 = dfs['usr02']
 
         if not df_usr02.empty:
             st.subheader("Répartition des Utilisateurs par Type (USTYP)")
-            if 'USTYP' in df_usr02.columns and not df_usr02['USTYP'].empty:
-                user_type_counts = df_usr02['USTYP'].value_counts().reset_index()
-                user_type_counts.columns = ['Type d\'Utilisateur', 'Nombre']
-                if not user_type_counts.empty and user_type_counts['Nombre'].sum() > 0:
-                    fig_user_type_pie = px.pie(user_type_counts, values='Nombre', names='Type d\'Utilisateur',
-                                                title="Répartition des Utilisateurs par Type",
-                                                hole=0.3, color_discrete_sequence=px.colors.qualitative.Set3)
-                    st.plotly_chart(fig_user_type_pie, use_container_width=True)
-                else:
-                    st.info("Pas de données valides pour la répartition des types d'utilisateurs après filtrage.")
-            else:
+            user_type_counts = value_counts_frame(df_usr02, 'USTYP', ['Type d\'Utilisateur', 'Nombre'])
+            if user_type_counts is None:
                 st.info("Colonne 'USTYP' manquante ou vide après filtrage.")
+            elif not user_type_counts.empty and user_type_counts['Nombre'].sum() > 0:
+                fig_user_type_pie = cached_figure(px.pie, user_type_counts, values='Nombre', names='Type d\'Utilisateur',
+                                                  title="Répartition des Utilisateurs par Type",
+                                                  hole=0.3, color_discrete_sequence=px.colors.qualitative.Set3)
+                render_chart(fig_user_type_pie)
+            else:
+                st.info("Pas de données valides pour la répartition des types d'utilisateurs après filtrage.")
 
             st.subheader("Nombre d'Utilisateurs par Date de Dernier Logon (GLTGB)")
             st.markdown("""
                 Ce graphique montre le nombre d'utilisateurs ayant enregistré leur dernière connexion à une date donnée.
                 Les dates "00000000" (logon jamais enregistré) sont exclues de cette analyse.
                 """)
-            if 'GLTGB_DATE' in df_usr02.columns and not df_usr02['GLTGB_DATE'].isnull().all():
-                df_valid_logons = df_usr02.dropna(subset=['GLTGB_DATE']).copy()
-                if not df_valid_logons.empty:
-                    logon_counts = df_valid_logons['GLTGB_DATE'].dt.date.value_counts().sort_index().reset_index()
-                    logon_counts.columns = ['Date de Dernier Logon', 'Nombre d\'Utilisateurs']
-                    
-                    if not logon_counts.empty and logon_counts['Nombre d\'Utilisateurs'].sum() > 0:
-                        fig_logon_dates = px.line(logon_counts, x='Date de Dernier Logon', y='Nombre d\'Utilisateurs',
-                                                  title="Nombre d'Utilisateurs par Date de Dernier Logon",
-                                                  labels={'Date de Dernier Logon': 'Date', 'Nombre d\'Utilisateurs': 'Nombre d\'Utilisateurs'},
-                                                  markers=True,
-                                                  color_discrete_sequence=['#6A0DAD'])
-                        
-                        fig_logon_dates.update_xaxes(
-                            tickangle=45,
-                            rangeselector=dict(
-                                buttons=list([
-                                    dict(count=1, label="1m", step="month", stepmode="backward"),
-                                    dict(count=6, label="6m", step="month", stepmode="backward"),
-                                    dict(count=1, label="YTD", step="year", stepmode="todate"),
-                                    dict(count=1, label="1y", step="year", stepmode="backward"),
-                                    dict(step="all")
-                                ])
-                            ),
-                            rangeslider=dict(visible=True),
-                            type="date"
-                        )
-                        
-                        st.plotly_chart(fig_logon_dates, use_container_width=True)
-                    else:
-                        st.info("Aucune donnée de date de dernier logon valide après filtrage ou la somme des utilisateurs est zéro.")
-                else:
-                    st.info("Aucune donnée de date de dernier logon valide après filtrage.")
-            else:
+            logon_counts = logon_counts_by_date(df_usr02)
+            if logon_counts is None:
                 st.info("Colonne 'GLTGB_DATE' manquante ou ne contient pas de dates valides après filtrage.")
+            elif not logon_counts.empty and logon_counts['Nombre d\'Utilisateurs'].sum() > 0:
+                fig_logon_dates = cached_figure(px.line, logon_counts, x='Date de Dernier Logon', y='Nombre d\'Utilisateurs',
+                                                title="Nombre d'Utilisateurs par Date de Dernier Logon",
+                                                labels={'Date de Dernier Logon': 'Date', 'Nombre d\'Utilisateurs': 'Nombre d\'Utilisateurs'},
+                                                markers=True,
+                                                color_discrete_sequence=['#6A0DAD'],
+                                                xaxes=dict(
+                                                    tickangle=45,
+                                                    rangeselector=dict(
+                                                        buttons=list([
+                                                            dict(count=1, label="1m", step="month", stepmode="backward"),
+                                                            dict(count=6, label="6m", step="month", stepmode="backward"),
+                                                            dict(count=1, label="YTD", step="year", stepmode="todate"),
+                                                            dict(count=1, label="1y", step="year", stepmode="backward"),
+                                                            dict(step="all")
+                                                        ])
+                                                    ),
+                                                    rangeslider=dict(visible=True),
+                                                    type="date"
+                                                ))
+                render_chart(fig_logon_dates)
+            else:
+                st.info("Aucune donnée de date de dernier logon valide après filtrage ou la somme des utilisateurs est zéro.")
 
-            st.subheader("Aperçu des Données Utilisateurs Filtrées")
-            st.dataframe(df_usr02.head())
+            st.subheader("Explorateur des Données Utilisateurs Filtrées")
+            render_data_explorer(df_usr02, 'usr02')
+            render_section_exports(df_usr02, 'usr02', dict(chart_frames))
         else:
             st.warning("Données utilisateurs (USR02) non disponibles ou filtrées à vide.")
 
+    @st.fragment
+    def render_cross_source_section(cross_source_index, selected_accounts, selected_reports, selected_tasktypes, selected_systems):
+        # --- Section: Corrélations entre hitlist_db, usertcode et memory (index précalculé) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
+        st.header("🔗 Corrélations Inter-Sources (Hitlist DB, Transactions, Mémoire)")
+        st.markdown("""
+            Cette section rapproche les pas de dialogue Hitlist DB des enregistrements usertcode et mémoire
+            du même compte (ACCOUNT) à l'instant le plus proche (tolérance d'une heure).
+            L'index de jointure est calculé une seule fois au chargement ; les filtres sont appliqués à la lecture.
+            """)
+        df_steps = filter_cross_source_steps(cross_source_index['steps'], selected_accounts, selected_reports, selected_tasktypes,
+                                             selected_systems)
+        df_hourly = cross_source_index['hourly']
+
+        if not df_steps.empty:
+            top_n_steps = st.slider("Nombre de pas de dialogue les plus lents à analyser", min_value=5, max_value=100, value=20, step=5)
+            # L'index est déjà trié par RESPTI décroissant : les pires pas sont en tête.
+            df_worst_steps = df_steps.head(top_n_steps).copy()
+
+            st.subheader("Mémoire Utilisée lors des Pas de Dialogue les plus Lents (RESPTI)")
+            if 'MEMORY_USEDBYTES' in df_worst_steps.columns and df_worst_steps['MEMORY_USEDBYTES'].fillna(0).sum() > 0:
+                df_worst_steps['STEP_LABEL'] = (df_worst_steps['ACCOUNT'].astype(str) + ' | '
+                                                + df_worst_steps['FULL_DATETIME'].dt.strftime('%H:%M:%S'))
+                fig_worst_steps_mem = cached_figure(px.bar, df_worst_steps, cache_key=('cross_source_worst', selection_key, top_n_steps), x='STEP_LABEL', y='MEMORY_USEDBYTES',
+                                                    title=f"USEDBYTES des {top_n_steps} Pas de Dialogue les plus Lents",
+                                                    labels={'STEP_LABEL': 'Compte | Heure', 'MEMORY_USEDBYTES': 'Utilisation Mémoire (Octets)', 'RESPTI': 'Temps de Réponse (ms)'},
+                                                    hover_data=[col for col in ['REPORT', 'RESPTI', 'CPUTI'] if col in df_worst_steps.columns],
+                                                    color='RESPTI', color_continuous_scale=px.colors.sequential.Reds,
+                                                    xaxes=dict(type='category'))
+                render_chart(fig_worst_steps_mem)
+            else:
+                st.info("Aucune donnée mémoire n'a pu être rapprochée des pas de dialogue les plus lents après filtrage.")
+
+            st.subheader("Temps de Réponse Hitlist DB vs. Transactions Utilisateurs Rapprochées")
+            if 'USERTCODE_RESPTI' in df_steps.columns and df_steps['USERTCODE_RESPTI'].notna().any():
+                df_matched_user = df_steps.dropna(subset=['USERTCODE_RESPTI'])
+                fig_hitlist_vs_user = cached_figure(px.scatter, df_matched_user, cache_key=('cross_source_matched', selection_key), x='RESPTI', y='USERTCODE_RESPTI',
+                                                    title="RESPTI Hitlist DB vs. RESPTI usertcode (même compte, instant le plus proche)",
+                                                    labels={'RESPTI': 'RESPTI Hitlist DB (ms)', 'USERTCODE_RESPTI': 'RESPTI usertcode (ms)'},
+                                                    hover_data=[col for col in ['ACCOUNT', 'REPORT', 'USERTCODE_ENTRY_ID'] if col in df_matched_user.columns],
+                                                    color='TASKTYPE' if 'TASKTYPE' in df_matched_user.columns else None,
+                                                    color_discrete_sequence=px.colors.qualitative.Plotly)
+                render_chart(fig_hitlist_vs_user)
+            else:
+                st.info("Aucune transaction usertcode n'a pu être rapprochée des pas de dialogue Hitlist DB après filtrage.")
+
+            st.subheader("Détail des Pas de Dialogue les plus Lents et Contexte Associé")
+            st.dataframe(df_worst_steps.drop(columns=['STEP_LABEL'], errors='ignore'))
+        else:
+            st.warning("Index de corrélation Hitlist DB non disponible ou filtré à vide.")
+
+        st.subheader("Statistiques Horaires Jointes par Compte (ACCOUNT, Heure)")
+        if not df_hourly.empty:
+            df_hourly_view = df_hourly
+            if selected_systems and 'SYSTEM' in df_hourly_view.index.names:
+                df_hourly_view = df_hourly_view[df_hourly_view.index.get_level_values('SYSTEM').isin(selected_systems)]
+            if selected_accounts:
+                df_hourly_view = df_hourly_view[df_hourly_view.index.get_level_values('ACCOUNT').isin(selected_accounts)]
+            st.dataframe(df_hourly_view.reset_index())
+        else:
+            st.info("Aucune source horodatée disponible pour construire l'index horaire.")
+
+        render_section_exports(df_steps, 'cross_source', dict(chart_frames))
+
+    @st.fragment
+    def render_anomaly_section(anomaly_report, selected_accounts, selected_tasktypes, selected_systems):
+        # --- Section: Fenêtres horaires anormales (rapport précalculé au chargement) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
+        st.header("🚨 Détection d'Anomalies sur les Séries Horaires")
+        st.markdown(f"""
+            Chaque série horaire (ACCOUNT, TASKTYPE) de RESPTI (Hitlist DB, usertcode), USEDBYTES (mémoire)
+            et PHYCALLS (Times) est comparée à sa médiane glissante sur les 24 heures précédentes et, quand
+            l'historique le permet, à sa médiane à la même heure de la journée. Une heure est signalée lorsque
+            le z-score robuste (médiane/MAD) dépasse {ANOMALY_Z_THRESHOLD:g} ; les heures consécutives forment une fenêtre.
+            """)
+        df_windows = filter_anomaly_windows(anomaly_report['windows'], selected_accounts, selected_tasktypes, selected_systems)
+        if not anomaly_report['coverage'].empty:
+            st.dataframe(anomaly_report['coverage'].rename(columns={
+                'SOURCE': 'Source', 'METRIC': 'Métrique', 'SERIES': 'Séries analysées', 'OBSERVATIONS': 'Heures observées',
+                'WINDOWS': 'Fenêtres détectées', 'CALENDAR': 'Axe calendaire'}))
+        else:
+            st.info("Aucune série horaire exploitable (métriques ou horodatages manquants).")
+
+        if not df_windows.empty:
+            df_windows_count = (df_windows.assign(SERIES=df_windows['SOURCE'] + ' ' + df_windows['METRIC'])
+                                .groupby(['SERIES', 'DIRECTION'], as_index=False).size())
+            fig_anomaly_counts = cached_figure(px.bar, df_windows_count, x='SERIES', y='size', color='DIRECTION',
+                                               title="Nombre de Fenêtres Anormales par Série",
+                                               labels={'SERIES': 'Source et Métrique', 'size': 'Fenêtres', 'DIRECTION': 'Sens'},
+                                               color_discrete_map={'hausse': '#d62728', 'baisse': '#1f77b4'})
+            render_chart(fig_anomaly_counts)
+
+            df_timeline = df_windows.dropna(subset=['PEAK_HOUR'])
+            if not df_timeline.empty:
+                df_timeline = df_timeline.assign(SERIES=df_timeline['SOURCE'] + ' ' + df_timeline['METRIC'],
+                                                 ABS_Z=df_timeline['PEAK_Z'].abs())
+                fig_anomaly_timeline = cached_figure(px.scatter, df_timeline, x='PEAK_HOUR', y='PEAK_Z', color='SERIES', size='ABS_Z',
+                                                     title="Pics des Fenêtres Anormales dans le Temps",
+                                                     labels={'PEAK_HOUR': 'Heure du pic', 'PEAK_Z': 'Z-score robuste', 'SERIES': 'Série'},
+                                                     hover_data=['ACCOUNT', 'TASKTYPE', 'PERIOD', 'PEAK_VALUE', 'BASELINE'])
+                render_chart(fig_anomaly_timeline)
+
+            st.subheader("Fenêtres Anormales par Compte et Type de Tâche")
+            render_data_explorer(df_windows, 'anomalies')
+            render_section_exports(df_windows, 'anomalies', dict(chart_frames))
+        else:
+            st.success("Aucune fenêtre anormale pour la sélection actuelle.")
+
+    COMPARISON_DIMENSION_LABELS = {
+        'REPORT': "Programme (REPORT, Hitlist DB)",
+        'TASKTYPE': "Type de Tâche (TASKTYPE, Hitlist DB)",
+        'SQL_FINGERPRINT': "Instruction SQL (empreinte normalisée)",
+    }
+
+    @st.fragment
+    def render_comparison_section(comparison_aggregates, sql_fingerprint_lookup):
+        # --- Section: Comparaison avant/après (agrégats précalculés alignés par clé) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
+        st.header("⚖️ Comparaison de Régression entre Deux Périodes ou Deux Jeux d'Exports")
+        st.markdown(f"""
+            Compare les moyennes de RESPTI, CPUTI et DBCALLS par programme et par type de tâche, et d'EXECTIME
+            par instruction SQL, entre une référence et une période comparée (par exemple avant et après une mise
+            à niveau du noyau ou un transport). Chaque écart est testé (test t de Welch sur log(1 + valeur)) et
+            déclaré significatif si sa q-value de Benjamini-Hochberg est inférieure à {COMPARISON_ALPHA:g}.
+            Les filtres globaux ne s'appliquent pas à cette section.
+            """)
+        mode = st.radio("Référence", ["Deux périodes du snapshot courant", "Jeu d'exports de référence"],
+                        horizontal=True, key="comparison_mode")
+        if mode == "Deux périodes du snapshot courant":
+            time_range = comparison_time_range(comparison_aggregates)
+            if time_range is None:
+                st.warning("Aucune source horodatée : la comparaison par périodes n'est pas disponible.")
+                return
+            boundaries = list(pd.date_range(*time_range, freq='h'))
+            if len(boundaries) < 3:
+                st.warning("Les données couvrent moins de deux heures : impossible de définir deux périodes.")
+                return
+            split = st.select_slider("Début de la période comparée (la référence couvre les heures précédentes)",
+                                     options=boundaries[1:-1], value=boundaries[len(boundaries) // 2],
+                                     format_func=lambda hour: f"{hour:%d/%m/%Y %H:%M}", key="comparison_split")
+            st.caption(f"Référence : {time_range[0]:%d/%m/%Y %H:%M} → {split:%d/%m/%Y %H:%M} ; "
+                       f"période comparée : {split:%d/%m/%Y %H:%M} → {time_range[1]:%d/%m/%Y %H:%M}. "
+                       "Les traces SQL ne sont pas horodatées et ne sont comparées qu'entre deux jeux d'exports.")
+            results = compare_snapshots(comparison_aggregates, comparison_aggregates,
+                                        (time_range[0], split), (split, time_range[1]))
+        else:
+            directory = st.text_input("Dossier du jeu d'exports de référence (mêmes noms de fichiers que les sources actuelles)",
+                                      value=COMPARISON_BASELINE_DIR, key="comparison_baseline_dir")
+            if not directory or not os.path.isdir(directory):
+                st.info("Indiquez un dossier existant contenant les exports de la période de référence.")
+                return
+            baseline = get_comparison_snapshot(directory, data_files_signature(baseline_data_paths(directory, data_store.data_paths),
+                                                                               use_incoming=False))
+            for baseline_error in baseline['errors'].values():
+                st.warning(f"Référence : {baseline_error}")
+            st.caption(f"Référence chargée le {baseline['loaded_at']:%d/%m/%Y %H:%M:%S} depuis {directory} ; "
+                       "période comparée : snapshot courant.")
+            results = compare_snapshots(baseline['comparison_aggregates'], comparison_aggregates)
+
+        for dimension, df_comparison in results.items():
+            st.subheader(COMPARISON_DIMENSION_LABELS[dimension])
+            if df_comparison is None:
+                st.info("Comparaison non disponible pour cette dimension (colonnes ou horodatages manquants d'un côté).")
+                continue
+            if dimension == 'SQL_FINGERPRINT':
+                labels = sql_fingerprint_lookup['SQLSTATEM_SHORT'].reindex(df_comparison['KEY'].to_numpy())
+                df_comparison = df_comparison.assign(KEY=labels.fillna(pd.Series([f"[{fp:016x}]" for fp in labels.index],
+                                                                                 index=labels.index)).to_numpy())
+            status_counts = df_comparison['STATUS'].value_counts()
+            status_cols = st.columns(4)
+            for status_col, status in zip(status_cols, ['régression', 'amélioration', 'nouveau', 'disparu']):
+                status_col.metric(status.capitalize(), int(status_counts.get(status, 0)))
+
+            df_regressions = df_comparison[df_comparison['STATUS'] == 'régression'].nlargest(15, 'DELTA_PCT')
+            if not df_regressions.empty:
+                df_regressions = df_regressions.assign(KEY=df_regressions['KEY'].astype(str))
+                fig_regressions = cached_figure(px.bar, df_regressions, x='DELTA_PCT', y='KEY', color='METRIC', orientation='h',
+                                                title=f"Régressions Significatives les plus Fortes ({COMPARISON_DIMENSION_LABELS[dimension]})",
+                                                labels={'DELTA_PCT': 'Écart de la moyenne (%)', 'KEY': '', 'METRIC': 'Métrique'},
+                                                hover_data=['MEAN_BASE', 'MEAN_CAND', 'N_BASE', 'N_CAND', 'Q_VALUE'],
+                                                yaxes=dict(categoryorder='total ascending'))
+                render_chart(fig_regressions)
+            else:
+                st.success("Aucune régression significative sur cette dimension.")
+            render_data_explorer(df_comparison, f"comparison_{dimension}")
+            render_section_exports(df_comparison, f"comparison_{dimension}", dict(chart_frames))
+
+    RESPONSE_COMPONENT_COLORS = dict(zip(RESPONSE_COMPONENT_NAMES, px.colors.qualitative.Set2))
+
+    @st.fragment
+    def render_response_breakdown_section(response_breakdown_summary, selected_accounts, selected_reports, selected_tasktypes,
+                                          selected_systems):
+        # --- Section: Décomposition de RESPTI (matrice précalculée au chargement, filtrée à la lecture) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
+        st.header("🧩 Décomposition du Temps de Réponse (Hitlist DB)")
+        st.markdown("""
+            Le temps de réponse de chaque pas de dialogue est réparti entre CPU, base de données (lectures directes
+            et séquentielles, insertions, mises à jour, suppressions, commit), attente (file du dispatcher, verrous,
+            roll-in/roll-out, attente de roll hors GUI et RFC), GUI, chargement/génération de programmes et appels RFC.
+            Les compteurs SAP se recouvrant en partie, ils sont réduits proportionnellement lorsque leur somme
+            dépasse RESPTI ; le reste non expliqué apparaît en 'Autre'.
+            """)
+        if response_breakdown_summary is None:
+            st.warning("Données Hitlist DB non disponibles ou colonne 'RESPTI' manquante.")
+            return
+        share = st.radio("Échelle", ["Temps total (ms)", "Part du temps de réponse (%)"], horizontal=True,
+                         key="response_breakdown_scale") != "Temps total (ms)"
+        value_column = 'SHARE' if share else 'RESPTI'
+        breakdown_frames = {}
+        for by, label in (('REPORT', 'Rapport'), ('ACCOUNT', 'Compte Utilisateur')):
+            df_breakdown = response_breakdown(response_breakdown_summary, by, n=15, accounts=selected_accounts,
+                                              reports=selected_reports, tasktypes=selected_tasktypes, systems=selected_systems)
+            st.subheader(f"Décomposition du Temps de Réponse par {label} (Top 15 par temps total)")
+            if df_breakdown is None:
+                st.info(f"Colonne '{by}' manquante dans Hitlist DB.")
+            elif not df_breakdown.empty:
+                fig_breakdown = cached_figure(px.bar, df_breakdown, x=by, y=value_column, color='COMPONENT',
+                                              title=f"Décomposition du Temps de Réponse par {label}",
+                                              labels={by: label, 'COMPONENT': 'Composante', 'RESPTI': 'Temps de Réponse (ms)',
+                                                      'SHARE': 'Part du Temps de Réponse', 'STEPS': 'Pas de dialogue'},
+                                              hover_data=['STEPS'], color_discrete_map=RESPONSE_COMPONENT_COLORS,
+                                              category_orders={'COMPONENT': RESPONSE_COMPONENT_NAMES},
+                                              yaxes=dict(tickformat='.0%') if share else None)
+                render_chart(fig_breakdown)
+                breakdown_frames[by] = df_breakdown
+            else:
+                st.info("Aucun pas de dialogue pour la sélection actuelle.")
+        if 'REPORT' in breakdown_frames:
+            render_section_exports(breakdown_frames['REPORT'], 'response_breakdown', dict(chart_frames))
+
+    @st.fragment
+    def render_db_access_section(db_access, selected_accounts, selected_reports, selected_tasktypes, selected_systems):
+        # --- Section: Matrice REPORT x type d'accès (compteurs précalculés au chargement) ---
+        # Agrégats de cette exécution de la section uniquement (le fragment peut être relancé seul).
+        chart_frames.clear()
+        st.header("🗄️ Accès Base de Données et Buffers de Tables (Hitlist DB)")
+        st.markdown(f"""
+            Lectures directes et séquentielles servies par le buffer de tables ou par la base, écritures logiques
+            et physiques (insertions, mises à jour, suppressions) par programme. Un programme est signalé comme
+            lisant séquentiellement sans buffer lorsqu'il fait au moins {DB_UNBUFFERED_MIN_SEQ_READS} lectures
+            séquentielles avec un taux de succès buffer inférieur à {DB_UNBUFFERED_MAX_HIT_RATIO:.0%}.
+            """)
+        df_access = db_access_by_report(db_access, selected_accounts, selected_reports, selected_tasktypes, selected_systems)
+        if df_access is None:
+            st.warning("Données Hitlist DB non disponibles ou colonne 'REPORT' manquante.")
+            return
+        if df_access.empty:
+            st.info("Aucun pas de dialogue pour la sélection actuelle.")
+            return
+
+        logical_reads = df_access['READDIRCNT'].sum() + df_access['READSEQCNT'].sum()
+        buffered_reads = df_access['READDIRBUF'].sum() + df_access['READSEQBUF'].sum()
+        metric_cols = st.columns(3)
+        metric_cols[0].metric("Lectures logiques", f"{logical_reads:,.0f}".replace(",", " "))
+        metric_cols[1].metric("Taux de succès buffer (lectures)", f"{buffered_reads / logical_reads:.1%}" if logical_reads else "N/A")
+        metric_cols[2].metric("Programmes en lecture séquentielle sans buffer", int(df_access['UNBUFFERED_SEQ'].sum()))
+
+        df_reads = db_access_pattern(df_access, 'reads')
+        st.subheader("Lectures par Programme : Buffer de Tables ou Base de Données (Top 15)")
+        if not df_reads.empty:
+            fig_reads = cached_figure(px.bar, df_reads, x='REPORT', y='COUNT', color='LEVEL', pattern_shape='ACCESS',
+                                      title="Lectures Directes et Séquentielles par Programme",
+                                      labels={'REPORT': 'Rapport', 'COUNT': 'Lectures', 'LEVEL': 'Servies par', 'ACCESS': "Type d'accès"},
+                                      color_discrete_map={'Buffer': '#2ca02c', 'Base de données': '#d62728'})
+            render_chart(fig_reads)
+        else:
+            st.info("Aucune lecture pour la sélection actuelle.")
+
+        df_writes = db_access_pattern(df_access, 'writes')
+        st.subheader("Écritures Logiques et Physiques par Programme (Top 15)")
+        if not df_writes.empty:
+            fig_writes = cached_figure(px.bar, df_writes, x='REPORT', y='COUNT', color='LEVEL', pattern_shape='ACCESS', barmode='group',
+                                       title="Écritures Logiques et Physiques par Programme",
+                                       labels={'REPORT': 'Rapport', 'COUNT': 'Opérations', 'LEVEL': 'Niveau', 'ACCESS': "Type d'accès"})
+            render_chart(fig_writes)
+        else:
+            st.info("Aucune écriture pour la sélection actuelle.")
+
+        df_seq = df_access[df_access['READSEQCNT'] > 0]
+        if not df_seq.empty:
+            fig_seq = cached_figure(px.scatter, df_seq, x='READSEQCNT', y='SEQ_HIT_RATIO', color='UNBUFFERED_SEQ', log_x=True,
+                                    title="Taux de Succès Buffer des Lectures Séquentielles par Programme",
+                                    labels={'READSEQCNT': 'Lectures séquentielles', 'SEQ_HIT_RATIO': 'Taux de succès buffer',
+                                            'UNBUFFERED_SEQ': 'Sans buffer'},
+                                    hover_data=['REPORT', 'STEPS', 'PHYREADCNT'],
+                                    color_discrete_map={True: '#d62728', False: '#1f77b4'}, yaxes=dict(tickformat='.0%'))
+            render_chart(fig_seq)
+
+        st.subheader("Programmes en Lecture Séquentielle sans Buffer")
+        df_unbuffered = df_access[df_access['UNBUFFERED_SEQ']]
+        if not df_unbuffered.empty:
+            render_data_explorer(df_unbuffered, 'db_access_unbuffered')
+        else:
+            st.success("Aucun programme ne lit séquentiellement sans buffer pour la sélection actuelle.")
+        render_section_exports(df_access, 'db_access', dict(chart_frames))
+
+    def read_trend(source, df, column, scale=1.0):
+        """Tendance moyenne : historique hiérarchisé s'il est configuré (filtres globaux), sinon moyenne horaire de `df`."""
+        return trend_mean(history, source, df, column, scale, selected_accounts, selected_reports, selected_tasktypes, selected_systems)
+
+    section_renderers = {
+        "Analyse Mémoire": lambda: render_memory_section(dfs),
+        "Transactions Utilisateurs": lambda: render_user_transactions_section(dfs, read_trend),
+        "Statistiques Horaires": lambda: render_hourly_stats_section(dfs),
+        "Décomposition des Tâches": lambda: render_task_breakdown_section(dfs),
+        "Insights Hitlist DB": lambda: render_hitlist_section(dfs, read_trend),
+        "Performance des Processus de Travail": lambda: render_work_process_section(dfs, wp_history, selected_wp_types, selected_systems),
+        "Résumé des Traces de Performance SQL": lambda: render_sql_trace_section(dfs, sql_fingerprint_lookup, sql_server_stats),
+        "Analyse des Utilisateurs": lambda: render_users_section(dfs),
+        "Corrélations Inter-Sources": lambda: render_cross_source_section(cross_source_index, selected_accounts, selected_reports, selected_tasktypes,
+                                                                          selected_systems),
+        "Détection d'Anomalies": lambda: render_anomaly_section(anomaly_report, selected_accounts, selected_tasktypes, selected_systems),
+        "Comparaison de Régression": lambda: render_comparison_section(comparison_aggregates, sql_fingerprint_lookup),
+        "Décomposition du Temps de Réponse": lambda: render_response_breakdown_section(response_breakdown_summary, selected_accounts,
+                                                                                      selected_reports, selected_tasktypes, selected_systems),
+        "Accès Base de Données et Buffers": lambda: render_db_access_section(db_access, selected_accounts, selected_reports, selected_tasktypes,
+                                                                              selected_systems),
+    }
+    with recorder.stage(st.session_state.current_section, 'section'):
+        section_renderers[st.session_state.current_section]()
+
 # Option pour afficher tous les DataFrames (utile pour le débogage)
-with st.expander("🔍 Afficher tous les DataFrames chargés (pour débogage)"):
-    for key, df in dfs.items():
-        st.subheader(f"DataFrame: {key} (Taille: {len(df)} lignes)")
-        st.dataframe(df.head())
-        # Mise à jour de la checkbox avec une clé unique et un label plus clair
-        if st.checkbox(f"Afficher les informations de '{key}' (df.info())", key=f"info_{key}"):
-            buffer = io.StringIO()
-            df.info(buf=buffer)
-            st.text(buffer.getvalue())
-            st.write(f"Description statistique pour {key}:")
-            st.dataframe(df.describe())
+@st.fragment
+def render_loaded_frames(dfs):
+    with st.expander("🔍 Afficher tous les DataFrames chargés (pour débogage)"):
+        for key, df in dfs.items():
+            st.subheader(f"DataFrame: {key} (Taille: {len(df)} lignes)")
+            st.dataframe(df.head())
+            # Mise à jour de la checkbox avec une clé unique et un label plus clair
+            if st.checkbox(f"Afficher les informations de '{key}' (df.info())", key=f"info_{key}"):
+                buffer = io.StringIO()
+                df.info(buf=buffer)
+                st.text(buffer.getvalue())
+                st.write(f"Description statistique pour {key}:")
+                st.dataframe(df.describe())
+
+render_loaded_frames(dfs)
+
+# Panneau d'instrumentation : étapes de cette exécution et du dernier chargement des données
+@st.fragment
+def render_instrumentation_panel(recorder, data_snapshot):
+    with st.expander("⏱️ Instrumentation des étapes (pour débogage des performances)"):
+        if not recorder.enabled:
+            st.caption("Cochez « Instrumentation des performances (débogage) » dans la barre latérale puis relancez une section.")
+        else:
+            if st.checkbox("Mesurer les allocations mémoire (tracemalloc, ralentit fortement le rendu)", key="instrumentation_tracemalloc"):
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+            elif tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+            cache_stats = figure_cache.stats()
+            st.caption(f"Cache des figures : {cache_stats['entries']}/{cache_stats['max_entries']} entrées, "
+                       f"{cache_stats['hits']} réutilisations, {cache_stats['misses']} constructions, "
+                       f"{cache_stats['coalesced']} attentes d'une construction en cours.")
+            flight_stats = REQUEST_FLIGHTS.stats()
+            if flight_stats:
+                st.caption("Calculs identiques simultanés regroupés dans ce processus (toutes sessions) : "
+                           "exécutions, requêtes ayant attendu le calcul d'une autre, calculs en cours.")
+                st.dataframe(pd.DataFrame.from_dict(flight_stats, orient='index').rename_axis('calcul'))
+
+            st.subheader("Rendu de la page (cette exécution)")
+            st.dataframe(stages_summary(recorder.spans))
+            st.dataframe(stages_frame(recorder.spans))
+
+            load_stages = data_snapshot.get('load_stages', [])
+            st.subheader(f"Chargement des données (version {data_snapshot['version']})")
+            if load_stages:
+                st.dataframe(stages_frame(load_stages))
+            else:
+                st.info("Étapes de chargement non mesurées : lancez le dashboard avec SAP_DASHBOARD_INSTRUMENTATION=1.")
+
+            all_stages = load_stages + recorder.spans
+            export_cols = st.columns(2)
+            export_cols[0].download_button("Exporter en Chrome trace", to_chrome_trace(all_stages),
+                                           file_name="sap_dashboard_trace.json", mime="application/json")
+            export_cols[1].download_button("Exporter en JSON", to_json(all_stages),
+                                           file_name="sap_dashboard_stages.json", mime="application/json")
 
+render_instrumentation_panel(recorder, data_snapshot)
@@ -0,0 +1,2516 @@
+"""
+Cœur analytique du dashboard SAP, indépendant de Streamlit.
+
+Chargement et nettoyage des sources, agrégats précalculés par snapshot, filtres globaux, KPIs
+et agrégations par section. Les fonctions d'agrégation sont pures et retournent de petits DataFrames :
+elles peuvent être importées, profilées ou réutilisées dans des traitements batch
+sans lancer l'interface (mon_dashboard_sap2.py n'en est que le rendu).
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import warnings
+import threading
+import multiprocessing
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from scipy.special import stdtr
+
+from sap_instrumentation import LOAD_INSTRUMENTATION_ENABLED, NULL_RECORDER, StageRecorder
+from sap_retention import HISTORY_DIR, update_history
+from sap_wp_history import WP_HISTORY_DIR, update_wp_history
+from sap_live_tail import SPOOL_DIR, SPOOL_MAX_BUFFERED_ROWS, SpoolTailer, start_tail_thread
+
+# --- Chemins vers vos fichiers de données ---
+# ATTENTION : Ces chemins ont été mis à jour pour être RELATIFS.
+# Cela signifie que les fichiers Excel/CSV doivent se trouver dans le MÊME dossier
+# que ce script Python lorsque vous le déployez (par exemple, sur GitHub pour Streamlit Community Cloud).
+DATA_PATHS = {
+    "memory": "memory_final_cleaned_clean.xlsx",
+    "hitlist_db": "HITLIST_DATABASE_final_cleaned_clean.xlsx",
+    "times": "Times_final_cleaned_clean.xlsx",
+    "tasktimes": "TASKTIMES_final_cleaned_clean.xlsx",
+    "usertcode": "USERTCODE_cleaned.xlsx",
+    "performance": "AL_GET_PERFORMANCE_final_cleaned_clean.xlsx",
+    "sql_trace_summary": "performance_trace_summary_final_cleaned_clean.xlsx",
+    "usr02": "usr02_data.xlsx",
+}
+
+# Colonne ajoutée à chaque source en mode paysage : système ou instance SAP d'origine de la ligne.
+SYSTEM_COLUMN = 'SYSTEM'
+
+
+# --- Fonctions de Nettoyage et Chargement des Données ---
+
+def clean_string_column(series, default_value="Non défini"):
+    """
+    Nettoie une série de type string : supprime espaces, remplace NaN/vides/caractères non imprimables.
+    """
+    cleaned_series = series.astype(str).str.strip()
+    cleaned_series = cleaned_series.apply(lambda x: re.sub(r'[^\x20-\x7E\s]+', ' ', x).strip())
+    cleaned_series = cleaned_series.replace({'nan': default_value, '': default_value, ' ': default_value})
+    return cleaned_series
+
+def clean_column_names(df):
+    """
+    Nettoyage des noms de colonnes : supprime les espaces, les caractères invisibles,
+    et s'assure qu'ils sont valides pour l'accès.
+    """
+    new_columns = []
+    for col in df.columns:
+        cleaned_col = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', str(col)).strip()
+        cleaned_col = re.sub(r'[^a-zA-Z0-9_]', '_', cleaned_col)
+        cleaned_col = re.sub(r'_+', '_', cleaned_col)
+        cleaned_col = cleaned_col.strip('_')
+        new_columns.append(cleaned_col)
+    df.columns = new_columns
+    return df
+
+def convert_mm_ss_to_seconds(time_str):
+    """
+    Convertit une chaîne de caractères au format MM:SS en secondes.
+    Gère les cas où les minutes ou secondes sont manquantes ou invalides.
+    """
+    if pd.isna(time_str) or not isinstance(time_str, str):
+        return 0
+    try:
+        parts = time_str.split(':')
+        if len(parts) == 2:
+            minutes = float(parts[0])
+            seconds = float(parts[1])
+            return int(minutes * 60 + seconds)
+        elif len(parts) == 1:
+            return int(float(parts[0]))
+        else:
+            return 0
+    except ValueError:
+        return 0
+
+def clean_numeric_with_comma(series):
+    """
+    Nettoyage d'une série de chaînes numériques qui peuvent contenir des virgules
+    comme séparateurs de milliers ou décimaux, et conversion en float.
+    """
+    cleaned_series = series.astype(str).str.replace(' ', '').str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(cleaned_series, errors='coerce').fillna(0)
+
+# Règles de normalisation SQL appliquées dans l'ordre (chaînes, placeholders, nombres, listes IN, espaces) :
+# les variables de liaison passent avant les nombres, sinon `$1` deviendrait `$?`.
+SQL_NORMALIZATION_RULES = [
+    (r"'(?:[^']|'')*'", "?"),                                   # Littéraux chaîne
+    (r":[A-Za-z_]\w*|:\d+|@\w+|\$\d+", "?"),                    # Variables de liaison (:A0, @p1, $1)
+    (r"(?<![\w:\"])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b", "?"),   # Littéraux numériques
+    (r"(?i)\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (?)"),          # Listes IN réduites
+    (r"\s+", " "),                                             # Espaces multiples
+]
+
+SQL_SHORT_LENGTH = 70
+
+def normalize_sql_statements(series):
+    """
+    Normalise des instructions SQL (littéraux, variables de liaison, listes IN, espaces) de façon vectorisée.
+    Le travail n'est fait qu'une fois par instruction distincte ; le résultat est un Categorical
+    dont les catégories sont les textes normalisés, stockés une seule fois.
+    """
+    codes, uniques = pd.factorize(series.astype(str), sort=False)
+    normalized = pd.Series(uniques, dtype=object)
+    for pattern, replacement in SQL_NORMALIZATION_RULES:
+        normalized = normalized.str.replace(pattern, replacement, regex=True)
+    normalized = normalized.str.strip()
+    norm_codes, norm_uniques = pd.factorize(normalized, sort=False)
+    return pd.Categorical.from_codes(norm_codes[codes], categories=norm_uniques)
+
+def sql_fingerprint(normalized_texts):
+    """Empreinte 64 bits (uint64) de textes SQL normalisés."""
+    return pd.util.hash_pandas_object(pd.Series(normalized_texts, dtype=object), index=False).to_numpy()
+
+def build_sql_fingerprint_lookup(df_sql):
+    """
+    Table de correspondance SQL_FINGERPRINT -> texte normalisé et libellé court (70 caractères).
+    Construite à partir des catégories de SQLSTATEM_NORM : aucun parcours des lignes.
+    """
+    if df_sql.empty or 'SQLSTATEM_NORM' not in df_sql.columns:
+        return pd.DataFrame(columns=['SQLSTATEM_NORM', 'SQLSTATEM_SHORT'])
+    categories = pd.Series(df_sql['SQLSTATEM_NORM'].cat.categories, dtype=object)
+    short = categories.str.slice(0, SQL_SHORT_LENGTH).where(categories.str.len() <= SQL_SHORT_LENGTH,
+                                                            categories.str.slice(0, SQL_SHORT_LENGTH) + '...')
+    lookup = pd.DataFrame({'SQLSTATEM_NORM': categories.to_numpy(), 'SQLSTATEM_SHORT': short.to_numpy()},
+                          index=pd.Index(sql_fingerprint(categories), name='SQL_FINGERPRINT'))
+    # Deux instructions distinctes peuvent partager les mêmes 70 premiers caractères : on les distingue.
+    duplicated_short = lookup['SQLSTATEM_SHORT'].duplicated(keep=False)
+    lookup.loc[duplicated_short, 'SQLSTATEM_SHORT'] += [f" [{fp >> 32:08x}]" for fp in lookup.index[duplicated_short]]
+    return lookup
+
+SERVER_STATS_METRICS = ['EXECTIME', 'TIMEPEREXE', 'AVGTPERREC']
+SERVER_STATS_QUANTILES = [0.5, 0.75, 0.9, 0.95, 0.99]
+SERVER_STATS_BINS = 50
+
+def build_server_stats(df_sql):
+    """
+    Précalcule, une fois au chargement, les statistiques par serveur d'application (SERVERNAME) :
+    - 'totals'     : nombre de lignes, somme et moyenne de chaque métrique de SERVER_STATS_METRICS ;
+    - 'quantiles'  : quantiles par (SERVERNAME, métrique) ;
+    - 'histograms' : {(SERVERNAME, métrique): (densités, bornes)} pour les courbes de distribution.
+    L'affichage d'un serveur devient une simple lecture de dictionnaire, sans filtrage par regex.
+    """
+    metrics = [col for col in SERVER_STATS_METRICS if col in df_sql.columns]
+    if df_sql.empty or 'SERVERNAME' not in df_sql.columns or not metrics:
+        return {'totals': pd.DataFrame(), 'quantiles': pd.DataFrame(), 'histograms': {}}
+
+    grouped = df_sql.groupby('SERVERNAME', sort=True)[metrics]
+    totals = grouped.agg(['sum', 'mean'])
+    totals.columns = [f"{col}_{agg.upper()}" for col, agg in totals.columns]
+    totals.insert(0, 'ROWS', grouped.size())
+    quantiles = grouped.quantile(SERVER_STATS_QUANTILES)
+    quantiles.index.names = ['SERVERNAME', 'QUANTILE']
+
+    histograms = {}
+    for server, df_server in grouped:
+        for col in metrics:
+            values = df_server[col].dropna().to_numpy()
+            if values.size > 1 and np.ptp(values) > 0:
+                histograms[(server, col)] = np.histogram(values, bins=SERVER_STATS_BINS, density=True)
+    return {'totals': totals, 'quantiles': quantiles, 'histograms': histograms}
+
+def top_sql_by_fingerprint(df_sql, lookup, metric, agg='sum', n=10):
+    """Top N des instructions SQL normalisées pour une métrique, agrégée sur SQL_FINGERPRINT."""
+    top_sql = df_sql.groupby('SQL_FINGERPRINT', sort=False)[metric].agg(agg).nlargest(n).to_frame()
+    return top_sql.join(lookup, how='left').reset_index()
+
+
+# Colonnes numériques attendues par source (valeurs non numériques -> 0 au nettoyage).
+SOURCE_NUMERIC_COLUMNS = {
+    'memory': [
+        'MEMSUM', 'PRIVSUM', 'USEDBYTES', 'MAXBYTES', 'MAXBYTESDI', 'PRIVCOUNT', 'RESTCOUNT',
+        'COUNTER'
+    ],
+    'hitlist_db': [
+        'GENERATETI', 'REPLOADTI', 'CUALOADTI', 'DYNPLOADTI', 'QUETI', 'DDICTI', 'CPICTI',
+        'LOCKCNT', 'LOCKTI', 'BTCSTEPNR', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI',
+        'GUITIME', 'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'DSQLCNT', 'QUECNT', 'CPICCNT',
+        'SLI_CNT', 'TAB1DIRCNT', 'TAB1SEQCNT', 'TAB1UPDCNT', 'TAB2DIRCNT', 'TAB2SEQCNT',
+        'TAB2UPDCNT', 'TAB3DIRCNT', 'TAB3SEQCNT', 'TAB3UPDCNT', 'TAB4DIRCNT', 'TAB4SEQCNT',
+        'TAB4UPDCNT', 'TAB5DIRCNT', 'TAB5SEQCNT', 'TAB5UPDCNT', 'READDIRCNT', 'READDIRTI',
+        'READDIRBUF', 'READDIRREC', 'READSEQCNT', 'READSEQTI', 'READSEQBUF', 'READSEQREC',
+        'PHYREADCNT', 'INSCNT', 'INSTI', 'INSREC', 'PHYINSCNT', 'UPDCNT', 'UPDTI', 'UPDREC',
+        'PHYUPDCNT', 'DELCNT', 'DELTI', 'DELREC', 'PHYDELCNT', 'DBCALLS', 'COMMITTI', 'INPUTLEN',
+        'OUTPUTLEN', 'MAXROLL', 'MAXPAGE', 'ROLLINCNT', 'ROLLINTI', 'ROLLOUTCNT', 'ROLLOUTTI',
+        'ROLLED_OUT', 'PRIVSUM', 'USEDBYTES', 'MAXBYTES', 'MAXBYTESDI', 'RFCRECEIVE', 'RFCSEND',
+        'RFCEXETIME', 'RFCCALLTIM', 'RFCCALLS', 'VMC_CALL_COUNT', 'VMC_CPU_TIME', 'VMC_ELAP_TIME'
+    ],
+    'times': [
+        'COUNT', 'LUW_COUNT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI', 'GUITIME',
+        'GUICNT', 'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'READDIRCNT', 'READDIRTI', 'READDIRBUF',
+        'READDIRREC', 'READSEQCNT', 'READSEQTI', 'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI',
+        'CHNGREC', 'PHYREADCNT', 'PHYCHNGREC', 'PHYCALLS', 'VMC_CALL_COUNT', 'VMC_CPU_TIME',
+        'VMC_ELAP_TIME'
+    ],
+    'tasktimes': [
+        'COUNT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI', 'GUITIME', 'GUICNT',
+        'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'READDIRCNT', 'READDIRTI', 'READDIRBUF',
+        'READDIRREC', 'READSEQCNT', 'READSEQTI', 'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI',
+        'CHNGREC', 'PHYREADCNT', 'PHYCHNGREC', 'PHYCALLS', 'CNT001', 'CNT002', 'CNT003', 'CNT004',
+        'CNT005', 'CNT006', 'CNT007', 'CNT008', 'CNT009'
+    ],
+    'usertcode': [
+        'COUNT', 'DCOUNT', 'UCOUNT', 'BCOUNT', 'ECOUNT', 'SCOUNT', 'LUW_COUNT', 'TMBYTESIN',
+        'TMBYTESOUT', 'RESPTI', 'PROCTI', 'CPUTI', 'QUEUETI', 'ROLLWAITTI', 'GUITIME', 'GUICNT',
+        'GUINETTIME', 'DBP_COUNT', 'DBP_TIME', 'READDIRCNT', 'READDIRTI', 'READDIRBUF',
+        'READDIRREC', 'READSEQCNT', 'READSEQTI', 'READSEQBUF', 'READSEQREC', 'CHNGCNT', 'CHNGTI',
+        'CHNGREC', 'PHYREADCNT', 'PHYCHNGREC', 'PHYCALLS', 'DSQLCNT', 'QUECNT', 'CPICCNT',
+        'SLI_CNT', 'VMC_CALL_COUNT', 'VMC_CPU_TIME', 'VMC_ELAP_TIME'
+    ],
+    'performance': [
+        'WP_NO', 'WP_IRESTRT', 'WP_PID', 'WP_INDEX'
+    ],
+    'sql_trace_summary': [
+        'TOTALEXEC', 'IDENTSEL', 'EXECTIME', 'RECPROCNUM', 'TIMEPEREXE', 'RECPEREXE', 'AVGTPERREC',
+        'MINTPERREC'
+    ],
+}
+
+SUPPORTED_SOURCE_EXTENSIONS = ('.xlsx', '.csv')
+
+def read_source_file(path):
+    """Lecture brute d'un fichier Excel ou CSV, sans nettoyage."""
+    if path.lower().endswith('.xlsx'):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+def clean_source_frame(file_key, df):
+    """Nettoyage et typage d'un DataFrame brut selon sa source (sans E/S)."""
+    df = clean_column_names(df.copy())
+
+    # --- Gestion spécifique des types de données et valeurs manquantes ---
+    if file_key == "memory":
+        numeric_cols = SOURCE_NUMERIC_COLUMNS['memory']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        if 'ACCOUNT' in df.columns:
+            df['ACCOUNT'] = clean_string_column(df['ACCOUNT'], 'Compte Inconnu')
+        if 'MANDT' in df.columns:
+            df['MANDT'] = clean_string_column(df['MANDT'], 'MANDT Inconnu')
+        if 'TASKTYPE' in df.columns:
+            df['TASKTYPE'] = clean_string_column(df['TASKTYPE'], 'Type de Tâche Inconnu')
+
+        if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
+            df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
+            df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
+            df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
+        elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
+            df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
+
+        subset_cols_memory = []
+        if 'USEDBYTES' in df.columns:
+            subset_cols_memory.append('USEDBYTES')
+        if 'ACCOUNT' in df.columns:
+            subset_cols_memory.append('ACCOUNT')
+        if subset_cols_memory:
+            df.dropna(subset=subset_cols_memory, inplace=True)
+
+    
+    elif file_key == "hitlist_db":
+        numeric_cols = SOURCE_NUMERIC_COLUMNS['hitlist_db']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
+            df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
+            df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
+            df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
+        elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
+            df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
+
+        subset_cols_hitlist = []
+        if 'RESPTI' in df.columns: subset_cols_hitlist.append('RESPTI')
+        if 'PROCTI' in df.columns: subset_cols_hitlist.append('PROCTI')
+        if 'CPUTI' in df.columns: subset_cols_hitlist.append('CPUTI')
+        if 'DBCALLS' in df.columns: subset_cols_hitlist.append('DBCALLS')
+        if subset_cols_hitlist:
+            df.dropna(subset=subset_cols_hitlist, inplace=True)
+        if 'FULL_DATETIME' in df.columns:
+            df.dropna(subset=['FULL_DATETIME'], inplace=True)
+
+        for col in ['WPID', 'ACCOUNT', 'REPORT', 'ROLLKEY', 'PRIVMODE', 'WPRESTART', 'TASKTYPE']:
+            if col in df.columns:
+                df[col] = clean_string_column(df[col])
+
+    
+    elif file_key == "times":
+        numeric_cols = SOURCE_NUMERIC_COLUMNS['times']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        subset_cols_times = []
+        if 'RESPTI' in df.columns: subset_cols_times.append('RESPTI')
+        if 'PHYCALLS' in df.columns: subset_cols_times.append('PHYCALLS')
+        if 'COUNT' in df.columns: subset_cols_times.append('COUNT')
+        if subset_cols_times:
+            df.dropna(subset=subset_cols_times, inplace=True)
+
+        if 'TIME' in df.columns:
+            df['TIME'] = clean_string_column(df['TIME'])
+        if 'TASKTYPE' in df.columns:
+            df['TASKTYPE'] = clean_string_column(df['TASKTYPE'])
+        if 'ENTRY_ID' in df.columns:
+            df['ENTRY_ID'] = clean_string_column(df[col])
+
+    elif file_key == "tasktimes":
+        numeric_cols = SOURCE_NUMERIC_COLUMNS['tasktimes']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        subset_cols_tasktimes = []
+        if 'COUNT' in df.columns: subset_cols_tasktimes.append('COUNT')
+        if 'RESPTI' in df.columns: subset_cols_tasktimes.append('RESPTI')
+        if 'CPUTI' in df.columns: subset_cols_tasktimes.append('CPUTI')
+        if subset_cols_tasktimes:
+            df.dropna(subset=subset_cols_tasktimes, inplace=True)
+
+        if 'TASKTYPE' in df.columns:
+            df['TASKTYPE'] = clean_string_column(df['TASKTYPE'], 'Type de tâche non spécifié')
+        if 'TIME' in df.columns:
+            df['TIME'] = clean_string_column(df['TIME'])
+
+    
+    elif file_key == "usertcode":
+        numeric_cols = SOURCE_NUMERIC_COLUMNS['usertcode']
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        # Add FULL_DATETIME creation for usertcode
+        if 'ENDDATE' in df.columns and 'ENDTIME' in df.columns:
+            df['ENDTIME_STR'] = df['ENDTIME'].astype(str).str.zfill(6)
+            df['FULL_DATETIME'] = pd.to_datetime(df['ENDDATE'].astype(str) + df['ENDTIME_STR'], format='%Y%m%d%H%M%S', errors='coerce')
+            df.drop(columns=['ENDTIME_STR'], inplace=True, errors='ignore')
+        elif 'FULL_DATETIME' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME']):
+            df['FULL_DATETIME'] = pd.to_datetime(df['FULL_DATETIME'], errors='coerce')
+
+        critical_usertcode_cols = []
+        if 'RESPTI' in df.columns: critical_usertcode_cols.append('RESPTI')
+        if 'ACCOUNT' in df.columns: critical_usertcode_cols.append('ACCOUNT')
+        if 'COUNT' in df.columns: critical_usertcode_cols.append('COUNT')
+
+        if critical_usertcode_cols:
+            df.dropna(subset=critical_usertcode_cols, inplace=True)
+
+        for col in ['TASKTYPE', 'ENTRY_ID', 'ACCOUNT']:
+            if col in df.columns:
+                df[col] = clean_string_column(df[col])
+
+    elif file_key == "performance": # Nouveau bloc pour AL_GET_PERFORMANCE
+        # Convertir WP_CPU de MM:SS en secondes
+        if 'WP_CPU' in df.columns:
+            df['WP_CPU_SECONDS'] = df['WP_CPU'].apply(convert_mm_ss_to_seconds).astype(float) # Convertir en float
+
+        # Convertir WP_IWAIT en secondes (s'il est en ms, diviser par 1000)
+        if 'WP_IWAIT' in df.columns:
+            df['WP_IWAIT'] = pd.to_numeric(df['WP_IWAIT'], errors='coerce').fillna(0)
+            df['WP_IWAIT_SECONDS'] = df['WP_IWAIT'] / 1000.0
+        else:
+            df['WP_IWAIT_SECONDS'] = 0
+
+        # Nettoyage des colonnes string
+        for col in ['WP_SEMSTAT', 'WP_IACTION', 'WP_ITYPE', 'WP_RESTART', 'WP_ISTATUS', 'WP_TYP', 'WP_STATUS']:
+            if col in df.columns:
+                df[col] = clean_string_column(df[col])
+
+        # Nettoyage des colonnes numériques
+        numeric_cols_perf = SOURCE_NUMERIC_COLUMNS['performance']
+        for col in numeric_cols_perf:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float) # Ajout .astype(float)
+
+        # Supprimer les lignes avec des valeurs critiques manquantes si nécessaire
+        subset_cols_perf = []
+        if 'WP_CPU_SECONDS' in df.columns: subset_cols_perf.append('WP_CPU_SECONDS')
+        if 'WP_STATUS' in df.columns: subset_cols_perf.append('WP_STATUS')
+        if subset_cols_perf:
+            df.dropna(subset=subset_cols_perf, inplace=True)
+
+    elif file_key == "sql_trace_summary": # Nouveau bloc pour performance_trace_summary
+        # Nettoyage des colonnes numériques avec virgule/espace
+        numeric_cols_sql = SOURCE_NUMERIC_COLUMNS['sql_trace_summary']
+        for col in numeric_cols_sql:
+            if col in df.columns:
+                df[col] = clean_numeric_with_comma(df[col]).astype(float) # Ajout .astype(float)
+
+        # Nettoyage des colonnes string
+        for col in ['SQLSTATEM', 'SERVERNAME', 'TRANS_ID']:
+            if col in df.columns:
+                df[col] = clean_string_column(df[col])
+
+        # Normalisation SQL et empreinte 64 bits : les Top N agrègent sur l'entier, pas sur le texte brut
+        if 'SQLSTATEM' in df.columns:
+            df['SQLSTATEM_NORM'] = normalize_sql_statements(df['SQLSTATEM'])
+            df['SQL_FINGERPRINT'] = sql_fingerprint(df['SQLSTATEM_NORM'].cat.categories)[df['SQLSTATEM_NORM'].cat.codes.to_numpy()]
+
+        # Supprimer les lignes avec des valeurs critiques manquantes si nécessaire
+        subset_cols_sql = []
+        if 'EXECTIME' in df.columns: subset_cols_sql.append('EXECTIME')
+        if 'TOTALEXEC' in df.columns: subset_cols_sql.append('TOTALEXEC')
+        if 'SQLSTATEM' in df.columns: subset_cols_sql.append('SQLSTATEM')
+        if subset_cols_sql:
+            df.dropna(subset=subset_cols_sql, inplace=True)
+
+    elif file_key == "usr02": # Nouveau bloc pour usr02_data.xlsx
+        # Nettoyage des colonnes string
+        for col in ['BNAME', 'USTYP']:
+            if col in df.columns:
+                df[col] = clean_string_column(df[col])
+
+        # Conversion de GLTGB en datetime
+        if 'GLTGB' in df.columns:
+            df['GLTGB'] = df['GLTGB'].astype(str).replace('00000000', np.nan)
+            df['GLTGB_DATE'] = pd.to_datetime(df['GLTGB'], format='%Y%m%d', errors='coerce')
+        else:
+            df['GLTGB_DATE'] = pd.NaT
+
+    return df
+
+def load_and_process_data(file_key, path, recorder=NULL_RECORDER):
+    """
+    Charge et nettoie un fichier Excel/CSV.
+    Retourne (DataFrame, message d'erreur ou None) : aucune dépendance à Streamlit,
+    la fonction peut donc être appelée depuis le thread de rafraîchissement.
+    """
+    if not path.lower().endswith(SUPPORTED_SOURCE_EXTENSIONS):
+        return pd.DataFrame(), f"Format de fichier non supporté pour {file_key}: {path}"
+    try:
+        with recorder.stage(f"read_source_file[{file_key}]", 'load', path=path) as stage:
+            stage['frame'] = df_raw = read_source_file(path)
+        with recorder.stage(f"clean_source_frame[{file_key}]", 'load') as stage:
+            stage['frame'] = df = clean_source_frame(file_key, df_raw)
+        return df, None
+    except FileNotFoundError:
+        return pd.DataFrame(), f"Erreur: Le fichier '{path}' pour '{file_key}' est introuvable. Veuillez vérifier le chemin."
+    except Exception as e:
+        return pd.DataFrame(), f"Une erreur est survenue lors du traitement du fichier '{file_key}' : {e}. Détails : {e}"
+
+# --- Index de corrélation inter-sources (hitlist_db / usertcode / memory) ---
+
+CROSS_SOURCE_TOLERANCE = pd.Timedelta(hours=1)
+
+def _has_datetime(df):
+    """Indique si le DataFrame possède une colonne FULL_DATETIME exploitable."""
+    return (not df.empty and 'FULL_DATETIME' in df.columns
+            and pd.api.types.is_datetime64_any_dtype(df['FULL_DATETIME'])
+            and not df['FULL_DATETIME'].isnull().all())
+
+def _account_keys(df):
+    """Clés d'appariement d'un compte : (SYSTEM, ACCOUNT) en mode paysage, un même compte existant sur plusieurs systèmes."""
+    return [SYSTEM_COLUMN, 'ACCOUNT'] if SYSTEM_COLUMN in df.columns else ['ACCOUNT']
+
+def _hourly_bucket_stats(df, metrics, prefix):
+    """
+    Agrège une source par (ACCOUNT, HOUR), précédés de SYSTEM en mode paysage : somme, moyenne et max
+    de chaque métrique. Les colonnes résultantes sont préfixées par le nom de la source.
+    """
+    available = [col for col in metrics if col in df.columns]
+    if not available or 'ACCOUNT' not in df.columns or not _has_datetime(df):
+        return pd.DataFrame()
+    keys = _account_keys(df)
+    df_bucket = df[keys + ['FULL_DATETIME'] + available].dropna(subset=['FULL_DATETIME'])
+    df_bucket = df_bucket.assign(HOUR=df_bucket['FULL_DATETIME'].dt.floor('h'))
+    grouped = df_bucket.groupby(keys + ['HOUR'], sort=True, observed=True)[available]
+    stats = grouped.agg(['sum', 'mean', 'max'])
+    stats.columns = [f"{prefix}_{col}_{agg.upper()}" for col, agg in stats.columns]
+    stats[f"{prefix}_STEPS"] = grouped.size()
+    return stats
+
+def _system_as_text(df):
+    if SYSTEM_COLUMN in df.columns and isinstance(df[SYSTEM_COLUMN].dtype, pd.CategoricalDtype):
+        return df.assign(**{SYSTEM_COLUMN: df[SYSTEM_COLUMN].astype(str)})
+    return df
+
+def build_cross_source_index(dfs):
+    """
+    Construit, une seule fois par snapshot, l'index de corrélation entre hitlist_db, usertcode et memory.
+    - 'hourly' : statistiques des trois sources jointes sur l'index (ACCOUNT, HOUR).
+    - 'steps'  : chaque pas de dialogue Hitlist rapproché (merge_asof sur FULL_DATETIME, par ACCOUNT)
+                 de l'enregistrement usertcode et memory le plus proche.
+    """
+    df_hitlist = dfs.get('hitlist_db', pd.DataFrame())
+    df_user = dfs.get('usertcode', pd.DataFrame())
+    df_mem = dfs.get('memory', pd.DataFrame())
+
+    hourly_parts = [
+        _hourly_bucket_stats(df_hitlist, ['RESPTI', 'CPUTI', 'DBCALLS'], 'HITLIST'),
+        _hourly_bucket_stats(df_user, ['RESPTI', 'COUNT'], 'USERTCODE'),
+        _hourly_bucket_stats(df_mem, ['USEDBYTES', 'MAXBYTES'], 'MEMORY'),
+    ]
+    hourly_parts = [part for part in hourly_parts if not part.empty]
+    hourly = pd.concat(hourly_parts, axis=1, join='outer').sort_index() if hourly_parts else pd.DataFrame()
+
+    steps = pd.DataFrame()
+    if _has_datetime(df_hitlist) and 'ACCOUNT' in df_hitlist.columns and 'RESPTI' in df_hitlist.columns:
+        # Mode paysage : les rapprochements restent internes à un système (SYSTEM en clé, en texte
+        # car les catégories diffèrent d'une source à l'autre).
+        keys = _account_keys(df_hitlist)
+        step_cols = [col for col in [SYSTEM_COLUMN, 'FULL_DATETIME', 'ACCOUNT', 'TASKTYPE', 'REPORT', 'RESPTI', 'CPUTI', 'DBCALLS']
+                     if col in df_hitlist.columns]
+        steps = _system_as_text(df_hitlist[step_cols].dropna(subset=['FULL_DATETIME']).sort_values('FULL_DATETIME', kind='mergesort'))
+
+        if _has_datetime(df_user) and all(col in df_user.columns for col in keys):
+            user_cols = [col for col in ['ENTRY_ID', 'RESPTI', 'CPUTI', 'COUNT'] if col in df_user.columns]
+            df_user_side = df_user[['FULL_DATETIME'] + keys + user_cols].dropna(subset=['FULL_DATETIME'])
+            df_user_side = _system_as_text(df_user_side.rename(columns={col: f"USERTCODE_{col}" for col in user_cols}))
+            steps = pd.merge_asof(steps, df_user_side.sort_values('FULL_DATETIME', kind='mergesort'),
+                                  on='FULL_DATETIME', by=keys, direction='nearest',
+                                  tolerance=CROSS_SOURCE_TOLERANCE)
+
+        mem_cols = [col for col in ['USEDBYTES', 'MAXBYTES', 'PRIVSUM'] if col in df_mem.columns]
+        if mem_cols and all(col in df_mem.columns for col in keys):
+            if _has_datetime(df_mem):
+                df_mem_side = df_mem[['FULL_DATETIME'] + keys + mem_cols].dropna(subset=['FULL_DATETIME'])
+                df_mem_side = _system_as_text(df_mem_side.rename(columns={col: f"MEMORY_{col}" for col in mem_cols}))
+                steps = pd.merge_asof(steps, df_mem_side.sort_values('FULL_DATETIME', kind='mergesort'),
+                                      on='FULL_DATETIME', by=keys, direction='nearest',
+                                      tolerance=CROSS_SOURCE_TOLERANCE)
+            else:
+                # Extrait mémoire sans horodatage : rattachement au profil mémoire moyen du compte.
+                df_mem_side = _system_as_text(df_mem).groupby(keys)[mem_cols].mean()
+                df_mem_side.columns = [f"MEMORY_{col}" for col in mem_cols]
+                steps = steps.join(df_mem_side, on=keys)
+
+        steps['HOUR'] = steps['FULL_DATETIME'].dt.floor('h')
+        steps = steps.sort_values('RESPTI', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    return {'hourly': hourly, 'steps': steps}
+
+# --- Détection d'anomalies sur les séries horaires ---
+
+# (source, métrique, agrégat horaire) : une série par combinaison (SYSTEM, ACCOUNT, TASKTYPE) présente dans la source.
+ANOMALY_SERIES = [
+    ('hitlist_db', 'RESPTI', 'mean'),
+    ('usertcode', 'RESPTI', 'mean'),
+    ('memory', 'USEDBYTES', 'mean'),
+    ('times', 'PHYCALLS', 'sum'),
+]
+ANOMALY_DIMENSIONS = [SYSTEM_COLUMN, 'ACCOUNT', 'TASKTYPE']
+ANOMALY_Z_THRESHOLD = float(os.environ.get("SAP_DASHBOARD_ANOMALY_Z", "3.5"))
+ANOMALY_ROLLING_WINDOW = 24      # heures précédentes formant la référence glissante
+ANOMALY_MIN_PERIODS = 6          # observations minimales dans la fenêtre glissante
+ANOMALY_MIN_SEASONAL = 3         # observations minimales à une même heure de la journée
+ANOMALY_BLOCK_CELLS = 4_000_000  # séries x heures x fenêtre traitées ensemble (borne mémoire)
+MAD_TO_SIGMA = 1.4826
+MEAN_AD_TO_SIGMA = 1.2533
+ANOMALY_REPORT_COLUMNS = ['SOURCE', 'METRIC', SYSTEM_COLUMN, 'ACCOUNT', 'TASKTYPE', 'PERIOD', 'START', 'END', 'HOURS',
+                          'PEAK_HOUR', 'HOUR_OF_DAY', 'PEAK_VALUE', 'BASELINE', 'PEAK_Z', 'DIRECTION']
+
+def anomaly_series_frame(df, metric, agg='mean'):
+    """
+    Séries horaires au format long (SYSTEM, ACCOUNT, TASKTYPE, HOUR, VALUE) d'une métrique ;
+    les dimensions absentes de la source valent None.
+    HOUR est l'heure calendaire (FULL_DATETIME) quand elle existe, sinon l'heure de la journée (0-23)
+    de la tranche TIME : cas de Times, profil d'une journée sans référence saisonnière possible.
+    Retourne None si la métrique ou l'axe temporel manquent.
+    """
+    if not has_positive_total(df, metric):
+        return None
+    if _has_datetime(df):
+        hours = df['FULL_DATETIME'].dt.floor('h')
+    elif 'TIME' in df.columns:
+        hours = pd.to_numeric(hour_of_day(df['TIME']), errors='coerce')
+    else:
+        return None
+    dims = [col for col in ANOMALY_DIMENSIONS if col in df.columns]
+    series = _system_as_text(df[dims + [metric]].assign(HOUR=hours).dropna(subset=['HOUR', metric]))
+    hourly = series.groupby(dims + ['HOUR'], sort=False)[metric].agg(agg).rename('VALUE').reset_index()
+    for col in ANOMALY_DIMENSIONS:
+        if col not in hourly.columns:
+            hourly[col] = None
+    return hourly
+
+def _nanmedian_last_axis(values):
+    """Médiane le long du dernier axe en ignorant les NaN, par tri (bien plus rapide que np.nanmedian sur des fenêtres)."""
+    ordered = np.sort(values, axis=-1)  # les NaN sont rangés en fin de tri
+    counts = np.count_nonzero(~np.isnan(values), axis=-1)
+    low = np.take_along_axis(ordered, np.maximum(counts - 1, 0)[..., None] // 2, axis=-1)[..., 0]
+    high = np.take_along_axis(ordered, np.minimum(counts // 2, values.shape[-1] - 1)[..., None], axis=-1)[..., 0]
+    return np.where(counts > 0, (low + high) / 2, np.nan)
+
+def _robust_center_scale(values):
+    """Médiane et dispersion robuste (MAD, à défaut écart absolu moyen) le long du dernier axe, NaN ignorés."""
+    center = _nanmedian_last_axis(values)
+    deviations = np.abs(values - center[..., None])
+    scale = MAD_TO_SIGMA * _nanmedian_last_axis(deviations)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        fallback = MEAN_AD_TO_SIGMA * np.nanmean(deviations, axis=-1)
+    scale = np.where(scale > 0, scale, fallback)
+    return center, np.where(scale > 0, scale, np.nan)
+
+def rolling_robust_zscores(values, window=ANOMALY_ROLLING_WINDOW, min_periods=ANOMALY_MIN_PERIODS):
+    """
+    Z-score robuste de chaque point face aux `window` points qui le précèdent dans sa série (une ligne par série).
+    Toutes les séries sont traitées ensemble, par blocs de lignes pour borner la mémoire.
+    Retourne (z-scores, médianes de référence) ; NaN si la fenêtre compte moins de `min_periods` observations.
+    """
+    n_series, n_hours = values.shape
+    zscores = np.full(values.shape, np.nan)
+    centers = np.full(values.shape, np.nan)
+    # float32 pour les fenêtres : deux fois moins de mémoire parcourue, précision largement suffisante pour un score.
+    padded = np.concatenate([np.full((n_series, window), np.nan), values], axis=1).astype(np.float32)
+    block = max(1, ANOMALY_BLOCK_CELLS // max(1, n_hours * window))
+    for first in range(0, n_series, block):
+        rows = slice(first, first + block)
+        # Fenêtre t : valeurs t-window .. t-1 (le point évalué n'entre pas dans sa propre référence).
+        windows = np.lib.stride_tricks.sliding_window_view(padded[rows], window, axis=1)[:, :n_hours]
+        center, scale = _robust_center_scale(windows)
+        enough = np.count_nonzero(~np.isnan(windows), axis=2) >= min_periods
+        centers[rows] = np.where(enough, center, np.nan)
+        zscores[rows] = np.where(enough, (values[rows] - center) / scale, np.nan)
+    return zscores, centers
+
+def seasonal_robust_zscores(values, hours_of_day, min_samples=ANOMALY_MIN_SEASONAL):
+    """
+    Z-score robuste face à la référence saisonnière : médiane et MAD de la série à la même heure de la journée.
+    Une passe par heure de la journée, toutes séries confondues. Retourne (z-scores, médianes de référence).
+    """
+    zscores = np.full(values.shape, np.nan)
+    centers = np.full(values.shape, np.nan)
+    for hour in np.unique(hours_of_day):
+        columns = hours_of_day == hour
+        same_hour = values[:, columns]
+        center, scale = _robust_center_scale(same_hour)
+        center = np.where(np.count_nonzero(~np.isnan(same_hour), axis=1) >= min_samples, center, np.nan)
+        centers[:, columns] = center[:, None]
+        zscores[:, columns] = (same_hour - center[:, None]) / scale[:, None]
+    return zscores, centers
+
+def combine_anomaly_scores(rolling_z, seasonal_z):
+    """
+    Score retenu : le z-score glissant, confirmé par la référence saisonnière quand elle existe
+    (même signe, plus faible amplitude des deux). Un pic habituel à cette heure n'est donc pas signalé.
+    """
+    agree = np.sign(rolling_z) == np.sign(seasonal_z)
+    confirmed = np.where(agree, np.where(np.abs(rolling_z) <= np.abs(seasonal_z), rolling_z, seasonal_z), 0.0)
+    return np.where(np.isnan(seasonal_z), rolling_z, confirmed)
+
+def anomaly_windows(scores, threshold=ANOMALY_Z_THRESHOLD):
+    """
+    Fenêtres d'anomalie : suites d'heures consécutives d'une série où |score| dépasse `threshold`.
+    Retourne quatre tableaux indexés par fenêtre : série, première heure, dernière heure, heure du pic.
+    """
+    n_series, n_hours = scores.shape
+    width = n_hours + 1
+    # Colonne de garde à zéro : une fenêtre ne se prolonge jamais sur la série suivante.
+    magnitude = np.zeros((n_series, width))
+    magnitude[:, :n_hours] = np.abs(np.nan_to_num(scores))
+    magnitude = magnitude.ravel()
+    flagged = np.flatnonzero(magnitude > threshold)
+    if flagged.size == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty
+    edges = np.diff(np.concatenate([[0], (magnitude > threshold).astype(np.int8)]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    window_ids = np.searchsorted(starts, flagged, side='right') - 1
+    order = np.lexsort((-magnitude[flagged], window_ids))
+    is_peak = np.concatenate([[True], window_ids[order][1:] != window_ids[order][:-1]])
+    peaks = flagged[order][is_peak]
+    return starts // width, starts % width, ends % width, peaks % width
+
+def detect_series_anomalies(hourly, threshold=ANOMALY_Z_THRESHOLD):
+    """
+    Fenêtres anormales des séries d'anomaly_series_frame(), en une passe vectorisée sur la matrice
+    séries x heures (NaN pour les heures sans observation). Une ligne par fenêtre.
+    """
+    calendar = pd.api.types.is_datetime64_any_dtype(hourly['HOUR'])
+    codes = hourly.groupby(ANOMALY_DIMENSIONS, sort=False, dropna=False).ngroup().to_numpy()
+    keys = hourly[ANOMALY_DIMENSIONS].iloc[np.unique(codes, return_index=True)[1]].reset_index(drop=True)
+    if calendar:
+        first_hour = hourly['HOUR'].min()
+        hour_axis = pd.date_range(first_hour, hourly['HOUR'].max(), freq='h')
+        columns = ((hourly['HOUR'] - first_hour) // pd.Timedelta(hours=1)).to_numpy()
+    else:
+        hour_axis = np.arange(24)
+        columns = hourly['HOUR'].to_numpy(dtype=np.int64)
+    values = np.full((len(keys), len(hour_axis)), np.nan)
+    values[codes, columns] = hourly['VALUE'].to_numpy(dtype=float)
+
+    rolling_z, rolling_center = rolling_robust_zscores(values)
+    if calendar:
+        seasonal_z, seasonal_center = seasonal_robust_zscores(values, hour_axis.hour.to_numpy())
+    else:
+        seasonal_z = seasonal_center = np.full(values.shape, np.nan)
+    scores = combine_anomaly_scores(rolling_z, seasonal_z)
+    baseline = np.where(np.isnan(seasonal_center), rolling_center, seasonal_center)
+
+    rows, first, last, peak = anomaly_windows(scores, threshold)
+    report = keys.iloc[rows].reset_index(drop=True)
+    report['HOURS'] = last - first + 1
+    report['PEAK_VALUE'] = values[rows, peak]
+    report['BASELINE'] = baseline[rows, peak]
+    report['PEAK_Z'] = scores[rows, peak]
+    report['DIRECTION'] = np.where(report['PEAK_Z'] > 0, 'hausse', 'baisse')
+    if calendar:
+        report['START'] = hour_axis[first]
+        report['END'] = hour_axis[last] + pd.Timedelta(hours=1)
+        report['PEAK_HOUR'] = hour_axis[peak]
+        report['HOUR_OF_DAY'] = report['PEAK_HOUR'].dt.hour
+        report['PERIOD'] = report['START'].dt.strftime('%d/%m/%Y %H:%M') + ' → ' + report['END'].dt.strftime('%H:%M')
+    else:
+        report['START'] = report['END'] = report['PEAK_HOUR'] = pd.NaT
+        report['HOUR_OF_DAY'] = peak
+        report['PERIOD'] = [f"{start:02d}h → {end + 1:02d}h (profil journalier)" for start, end in zip(first, last)]
+    return report
+
+def build_anomaly_report(dfs, threshold=ANOMALY_Z_THRESHOLD):
+    """
+    Détecte, une fois par snapshot, les fenêtres horaires anormales de chaque série d'ANOMALY_SERIES.
+    - 'windows'  : une ligne par fenêtre (compte, type de tâche, période, pic, référence, z-score),
+                   triées par amplitude décroissante.
+    - 'coverage' : nombre de séries et d'heures analysées par source.
+    """
+    parts, coverage = [], []
+    for source, metric, agg in ANOMALY_SERIES:
+        hourly = anomaly_series_frame(dfs.get(source, pd.DataFrame()), metric, agg)
+        if hourly is None or hourly.empty:
+            continue
+        windows = detect_series_anomalies(hourly, threshold)
+        parts.append(windows.assign(SOURCE=source, METRIC=metric))
+        coverage.append({'SOURCE': source, 'METRIC': metric, 'SERIES': len(hourly[ANOMALY_DIMENSIONS].drop_duplicates()),
+                         'OBSERVATIONS': len(hourly), 'WINDOWS': len(windows),
+                         'CALENDAR': pd.api.types.is_datetime64_any_dtype(hourly['HOUR'])})
+    parts = [part for part in parts if not part.empty]
+    windows = pd.concat(parts, ignore_index=True)[ANOMALY_REPORT_COLUMNS] if parts else pd.DataFrame(columns=ANOMALY_REPORT_COLUMNS)
+    if windows[SYSTEM_COLUMN].isna().all():
+        windows = windows.drop(columns=SYSTEM_COLUMN)
+    if not windows.empty:
+        windows = windows.iloc[np.argsort(-windows['PEAK_Z'].abs().to_numpy(), kind='stable')].reset_index(drop=True)
+    return {'windows': windows, 'coverage': pd.DataFrame(coverage, columns=['SOURCE', 'METRIC', 'SERIES', 'OBSERVATIONS', 'WINDOWS', 'CALENDAR'])}
+
+def filter_anomaly_windows(df_windows, accounts=None, tasktypes=None, systems=None):
+    """Applique les filtres globaux aux fenêtres d'anomalie ; une série sans ACCOUNT (Times) ignore le filtre compte."""
+    if df_windows.empty:
+        return df_windows
+    if systems and SYSTEM_COLUMN in df_windows.columns:
+        df_windows = df_windows[df_windows[SYSTEM_COLUMN].isin(systems)]
+    if accounts:
+        df_windows = df_windows[df_windows['ACCOUNT'].isna() | df_windows['ACCOUNT'].isin(accounts)]
+    if tasktypes:
+        df_windows = df_windows[df_windows['TASKTYPE'].isin(tasktypes)]
+    return df_windows
+
+# --- Comparaison de régression entre deux snapshots ou deux périodes ---
+
+# Dimension -> (source, colonne clé, métriques comparées).
+COMPARISON_DIMENSIONS = {
+    'REPORT': ('hitlist_db', 'REPORT', ['RESPTI', 'CPUTI', 'DBCALLS']),
+    'TASKTYPE': ('hitlist_db', 'TASKTYPE', ['RESPTI', 'CPUTI', 'DBCALLS']),
+    'SQL_FINGERPRINT': ('sql_trace_summary', 'SQL_FINGERPRINT', ['EXECTIME', 'TIMEPEREXE']),
+}
+COMPARISON_ALPHA = 0.05
+COMPARISON_MIN_COUNT = 2
+COMPARISON_STATS = ('n', 'sum', 'logsum', 'logsq')
+# Dossier optionnel contenant un jeu d'exports de référence (mêmes noms de fichiers que DATA_PATHS).
+COMPARISON_BASELINE_DIR = os.environ.get("SAP_DASHBOARD_BASELINE_DIR", "")
+
+def comparison_aggregates(df, key, metrics):
+    """
+    Statistiques suffisantes par clé (et par heure si la source est horodatée) : effectif, somme,
+    somme et somme des carrés de log1p(valeur) pour chaque métrique. Les agrégats de deux périodes ou de
+    deux snapshots s'alignent ensuite sur la clé, sans jointure sur les lignes brutes.
+    Retourne None si la clé ou toutes les métriques manquent.
+    """
+    available = [col for col in metrics if col in df.columns]
+    if df.empty or key not in df.columns or not available:
+        return None
+    values = df[available].astype(float)
+    logs = np.log1p(values.clip(lower=0))
+    stats = {}
+    for col in available:
+        stats[f"{col}__n"] = values[col].notna().astype(np.int64)
+        stats[f"{col}__sum"] = values[col]
+        stats[f"{col}__logsum"] = logs[col]
+        stats[f"{col}__logsq"] = logs[col] ** 2
+    groups = [df[key]]
+    if _has_datetime(df):
+        groups.append(df['FULL_DATETIME'].dt.floor('h').rename('HOUR'))
+    return pd.DataFrame(stats, index=df.index).groupby(groups, sort=True).sum()
+
+def build_comparison_aggregates(dfs):
+    """Statistiques suffisantes de chaque dimension de COMPARISON_DIMENSIONS (None si indisponible)."""
+    return {dimension: comparison_aggregates(dfs.get(source, pd.DataFrame()), key, metrics)
+            for dimension, (source, key, metrics) in COMPARISON_DIMENSIONS.items()}
+
+def comparison_time_range(aggregates):
+    """Première et dernière heure couvertes par les agrégats horodatés, ou None."""
+    hours = [pre.index.get_level_values('HOUR') for pre in aggregates.values()
+             if pre is not None and 'HOUR' in pre.index.names and len(pre)]
+    if not hours:
+        return None
+    return min(hour.min() for hour in hours), max(hour.max() for hour in hours) + pd.Timedelta(hours=1)
+
+def aggregate_window(pre, start=None, end=None):
+    """
+    Agrégats par clé sur [start, end[ (heures). Sans bornes, toute la période est retenue.
+    Retourne None si une période est demandée sur une source non horodatée.
+    """
+    if pre is None:
+        return None
+    if 'HOUR' not in pre.index.names:
+        return pre if start is None and end is None else None
+    hours = pre.index.get_level_values('HOUR')
+    mask = np.ones(len(pre), dtype=bool)
+    if start is not None:
+        mask &= hours >= start
+    if end is not None:
+        mask &= hours < end
+    return pre[mask].groupby(level=0).sum()
+
+def benjamini_hochberg(p_values):
+    """q-values de Benjamini-Hochberg (taux de fausses découvertes) ; les NaN sont conservés."""
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if valid.size:
+        order = valid[np.argsort(p_values[valid], kind='stable')]
+        ranked = p_values[order] * valid.size / np.arange(1, valid.size + 1)
+        q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+def compare_aggregates(baseline, candidate, alpha=COMPARISON_ALPHA, min_count=COMPARISON_MIN_COUNT):
+    """
+    Écarts par clé et par métrique entre deux agrégats alignés (aggregate_window) : moyennes, delta
+    absolu et relatif, test t de Welch sur log1p(valeur) (temps et compteurs sont très asymétriques)
+    et q-value de Benjamini-Hochberg sur l'ensemble des tests. Une hausse significative est une régression.
+    """
+    columns = ['KEY', 'METRIC', 'N_BASE', 'N_CAND', 'MEAN_BASE', 'MEAN_CAND', 'DELTA', 'DELTA_PCT',
+               'T_STAT', 'P_VALUE', 'Q_VALUE', 'STATUS']
+    if baseline is None or candidate is None:
+        return None
+    keys = baseline.index.union(candidate.index)
+    base = baseline.reindex(keys, fill_value=0)
+    cand = candidate.reindex(keys, fill_value=0)
+    metrics = [col[:-len('__n')] for col in base.columns if col.endswith('__n') and col in cand.columns]
+    parts = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for metric in metrics:
+            moments = {}
+            for side, frame in (('BASE', base), ('CAND', cand)):
+                n = frame[f"{metric}__n"].to_numpy(dtype=float)
+                log_mean = frame[f"{metric}__logsum"].to_numpy() / n
+                log_var = np.clip((frame[f"{metric}__logsq"].to_numpy() - n * log_mean ** 2) / (n - 1), 0, None)
+                moments[side] = (n, frame[f"{metric}__sum"].to_numpy() / n, log_mean, log_var / n)
+            (n_base, mean_base, log_base, se_base), (n_cand, mean_cand, log_cand, se_cand) = moments['BASE'], moments['CAND']
+            testable = (n_base >= min_count) & (n_cand >= min_count)
+            t_stat = np.where(testable, (log_cand - log_base) / np.sqrt(se_base + se_cand), np.nan)
+            dof = (se_base + se_cand) ** 2 / (se_base ** 2 / (n_base - 1) + se_cand ** 2 / (n_cand - 1))
+            p_value = np.where(np.isnan(t_stat), np.nan, 2 * stdtr(np.where(np.isfinite(dof), dof, 1.0), -np.abs(t_stat)))
+            # Variances nulles des deux côtés : moyennes identiques (aucun écart) ou écart certain.
+            p_value = np.where(testable & ~np.isfinite(t_stat), np.where(log_cand == log_base, 1.0, 0.0), p_value)
+            parts.append(pd.DataFrame({
+                'KEY': keys, 'METRIC': metric, 'N_BASE': n_base.astype(np.int64), 'N_CAND': n_cand.astype(np.int64),
+                'MEAN_BASE': mean_base, 'MEAN_CAND': mean_cand, 'DELTA': mean_cand - mean_base,
+                'DELTA_PCT': (mean_cand - mean_base) / mean_base * 100, 'T_STAT': t_stat, 'P_VALUE': p_value,
+            }))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    result = pd.concat(parts, ignore_index=True)
+    result['Q_VALUE'] = benjamini_hochberg(result['P_VALUE'])
+    significant = result['Q_VALUE'] < alpha
+    result['STATUS'] = np.select(
+        [result['N_BASE'] == 0, result['N_CAND'] == 0, significant & (result['DELTA'] > 0), significant & (result['DELTA'] < 0)],
+        ['nouveau', 'disparu', 'régression', 'amélioration'], default='stable')
+    result['DELTA_PCT'] = result['DELTA_PCT'].replace([np.inf, -np.inf], np.nan)
+    return result[columns].sort_values(['Q_VALUE', 'DELTA_PCT'], ascending=[True, False], na_position='last',
+                                       kind='mergesort').reset_index(drop=True)
+
+def compare_snapshots(baseline_aggregates, candidate_aggregates, baseline_window=(None, None), candidate_window=(None, None)):
+    """
+    Comparaison par dimension : deux snapshots (fenêtres vides) ou deux périodes d'un même snapshot
+    (mêmes agrégats, fenêtres différentes). Une dimension sans agrégat exploitable vaut None.
+    """
+    return {dimension: compare_aggregates(aggregate_window(baseline_aggregates.get(dimension), *baseline_window),
+                                          aggregate_window(candidate_aggregates.get(dimension), *candidate_window))
+            for dimension in COMPARISON_DIMENSIONS}
+
+def baseline_data_paths(directory, data_paths=DATA_PATHS):
+    """Chemins d'un jeu d'exports de référence : mêmes noms de fichiers que `data_paths`, dans `directory`."""
+    return {key: os.path.join(directory, os.path.basename(path)) for key, path in data_paths.items()}
+
+def load_comparison_snapshot(directory, data_paths=DATA_PATHS):
+    """
+    Charge un jeu d'exports de référence et ne conserve que ses agrégats de comparaison.
+    Chargement local au processus : le stockage partagé reste réservé au snapshot courant.
+    """
+    signature = data_files_signature(baseline_data_paths(directory, data_paths), use_incoming=False)
+    snapshot_dfs, errors = load_snapshot_frames_locally(signature)
+    return {
+        'loaded_at': pd.Timestamp.now(),
+        'signature': signature,
+        'errors': errors,
+        'comparison_aggregates': build_comparison_aggregates(snapshot_dfs),
+    }
+
+# --- Décomposition du temps de réponse des pas de dialogue (hitlist_db) ---
+
+# Composante -> colonnes hitlist additionnées (ms). Le temps d'attente de roll (ROLLWAITTI) couvre aussi
+# l'attente du GUI et des RFC synchrones : seul son excédent sur GUITIME + RFCCALLTIM compte comme attente.
+RESPONSE_COMPONENTS = {
+    'CPU': ['CPUTI'],
+    'Base de données': ['READDIRTI', 'READSEQTI', 'INSTI', 'UPDTI', 'DELTI', 'COMMITTI', 'DBP_TIME'],
+    'Attente': ['QUEUETI', 'LOCKTI', 'ROLLINTI', 'ROLLOUTTI'],
+    'GUI': ['GUITIME'],
+    'Chargement/Génération': ['GENERATETI', 'REPLOADTI', 'CUALOADTI', 'DYNPLOADTI'],
+    'RFC': ['RFCCALLTIM'],
+}
+RESPONSE_OTHER = 'Autre'
+RESPONSE_COMPONENT_NAMES = list(RESPONSE_COMPONENTS) + [RESPONSE_OTHER]
+
+def response_time_components(df):
+    """
+    Matrice (pas x composantes, RESPONSE_COMPONENT_NAMES) du temps de réponse de chaque pas.
+    Les compteurs SAP se recouvrent en partie (CPU pendant un appel RFC...) : si leur somme dépasse RESPTI,
+    ils sont réduits proportionnellement ; sinon le reste est attribué à 'Autre'. Chaque ligne somme à RESPTI.
+    """
+    def column(name):
+        if name not in df.columns:
+            return np.zeros(len(df))
+        return np.clip(np.nan_to_num(df[name].to_numpy(dtype=float)), 0, None)
+
+    matrix = np.column_stack([sum(column(name) for name in columns) for columns in RESPONSE_COMPONENTS.values()])
+    wait = list(RESPONSE_COMPONENTS).index('Attente')
+    matrix[:, wait] += np.clip(column('ROLLWAITTI') - column('GUITIME') - column('RFCCALLTIM'), 0, None)
+    response = column('RESPTI')
+    attributed = matrix.sum(axis=1)
+    overlap = attributed > response
+    matrix[overlap] *= (response[overlap] / attributed[overlap])[:, None]
+    return np.column_stack([matrix, response - matrix.sum(axis=1).clip(None, response)])
+
+def build_response_breakdown(df_hitlist):
+    """
+    Temps de réponse décomposé, sommé par combinaison des dimensions de filtre de hitlist_db
+    (SYSTEM, ACCOUNT, REPORT, TASKTYPE) avec le nombre de pas. Matrice compacte : response_breakdown
+    en déduit les barres empilées de n'importe quelle sélection en O(groupes). None sans RESPTI.
+    """
+    if df_hitlist.empty or 'RESPTI' not in df_hitlist.columns:
+        return None
+    dims = _kpi_filter_dimensions('hitlist_db', df_hitlist)
+    components = pd.DataFrame(response_time_components(df_hitlist), columns=RESPONSE_COMPONENT_NAMES, index=df_hitlist.index)
+    components['STEPS'] = 1
+    if not dims:
+        return components.sum().to_frame().T
+    return components.groupby([df_hitlist[dim] for dim in dims], observed=True, dropna=False, sort=False).sum()
+
+def add_to_response_breakdown(breakdown, df_new):
+    """Décomposition intégrant des pas supplémentaires (sommes par groupe additives, comme add_to_kpi_summary)."""
+    delta = build_response_breakdown(df_new)
+    if delta is None:
+        return breakdown
+    return add_group_sums(breakdown, delta)
+
+def response_breakdown(breakdown, by, n=15, accounts=None, reports=None, tasktypes=None, systems=None):
+    """
+    Décomposition du temps de réponse des `n` groupes de `by` (REPORT, ACCOUNT...) au temps total le plus élevé,
+    filtres globaux appliqués, au format long : by, COMPONENT, RESPTI (ms), SHARE (part du groupe), STEPS.
+    None si la décomposition ou la dimension manque ; DataFrame vide si la sélection ne garde aucun pas.
+    """
+    if breakdown is None or by not in (breakdown.index.names or []):
+        return None
+    selections = {SYSTEM_COLUMN: systems, 'ACCOUNT': accounts, 'REPORT': reports, 'TASKTYPE': tasktypes}
+    mask = np.ones(len(breakdown), dtype=bool)
+    for dim in breakdown.index.names:
+        if selections.get(dim):
+            mask &= breakdown.index.get_level_values(dim).isin(selections[dim])
+    grouped = breakdown[mask].groupby(level=by, observed=True, sort=False).sum()
+    totals = grouped[RESPONSE_COMPONENT_NAMES].sum(axis=1)
+    grouped = grouped[totals > 0]
+    if grouped.empty:
+        return pd.DataFrame(columns=[by, 'COMPONENT', 'RESPTI', 'SHARE', 'STEPS'])
+    top = grouped.loc[totals[totals > 0].nlargest(n).index]
+    long = (top[RESPONSE_COMPONENT_NAMES].rename_axis(by).reset_index()
+                .melt(id_vars=by, var_name='COMPONENT', value_name='RESPTI'))
+    group_totals = long.groupby(by, observed=True, sort=False)['RESPTI'].transform('sum')
+    long['SHARE'] = long['RESPTI'] / group_totals
+    long['STEPS'] = long[by].map(top['STEPS'])
+    return long
+
+# --- Accès base de données et buffers de tables (hitlist_db) ---
+
+# Compteurs de la matrice REPORT x type d'accès. TABDIRCNT/TABSEQCNT/TABUPDCNT : somme des accès aux
+# 5 tables les plus sollicitées du pas (TAB1..TAB5).
+DB_ACCESS_COUNTERS = ['READDIRCNT', 'READDIRBUF', 'READSEQCNT', 'READSEQBUF', 'PHYREADCNT',
+                      'INSCNT', 'PHYINSCNT', 'UPDCNT', 'PHYUPDCNT', 'DELCNT', 'PHYDELCNT',
+                      'TABDIRCNT', 'TABSEQCNT', 'TABUPDCNT', 'STEPS']
+# Type d'accès -> (compteur logique, compteur servi par le buffer de tables ou physique).
+DB_READ_ACCESS = {'Lecture directe': ('READDIRCNT', 'READDIRBUF'), 'Lecture séquentielle': ('READSEQCNT', 'READSEQBUF')}
+DB_WRITE_ACCESS = {'Insertion': ('INSCNT', 'PHYINSCNT'), 'Mise à jour': ('UPDCNT', 'PHYUPDCNT'), 'Suppression': ('DELCNT', 'PHYDELCNT')}
+# Lectures séquentielles sans buffer : au moins ce nombre de lectures et un taux de succès buffer inférieur au seuil.
+DB_UNBUFFERED_MIN_SEQ_READS = 100
+DB_UNBUFFERED_MAX_HIT_RATIO = 0.05
+
+def _db_access_counters(df):
+    def column(name):
+        if name not in df.columns:
+            return np.zeros(len(df))
+        return np.nan_to_num(pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float))
+
+    counters = {name: column(name) for name in DB_ACCESS_COUNTERS[:11]}
+    for kind in ('DIR', 'SEQ', 'UPD'):
+        counters[f"TAB{kind}CNT"] = sum(column(f"TAB{i}{kind}CNT") for i in range(1, 6))
+    counters['STEPS'] = np.ones(len(df))
+    return np.column_stack([counters[name] for name in DB_ACCESS_COUNTERS])
+
+def build_db_access_matrix(df_hitlist):
+    """
+    Compteurs d'accès base de données sommés par combinaison des dimensions de filtre de hitlist_db,
+    avec le code dense du REPORT de chaque groupe : db_access_by_report en déduit, pour une sélection,
+    la matrice dense REPORT x compteur (np.bincount) sans relire les pas. None sans REPORT.
+    """
+    if df_hitlist.empty or 'REPORT' not in df_hitlist.columns:
+        return None
+    dims = _kpi_filter_dimensions('hitlist_db', df_hitlist)
+    counters = pd.DataFrame(_db_access_counters(df_hitlist), columns=DB_ACCESS_COUNTERS, index=df_hitlist.index)
+    return _db_access_from_groups(counters.groupby([df_hitlist[dim] for dim in dims], observed=True, dropna=False, sort=False).sum())
+
+def _db_access_from_groups(groups):
+    report_codes, reports = pd.factorize(groups.index.get_level_values('REPORT'), use_na_sentinel=False)
+    return {
+        'keys': groups.index,
+        'reports': np.asarray(reports, dtype=object),
+        'report_codes': report_codes,
+        'counters': groups.to_numpy(),
+    }
+
+def add_to_db_access_matrix(access, df_new):
+    """Matrice d'accès intégrant des pas supplémentaires : les compteurs par groupe sont additifs (coût en O(groupes))."""
+    delta = build_db_access_matrix(df_new)
+    if delta is None or access is None:
+        return access if delta is None else delta
+    groups = pd.DataFrame(access['counters'], index=access['keys'], columns=DB_ACCESS_COUNTERS)
+    added = pd.DataFrame(delta['counters'], index=delta['keys'], columns=DB_ACCESS_COUNTERS)
+    return _db_access_from_groups(add_group_sums(groups, added))
+
+def _safe_ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+def db_access_by_report(access, accounts=None, reports=None, tasktypes=None, systems=None):
+    """
+    Matrice REPORT x compteur pour la sélection, avec taux de succès du buffer de tables (lectures directes,
+    séquentielles, ensemble), lectures physiques par lecture non bufferisée et repérage des lectures
+    séquentielles sans buffer (UNBUFFERED_SEQ). Triée par lectures séquentielles non bufferisées.
+    None sans matrice ; DataFrame vide si la sélection ne garde aucun pas.
+    """
+    if access is None:
+        return None
+    selections = {SYSTEM_COLUMN: systems, 'ACCOUNT': accounts, 'REPORT': reports, 'TASKTYPE': tasktypes}
+    mask = np.ones(len(access['keys']), dtype=bool)
+    for dim in access['keys'].names:
+        if selections.get(dim):
+            mask &= access['keys'].get_level_values(dim).isin(selections[dim])
+    codes = access['report_codes'][mask]
+    dense = np.zeros((len(access['reports']), len(DB_ACCESS_COUNTERS)))
+    for j, column in enumerate(access['counters'][mask].T):
+        dense[:, j] = np.bincount(codes, weights=column, minlength=len(access['reports']))
+    present = dense[:, DB_ACCESS_COUNTERS.index('STEPS')] > 0
+    df = pd.DataFrame(dense[present], columns=DB_ACCESS_COUNTERS)
+    df.insert(0, 'REPORT', access['reports'][present])
+    if df.empty:
+        return df
+    logical_reads = df['READDIRCNT'] + df['READSEQCNT']
+    buffered_reads = df['READDIRBUF'] + df['READSEQBUF']
+    df['DIR_HIT_RATIO'] = _safe_ratio(df['READDIRBUF'], df['READDIRCNT'])
+    df['SEQ_HIT_RATIO'] = _safe_ratio(df['READSEQBUF'], df['READSEQCNT'])
+    df['READ_HIT_RATIO'] = _safe_ratio(buffered_reads, logical_reads)
+    df['PHYS_PER_DB_READ'] = _safe_ratio(df['PHYREADCNT'], (logical_reads - buffered_reads).clip(lower=0))
+    df['SEQ_UNBUFFERED'] = (df['READSEQCNT'] - df['READSEQBUF']).clip(lower=0)
+    df['UNBUFFERED_SEQ'] = ((df['READSEQCNT'] >= DB_UNBUFFERED_MIN_SEQ_READS)
+                            & (df['SEQ_HIT_RATIO'].fillna(0) < DB_UNBUFFERED_MAX_HIT_RATIO))
+    return df.sort_values('SEQ_UNBUFFERED', ascending=False, kind='mergesort').reset_index(drop=True)
+
+def db_access_pattern(by_report, kind='reads', n=15):
+    """
+    Format long des `n` rapports les plus actifs pour un graphique empilé : REPORT, ACCESS (type d'accès),
+    LEVEL ('Buffer'/'Base de données' pour les lectures, 'Logique'/'Physique' pour les écritures), COUNT.
+    """
+    if by_report is None or by_report.empty:
+        return by_report
+    access_types = DB_READ_ACCESS if kind == 'reads' else DB_WRITE_ACCESS
+    totals = sum(by_report[logical] for logical, _ in access_types.values())
+    top = by_report.loc[totals[totals > 0].nlargest(n).index]
+    rows = []
+    for access_type, (logical, other) in access_types.items():
+        if kind == 'reads':
+            levels = {'Buffer': top[other], 'Base de données': (top[logical] - top[other]).clip(lower=0)}
+        else:
+            levels = {'Logique': top[logical], 'Physique': top[other]}
+        for level, values in levels.items():
+            rows.append(pd.DataFrame({'REPORT': top['REPORT'], 'ACCESS': access_type, 'LEVEL': level, 'COUNT': values}))
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=['REPORT', 'ACCESS', 'LEVEL', 'COUNT'])
+
+# --- Snapshot des données et rafraîchissement en arrière-plan ---
+
+# Dossier de dépôt optionnel : un fichier portant le même nom qu'une entrée de DATA_PATHS y remplace l'original.
+DATA_INCOMING_DIR = os.environ.get("SAP_DASHBOARD_INCOMING_DIR", "")
+DATA_REFRESH_INTERVAL_SECONDS = float(os.environ.get("SAP_DASHBOARD_REFRESH_SECONDS", "30"))
+
+# Mode paysage : un sous-dossier par source (<dossier>/<clé de DATA_PATHS>/) contenant un export par système
+# ou instance SAP, nommé d'après lui (ex. PRD.xlsx, PRD_app01_00.csv). Vide : un seul jeu de fichiers (DATA_PATHS).
+LANDSCAPE_DIR = os.environ.get("SAP_DASHBOARD_LANDSCAPE_DIR", "")
+INGEST_WORKERS = int(os.environ.get("SAP_DASHBOARD_INGEST_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+def configured_data_paths():
+    """Chemins des sources : un dossier par source en mode paysage, sinon DATA_PATHS."""
+    if LANDSCAPE_DIR:
+        return {key: os.path.join(LANDSCAPE_DIR, key) for key in DATA_PATHS}
+    return dict(DATA_PATHS)
+
+def resolve_data_path(path):
+    """Retourne le fichier du dossier de dépôt s'il existe, sinon le chemin configuré."""
+    if DATA_INCOMING_DIR:
+        incoming_path = os.path.join(DATA_INCOMING_DIR, os.path.basename(path))
+        if os.path.exists(incoming_path):
+            return incoming_path
+    return path
+
+def source_system_files(directory):
+    """Exports d'une source en mode paysage : (système, chemin) triés, le système étant le nom du fichier sans extension."""
+    files = [name for name in os.listdir(directory) if name.lower().endswith(SUPPORTED_SOURCE_EXTENSIONS)]
+    return [(os.path.splitext(name)[0], os.path.join(directory, name)) for name in sorted(files)]
+
+def data_files_signature(data_paths, use_incoming=True):
+    """
+    Signature (source, système, chemin, mtime, taille) des fichiers sources : elle change dès qu'un fichier
+    est remplacé, ajouté ou retiré. Une source dont le chemin est un dossier (mode paysage) contribue une entrée
+    par export de système ; sinon le système vaut None.
+    `use_incoming=False` ignore le dossier de dépôt (jeu de référence aux mêmes noms de fichiers).
+    """
+    signature = []
+    for key, path in data_paths.items():
+        resolved_path = resolve_data_path(path) if use_incoming else path
+        if os.path.isdir(resolved_path):
+            system_files = source_system_files(resolved_path)
+            if not system_files:
+                signature.append((key, '', resolved_path, None, None))
+        else:
+            system_files = [(None, resolved_path)]
+        for system, file_path in system_files:
+            try:
+                stat = os.stat(file_path)
+                signature.append((key, system, file_path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((key, system, file_path, None, None))
+    return tuple(signature)
+
+# --- Stockage partagé entre processus (Arrow IPC mappé en mémoire) ---
+
+# Les DataFrames nettoyés sont publiés une fois par hôte dans ce dossier (tmpfs) puis mappés par chaque
+# processus Streamlit. Une valeur vide désactive le partage (chargement indépendant par processus).
+SHARED_STORE_DIR = os.environ.get("SAP_DASHBOARD_SHARED_DIR", "/dev/shm/sap_dashboard")
+SHARED_STORE_MANIFEST = "manifest.json"
+
+def shared_store_enabled():
+    return bool(SHARED_STORE_DIR) and os.path.isdir(os.path.dirname(SHARED_STORE_DIR.rstrip(os.sep)) or os.sep)
+
+def shared_snapshot_dir(signature):
+    """Dossier propre à une signature de fichiers sources : un nouveau jeu de données n'écrase jamais l'ancien."""
+    digest = hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SHARED_STORE_DIR, digest)
+
+def read_shared_frames(snapshot_dir):
+    """
+    Mappe en mémoire les fichiers Arrow d'un snapshot publié. Les colonnes numériques restent adossées
+    aux pages partagées du tmpfs (pas de copie par processus) ; retourne None si le snapshot est absent.
+    """
+    manifest_path = os.path.join(snapshot_dir, SHARED_STORE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    shared_dfs = {}
+    for key in manifest['keys']:
+        table = feather.read_table(os.path.join(snapshot_dir, f"{key}.arrow"), memory_map=True)
+        shared_dfs[key] = table.to_pandas(split_blocks=True)
+    return shared_dfs, manifest['errors']
+
+def publish_shared_frames(snapshot_dir, snapshot_dfs, errors):
+    """
+    Écrit chaque DataFrame en Arrow IPC non compressé (mappable) dans un dossier temporaire,
+    puis le renomme atomiquement : les autres processus ne voient jamais un snapshot partiel.
+    """
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=SHARED_STORE_DIR)
+    try:
+        os.chmod(tmp_dir, 0o755)
+        for key, df in snapshot_dfs.items():
+            feather.write_feather(pa.Table.from_pandas(df, preserve_index=False),
+                                  os.path.join(tmp_dir, f"{key}.arrow"), compression="uncompressed")
+        with open(os.path.join(tmp_dir, SHARED_STORE_MANIFEST), "w", encoding="utf-8") as manifest_file:
+            json.dump({'keys': list(snapshot_dfs), 'errors': errors}, manifest_file)
+        os.rename(tmp_dir, snapshot_dir)
+    except OSError:
+        # Un autre processus a publié le même snapshot entre-temps : on garde le sien.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(snapshot_dir):
+            raise
+
+def remove_stale_shared_snapshots(current_dir):
+    """Supprime les anciens snapshots ; les processus qui les mappent encore gardent leurs pages jusqu'à la fin."""
+    for entry in os.listdir(SHARED_STORE_DIR):
+        entry_path = os.path.join(SHARED_STORE_DIR, entry)
+        if entry_path != current_dir and not entry.startswith(".tmp-") and not entry.endswith(".lock"):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+def load_snapshot_frames(signature, recorder=NULL_RECORDER):
+    """
+    Charge les DataFrames nettoyés d'une signature donnée. Avec le stockage partagé, un seul processus
+    de l'hôte les construit (verrou fichier) ; les autres mappent le résultat publié. Dans le processus,
+    les chargements simultanés d'une même signature n'en font qu'un (REQUEST_FLIGHTS, type 'load').
+    """
+    frames, _ = REQUEST_FLIGHTS.do('load', (signature, shared_store_enabled()),
+                                   lambda: _load_snapshot_frames(signature, recorder))
+    return frames
+
+def _load_snapshot_frames(signature, recorder):
+    if not shared_store_enabled():
+        return load_snapshot_frames_locally(signature, recorder)
+
+    import fcntl  # POSIX uniquement : le stockage partagé cible un tmpfs Linux (/dev/shm)
+
+    snapshot_dir = shared_snapshot_dir(signature)
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    with open(os.path.join(SHARED_STORE_DIR, "build.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with recorder.stage('read_shared_frames', 'load', snapshot_dir=snapshot_dir):
+                shared = read_shared_frames(snapshot_dir)
+            if shared is None:
+                snapshot_dfs, errors = load_snapshot_frames_locally(signature, recorder)
+                with recorder.stage('publish_shared_frames', 'load', snapshot_dir=snapshot_dir):
+                    publish_shared_frames(snapshot_dir, snapshot_dfs, errors)
+                remove_stale_shared_snapshots(snapshot_dir)
+                # Relecture depuis le stockage partagé : le processus qui construit ne garde pas sa propre copie.
+                with recorder.stage('read_shared_frames', 'load', snapshot_dir=snapshot_dir):
+                    shared = read_shared_frames(snapshot_dir)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return shared
+
+def load_files_in_parallel(files, workers=INGEST_WORKERS, recorder=NULL_RECORDER):
+    """
+    Charge et nettoie des fichiers [(source, chemin)] dans un pool de processus (lecture Excel liée au GIL).
+    Processus lancés en 'spawn' : le serveur Streamlit est multi-thread et ne doit pas être dupliqué par fork.
+    Retourne les résultats de load_and_process_data dans l'ordre des fichiers.
+    """
+    with recorder.stage('parallel_ingest', 'load', files=len(files), workers=workers):
+        with ProcessPoolExecutor(max_workers=min(workers, len(files)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(load_and_process_data, [key for key, _ in files], [path for _, path in files]))
+
+def load_snapshot_frames_locally(signature, recorder=NULL_RECORDER):
+    """
+    Charge et nettoie toutes les sources dans le processus courant. En mode paysage, les exports des systèmes
+    sont chargés en parallèle puis réunis par source en un DataFrame partitionné par SYSTEM.
+    """
+    files = [(key, system, path) for key, system, path, _, _ in signature]
+    if any(system is not None for _, system, _ in files) and INGEST_WORKERS > 1 and len(files) > 1:
+        results = load_files_in_parallel([(key, path) for key, _, path in files], recorder=recorder)
+    else:
+        results = [load_and_process_data(key, path, recorder) for key, _, path in files]
+
+    snapshot_dfs = {}
+    errors = {}
+    partitions = {}
+    for (key, system, path), (df, error) in zip(files, results):
+        if system is None:
+            snapshot_dfs[key] = df
+            if error:
+                errors[key] = error
+            continue
+        if system == '':
+            error = f"Aucun export (.xlsx, .csv) trouvé dans le dossier '{path}' pour '{key}'."
+        if error:
+            errors[f"{key}[{system}]" if system else key] = error
+        partitions.setdefault(key, []).append((system, df))
+    for key, parts in partitions.items():
+        snapshot_dfs[key] = concat_system_partitions(parts)
+    return snapshot_dfs, errors
+
+def performance_snapshots(signature, df_perf):
+    """
+    Snapshots AL_GET_PERFORMANCE [(instance, horodatage, DataFrame)] du jeu chargé, horodatés par la date
+    de modification de leur export ; en mode paysage, un snapshot par système.
+    """
+    snapshots = []
+    for key, system, _path, mtime_ns, _size in signature:
+        if key != 'performance' or mtime_ns is None:
+            continue
+        df = df_perf
+        if system and SYSTEM_COLUMN in df_perf.columns:
+            df = df_perf[df_perf[SYSTEM_COLUMN] == system]
+        snapshots.append((system or '', pd.Timestamp.fromtimestamp(mtime_ns / 1e9), df))
+    return snapshots
+
+def build_snapshot_indexes(snapshot_dfs, recorder=NULL_RECORDER):
+    """Index dérivés non additifs (corrélations, SQL, anomalies, comparaison), calculés sur les frames complets."""
+    indexes = {}
+    with recorder.stage('build_cross_source_index', 'index'):
+        indexes['cross_source_index'] = build_cross_source_index(snapshot_dfs)
+    with recorder.stage('build_sql_fingerprint_lookup', 'index'):
+        indexes['sql_fingerprint_lookup'] = build_sql_fingerprint_lookup(snapshot_dfs['sql_trace_summary'])
+    with recorder.stage('build_server_stats', 'index'):
+        indexes['sql_server_stats'] = build_server_stats(snapshot_dfs['sql_trace_summary'])
+    with recorder.stage('build_anomaly_report', 'index'):
+        indexes['anomaly_report'] = build_anomaly_report(snapshot_dfs)
+    with recorder.stage('build_comparison_aggregates', 'index'):
+        indexes['comparison_aggregates'] = build_comparison_aggregates(snapshot_dfs)
+    return indexes
+
+def build_data_snapshot(data_paths, version=1):
+    """
+    Charge et nettoie toutes les sources puis précalcule leurs agrégats.
+    Le snapshot retourné est en lecture seule : les sections travaillent sur des copies filtrées.
+    Avec SAP_DASHBOARD_INSTRUMENTATION=1, les étapes du chargement sont conservées dans 'load_stages'.
+    """
+    recorder = StageRecorder(enabled=LOAD_INSTRUMENTATION_ENABLED, name=f"snapshot-{version}")
+    signature = data_files_signature(data_paths)
+    snapshot_dfs, errors = load_snapshot_frames(signature, recorder)
+    # Agrégats précalculés sur les données non filtrées : les filtres de la barre latérale s'appliquent à la lecture.
+    indexes = build_snapshot_indexes(snapshot_dfs, recorder)
+    with recorder.stage('build_response_breakdown', 'index'):
+        response_breakdown_summary = build_response_breakdown(snapshot_dfs['hitlist_db'])
+    with recorder.stage('build_db_access_matrix', 'index'):
+        db_access = build_db_access_matrix(snapshot_dfs['hitlist_db'])
+    # Historique hiérarchisé (brut récent, agrégats horaires puis journaliers) : seulement si un dossier est configuré.
+    history = None
+    if HISTORY_DIR:
+        with recorder.stage('update_history', 'index', history_dir=HISTORY_DIR):
+            history = update_history(HISTORY_DIR, snapshot_dfs)
+    wp_history = None
+    if WP_HISTORY_DIR:
+        with recorder.stage('update_wp_history', 'index', history_dir=WP_HISTORY_DIR):
+            wp_history = update_wp_history(WP_HISTORY_DIR, performance_snapshots(signature, snapshot_dfs['performance']))
+    # Valeurs des filtres et résumé des KPIs ne dépendent que des données non filtrées : calculés une fois par snapshot.
+    with recorder.stage('filter_options', 'index'):
+        snapshot_filter_options = filter_options(snapshot_dfs)
+    with recorder.stage('build_kpi_summary', 'index'):
+        kpi_summary = build_kpi_summary(snapshot_dfs)
+    return {
+        'version': version,
+        'loaded_at': pd.Timestamp.now(),
+        'signature': signature,
+        'dfs': snapshot_dfs,
+        'errors': errors,
+        **indexes,
+        'history': history,
+        'wp_history': wp_history,
+        'response_breakdown': response_breakdown_summary,
+        'db_access': db_access,
+        'filter_options': snapshot_filter_options,
+        'kpi_summary': kpi_summary,
+        'live_rows': 0,
+        'stale_indexes': False,
+        'load_stages': recorder.spans,
+    }
+
+def append_source_rows(df, parts):
+    """
+    `df` prolongé des lignes [(système, DataFrame)] d'une source : concaténation simple, ou, si les lignes
+    portent un système, partitions réunies par concat_system_partitions (chaque système reste contigu).
+    """
+    parts = [(system, new) for system, new in parts if not new.empty]
+    if not parts:
+        return df
+    if all(system is None for system, _ in parts):
+        return pd.concat([frame for frame in [df] + [new for _, new in parts] if not frame.empty], ignore_index=True)
+    by_system = {system: [df.iloc[start:stop].drop(columns=SYSTEM_COLUMN)]
+                 for system, (start, stop) in (system_partitions(df) or {}).items()}
+    for system, new in parts:
+        by_system.setdefault(system, []).append(new)
+    return concat_system_partitions([(system, pd.concat(frames, ignore_index=True)) for system, frames in by_system.items()])
+
+def extend_data_snapshot(snapshot, new_parts, version):
+    """
+    Nouveau snapshot intégrant des lignes reçues en continu {source: [(système, DataFrame nettoyé)]}.
+    Les frames sont prolongés ; résumé des KPIs, décomposition du temps de réponse, matrice d'accès DB,
+    valeurs des filtres et historique hiérarchisé sont mis à jour par ajout, pour un coût proportionnel aux
+    nouvelles lignes. Les index non additifs (build_snapshot_indexes) sont repris du snapshot précédent et
+    signalés périmés ('stale_indexes') : DataSnapshotStore les recalcule à son propre rythme.
+    """
+    recorder = StageRecorder(enabled=LOAD_INSTRUMENTATION_ENABLED, name=f"snapshot-{version}")
+    dfs = dict(snapshot['dfs'])
+    new_dfs = {}
+    with recorder.stage('append_source_rows', 'load', sources=len(new_parts)):
+        for source, parts in new_parts.items():
+            dfs[source] = append_source_rows(dfs.get(source, pd.DataFrame()), parts)
+            new_dfs[source] = append_source_rows(pd.DataFrame(), parts)
+    hitlist_new = new_dfs.get('hitlist_db', pd.DataFrame())
+    with recorder.stage('extend_aggregates', 'index', rows=sum(len(df) for df in new_dfs.values())):
+        kpi_summary = snapshot['kpi_summary']
+        for source, df_new in new_dfs.items():
+            kpi_summary = add_to_kpi_summary(kpi_summary, source, df_new)
+        response_breakdown_summary = add_to_response_breakdown(snapshot['response_breakdown'], hitlist_new)
+        db_access = add_to_db_access_matrix(snapshot['db_access'], hitlist_new)
+        new_options = filter_options(new_dfs)
+        snapshot_filter_options = {name: sorted(set(values).union(new_options[name]))
+                                   for name, values in snapshot['filter_options'].items()}
+    history = snapshot['history']
+    if history is not None:
+        with recorder.stage('extend_history', 'index'):
+            history = history.copy()
+            if sum(history.ingest(source, new_dfs[source]) for source in history.sources if source in new_dfs):
+                history.compact()
+    return {
+        **snapshot,
+        'version': version,
+        'loaded_at': pd.Timestamp.now(),
+        'dfs': dfs,
+        'history': history,
+        'response_breakdown': response_breakdown_summary,
+        'db_access': db_access,
+        'filter_options': snapshot_filter_options,
+        'kpi_summary': kpi_summary,
+        'live_rows': snapshot['live_rows'] + sum(len(df) for df in new_dfs.values()),
+        'stale_indexes': True,
+        'load_stages': recorder.spans,
+    }
+
+def rows_after_source_end(df_source, system, df):
+    """
+    Lignes reçues `df` (du système `system`, ou None) postérieures à la dernière FULL_DATETIME de la source
+    rechargée `df_source` : les lignes antérieures ou égales sont couvertes par le nouvel export.
+    Sans date exploitable (colonne absente, système absent de l'export), `df` est retourné tel quel.
+    """
+    if 'FULL_DATETIME' not in df.columns or df_source.empty or 'FULL_DATETIME' not in df_source.columns:
+        return df
+    partitions = system_partitions(df_source) if system is not None else None
+    if partitions is not None:
+        if system not in partitions:
+            return df
+        start, stop = partitions[system]
+        df_source = df_source.iloc[start:stop]
+    end = df_source['FULL_DATETIME'].max()
+    if pd.isna(end):
+        return df
+    covered = (df['FULL_DATETIME'] <= end).to_numpy()
+    return df[~covered] if covered.any() else df
+
+class DataSnapshotStore:
+    """
+    Détient le snapshot courant et le reconstruit dans un thread d'arrière-plan quand les fichiers changent.
+    Le nouveau snapshot est entièrement construit hors du chemin des requêtes puis publié par une
+    simple affectation de référence : une session voit soit l'ancien, soit le nouveau snapshot, jamais un mélange.
+
+    Avec un dossier de dépôt (`spool_dir`, SAP_DASHBOARD_SPOOL_DIR), les lignes reçues en continu prolongent
+    le snapshot (extend_data_snapshot) à chaque passage du suivi ; le thread de rafraîchissement recalcule ensuite
+    les index non additifs toutes les `interval_seconds` secondes et enregistre les nouvelles lignes dans
+    l'historique hiérarchisé. Les lignes reçues sont gardées pour être réappliquées après une reconstruction
+    complète (fichiers sources remplacés), jusqu'à ce que le nouvel export les couvre (rows_after_source_end).
+    L'historique sur disque ne les remplace pas : il ne garde que des métriques de tendance de quelques sources.
+    Au-delà de SAP_DASHBOARD_SPOOL_MAX_BUFFERED_ROWS lignes gardées, les plus anciennes sont abandonnées
+    (compteur `live_rows_dropped`).
+    """
+
+    def __init__(self, data_paths, interval_seconds, spool_dir=SPOOL_DIR):
+        self.data_paths = dict(data_paths)
+        self.interval_seconds = interval_seconds
+        self.last_error = None
+        self.live_enabled = bool(spool_dir)
+        # Sérialise les publications : reconstruction complète, ajout de lignes reçues, index recalculés.
+        self._lock = threading.Lock()
+        # Lignes reçues [(source, (système, DataFrame))] par ordre d'arrivée, à réappliquer après une reconstruction.
+        self._live_parts = []
+        self._unsaved_parts = {}
+        self.live_rows_dropped = 0
+        self._snapshot = build_data_snapshot(self.data_paths)
+        self._refresh_requested = threading.Event()
+        self._worker = threading.Thread(target=self._watch, name="sap-data-refresh", daemon=True)
+        self._worker.start()
+        if self.live_enabled:
+            tailer = SpoolTailer(spool_dir, list(self.data_paths), clean_source_frame, landscape=bool(LANDSCAPE_DIR))
+            self._tail_thread = start_tail_thread(tailer, self.append_live)
+
+    def current(self):
+        """Snapshot courant (référence stable pendant toute l'exécution du script)."""
+        return self._snapshot
+
+    def request_refresh(self):
+        """Demande une reconstruction immédiate, même si les fichiers n'ont pas changé."""
+        self._refresh_requested.set()
+
+    def append_live(self, parts, errors):
+        """Publie un snapshot prolongé des lignes reçues {source: [(système, DataFrame)]} (appelé par le suivi)."""
+        if errors:
+            self.last_error = " ; ".join(errors.values())
+        if not parts:
+            return
+        with self._lock:
+            try:
+                new_snapshot = extend_data_snapshot(self._snapshot, parts, self._snapshot['version'] + 1)
+            except Exception as e:
+                self.last_error = f"Échec de l'intégration des données reçues : {e}"
+                return
+            for source, source_parts in parts.items():
+                self._live_parts.extend((source, part) for part in source_parts)
+                self._unsaved_parts.setdefault(source, []).extend(source_parts)
+            self._trim_live_parts()
+            if not errors:
+                self.last_error = None
+            self._snapshot = new_snapshot
+
+    def _trim_live_parts(self):
+        """Abandonne les lignes reçues les plus anciennes au-delà de SPOOL_MAX_BUFFERED_ROWS (verrou tenu par l'appelant)."""
+        total = sum(len(df) for _, (_, df) in self._live_parts)
+        while total > SPOOL_MAX_BUFFERED_ROWS and self._live_parts:
+            _, (_, df) = self._live_parts.pop(0)
+            total -= len(df)
+            self.live_rows_dropped += len(df)
+
+    def _replay_live_parts(self, new_snapshot):
+        """
+        Snapshot reconstruit prolongé des lignes reçues que ses exports ne couvrent pas encore ; les autres sont
+        abandonnées (verrou tenu par l'appelant). La version suit celle du snapshot publié entre-temps.
+        """
+        remaining = []
+        for source, (system, df) in self._live_parts:
+            rest = rows_after_source_end(new_snapshot['dfs'].get(source, pd.DataFrame()), system, df)
+            if rest is df:
+                remaining.append((source, (system, df)))
+            elif not rest.empty:
+                remaining.append((source, (system, rest)))
+        self._live_parts = remaining
+        version = self._snapshot['version'] + 1
+        if not remaining:
+            return {**new_snapshot, 'version': version}
+        parts = {}
+        for source, part in remaining:
+            parts.setdefault(source, []).append(part)
+        return extend_data_snapshot(new_snapshot, parts, version)
+
+    def _refresh_indexes(self):
+        """Index non additifs recalculés sur les frames courants ; nouvelles lignes ajoutées à l'historique sur disque."""
+        snapshot = self._snapshot
+        indexes = build_snapshot_indexes(snapshot['dfs'])
+        with self._lock:
+            unsaved, self._unsaved_parts = self._unsaved_parts, {}
+            current = self._snapshot
+            # Des lignes arrivées pendant le calcul laissent les index périmés jusqu'au prochain passage.
+            self._snapshot = {**current, **indexes, 'version': current['version'] + 1, 'stale_indexes': current is not snapshot}
+        if HISTORY_DIR and unsaved:
+            update_history(HISTORY_DIR, {source: append_source_rows(pd.DataFrame(), parts) for source, parts in unsaved.items()})
+
+    def _watch(self):
+        while True:
+            forced = self._refresh_requested.wait(self.interval_seconds)
+            self._refresh_requested.clear()
+            current = self._snapshot
+            if not forced and data_files_signature(self.data_paths) == current['signature']:
+                if current.get('stale_indexes'):
+                    try:
+                        self._refresh_indexes()
+                    except Exception as e:
+                        self.last_error = f"Échec du recalcul des index : {e}"
+                continue
+            try:
+                # Reconstruction hors verrou : le suivi du dossier de dépôt continue de publier pendant ce temps.
+                new_snapshot = build_data_snapshot(self.data_paths, version=current['version'] + 1)
+                with self._lock:
+                    self._snapshot = self._replay_live_parts(new_snapshot)
+            except Exception as e:
+                # L'ancien snapshot reste servi ; l'erreur est exposée via last_error.
+                self.last_error = f"Échec du rafraîchissement des données : {e}"
+                continue
+            self.last_error = None
+
+# --- Filtres globaux ---
+
+def filter_options(dfs):
+    """Valeurs proposées par les filtres de la barre latérale (listes triées)."""
+    def union_of(keys, column):
+        values = pd.Index([])
+        for key in keys:
+            df = dfs.get(key, pd.DataFrame())
+            if not df.empty and column in df.columns:
+                values = values.union(df[column].dropna().unique())
+        return sorted(values.tolist())
+
+    return {
+        'systems': union_of(list(dfs), SYSTEM_COLUMN),
+        'accounts': union_of(['memory', 'usertcode', 'hitlist_db'], 'ACCOUNT'),
+        'reports': union_of(['hitlist_db'], 'REPORT'),
+        'tasktypes': union_of(['usertcode', 'times', 'tasktimes', 'hitlist_db'], 'TASKTYPE'),
+        'wp_types': union_of(['performance'], 'WP_TYP'),
+    }
+
+# --- Partitionnement par système (mode paysage) ---
+
+def concat_system_partitions(parts):
+    """
+    Réunit les exports [(système, DataFrame)] d'une source, triés par système : chaque système occupe une plage
+    de lignes contiguë et SYSTEM est catégoriel (ordre des catégories = ordre des lignes). Les colonnes
+    catégorielles communes gardent leur type (catégories réunies).
+    """
+    parts = sorted(((system, df) for system, df in parts if not df.empty), key=lambda part: part[0])
+    if not parts:
+        return pd.DataFrame()
+    categorical = set.intersection(*(set(df.select_dtypes('category').columns) for _, df in parts))
+    categories = {col: pd.api.types.union_categoricals([df[col] for _, df in parts], ignore_order=True).categories
+                  for col in categorical}
+    frames = []
+    for system, df in parts:
+        df = df.assign(**{col: df[col].cat.set_categories(categories[col]) for col in categorical})
+        df.insert(0, SYSTEM_COLUMN, system)
+        frames.append(df)
+    combined = pd.concat(frames, ignore_index=True)
+    combined[SYSTEM_COLUMN] = pd.Categorical(combined[SYSTEM_COLUMN], categories=[system for system, _ in parts])
+    return combined
+
+def system_partitions(df):
+    """
+    Plages de lignes [début, fin[ de chaque système d'un DataFrame issu de concat_system_partitions,
+    obtenues par recherche dichotomique sur les codes catégoriels (aucun balayage des lignes).
+    Retourne None si le DataFrame n'est pas partitionné.
+    """
+    if df.empty or SYSTEM_COLUMN not in df.columns or not isinstance(df[SYSTEM_COLUMN].dtype, pd.CategoricalDtype):
+        return None
+    systems = df[SYSTEM_COLUMN].cat.categories
+    bounds = np.searchsorted(df[SYSTEM_COLUMN].cat.codes.to_numpy(), np.arange(len(systems) + 1))
+    return {system: (int(bounds[i]), int(bounds[i + 1])) for i, system in enumerate(systems) if bounds[i] < bounds[i + 1]}
+
+def select_systems(df, systems):
+    """Lignes des systèmes sélectionnés : tranches des partitions concernées, les autres systèmes ne sont pas lus."""
+    partitions = system_partitions(df)
+    if partitions is None:
+        return df[df[SYSTEM_COLUMN].isin(systems)]
+    slices = [df.iloc[start:stop] for system, (start, stop) in partitions.items() if system in set(systems)]
+    if not slices:
+        return df.iloc[0:0]
+    return slices[0] if len(slices) == 1 else pd.concat(slices)
+
+# Sources concernées par chaque filtre global.
+GLOBAL_FILTER_TARGETS = {
+    SYSTEM_COLUMN: list(DATA_PATHS),
+    'ACCOUNT': ['memory', 'usertcode', 'hitlist_db'],
+    'REPORT': ['hitlist_db'],
+    'TASKTYPE': ['usertcode', 'times', 'tasktimes', 'hitlist_db'],
+    'WP_TYP': ['performance'],
+}
+
+def apply_global_filters(dfs, accounts=None, reports=None, tasktypes=None, wp_types=None, systems=None,
+                         recorder=NULL_RECORDER):
+    """
+    Retourne un nouveau dictionnaire de DataFrames filtrés ; `dfs` n'est pas modifié.
+    Le filtre système s'applique en premier, par élagage des partitions : les filtres suivants ne
+    parcourent que les lignes des systèmes retenus.
+    """
+    selections = {SYSTEM_COLUMN: systems, 'ACCOUNT': accounts, 'REPORT': reports, 'TASKTYPE': tasktypes, 'WP_TYP': wp_types}
+    filtered = dict(dfs)
+    for column, selected_values in selections.items():
+        if not selected_values:
+            continue
+        for key in GLOBAL_FILTER_TARGETS[column]:
+            df = filtered.get(key, pd.DataFrame())
+            if not df.empty and column in df.columns:
+                with recorder.stage(f"{column}[{key}]", 'filter', rows_in=len(df), selected=len(selected_values)) as stage:
+                    if column == SYSTEM_COLUMN:
+                        stage['frame'] = filtered[key] = select_systems(df, selected_values)
+                    else:
+                        stage['frame'] = filtered[key] = df[df[column].isin(selected_values)]
+    return filtered
+
+def filter_snapshot(snapshot, accounts=None, reports=None, tasktypes=None, wp_types=None, systems=None,
+                    recorder=NULL_RECORDER):
+    """
+    apply_global_filters sur les frames d'un snapshot. Les sessions qui demandent en même temps la même sélection
+    du même snapshot (affluence après un rafraîchissement) attendent un seul filtrage (REQUEST_FLIGHTS, type
+    'filter') ; ses étapes sont enregistrées par la session qui filtre. Le dictionnaire retourné est propre à
+    l'appelant, les DataFrames sont partagés.
+    """
+    selection = {'accounts': accounts, 'reports': reports, 'tasktypes': tasktypes, 'wp_types': wp_types, 'systems': systems}
+    filtered, _ = REQUEST_FLIGHTS.do('filter', (snapshot['version'], snapshot['loaded_at'], selection),
+                                     lambda: apply_global_filters(snapshot['dfs'], **selection, recorder=recorder))
+    return dict(filtered)
+
+def filter_cross_source_steps(df_steps, accounts=None, reports=None, tasktypes=None, systems=None):
+    """Applique les filtres globaux à l'index des pas de dialogue inter-sources."""
+    if df_steps.empty:
+        return df_steps
+    for column, selected_values in ((SYSTEM_COLUMN, systems), ('ACCOUNT', accounts), ('REPORT', reports), ('TASKTYPE', tasktypes)):
+        if selected_values and column in df_steps.columns:
+            df_steps = df_steps[df_steps[column].isin(selected_values)]
+    return df_steps
+
+# --- KPIs globaux ---
+
+def _column_stat(df, column, agg):
+    if df.empty or column not in df.columns or not pd.api.types.is_numeric_dtype(df[column]):
+        return 0
+    return getattr(df[column], agg)()
+
+# KPI -> (source, colonne, agrégat, facteur vers l'unité d'affichage)
+GLOBAL_KPI_DEFINITIONS = {
+    'avg_resp_time_s': ('hitlist_db', 'RESPTI', 'mean', 1 / 1000),
+    'avg_memory_mb': ('memory', 'USEDBYTES', 'mean', 1 / (1024 * 1024)),
+    'total_db_calls': ('hitlist_db', 'DBCALLS', 'sum', 1),
+    'total_sql_executions': ('sql_trace_summary', 'TOTALEXEC', 'sum', 1),
+    'avg_cpu_time_s': ('hitlist_db', 'CPUTI', 'mean', 1 / 1000),
+}
+
+def compute_global_kpis(dfs):
+    """Les cinq KPIs d'en-tête, dans leurs unités d'affichage (s, Mo, nombres), par parcours complet des frames."""
+    return {kpi: _column_stat(dfs[source], column, agg) * factor
+            for kpi, (source, column, agg, factor) in GLOBAL_KPI_DEFINITIONS.items()}
+
+def _kpi_filter_dimensions(source, df):
+    return [column for column, keys in GLOBAL_FILTER_TARGETS.items() if source in keys and column in df.columns]
+
+def _kpi_source_summary(source, df):
+    columns = sorted({column for src, column, _, _ in GLOBAL_KPI_DEFINITIONS.values()
+                      if src == source and column in df.columns and pd.api.types.is_numeric_dtype(df[column])})
+    if df.empty or not columns:
+        return None
+    dims = _kpi_filter_dimensions(source, df)
+    values = df[columns]
+    if dims:
+        grouped = values.groupby([df[dim] for dim in dims], observed=True, dropna=False, sort=False)
+        sums, counts = grouped.sum(), grouped.count()
+    else:
+        sums, counts = values.sum().to_frame().T, values.count().to_frame().T
+    return pd.concat([sums.add_suffix('_SUM'), counts.add_suffix('_COUNT')], axis=1)
+
+def build_kpi_summary(dfs):
+    """
+    Sommes et effectifs des colonnes KPI par source, groupés selon les dimensions de filtre qui la concernent
+    (ACCOUNT, REPORT, TASKTYPE...). kpis_from_summary en déduit les KPIs d'une sélection en O(groupes).
+    """
+    return {source: _kpi_source_summary(source, dfs[source])
+            for source in {src for src, _, _, _ in GLOBAL_KPI_DEFINITIONS.values()}}
+
+def add_group_sums(current, delta):
+    """
+    Somme de deux tables de sommes par groupe (index = combinaison de dimensions) : les groupes connus sont
+    incrémentés sur place d'une copie via get_indexer, les nouveaux ajoutés en fin. Coût en O(groupes de `delta`)
+    plus une copie des valeurs, sans alignement trié des deux index (DataFrame.add).
+    """
+    if current is None:
+        return delta
+    columns = current.columns.union(delta.columns, sort=False)
+    current = current.reindex(columns=columns, fill_value=0)
+    delta = delta.reindex(columns=columns, fill_value=0)
+    positions = current.index.get_indexer(delta.index)
+    known = positions >= 0
+    values = current.to_numpy(dtype=float, copy=True)
+    values[positions[known]] += delta.to_numpy(dtype=float)[known]
+    merged = pd.DataFrame(values, index=current.index, columns=columns)
+    if known.all():
+        return merged
+    return pd.concat([merged, delta[~known].astype(float)])
+
+def add_to_kpi_summary(summary, source, df_new):
+    """Nouveau résumé intégrant des lignes supplémentaires d'une source (sommes et effectifs sont additifs)."""
+    delta = _kpi_source_summary(source, df_new)
+    if delta is None:
+        return summary
+    return {**summary, source: add_group_sums(summary.get(source), delta)}
+
+def kpis_from_summary(summary, accounts=None, reports=None, tasktypes=None, wp_types=None, systems=None):
+    """KPIs d'en-tête cohérents avec les filtres globaux, calculés sur le résumé (mêmes valeurs que compute_global_kpis)."""
+    selections = {SYSTEM_COLUMN: systems, 'ACCOUNT': accounts, 'REPORT': reports, 'TASKTYPE': tasktypes, 'WP_TYP': wp_types}
+    kpis = {}
+    for kpi, (source, column, agg, factor) in GLOBAL_KPI_DEFINITIONS.items():
+        part = summary.get(source)
+        if part is None or f"{column}_SUM" not in part.columns:
+            kpis[kpi] = 0
+            continue
+        mask = np.ones(len(part), dtype=bool)
+        for dim in part.index.names:
+            if selections.get(dim):
+                mask &= part.index.get_level_values(dim).isin(selections[dim])
+        if not mask.any():
+            kpis[kpi] = 0
+            continue
+        total = part[f"{column}_SUM"].to_numpy()[mask].sum()
+        count = part[f"{column}_COUNT"].to_numpy()[mask].sum()
+        value = total if agg == 'sum' else (total / count if count else np.nan)
+        kpis[kpi] = value * factor
+    return kpis
+
+def kpis_by_system(summary, systems, accounts=None, reports=None, tasktypes=None, wp_types=None):
+    """KPIs d'en-tête de chaque système (une ligne par système), déduits du même résumé."""
+    return pd.DataFrame([kpis_from_summary(summary, accounts, reports, tasktypes, wp_types, [system]) for system in systems],
+                        index=pd.Index(systems, name=SYSTEM_COLUMN))
+
+# --- Agrégations génériques utilisées par les sections ---
+# Convention : None signifie que les colonnes requises manquent ou que le total est nul
+# (prérequis non remplis) ; un DataFrame vide signifie qu'aucun groupe ne subsiste.
+
+def has_positive_total(df, columns):
+    """Vrai si toutes les colonnes existent et que leur somme globale est strictement positive."""
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    return not df.empty and all(col in df.columns for col in columns) and df[columns].sum().sum() > 0
+
+def top_n_by(df, by, metrics, n=10, agg='sum', order_by=None):
+    """
+    Agrège `metrics` par `by` puis garde les `n` plus grands groupes selon `order_by`
+    (première métrique par défaut). `n=None` retourne tous les groupes.
+    """
+    metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+    order_by = order_by or metrics[0]
+    if by not in df.columns or not has_positive_total(df, metrics):
+        return None
+    grouped = df.groupby(by, as_index=False)[metrics].agg(agg)
+    return grouped if n is None else grouped.nlargest(n, order_by)
+
+def value_counts_frame(df, column, names):
+    """Comptage des valeurs d'une colonne sous forme de DataFrame à deux colonnes `names`."""
+    if column not in df.columns or df[column].empty:
+        return None
+    counts = df[column].value_counts().reset_index()
+    counts.columns = list(names)
+    return counts
+
+def density_input(series):
+    """Valeurs et largeur de classe pour une courbe de densité ; None si moins de deux valeurs distinctes."""
+    values = series.dropna()
+    if values.nunique() <= 1:
+        return None
+    std = values.std()
+    return values, std / 5 if std > 0 else 1
+
+def hourly_mean(df, column, scale=1.0):
+    """Moyenne horaire d'une colonne sur FULL_DATETIME, divisée par `scale` (ex. 1000 pour des ms -> s)."""
+    if not _has_datetime(df) or not has_positive_total(df, column):
+        return None
+    return df.set_index('FULL_DATETIME')[column].resample('H').mean().dropna() / scale
+
+def trend_mean(history, source, df, column, scale=1.0, accounts=None, reports=None, tasktypes=None, systems=None):
+    """
+    Tendance moyenne d'une colonne, au même format que hourly_mean. Avec l'historique hiérarchisé
+    (sap_retention), elle est lue sur tous ses niveaux : un point par jour pour les données anciennes,
+    par heure ensuite ; les filtres globaux qui visent la source s'appliquent aux dimensions des agrégats.
+    Sans historique (ou pour une métrique non historisée), hourly_mean sur les lignes filtrées.
+    """
+    if history is None or column not in history.sources.get(source, []):
+        return hourly_mean(df, column, scale)
+    selections = {dimension: values for dimension, values in
+                  ((SYSTEM_COLUMN, systems), ('ACCOUNT', accounts), ('REPORT', reports), ('TASKTYPE', tasktypes))
+                  if values and source in GLOBAL_FILTER_TARGETS[dimension]}
+    trend = history.trend(source, column, selections=selections).dropna(subset=['MEAN'])
+    if trend.empty:
+        return None
+    return pd.Series(trend['MEAN'].to_numpy() / scale, index=pd.DatetimeIndex(trend['PERIOD'], name='FULL_DATETIME'), name=column)
+
+# --- Analyse Mémoire ---
+
+MEMORY_METRICS = ['USEDBYTES', 'MAXBYTES', 'PRIVSUM']
+
+def memory_top_accounts(df_mem, n=10):
+    """Top comptes par USEDBYTES total, avec MAXBYTES et PRIVSUM."""
+    return top_n_by(df_mem, 'ACCOUNT', MEMORY_METRICS, n=n, order_by='USEDBYTES')
+
+def memory_avg_by_account(df_mem, max_accounts=6):
+    """Moyenne de USEDBYTES par client SAP, restreinte aux `max_accounts` comptes les plus fréquents."""
+    if 'ACCOUNT' not in df_mem.columns or not has_positive_total(df_mem, 'USEDBYTES'):
+        return None
+    df_known = df_mem.loc[df_mem['ACCOUNT'] != 'Compte Inconnu', ['ACCOUNT', 'USEDBYTES']]
+    df_known = df_known.assign(ACCOUNT_DISPLAY=df_known['ACCOUNT'].astype(str))
+    if df_known['ACCOUNT_DISPLAY'].nunique() > max_accounts:
+        top_accounts = df_known['ACCOUNT_DISPLAY'].value_counts().nlargest(max_accounts).index
+        df_known = df_known[df_known['ACCOUNT_DISPLAY'].isin(top_accounts)]
+    return df_known.groupby('ACCOUNT_DISPLAY', as_index=False)['USEDBYTES'].mean().sort_values(by='USEDBYTES', ascending=False)
+
+# Prévision : tendance linéaire + saisonnalité journalière (harmoniques de 24 h), hebdomadaire si l'historique
+# couvre au moins deux semaines. Une série doit compter MEMORY_FORECAST_MIN_HOURS heures observées.
+MEMORY_FORECAST_DAILY_HARMONICS = 2
+MEMORY_FORECAST_WEEKLY_MIN_DAYS = 14
+MEMORY_FORECAST_MIN_HOURS = 24
+# Quantile normal de la borne haute des pics projetés (≈ 95 % unilatéral).
+MEMORY_FORECAST_UPPER_Z = 1.645
+
+def memory_hourly_matrix(df_mem, metric, keys):
+    """
+    Moyenne horaire de `metric` par série `keys` en matrice dense séries x heures (NaN sans observation),
+    sur la grille horaire continue de l'extrait. Retourne (index des séries, heures, matrice).
+    """
+    hours = df_mem['FULL_DATETIME'].dt.floor('h')
+    grid = pd.date_range(hours.min(), hours.max(), freq='h')
+    groups = df_mem.groupby(keys, observed=True, dropna=False, sort=False)
+    # Cellule (série, heure) aplatie : sommes et effectifs par np.bincount, sans index de tuples.
+    cells = groups.ngroup().to_numpy() * len(grid) + grid.get_indexer(hours)
+    shape = (groups.ngroups, len(grid))
+    values = df_mem[metric].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    sums = np.bincount(cells[valid], weights=values[valid], minlength=shape[0] * shape[1]).reshape(shape)
+    counts = np.bincount(cells[valid], minlength=shape[0] * shape[1]).reshape(shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix = np.where(counts > 0, sums / counts, np.nan)
+    series_index = groups.size().index
+    if not isinstance(series_index, pd.MultiIndex):
+        series_index = pd.MultiIndex.from_arrays([series_index], names=keys)
+    return series_index, grid, matrix
+
+def seasonal_design(hours, origin, weekly):
+    """Matrice de régression : constante, tendance (en jours depuis `origin`), harmoniques journalières et hebdomadaire."""
+    days = (hours - origin) / pd.Timedelta(days=1)
+    day_phase = 2 * np.pi * (hours.hour + hours.minute / 60) / 24
+    columns = [np.ones(len(hours)), np.asarray(days, dtype=float)]
+    for k in range(1, MEMORY_FORECAST_DAILY_HARMONICS + 1):
+        columns += [np.cos(k * day_phase), np.sin(k * day_phase)]
+    if weekly:
+        week_phase = 2 * np.pi * (hours.dayofweek + hours.hour / 24) / 7
+        columns += [np.cos(week_phase), np.sin(week_phase)]
+    return np.column_stack(columns)
+
+def fit_seasonal_trend(matrix, design):
+    """
+    Moindres carrés de toutes les séries (lignes de `matrix`, NaN ignorés) sur `design` en une passe :
+    équations normales empilées par einsum puis pseudo-inverses par lots. Retourne (coefficients, écart-type
+    des résidus, heures observées) ; coefficients NaN pour une série trop courte.
+    """
+    observed = ~np.isnan(matrix)
+    values = np.where(observed, matrix, 0.0)
+    weights = observed.astype(float)
+    gram = np.einsum('st,tp,tq->spq', weights, design, design, optimize=True)
+    moments = values @ design
+    coefficients = np.einsum('spq,sq->sp', np.linalg.pinv(gram), moments)
+    n_obs = observed.sum(axis=1)
+    residuals = np.where(observed, matrix - coefficients @ design.T, 0.0)
+    dof = np.maximum(n_obs - design.shape[1], 1)
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / dof)
+    too_short = n_obs < MEMORY_FORECAST_MIN_HOURS
+    coefficients[too_short] = np.nan
+    sigma[too_short] = np.nan
+    return coefficients, sigma, n_obs
+
+def memory_forecast(df_mem, metric='USEDBYTES', horizon_hours=168, limit=None):
+    """
+    Prévision horaire de `metric` par série (ACCOUNT, TASKTYPE, et SYSTEM en mode paysage) et pour la moyenne
+    de l'ensemble, ajustées ensemble par fit_seasonal_trend. Retourne un dict :
+    'series' : par série, heures observées, niveau ajusté à la dernière heure, croissance par jour, pic projeté
+    sur `horizon_hours` (heure et borne haute) et, avec `limit`, première heure prévue au-delà de la limite ;
+    'total' : moyenne horaire observée, ajustée et prévue de l'ensemble (format long pour un graphique).
+    None sans dates ni colonnes requises.
+    """
+    keys = [key for key in (SYSTEM_COLUMN, 'ACCOUNT', 'TASKTYPE') if key in df_mem.columns]
+    if not _has_datetime(df_mem) or metric not in df_mem.columns or 'ACCOUNT' not in keys:
+        return None
+    df = df_mem.dropna(subset=['FULL_DATETIME'])
+    series_index, grid, matrix = memory_hourly_matrix(df, metric, keys)
+    total = df.groupby(df['FULL_DATETIME'].dt.floor('h'))[metric].mean().reindex(grid).to_numpy()
+    matrix = np.vstack([matrix, total])
+
+    weekly = (grid[-1] - grid[0]) >= pd.Timedelta(days=MEMORY_FORECAST_WEEKLY_MIN_DAYS)
+    future = pd.date_range(grid[-1] + pd.Timedelta(hours=1), periods=horizon_hours, freq='h')
+    design = seasonal_design(grid, grid[0], weekly)
+    future_design = seasonal_design(future, grid[0], weekly)
+    coefficients, sigma, n_obs = fit_seasonal_trend(matrix, design)
+    forecast = coefficients @ future_design.T
+
+    peak_positions = np.nanargmax(np.where(np.isnan(forecast), -np.inf, forecast), axis=1)
+    peaks = forecast[np.arange(len(forecast)), peak_positions]
+    series = series_index.to_frame(index=False)
+    series['HOURS'] = n_obs[:-1]
+    series['CURRENT'] = (coefficients @ design[-1])[:-1]
+    series['GROWTH_PER_DAY'] = coefficients[:-1, 1]
+    series['PROJECTED_PEAK'] = peaks[:-1]
+    series['PROJECTED_PEAK_AT'] = future[peak_positions[:-1]].where(~np.isnan(peaks[:-1]))
+    series['PROJECTED_PEAK_UPPER'] = (peaks + MEMORY_FORECAST_UPPER_Z * sigma)[:-1]
+    if limit:
+        exceeded = forecast[:-1] >= limit
+        series['EXHAUSTION_AT'] = future[exceeded.argmax(axis=1)].where(exceeded.any(axis=1))
+    series = series[series['HOURS'] >= MEMORY_FORECAST_MIN_HOURS]
+
+    trend = pd.concat([
+        pd.DataFrame({'PERIOD': grid, 'SERIE': 'Observé', metric: matrix[-1]}),
+        pd.DataFrame({'PERIOD': grid, 'SERIE': 'Ajusté', metric: design @ coefficients[-1]}),
+        pd.DataFrame({'PERIOD': future, 'SERIE': 'Prévu', metric: forecast[-1]}),
+        pd.DataFrame({'PERIOD': future, 'SERIE': 'Borne haute', metric: forecast[-1] + MEMORY_FORECAST_UPPER_Z * sigma[-1]}),
+    ], ignore_index=True)
+    return {
+        'series': series.sort_values('PROJECTED_PEAK', ascending=False).reset_index(drop=True),
+        'total': trend.dropna(subset=[metric]),
+    }
+
+def memory_growth_drivers(series, n=10):
+    """
+    Comptes qui portent la croissance : somme des croissances journalières de leurs séries, part de la
+    croissance positive de l'ensemble, pic projeté le plus haut. Les `n` premiers par croissance.
+    """
+    drivers = (series.groupby('ACCOUNT', observed=True)
+                     .agg(GROWTH_PER_DAY=('GROWTH_PER_DAY', 'sum'), PROJECTED_PEAK=('PROJECTED_PEAK', 'max'),
+                          SERIES=('GROWTH_PER_DAY', 'size'))
+                     .reset_index())
+    positive = drivers['GROWTH_PER_DAY'].clip(lower=0)
+    drivers['GROWTH_SHARE'] = positive / positive.sum() if positive.sum() > 0 else 0.0
+    return drivers.nlargest(n, 'GROWTH_PER_DAY').reset_index(drop=True)
+
+# --- Transactions Utilisateurs ---
+
+USER_TRANSACTION_TYPES = ['COUNT', 'DCOUNT', 'UCOUNT', 'BCOUNT', 'ECOUNT', 'SCOUNT']
+
+def top_tasktypes_by_mean(df, metrics, n):
+    """
+    Top `n` TASKTYPE par moyenne de la première métrique, en secondes (les temps SAP sont en ms).
+    Retourne un DataFrame vide s'il y a moins de `n` types de tâches.
+    """
+    metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+    means = top_n_by(df, 'TASKTYPE', metrics, n=None, agg='mean')
+    if means is None:
+        return None
+    if means[metrics[0]].dropna().count() < n:
+        return means.iloc[0:0]
+    top_means = means.nlargest(n, metrics[0]).sort_values(by=metrics[0], ascending=False)
+    top_means[metrics] = top_means[metrics] / 1000.0
+    return top_means
+
+def user_transaction_totals(df_user):
+    """Nombre total de transactions par type de compteur (COUNT, DCOUNT, ...)."""
+    available = [col for col in USER_TRANSACTION_TYPES if col in df_user.columns]
+    if not available or not has_positive_total(df_user, available):
+        return None
+    return df_user[available].sum().sort_values(ascending=False)
+
+def long_response_breakdown(df_user, quantile=0.90, n=10):
+    """
+    Seuil de temps de réponse élevé (quantile de RESPTI) et comptes / ENTRY_ID les plus fréquents au-delà.
+    Retourne {'threshold', 'rows', 'accounts', 'entries'} ou None si les colonnes manquent.
+    """
+    if not all(col in df_user.columns for col in ['ACCOUNT', 'ENTRY_ID']) or not has_positive_total(df_user, 'RESPTI'):
+        return None
+    threshold = df_user['RESPTI'].quantile(quantile)
+    long_duration = df_user[df_user['RESPTI'] > threshold]
+    accounts = long_duration['ACCOUNT'].value_counts().nlargest(n).reset_index()
+    accounts.columns = ['ACCOUNT', 'Occurrences']
+    entries = long_duration['ENTRY_ID'].value_counts().nlargest(n).reset_index()
+    entries.columns = ['ENTRY_ID', 'Occurrences']
+    return {'threshold': threshold, 'rows': len(long_duration), 'accounts': accounts, 'entries': entries}
+
+# --- Statistiques Horaires ---
+
+TIMES_HOURLY_CATEGORIES = [
+    '00--06', '06--07', '07--08', '08--09', '09--10', '10--11', '11--12', '12--13',
+    '13--14', '14--15', '15--16', '16--17', '17--18', '18--19', '19--20', '20--21',
+    '21--22', '22--23', '23--00'
+]
+
+def hour_of_day(time_series):
+    """Heure sur deux chiffres ('HH') extraite d'une tranche TIME ('HH:MM' ou 'HH--HH')."""
+    time_str = time_series.astype(str)
+    return time_str.str.split(':').str[0].str.zfill(2).where(time_str.str.contains(':', regex=False),
+                                                              time_str.str.zfill(2).str[:2])
+
+def phycalls_by_hour(df_times):
+    """Total PHYCALLS par heure de la journée (00 à 23), ordonné."""
+    if 'TIME' not in df_times.columns or not has_positive_total(df_times, 'PHYCALLS'):
+        return None
+    hourly_counts = df_times['PHYCALLS'].groupby(hour_of_day(df_times['TIME']).rename('HOUR_OF_DAY')).sum().fillna(0).reset_index()
+    hourly_counts['HOUR_OF_DAY'] = pd.Categorical(hourly_counts['HOUR_OF_DAY'], categories=[str(i).zfill(2) for i in range(24)], ordered=True)
+    return hourly_counts.sort_values('HOUR_OF_DAY')
+
+def top_io_time_slots(df_times, n=5):
+    """Top tranches horaires par total d'opérations E/S (READDIRCNT + READSEQCNT + CHNGCNT)."""
+    io_cols = ['READDIRCNT', 'READSEQCNT', 'CHNGCNT']
+    if 'TIME' not in df_times.columns or not has_positive_total(df_times, io_cols):
+        return None
+    total_io = df_times[io_cols].sum(axis=1).rename('TOTAL_IO')
+    return total_io.groupby(df_times['TIME']).sum().nlargest(n).reset_index()
+
+def avg_times_by_slot(df_times, perf_cols=('RESPTI', 'CPUTI', 'PROCTI')):
+    """Temps moyens (s) par tranche horaire TIME, dans l'ordre chronologique des tranches."""
+    perf_cols = list(perf_cols)
+    avg_times = top_n_by(df_times, 'TIME', perf_cols, n=None, agg='mean')
+    if avg_times is None:
+        return None
+    avg_times[perf_cols] = (avg_times[perf_cols] / 1000.0).fillna(0)
+    avg_times['TIME'] = pd.Categorical(avg_times['TIME'], categories=TIMES_HOURLY_CATEGORIES, ordered=True)
+    return avg_times.sort_values('TIME')
+
+# --- Décomposition des Tâches ---
+
+def tasktype_distribution(df_task, min_share=0.01):
+    """Répartition de COUNT par TASKTYPE ; les types sous `min_share` du total sont regroupés."""
+    task_counts = top_n_by(df_task, 'TASKTYPE', 'COUNT', n=None)
+    if task_counts is None:
+        return None
+    task_counts.columns = ['TASKTYPE', 'Count']
+    min_count = task_counts['Count'].sum() * min_share
+    significant_tasks = task_counts[task_counts['Count'] >= min_count]
+    other_tasks_count = task_counts.loc[task_counts['Count'] < min_count, 'Count'].sum()
+    if other_tasks_count > 0:
+        significant_tasks = pd.concat([significant_tasks, pd.DataFrame([{'TASKTYPE': 'Autres Petites Tâches', 'Count': other_tasks_count}])])
+    return significant_tasks
+
+# --- Modèle de capacité des processus de travail (file M/M/c) ---
+
+# Code de type de tâche SAP (hexadécimal, exporté par Excel sous la forme '_x0001_') ou libellé -> type de WP.
+# Les RFC (FE) s'exécutent dans les WPs de dialogue.
+TASKTYPE_WP_TYPES = {'01': 'DIA', '02': 'UPD', '03': 'SPO', '04': 'BGD', '08': 'UP2', 'FE': 'DIA',
+                     'DIALOG': 'DIA', 'DIA': 'DIA', 'RFC': 'DIA', 'UPDATE': 'UPD', 'UPD': 'UPD', 'UPDATE2': 'UP2',
+                     'UP2': 'UP2', 'SPOOL': 'SPO', 'SPO': 'SPO', 'BACKGROUND': 'BGD', 'BATCH': 'BGD', 'BTC': 'BGD', 'BGD': 'BGD'}
+CAPACITY_MAX_SERVERS = 200
+
+def tasktype_wp_types(tasktypes):
+    """Type de WP (DIA, BGD, UPD, UP2, SPO) de chaque type de tâche ; NaN si le type ne correspond à aucun WP modélisé."""
+    text = tasktypes.astype(str).str.strip().str.upper()
+    codes = text.str.extract(r'^_X00([0-9A-F]{2})_$', expand=False)
+    return codes.fillna(text).map(TASKTYPE_WP_TYPES)
+
+def slot_hours(time_slots):
+    """Durée en heures de chaque tranche TIME 'HH--HH' (ex. '00--06' -> 6, '23--00' -> 1)."""
+    bounds = time_slots.astype(str).str.extract(r'^(\d{1,2})--(\d{1,2})$').astype(float)
+    hours = (bounds[1] - bounds[0]) % 24
+    return hours.mask(hours == 0, 24.0)
+
+def wp_load_profile(df_task):
+    """
+    Charge par (SYSTEM si présent, type de WP, tranche horaire) d'après tasktimes : pas (COUNT), taux
+    d'arrivée (pas/s), durée moyenne d'occupation d'un WP (RESPTI - QUEUETI - ROLLWAITTI, en ms : le WP
+    est libéré pendant l'attente de roll), charge offerte (erlangs) et attente observée en file (QUEUETI / COUNT).
+    None si les colonnes manquent ; DataFrame vide si aucune tranche exploitable.
+    """
+    required = ['TASKTYPE', 'TIME', 'COUNT', 'RESPTI']
+    if df_task.empty or any(col not in df_task.columns for col in required):
+        return None
+    keys = [SYSTEM_COLUMN] if SYSTEM_COLUMN in df_task.columns else []
+    df = pd.DataFrame({key: df_task[key] for key in keys})
+    df['WP_TYP'] = tasktype_wp_types(df_task['TASKTYPE'])
+    df['TIME'] = df_task['TIME'].astype(str)
+    df['HOURS'] = slot_hours(df['TIME'])
+    df['COUNT'] = df_task['COUNT']
+    df['QUEUETI'] = df_task['QUEUETI'] if 'QUEUETI' in df_task.columns else 0.0
+    df['OCCUPATION'] = (df_task['RESPTI'] - df['QUEUETI']
+                        - (df_task['ROLLWAITTI'] if 'ROLLWAITTI' in df_task.columns else 0.0)).clip(lower=0)
+    df = df.dropna(subset=['WP_TYP', 'HOURS'])
+    profile = (df.groupby(keys + ['WP_TYP', 'TIME'], observed=True, sort=False)
+                 .agg(HOURS=('HOURS', 'first'), COUNT=('COUNT', 'sum'), QUEUETI=('QUEUETI', 'sum'), OCCUPATION=('OCCUPATION', 'sum'))
+                 .reset_index())
+    profile = profile[profile['COUNT'] > 0]
+    profile['ARRIVAL_RATE'] = profile['COUNT'] / (profile['HOURS'] * 3600.0)
+    profile['SERVICE_MS'] = profile['OCCUPATION'] / profile['COUNT']
+    profile['OFFERED_LOAD'] = profile['ARRIVAL_RATE'] * profile['SERVICE_MS'] / 1000.0
+    profile['OBSERVED_WAIT_MS'] = profile['QUEUETI'] / profile['COUNT']
+    profile['TIME'] = pd.Categorical(profile['TIME'], categories=TIMES_HOURLY_CATEGORIES, ordered=True)
+    return profile.sort_values(keys + ['WP_TYP', 'TIME']).reset_index(drop=True)
+
+def wp_capacity(df_perf):
+    """Nombre de processus de travail configurés par (SYSTEM si présent, WP_TYP) d'après AL_GET_PERFORMANCE."""
+    if df_perf.empty or 'WP_TYP' not in df_perf.columns:
+        return None
+    keys = ([SYSTEM_COLUMN] if SYSTEM_COLUMN in df_perf.columns else []) + ['WP_TYP']
+    return df_perf.groupby(keys, observed=True).size().rename('WORK_PROCESSES').reset_index()
+
+def erlang_c_sweep(offered_load, service_ms, max_servers=CAPACITY_MAX_SERVERS):
+    """
+    Modèle M/M/c pour c = 1..max_servers et chaque tranche (vecteurs `offered_load` en erlangs, `service_ms`).
+    Retourne (utilisation, probabilité d'attente, attente moyenne en file en ms), matrices c x tranches ;
+    attente infinie quand la charge dépasse c. Erlang B par récurrence, vectorisée sur les tranches.
+    """
+    load = np.asarray(offered_load, dtype=float)
+    service = np.asarray(service_ms, dtype=float)
+    servers = np.arange(1, max_servers + 1, dtype=float)[:, None]
+    blocking = np.empty((max_servers, len(load)))
+    b = np.ones(len(load))
+    for k in range(1, max_servers + 1):
+        b = load * b / (k + load * b)
+        blocking[k - 1] = b
+    utilization = load / servers
+    stable = utilization < 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wait_probability = np.where(stable, blocking / (1 - utilization * (1 - blocking)), 1.0)
+        queue_wait = np.where(stable, wait_probability * service / (servers - load), np.inf)
+    return utilization, wait_probability, np.where(load > 0, queue_wait, 0.0)
+
+def wp_capacity_model(profile, wp_type, servers, target_wait_ms, system=None, max_servers=CAPACITY_MAX_SERVERS):
+    """
+    Scénario « et si » pour un type de WP : par tranche, utilisation, probabilité d'attente et attente en file
+    prévues avec `servers` WPs (SATURATED, attente NaN, si la charge les dépasse), attente observée, et nombre
+    minimal de WPs pour rester sous `target_wait_ms` (NaN au-delà de `max_servers`). Toute la plage
+    1..max_servers est évaluée d'un bloc.
+    """
+    if profile is None:
+        return None
+    selected = profile[profile['WP_TYP'] == wp_type]
+    if system is not None and SYSTEM_COLUMN in selected.columns:
+        selected = selected[selected[SYSTEM_COLUMN] == system]
+    if selected.empty:
+        return selected
+    max_servers = max(max_servers, int(servers))
+    utilization, wait_probability, queue_wait = erlang_c_sweep(selected['OFFERED_LOAD'], selected['SERVICE_MS'], max_servers)
+    meets_target = queue_wait <= target_wait_ms
+    required = np.where(meets_target.any(axis=0), meets_target.argmax(axis=0) + 1, np.nan)
+    result = selected[['TIME', 'HOURS', 'COUNT', 'ARRIVAL_RATE', 'SERVICE_MS', 'OFFERED_LOAD', 'OBSERVED_WAIT_MS']].reset_index(drop=True)
+    row = int(servers) - 1
+    result['UTILIZATION'] = utilization[row]
+    result['WAIT_PROBABILITY'] = wait_probability[row]
+    result['PREDICTED_WAIT_MS'] = np.where(np.isfinite(queue_wait[row]), queue_wait[row], np.nan)
+    result['SATURATED'] = utilization[row] >= 1
+    result['REQUIRED_WPS'] = required
+    return result
+
+# --- Analyse des Utilisateurs (USR02) ---
+
+def logon_counts_by_date(df_usr02):
+    """Nombre d'utilisateurs par date de dernier logon (GLTGB), dates invalides exclues."""
+    if 'GLTGB_DATE' not in df_usr02.columns or df_usr02['GLTGB_DATE'].isnull().all():
+        return None
+    logon_counts = df_usr02['GLTGB_DATE'].dropna().dt.date.value_counts().sort_index().reset_index()
+    logon_counts.columns = ['Date de Dernier Logon', 'Nombre d\'Utilisateurs']
+    return logon_counts
+
+# --- Explorateur de données paginé ---
+
+def _text_match_mask(series, text):
+    """Lignes dont la valeur contient `text` (insensible à la casse) ; sur une catégorielle, test sur les catégories seulement."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        matching = series.cat.categories.astype(str).str.contains(text, case=False, regex=False)
+        return series.isin(series.cat.categories[matching])
+    return series.astype(str).str.contains(text, case=False, regex=False, na=False)
+
+def _sorted_positions(values, stop, ascending):
+    """
+    Positions des `stop` premières lignes d'un tri stable (NaN en dernier), sans trier toute la colonne :
+    argpartition isole les candidats (ex-aequo au seuil inclus), seuls ceux-ci sont triés.
+    """
+    keys = values.astype(float) if ascending else -values.astype(float)
+    keys[np.isnan(keys)] = np.inf
+    if stop < len(keys):
+        threshold = np.partition(keys, stop - 1)[stop - 1]
+        candidates = np.flatnonzero(keys <= threshold)
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.argsort(keys[candidates], kind='stable')][:stop]
+
+def table_page(df, page=0, page_size=100, sort_by=None, ascending=True, filter_column=None, filter_text=None):
+    """
+    Une page d'une source pour l'explorateur : filtre texte, tri et découpage côté serveur.
+    Retourne (DataFrame de `page_size` lignes au plus, nombre de lignes après filtre) ; seule la page
+    est ensuite envoyée au navigateur. Le tri d'une colonne numérique ne trie que les lignes jusqu'à la page demandée.
+    """
+    if filter_column and filter_text and filter_column in df.columns:
+        df = df[_text_match_mask(df[filter_column], filter_text)]
+    total = len(df)
+    start = min(page * page_size, total)
+    stop = min(start + page_size, total)
+    if not sort_by or sort_by not in df.columns or start == stop:
+        return df.iloc[start:stop], total
+    column = df[sort_by]
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        positions = _sorted_positions(column.to_numpy(dtype=float, na_value=np.nan), stop, ascending)
+        return df.iloc[positions[start:stop]], total
+    return df.sort_values(sort_by, ascending=ascending, kind='stable', na_position='last').iloc[start:stop], total
+
+# --- Export des données filtrées et des agrégats ---
+
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'csv': ('.csv', 'text/csv'),
+}
+
+def _export_chunk(chunk, object_columns):
+    """Colonnes objet converties en texte (NaN conservés) pour un schéma Parquet identique d'un bloc à l'autre."""
+    if not object_columns:
+        return chunk
+    chunk = chunk.copy()
+    for col in object_columns:
+        chunk[col] = chunk[col].where(chunk[col].isna(), chunk[col].astype(str))
+    return chunk
+
+def write_frame_export(df, fileobj, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Écrit `df` dans `fileobj` (binaire) par blocs de `chunk_rows` lignes, en Parquet (un groupe de lignes par bloc)
+    ou en CSV. Seul le bloc courant est converti en mémoire : jamais de copie complète ni de classeur Excel.
+    """
+    object_columns = [col for col in df.columns if df[col].dtype == object]
+    if fmt == 'csv':
+        for start in range(0, max(len(df), 1), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            fileobj.write(chunk.to_csv(index=False, header=(start == 0)).encode('utf-8'))
+        return
+    schema = _export_schema(df, object_columns, chunk_rows)
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = _export_chunk(df.iloc[start:start + chunk_rows], object_columns)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def _export_schema(df, object_columns, chunk_rows):
+    schema = pa.Schema.from_pandas(_export_chunk(df.iloc[:chunk_rows], object_columns), preserve_index=False)
+    return pa.schema([pa.field(field.name, pa.string()) if field.name in object_columns else field for field in schema],
+                     metadata=schema.metadata)
+
+def write_arrow_stream(df, fileobj, chunk_rows=EXPORT_CHUNK_ROWS):
+    """`df` en flux Arrow IPC (un lot par bloc de `chunk_rows` lignes), colonnes objet en texte comme write_frame_export."""
+    object_columns = [col for col in df.columns if df[col].dtype == object]
+    schema = _export_schema(df, object_columns, chunk_rows)
+    with pa.ipc.new_stream(fileobj, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            chunk = _export_chunk(df.iloc[start:start + chunk_rows], object_columns)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def export_frame(df, fmt):
+    """
+    Export d'un DataFrame en octets (type accepté par st.download_button). L'écriture par blocs dans un fichier
+    temporaire évite les copies intermédiaires ; le contenu final est en revanche lu en entier en mémoire,
+    comme Streamlit le ferait de toute façon pour le servir.
+    """
+    with tempfile.TemporaryFile() as export_file:
+        write_frame_export(df, export_file, fmt)
+        export_file.seek(0)
+        return export_file.read()
+
+def export_frames_zip(frames, fmt):
+    """Archive ZIP en octets contenant un export par DataFrame de `frames` (nom -> DataFrame), voir export_frame."""
+    extension = EXPORT_FORMATS[fmt][0]
+    with tempfile.TemporaryFile() as export_file:
+        _write_frames_zip(export_file, frames, fmt, extension)
+        export_file.seek(0)
+        return export_file.read()
+
+def _write_frames_zip(export_file, frames, fmt, extension):
+    used_names = set()
+    with zipfile.ZipFile(export_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, df in frames.items():
+            base = re.sub(r'[^\w-]+', '_', name).strip('_')[:80] or 'agregat'
+            entry_name = base
+            suffix = 2
+            while entry_name in used_names:
+                entry_name = f"{base}_{suffix}"
+                suffix += 1
+            used_names.add(entry_name)
+            with archive.open(entry_name + extension, 'w', force_zip64=True) as entry:
+                write_frame_export(df, entry, fmt)
+
+# --- Cache des figures (partagé entre sessions) ---
+
+FIGURE_CACHE_MAX_ENTRIES = int(os.environ.get("SAP_DASHBOARD_FIGURE_CACHE_ENTRIES", "256"))
+
+def _update_fingerprint(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) else [value.dtype]
+        digest.update(repr((type(value).__name__, value.shape, columns, dtypes)).encode())
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype, value.shape)).encode())
+        digest.update(pd.util.hash_array(value.ravel()).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            digest.update(repr(key).encode())
+            _update_fingerprint(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}".encode())
+        for item in value:
+            _update_fingerprint(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+def data_fingerprint(*parts):
+    """
+    Empreinte 64 bits d'agrégats, séries et options (dictionnaires, listes, scalaires).
+    Le hachage des DataFrames est vectorisé (hash_pandas_object) : coût linéaire mais bien inférieur
+    à la construction d'une figure. TypeError si une valeur n'est pas hachable (ex. listes dans une colonne).
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        _update_fingerprint(digest, part)
+    return digest.hexdigest()
+
+class _FlightCall:
+    """Calcul en cours d'une clé de SingleFlight : résultat ou exception, publié à la fin par `done`."""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Regroupement des calculs identiques simultanés : le premier appel pour une clé exécute le calcul, les appels
+    concurrents pour la même clé attendent son résultat (ou son exception) au lieu de le refaire. Rien n'est gardé
+    une fois le calcul terminé : la mise en cache reste l'affaire de l'appelant. Les compteurs sont tenus par type
+    de calcul ('load', 'filter', 'figures'...).
+    """
+
+    def __init__(self):
+        self.executions = Counter()
+        self.coalesced = Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, kind, key_parts, compute):
+        """Retourne (compute(), False) pour l'appel qui calcule, (même objet, True) pour ceux qui l'ont attendu."""
+        try:
+            key = (kind, data_fingerprint(*key_parts))
+        except TypeError:
+            return compute(), False
+        with self._lock:
+            call = self._calls.get(key)
+            # Un appel réentrant du thread qui calcule déjà cette clé s'attendrait lui-même : il calcule directement.
+            waiting = call is not None and call.thread != threading.get_ident()
+            if waiting:
+                self.coalesced[kind] += 1
+            else:
+                self.executions[kind] += 1
+                if call is None:
+                    call = self._calls[key] = _FlightCall()
+                else:
+                    call = None
+        if waiting:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        if call is None:
+            return compute(), False
+        try:
+            call.result = compute()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """{type de calcul: {'executions', 'coalesced', 'in_flight'}} depuis le démarrage du processus."""
+        with self._lock:
+            in_flight = Counter(kind for kind, _ in self._calls)
+        return {kind: {'executions': self.executions[kind], 'coalesced': self.coalesced[kind], 'in_flight': in_flight[kind]}
+                for kind in sorted(set(self.executions) | set(self.coalesced))}
+
+# Regroupement des chargements, filtres et constructions de figures identiques de toutes les sessions du processus.
+REQUEST_FLIGHTS = SingleFlight()
+
+class FigureCache:
+    """
+    Cache LRU borné d'objets construits (figures Plotly), indexé par l'empreinte de leurs entrées.
+    Les objets retournés sont partagés entre sessions : ils ne doivent pas être modifiés après coup.
+    Les constructions simultanées d'une même entrée sont regroupées (SingleFlight, type `name`).
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_MAX_ENTRIES, name='figures', flights=REQUEST_FLIGHTS):
+        self.max_entries = max_entries
+        self.name = name
+        self.flights = flights
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], True
+        return None, False
+
+    def get_or_build(self, key_parts, build):
+        """
+        Retourne (objet, True) si `key_parts` est déjà en cache ou en cours de construction par une autre session,
+        sinon construit via build() : (objet, False).
+        """
+        try:
+            key = data_fingerprint(*key_parts)
+        except TypeError:
+            return build(), False
+        cached, found = self._lookup(key)
+        if found:
+            return cached, True
+
+        def build_and_store():
+            # Une construction a pu se terminer entre la recherche ci-dessus et l'entrée dans le regroupement.
+            cached, found = self._lookup(key)
+            if found:
+                return cached, True
+            built = build()
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = built
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return built, False
+
+        (built, found), coalesced = self.flights.do(self.name, (key,), build_and_store)
+        if coalesced:
+            with self._lock:
+                self.coalesced += 1
+        return built, found or coalesced
+
+    def stats(self):
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced}
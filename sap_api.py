@@ -0,0 +1,237 @@
+"""
+API HTTP locale servant les agrégats du dashboard en Arrow IPC ou en JSON, indépendante de Streamlit.
+
+    python sap_api.py [--host 127.0.0.1] [--port 8601]
+
+Les données sont celles du dashboard : DataSnapshotStore charge les sources par le stockage partagé (les frames
+publiés par les processus Streamlit de l'hôte sont mappés, pas relus ni renettoyés), suit les fichiers remplacés
+et, s'il est configuré, le dossier de dépôt. Routes :
+
+    GET /health                  snapshot servi (version, date, lignes reçues en continu), état du cache et
+                                 calculs regroupés
+    GET /aggregates              agrégats disponibles et leurs paramètres par défaut
+    GET /aggregates/{nom}        un agrégat ; paramètres : format=arrow|json, filtres globaux en listes séparées
+                                 par des virgules (accounts, reports, tasktypes, wp_types, systems) et paramètres
+                                 propres à l'agrégat (n, metric...)
+
+Une réponse Arrow est un flux IPC (application/vnd.apache.arrow.stream, pyarrow.ipc.open_stream) ; l'en-tête
+X-Snapshot-Version indique le snapshot utilisé. Les calculs s'exécutent dans un pool de threads borné
+(SAP_DASHBOARD_API_WORKERS) partagé par toutes les requêtes ; frames filtrés et résultats sont mis en cache par
+(version du snapshot, paramètres), donc réutilisés d'une requête à l'autre jusqu'au snapshot suivant. Les requêtes
+identiques simultanées attendent un seul calcul (sap_analytics.REQUEST_FLIGHTS, compteurs dans /health).
+"""
+import io
+import os
+import sys
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import sap_analytics as sa
+
+API_HOST = os.environ.get("SAP_DASHBOARD_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("SAP_DASHBOARD_API_PORT", "8601"))
+API_WORKERS = int(os.environ.get("SAP_DASHBOARD_API_WORKERS", str(min(4, os.cpu_count() or 1))))
+API_MAX_ROWS = 1000
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+FILTER_PARAMETERS = ('accounts', 'reports', 'tasktypes', 'wp_types', 'systems')
+# Frames filtrés gardés par sélection : peu d'entrées, ce sont des copies des sources.
+FILTERED_CACHE_ENTRIES = 8
+
+# --- Agrégats : fonction(snapshot, filtered, filters, params) -> DataFrame, ou None si les prérequis manquent ---
+# `filtered()` retourne les frames du snapshot filtrés par la sélection (calculés une fois par sélection).
+
+def _kpis(snapshot, filtered, filters, params):
+    return pd.DataFrame([sa.kpis_from_summary(snapshot['kpi_summary'], **filters)])
+
+def _top_reports(snapshot, filtered, filters, params):
+    return sa.top_n_by(filtered()['hitlist_db'], 'REPORT', params['metric'], n=params['n'], agg=params['agg'])
+
+def _hourly_mean(snapshot, filtered, filters, params):
+    trend = sa.trend_mean(snapshot['history'], params['source'], filtered()[params['source']], params['column'], 1.0,
+                          filters['accounts'], filters['reports'], filters['tasktypes'], filters['systems'])
+    return None if trend is None else trend.rename(params['column']).reset_index()
+
+def _top_sql(snapshot, filtered, filters, params):
+    df_sql = filtered()['sql_trace_summary']
+    if 'SQL_FINGERPRINT' not in df_sql.columns or not sa.has_positive_total(df_sql, params['metric']):
+        return None
+    return sa.top_sql_by_fingerprint(df_sql, snapshot['sql_fingerprint_lookup'], params['metric'], params['agg'], params['n'])
+
+def _response_breakdown(snapshot, filtered, filters, params):
+    return sa.response_breakdown(snapshot['response_breakdown'], params['by'], params['n'], filters['accounts'],
+                                 filters['reports'], filters['tasktypes'], filters['systems'])
+
+def _db_access(snapshot, filtered, filters, params):
+    access = sa.db_access_by_report(snapshot['db_access'], filters['accounts'], filters['reports'], filters['tasktypes'],
+                                    filters['systems'])
+    return None if access is None else access.head(params['n'])
+
+def _memory_top_accounts(snapshot, filtered, filters, params):
+    return sa.memory_top_accounts(filtered()['memory'], n=params['n'])
+
+# nom -> (description, fonction, paramètres propres et valeurs par défaut ; le type du défaut fixe celui du paramètre)
+AGGREGATES = {
+    'kpis': ("KPIs d'en-tête de la sélection (une ligne).", _kpis, {}),
+    'top_reports': ("Top REPORT de hitlist_db par métrique.", _top_reports, {'metric': 'RESPTI', 'agg': 'sum', 'n': 10}),
+    'hourly_mean': ("Moyenne horaire d'une colonne (historique hiérarchisé s'il est configuré).", _hourly_mean,
+                    {'source': 'hitlist_db', 'column': 'RESPTI'}),
+    'top_sql': ("Top instructions SQL normalisées par métrique.", _top_sql, {'metric': 'EXECTIME', 'agg': 'sum', 'n': 10}),
+    'response_breakdown': ("Décomposition du temps de réponse des groupes les plus coûteux (format long).",
+                           _response_breakdown, {'by': 'REPORT', 'n': 15}),
+    'db_access': ("Matrice REPORT x accès base de données, triée par lectures séquentielles non bufferisées.",
+                  _db_access, {'n': 100}),
+    'memory_top_accounts': ("Top comptes par USEDBYTES total.", _memory_top_accounts, {'n': 10}),
+}
+# Dimensions de la décomposition du temps de réponse : celles des filtres globaux qui visent hitlist_db.
+BREAKDOWN_DIMENSIONS = tuple(column for column, sources in sa.GLOBAL_FILTER_TARGETS.items() if 'hitlist_db' in sources)
+PARAMETER_CHOICES = {'agg': ('sum', 'mean'), 'source': tuple(sa.DATA_PATHS), 'format': ('arrow', 'json'),
+                     'by': BREAKDOWN_DIMENSIONS}
+# Source dont `metric` / `column` doit être une colonne numérique (SOURCE_NUMERIC_COLUMNS) ; 'hourly_mean' : paramètre `source`.
+METRIC_SOURCES = {'top_reports': 'hitlist_db', 'top_sql': 'sql_trace_summary'}
+
+class BadRequest(ValueError):
+    pass
+
+def parse_parameters(name, query):
+    """(filtres globaux, paramètres de l'agrégat, format) d'une requête ; BadRequest si un paramètre est invalide."""
+    filters = {key: [value for value in query.get(key, '').split(',') if value] for key in FILTER_PARAMETERS}
+    params = {}
+    for key, default in AGGREGATES[name][2].items():
+        value = query.get(key, default)
+        if isinstance(default, int):
+            try:
+                value = int(value)
+            except ValueError:
+                raise BadRequest(f"Paramètre '{key}' : entier attendu, reçu '{value}'.")
+            if not 1 <= value <= API_MAX_ROWS:
+                raise BadRequest(f"Paramètre '{key}' : valeur entre 1 et {API_MAX_ROWS} attendue.")
+        params[key] = value
+    fmt = query.get('format', 'arrow')
+    for key, value in {**params, 'format': fmt}.items():
+        if key in PARAMETER_CHOICES and value not in PARAMETER_CHOICES[key]:
+            raise BadRequest(f"Paramètre '{key}' : une valeur parmi {', '.join(PARAMETER_CHOICES[key])} attendue.")
+    source = params.get('source', METRIC_SOURCES.get(name))
+    for key in ('metric', 'column'):
+        if key in params and params[key] not in sa.SOURCE_NUMERIC_COLUMNS.get(source, ()):
+            raise BadRequest(f"Paramètre '{key}' : colonne numérique de '{source}' attendue, reçu '{params[key]}'.")
+    return filters, params, fmt
+
+def frame_payload(df, fmt):
+    """Corps de réponse et type MIME d'un agrégat."""
+    if fmt == 'json':
+        return df.to_json(orient='records', date_format='iso', force_ascii=False).encode('utf-8'), 'application/json'
+    sink = io.BytesIO()
+    sa.write_arrow_stream(df, sink)
+    return sink.getvalue(), ARROW_MEDIA_TYPE
+
+class AggregateService:
+    """
+    Calcul des agrégats sur le snapshot courant d'un DataSnapshotStore, dans un pool de threads partagé.
+    Les frames filtrés et les réponses sérialisées sont gardés en cache LRU (FigureCache) par version de snapshot.
+    """
+
+    def __init__(self, store, workers=API_WORKERS):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sap-api")
+        self.results = sa.FigureCache(name='api_results')
+        self.filtered_frames = sa.FigureCache(max_entries=FILTERED_CACHE_ENTRIES, name='api_filters')
+
+    def frame(self, snapshot, name, filters, params):
+        """DataFrame de l'agrégat, ou None si ses prérequis manquent dans les lignes retenues."""
+        def filtered():
+            frames, _ = self.filtered_frames.get_or_build(
+                (snapshot['version'], filters),
+                lambda: sa.apply_global_filters(snapshot['dfs'], **filters))
+            return frames
+
+        return AGGREGATES[name][1](snapshot, filtered, filters, params)
+
+    def compute(self, snapshot, name, filters, params, fmt):
+        """
+        (corps, type MIME) de l'agrégat, ou None si ses prérequis manquent dans les données. Une sélection qui ne
+        retient aucune ligne donne un tableau vide au schéma de l'agrégat calculé sans filtres.
+        """
+        def build():
+            df = self.frame(snapshot, name, filters, params)
+            if df is None and any(filters.values()):
+                unfiltered = self.frame(snapshot, name, {key: [] for key in filters}, params)
+                df = None if unfiltered is None else unfiltered.iloc[0:0]
+            return None if df is None else frame_payload(df, fmt)
+
+        payload, _ = self.results.get_or_build((snapshot['version'], name, filters, params, fmt), build)
+        return payload
+
+    async def run(self, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.compute, *args)
+
+def create_app(store=None, workers=API_WORKERS):
+    """Application Starlette ; `store` par défaut : DataSnapshotStore des chemins configurés (créé au démarrage)."""
+    state = {}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        data_store = store or await asyncio.to_thread(sa.DataSnapshotStore, sa.configured_data_paths(),
+                                                      sa.DATA_REFRESH_INTERVAL_SECONDS)
+        state['service'] = AggregateService(data_store, workers)
+        yield
+        state['service'].executor.shutdown(wait=False, cancel_futures=True)
+
+    async def health(request):
+        service = state['service']
+        snapshot = service.store.current()
+        return JSONResponse({
+            'version': snapshot['version'],
+            'loaded_at': snapshot['loaded_at'].isoformat(),
+            'live_rows': snapshot.get('live_rows', 0),
+            'stale_indexes': snapshot.get('stale_indexes', False),
+            'last_error': service.store.last_error,
+            'result_cache': service.results.stats(),
+            'single_flight': sa.REQUEST_FLIGHTS.stats(),
+        })
+
+    async def list_aggregates(request):
+        return JSONResponse({name: {'description': description, 'parameters': defaults}
+                             for name, (description, _, defaults) in AGGREGATES.items()})
+
+    async def aggregate(request):
+        name = request.path_params['name']
+        if name not in AGGREGATES:
+            return JSONResponse({'error': f"Agrégat inconnu : '{name}'."}, status_code=404)
+        try:
+            filters, params, fmt = parse_parameters(name, request.query_params)
+        except BadRequest as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        service = state['service']
+        snapshot = service.store.current()
+        payload = await service.run(snapshot, name, filters, params, fmt)
+        if payload is None:
+            return JSONResponse({'error': f"Agrégat '{name}' indisponible : colonnes requises manquantes ou total nul."},
+                                status_code=422)
+        body, media_type = payload
+        return Response(body, media_type=media_type, headers={'X-Snapshot-Version': str(snapshot['version'])})
+
+    return Starlette(routes=[
+        Route('/health', health),
+        Route('/aggregates', list_aggregates),
+        Route('/aggregates/{name}', aggregate),
+    ], lifespan=lifespan)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API locale des agrégats du dashboard SAP (Arrow IPC ou JSON).")
+    parser.add_argument('--host', default=API_HOST, help="Adresse d'écoute (locale par défaut).")
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=API_WORKERS, help="Threads de calcul partagés par les requêtes.")
+    args = parser.parse_args(argv)
+    uvicorn.run(create_app(workers=args.workers), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
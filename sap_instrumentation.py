@@ -0,0 +1,118 @@
+"""
+Instrumentation optionnelle des chemins chauds du dashboard SAP, indépendante de Streamlit.
+
+Un StageRecorder chronomètre des étapes nommées (chargement par file_key, étapes de filtre,
+sections et graphiques) et note pour chacune le nombre de lignes traitées, la taille du DataFrame
+produit et, si tracemalloc est actif, la variation de mémoire allouée. Désactivé, il ne mesure rien :
+les appels sont laissés en place dans le code sans coût notable.
+
+Les étapes s'exportent au format Chrome trace (chrome://tracing, Perfetto) ou en JSON brut.
+"""
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Instrumentation du chargement (thread de rafraîchissement) : activée par variable d'environnement,
+# car elle s'exécute hors de toute session. Le rendu s'active par session depuis la barre latérale.
+LOAD_INSTRUMENTATION_ENABLED = os.environ.get("SAP_DASHBOARD_INSTRUMENTATION", "") == "1"
+
+class StageRecorder:
+    """Collecte des étapes chronométrées ; sans effet si `enabled` est faux."""
+
+    def __init__(self, enabled=True, name="dashboard"):
+        self.enabled = enabled
+        self.name = name
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def begin(self, name, category, **args):
+        """Ouvre une étape ; à refermer par end(). Retourne None si l'instrumentation est désactivée."""
+        if not self.enabled:
+            return None
+        return {
+            'name': name,
+            'category': category,
+            'thread': threading.current_thread().name,
+            'start': time.time(),
+            '_perf_start': time.perf_counter(),
+            '_traced_start': tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            'args': dict(args),
+        }
+
+    def end(self, span, rows=None, frame=None, **args):
+        """Referme une étape ouverte par begin() ; `frame` renseigne lignes et taille mémoire du résultat."""
+        if span is None:
+            return
+        span['duration_ms'] = (time.perf_counter() - span.pop('_perf_start')) * 1000.0
+        traced_start = span.pop('_traced_start')
+        span['alloc_mb'] = None
+        if traced_start is not None and tracemalloc.is_tracing():
+            span['alloc_mb'] = (tracemalloc.get_traced_memory()[0] - traced_start) / 2**20
+        if isinstance(frame, pd.DataFrame):
+            rows = len(frame) if rows is None else rows
+            span['frame_mb'] = frame.memory_usage(deep=False).sum() / 2**20
+        span['rows'] = rows
+        span['args'].update(args)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def stage(self, name, category, **args):
+        """
+        Étape sous forme de bloc `with`. Le dictionnaire produit accepte 'rows' et 'frame' ;
+        toute autre clé est ajoutée aux arguments de l'étape.
+        """
+        span = self.begin(name, category, **args)
+        result = {}
+        try:
+            yield result
+        finally:
+            self.end(span, rows=result.pop('rows', None), frame=result.pop('frame', None), **result)
+
+NULL_RECORDER = StageRecorder(enabled=False)
+
+def stages_frame(spans):
+    """Étapes sous forme de DataFrame (une ligne par étape), dans l'ordre de démarrage."""
+    columns = ['category', 'name', 'thread', 'duration_ms', 'rows', 'frame_mb', 'alloc_mb', 'args']
+    if not spans:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(sorted(spans, key=lambda span: span['start']))
+    for col in columns:
+        if col not in df.columns:
+            df[col] = None
+    df['args'] = df['args'].map(lambda args: ', '.join(f"{key}={value}" for key, value in args.items()))
+    return df[columns]
+
+def stages_summary(spans):
+    """Temps total, nombre d'appels et lignes par (catégorie, étape), du plus coûteux au moins coûteux."""
+    df = stages_frame(spans)
+    if df.empty:
+        return df
+    return (df.groupby(['category', 'name'], sort=False)
+              .agg(calls=('duration_ms', 'size'), total_ms=('duration_ms', 'sum'),
+                   max_ms=('duration_ms', 'max'), rows=('rows', lambda rows: rows.sum(min_count=1)))
+              .sort_values('total_ms', ascending=False)
+              .reset_index())
+
+def to_chrome_trace(spans, process_name="sap-dashboard"):
+    """Format Trace Event (événements complets 'X') lisible par chrome://tracing et Perfetto."""
+    threads = {}
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': {'name': process_name}}]
+    for span in sorted(spans, key=lambda span: span['start']):
+        tid = threads.setdefault(span['thread'], len(threads) + 1)
+        args = {key: span.get(key) for key in ('rows', 'frame_mb', 'alloc_mb') if span.get(key) is not None}
+        args.update(span['args'])
+        events.append({'name': span['name'], 'cat': span['category'], 'ph': 'X', 'pid': 1, 'tid': tid,
+                       'ts': span['start'] * 1e6, 'dur': span['duration_ms'] * 1e3, 'args': args})
+    events.extend({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}}
+                  for thread, tid in threads.items())
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str)
+
+def to_json(spans):
+    """Export brut : liste des étapes (horodatage epoch en secondes, durées en ms)."""
+    return json.dumps(sorted(spans, key=lambda span: span['start']), default=str, indent=2)
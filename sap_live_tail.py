@@ -0,0 +1,128 @@
+"""
+Ingestion en continu d'un dossier de dépôt (spool) alimenté par les collecteurs, indépendante de Streamlit.
+
+Les collecteurs écrivent les nouveaux enregistrements dans SAP_DASHBOARD_SPOOL_DIR : un sous-dossier par source
+(noms de DATA_PATHS : hitlist_db/, usertcode/, memory/...) et, en mode paysage, un sous-dossier par système dans
+chaque source (hitlist_db/PRD/...). Les fichiers .csv (première ligne = en-têtes) et .jsonl (un objet JSON par ligne)
+sont suivis comme avec `tail -f` : chaque passage ne lit que les octets ajoutés depuis le dernier offset, jusqu'à la
+dernière fin de ligne complète (une ligne en cours d'écriture attend le passage suivant). Un fichier tronqué ou
+remplacé (inode différent) est relu depuis le début.
+
+La boucle asyncio scrute le dossier toutes les SAP_DASHBOARD_SPOOL_POLL_SECONDS secondes ; lectures et analyses
+des fichiers d'un passage s'exécutent en parallèle dans des threads (asyncio.to_thread). Les offsets ne sont
+gardés qu'en mémoire : au démarrage, le contenu déjà présent dans le dossier est relu une fois.
+"""
+import io
+import os
+import asyncio
+import threading
+
+import pandas as pd
+
+SPOOL_DIR = os.environ.get("SAP_DASHBOARD_SPOOL_DIR", "")
+SPOOL_POLL_SECONDS = float(os.environ.get("SAP_DASHBOARD_SPOOL_POLL_SECONDS", "2"))
+SPOOL_EXTENSIONS = ('.csv', '.jsonl')
+# Octets lus au plus par fichier et par passage : un gros rattrapage est étalé sur plusieurs passages.
+SPOOL_MAX_READ_BYTES = 64 * 1024 * 1024
+# Lignes reçues gardées au plus pour être réappliquées après un rechargement complet des exports.
+SPOOL_MAX_BUFFERED_ROWS = int(os.environ.get("SAP_DASHBOARD_SPOOL_MAX_BUFFERED_ROWS", "1000000"))
+
+def spool_files(directory, sources, landscape=False):
+    """Fichiers suivis [(source, système, chemin)] triés ; système None hors mode paysage."""
+    files = []
+    for source in sources:
+        source_dir = os.path.join(directory, source)
+        if not os.path.isdir(source_dir):
+            continue
+        if landscape:
+            folders = sorted((entry.name, entry.path) for entry in os.scandir(source_dir) if entry.is_dir())
+        else:
+            folders = [(None, source_dir)]
+        for system, folder in folders:
+            files.extend((source, system, entry.path) for entry in sorted(os.scandir(folder), key=lambda entry: entry.name)
+                         if entry.is_file() and entry.name.lower().endswith(SPOOL_EXTENSIONS))
+    return files
+
+def parse_spool_chunk(path, chunk):
+    """Lignes complètes d'un fichier suivi en DataFrame brut (en-têtes CSV déjà préfixés au bloc)."""
+    if path.lower().endswith('.jsonl'):
+        return pd.read_json(io.BytesIO(chunk), lines=True, dtype=False)
+    return pd.read_csv(io.BytesIO(chunk))
+
+class SpoolTailer:
+    """
+    Suivi des fichiers d'un dossier de dépôt. `clean(source, df)` nettoie les lignes brutes d'une source
+    (sap_analytics.clean_source_frame) ; `positions` garde par chemin (inode, offset lu, en-têtes CSV).
+    """
+
+    def __init__(self, directory, sources, clean, landscape=False):
+        self.directory = directory
+        self.sources = list(sources)
+        self.clean = clean
+        self.landscape = landscape
+        self.positions = {}
+
+    def read_new_bytes(self, path):
+        """Octets complets ajoutés depuis le dernier passage (préfixés des en-têtes pour un CSV), ou None."""
+        stat = os.stat(path)
+        inode, offset, header = self.positions.get(path, (stat.st_ino, 0, b''))
+        if inode != stat.st_ino or stat.st_size < offset:
+            offset, header = 0, b''
+        if stat.st_size == offset:
+            return None
+        with open(path, 'rb') as spool_file:
+            spool_file.seek(offset)
+            chunk = spool_file.read(min(stat.st_size - offset, SPOOL_MAX_READ_BYTES))
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return None
+        chunk = chunk[:end]
+        if path.lower().endswith('.csv') and not header:
+            header_end = chunk.find(b'\n') + 1
+            header, chunk = chunk[:header_end], chunk[header_end:]
+        self.positions[path] = (stat.st_ino, offset + end, header)
+        if not chunk.strip():
+            return None
+        return header + chunk
+
+    def read_file(self, source, system, path):
+        """Nouvelles lignes nettoyées d'un fichier : (source, système, DataFrame ou None)."""
+        chunk = self.read_new_bytes(path)
+        if chunk is None:
+            return source, system, None
+        return source, system, self.clean(source, parse_spool_chunk(path, chunk))
+
+    async def poll(self):
+        """
+        Un passage sur tout le dossier. Retourne ({source: [(système, DataFrame)]}, erreurs) ;
+        un fichier illisible est signalé sans bloquer les autres (ses octets sont considérés comme lus).
+        """
+        files = await asyncio.to_thread(spool_files, self.directory, self.sources, self.landscape)
+        results = await asyncio.gather(*(asyncio.to_thread(self.read_file, source, system, path)
+                                         for source, system, path in files), return_exceptions=True)
+        parts, errors = {}, {}
+        for (source, system, path), result in zip(files, results):
+            if isinstance(result, Exception):
+                errors[path] = f"Lecture du fichier de dépôt '{path}' impossible : {result}"
+                continue
+            _, _, df = result
+            if df is not None and not df.empty:
+                parts.setdefault(source, []).append((system, df))
+        return parts, errors
+
+    async def run(self, on_batch, interval=SPOOL_POLL_SECONDS):
+        """Boucle sans fin : `on_batch(parts, errors)` (exécuté dans un thread) après chaque passage qui apporte du nouveau."""
+        while True:
+            try:
+                parts, errors = await self.poll()
+            except OSError as e:
+                parts, errors = {}, {self.directory: f"Dossier de dépôt '{self.directory}' illisible : {e}"}
+            if parts or errors:
+                await asyncio.to_thread(on_batch, parts, errors)
+            await asyncio.sleep(interval)
+
+def start_tail_thread(tailer, on_batch, interval=SPOOL_POLL_SECONDS):
+    """Lance la boucle asyncio du suivi dans un thread démon (le serveur Streamlit a sa propre boucle)."""
+    thread = threading.Thread(target=asyncio.run, args=(tailer.run(on_batch, interval),), name="sap-spool-tail", daemon=True)
+    thread.start()
+    return thread
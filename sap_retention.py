@@ -0,0 +1,381 @@
+"""
+Rétention hiérarchisée de l'historique hitlist_db / usertcode, indépendante de Streamlit.
+
+Trois niveaux par source : les lignes brutes d'une fenêtre récente, puis des agrégats horaires, puis des
+agrégats journaliers. Chaque agrégat conserve, par (SYSTEM, ACCOUNT, REPORT, TASKTYPE) et par période,
+l'effectif, la somme, le minimum et le maximum de chaque métrique, ainsi qu'un sketch de quantiles
+(histogramme à échelle logarithmique, fusionnable par simple addition). Les lectures de tendance
+parcourent les trois niveaux de façon transparente : une vue sur un an ne lit que des agrégats.
+
+L'historique est persisté dans SAP_DASHBOARD_HISTORY_DIR (Parquet + sketches NumPy) ; vide, il est désactivé.
+"""
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+HISTORY_DIR = os.environ.get("SAP_DASHBOARD_HISTORY_DIR", "")
+RAW_RETENTION = pd.Timedelta(days=float(os.environ.get("SAP_DASHBOARD_RAW_RETENTION_DAYS", "7")))
+HOURLY_RETENTION = pd.Timedelta(days=float(os.environ.get("SAP_DASHBOARD_HOURLY_RETENTION_DAYS", "90")))
+
+# Source -> métriques historisées.
+HISTORY_SOURCES = {
+    'hitlist_db': ['RESPTI', 'CPUTI', 'DBCALLS'],
+    'usertcode': ['RESPTI', 'CPUTI'],
+}
+ROLLUP_DIMENSIONS = ['SYSTEM', 'ACCOUNT', 'REPORT', 'TASKTYPE']
+ROLLUP_STATS = ('COUNT', 'SUM', 'MIN', 'MAX')
+
+# Sketch de quantiles : seau 0 pour [0, 1[, seau i pour [γ^(i-1), γ^i[ ; erreur relative ≤ (γ-1)/(γ+1) ≈ 11 %.
+SKETCH_GAMMA = 1.25
+SKETCH_BUCKETS = 96
+SKETCH_DTYPE = np.uint32
+_LOG_GAMMA = np.log(SKETCH_GAMMA)
+
+def sketch_buckets(values):
+    """Indice de seau de chaque valeur (le dernier seau est ouvert vers le haut)."""
+    values = np.asarray(values, dtype=float)
+    index = np.floor(np.log(np.maximum(values, 1.0)) / _LOG_GAMMA) + 1
+    return np.where(values < 1.0, 0, np.minimum(index, SKETCH_BUCKETS - 1)).astype(np.int64)
+
+def sketch_quantiles(sketches, q):
+    """Quantile `q` estimé pour chaque ligne d'une matrice de sketches ; NaN pour une ligne vide."""
+    cumulative = np.cumsum(sketches, axis=1)
+    totals = cumulative[:, -1]
+    rank = np.maximum(np.ceil(q * totals), 1)
+    index = np.argmax(cumulative >= rank[:, None], axis=1)
+    estimate = np.where(index == 0, 0.0, 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1))
+    return np.where(totals > 0, estimate, np.nan)
+
+def _stat_columns(metric):
+    return [f"{metric}_{stat}" for stat in ROLLUP_STATS]
+
+def _group_codes(frame, keys):
+    """Numéro de groupe de chaque ligne et position de la première ligne de chaque groupe (ordre d'apparition)."""
+    codes = frame.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    return codes, np.unique(codes, return_index=True)[1]
+
+def _sum_rows(sketches, codes, n_groups):
+    """Somme des sketches par groupe ; ne parcourt que leurs seaux non vides (matrices très creuses)."""
+    rows, buckets = np.nonzero(sketches)
+    flat = codes[rows] * SKETCH_BUCKETS + buckets
+    summed = np.bincount(flat, weights=sketches[rows, buckets], minlength=n_groups * SKETCH_BUCKETS)
+    return summed.reshape(n_groups, SKETCH_BUCKETS).astype(SKETCH_DTYPE)
+
+def _row_dtypes(rows, metrics):
+    """
+    Types fixes des lignes brutes (FULL_DATETIME en ns, dimensions objet, métriques flottantes) : le dédoublonnage
+    par empreinte de ligne ne doit pas dépendre de l'unité relue dans un fichier Parquet.
+    """
+    return rows.astype({'FULL_DATETIME': 'datetime64[ns]', **{dim: object for dim in ROLLUP_DIMENSIONS},
+                        **{metric: float for metric in metrics}})
+
+def history_rows(df, metrics):
+    """
+    Lignes historisées d'une source : dimensions (None si absentes, texte sinon), FULL_DATETIME et métriques.
+    Seules ces colonnes sont conservées dans le niveau brut.
+    """
+    columns = ROLLUP_DIMENSIONS + ['FULL_DATETIME'] + list(metrics)
+    if df.empty or 'FULL_DATETIME' not in df.columns:
+        return pd.DataFrame({col: pd.Series(dtype='datetime64[ns]' if col == 'FULL_DATETIME' else
+                                            float if col in metrics else object) for col in columns})
+    rows = df[[col for col in columns if col in df.columns]].dropna(subset=['FULL_DATETIME'])
+    rows = rows.assign(**{dim: rows[dim].astype(str).astype(object) if dim in rows.columns else None
+                          for dim in ROLLUP_DIMENSIONS},
+                       **{metric: rows[metric].astype(float) if metric in rows.columns else np.nan for metric in metrics})
+    return _row_dtypes(rows[columns].reset_index(drop=True), metrics)
+
+class Rollup:
+    """
+    Agrégats d'un niveau : `frame` (dimensions, PERIOD puis COUNT/SUM/MIN/MAX par métrique) et
+    `sketches` {métrique: matrice lignes x seaux}, alignés ligne à ligne sur `frame`.
+    """
+
+    def __init__(self, frame, sketches):
+        self.frame = frame
+        self.sketches = sketches
+
+    @classmethod
+    def empty(cls, metrics):
+        columns = {dim: pd.Series(dtype=object) for dim in ROLLUP_DIMENSIONS}
+        columns['PERIOD'] = pd.Series(dtype='datetime64[ns]')
+        for metric in metrics:
+            columns.update({col: pd.Series(dtype=float) for col in _stat_columns(metric)})
+        return cls(pd.DataFrame(columns), {metric: np.zeros((0, SKETCH_BUCKETS), dtype=SKETCH_DTYPE) for metric in metrics})
+
+    @classmethod
+    def from_rows(cls, rows, metrics, freq):
+        """Agrège des lignes brutes (history_rows) par dimensions et période `freq` ('h', 'D')."""
+        if rows.empty:
+            return cls.empty(metrics)
+        rows = rows.assign(PERIOD=rows['FULL_DATETIME'].dt.floor(freq))
+        codes, first = _group_codes(rows, ROLLUP_DIMENSIONS + ['PERIOD'])
+        grouped = rows.groupby(codes)
+        frame = rows[ROLLUP_DIMENSIONS + ['PERIOD']].iloc[first].reset_index(drop=True)
+        sketches = {}
+        for metric in metrics:
+            for stat, values in zip(ROLLUP_STATS, (grouped[metric].count(), grouped[metric].sum(),
+                                                   grouped[metric].min(), grouped[metric].max())):
+                frame[f"{metric}_{stat}"] = values.to_numpy(dtype=float)
+            valid = rows[metric].notna().to_numpy()
+            flat = codes[valid] * SKETCH_BUCKETS + sketch_buckets(rows[metric].to_numpy()[valid])
+            sketches[metric] = np.bincount(flat, minlength=len(first) * SKETCH_BUCKETS).reshape(len(first), SKETCH_BUCKETS).astype(SKETCH_DTYPE)
+        return cls(frame, sketches)
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def metrics(self):
+        return list(self.sketches)
+
+    def take(self, mask):
+        """Sous-ensemble de lignes (masque booléen ou positions)."""
+        return Rollup(self.frame[mask].reset_index(drop=True) if isinstance(mask, np.ndarray) and mask.dtype == bool
+                      else self.frame.iloc[mask].reset_index(drop=True),
+                      {metric: sketch[mask] for metric, sketch in self.sketches.items()})
+
+    def concat(self, other):
+        return Rollup(pd.concat([self.frame, other.frame], ignore_index=True),
+                      {metric: np.concatenate([self.sketches[metric], other.sketches[metric]]) for metric in self.sketches})
+
+    def regroup(self, freq=None, keys=None):
+        """
+        Fusionne les lignes de même clé : `freq` élargit la période (ex. 'D'), `keys` restreint les dimensions
+        conservées (PERIOD toujours incluse). Effectifs et sommes s'additionnent, sketches aussi.
+        """
+        keys = ROLLUP_DIMENSIONS if keys is None else keys
+        frame = self.frame if freq is None else self.frame.assign(PERIOD=self.frame['PERIOD'].dt.floor(freq))
+        if frame.empty:
+            return Rollup(frame[keys + ['PERIOD'] + [col for m in self.metrics for col in _stat_columns(m)]], self.sketches)
+        codes, first = _group_codes(frame, keys + ['PERIOD'])
+        grouped = frame.groupby(codes)
+        regrouped = frame[keys + ['PERIOD']].iloc[first].reset_index(drop=True)
+        for metric in self.metrics:
+            for stat, agg in zip(ROLLUP_STATS, ('sum', 'sum', 'min', 'max')):
+                column = f"{metric}_{stat}"
+                regrouped[column] = grouped[column].agg(agg).to_numpy()
+        return Rollup(regrouped, {metric: _sum_rows(sketch, codes, len(first)) for metric, sketch in self.sketches.items()})
+
+def _append_rollup(existing, new):
+    """Ajoute des agrégats à un niveau ; fusionne seulement si les nouvelles périodes recouvrent les anciennes."""
+    if not len(new):
+        return existing
+    combined = existing.concat(new)
+    if len(existing) and new.frame['PERIOD'].min() <= existing.frame['PERIOD'].max():
+        combined = combined.regroup()
+    return combined
+
+def _selection_mask(frame, time_column, start, end, selections):
+    mask = np.ones(len(frame), dtype=bool)
+    if start is not None:
+        mask &= (frame[time_column] >= start).to_numpy()
+    if end is not None:
+        mask &= (frame[time_column] < end).to_numpy()
+    for dim, values in (selections or {}).items():
+        if values:
+            mask &= frame[dim].isin(values).to_numpy()
+    return mask
+
+class TieredHistory:
+    """
+    Historique hiérarchisé de chaque source de HISTORY_SOURCES : `raw` (lignes brutes récentes),
+    `hourly` et `daily` (Rollup). Les seuils de rétention sont relatifs au dernier horodatage intégré,
+    pas à l'horloge : un jeu d'exports ancien garde sa fenêtre récente au niveau brut.
+    """
+
+    def __init__(self, sources=None, raw_retention=RAW_RETENTION, hourly_retention=HOURLY_RETENTION):
+        self.sources = dict(HISTORY_SOURCES if sources is None else sources)
+        self.raw_retention = raw_retention
+        self.hourly_retention = hourly_retention
+        self.raw = {source: history_rows(pd.DataFrame(), metrics) for source, metrics in self.sources.items()}
+        self.hourly = {source: Rollup.empty(metrics) for source, metrics in self.sources.items()}
+        self.daily = {source: Rollup.empty(metrics) for source, metrics in self.sources.items()}
+        # Dernier horodatage intégré par (source, système) : une relecture du même export n'ajoute rien.
+        self.watermarks = {source: {} for source in self.sources}
+        # Cumul des lignes tardives écartées par ingest (antérieures au niveau brut, donc non dédoublonnables).
+        self.rejected = {source: 0 for source in self.sources}
+
+    def copy(self):
+        """Copie légère : niveaux partagés, dictionnaires propres (ingest et compact remplacent les niveaux sans les modifier)."""
+        history = TieredHistory(self.sources, self.raw_retention, self.hourly_retention)
+        history.raw, history.hourly, history.daily = dict(self.raw), dict(self.hourly), dict(self.daily)
+        history.watermarks = {source: dict(marks) for source, marks in self.watermarks.items()}
+        history.rejected = dict(self.rejected)
+        return history
+
+    def ingest(self, source, df):
+        """
+        Intègre les nouvelles lignes d'une source ; retourne leur nombre. Les lignes postérieures au dernier
+        horodatage connu de leur système sont ajoutées ; les autres (même horodatage, arrivées en retard, relecture
+        d'un export) sont comparées aux lignes brutes conservées et seules les occurrences absentes sont ajoutées.
+        Les lignes antérieures au niveau brut (déjà compacté) ne peuvent pas être dédoublonnées : elles sont écartées
+        et comptées dans `rejected`.
+        """
+        rows = history_rows(df, self.sources[source])
+        if rows.empty:
+            return 0
+        systems = rows['SYSTEM'].fillna('').to_numpy()
+        marks = self.watermarks[source]
+        thresholds = pd.to_datetime(pd.Series(systems).map(marks))
+        after = (thresholds.isna() | (rows['FULL_DATETIME'] > thresholds)).to_numpy()
+        keep = after.copy()
+        if not after.all():
+            latest = self.latest()
+            raw_cutoff = (latest - self.raw_retention).floor('h')
+            too_old = ~after & (rows['FULL_DATETIME'] < raw_cutoff).to_numpy()
+            self.rejected[source] += int(too_old.sum())
+            overlap = ~after & ~too_old
+            if overlap.any():
+                keep[overlap] = self._absent_from_raw(source, rows[overlap])
+        new = rows[keep]
+        if new.empty:
+            return 0
+        latest = new['FULL_DATETIME'].groupby(new['SYSTEM'].fillna('').to_numpy()).max()
+        marks.update(latest.to_dict())
+        self.raw[source] = pd.concat([self.raw[source], new], ignore_index=True)
+        return len(new)
+
+    def _absent_from_raw(self, source, candidates):
+        """
+        Masque des lignes candidates absentes du niveau brut, par identité de ligne (dimensions, horodatage,
+        métriques). Une ligne présente k fois n'est ajoutée qu'au-delà de ses k occurrences déjà conservées.
+        """
+        raw = self.raw[source]
+        existing = raw[(raw['FULL_DATETIME'] >= candidates['FULL_DATETIME'].min()).to_numpy()]
+        candidate_hashes = pd.Series(pd.util.hash_pandas_object(candidates, index=False).to_numpy())
+        existing_counts = pd.util.hash_pandas_object(existing[candidates.columns], index=False).value_counts()
+        occurrence = candidate_hashes.groupby(candidate_hashes).cumcount()
+        return (occurrence >= candidate_hashes.map(existing_counts).fillna(0)).to_numpy()
+
+    def latest(self):
+        """Dernier horodatage intégré, toutes sources confondues (None si l'historique est vide)."""
+        marks = [mark for source_marks in self.watermarks.values() for mark in source_marks.values()]
+        return max(marks) if marks else None
+
+    def compact(self, now=None):
+        """Bascule les lignes brutes hors fenêtre vers l'horaire, puis l'horaire hors fenêtre vers le journalier."""
+        now = self.latest() if now is None else now
+        if now is None:
+            return
+        raw_cutoff = (now - self.raw_retention).floor('h')
+        daily_cutoff = (now - self.hourly_retention).floor('D')
+        for source, metrics in self.sources.items():
+            raw = self.raw[source]
+            expired = (raw['FULL_DATETIME'] < raw_cutoff).to_numpy()
+            if expired.any():
+                self.hourly[source] = _append_rollup(self.hourly[source], Rollup.from_rows(raw[expired], metrics, 'h'))
+                self.raw[source] = raw[~expired].reset_index(drop=True)
+            hourly = self.hourly[source]
+            expired = (hourly.frame['PERIOD'] < daily_cutoff).to_numpy()
+            if expired.any():
+                self.daily[source] = _append_rollup(self.daily[source], hourly.take(expired).regroup('D'))
+                self.hourly[source] = hourly.take(~expired)
+
+    def trend(self, source, metric, start=None, end=None, selections=None, quantiles=(0.5, 0.95)):
+        """
+        Série temporelle de `metric` sur les trois niveaux : un point par jour (journalier), par heure
+        (horaire) et par heure recalculée depuis les lignes brutes récentes. Colonnes PERIOD, TIER, COUNT,
+        MEAN et P50/P95 (sketches). `selections` : {dimension: valeurs retenues}.
+        """
+        parts = []
+        for tier, rollup in (('daily', self.daily[source]), ('hourly', self.hourly[source])):
+            parts.append((tier, rollup.take(_selection_mask(rollup.frame, 'PERIOD', start, end, selections))))
+        raw = self.raw[source]
+        raw = raw[_selection_mask(raw, 'FULL_DATETIME', start, end, selections)]
+        parts.append(('raw', Rollup.from_rows(raw, self.sources[source], 'h')))
+
+        frames = []
+        for tier, rollup in parts:
+            if not len(rollup):
+                continue
+            per_period = rollup.regroup(keys=[])
+            frame = pd.DataFrame({'PERIOD': per_period.frame['PERIOD'], 'TIER': tier,
+                                  'COUNT': per_period.frame[f"{metric}_COUNT"],
+                                  'MEAN': per_period.frame[f"{metric}_SUM"] / per_period.frame[f"{metric}_COUNT"]})
+            for q in quantiles:
+                frame[f"P{round(q * 100)}"] = sketch_quantiles(per_period.sketches[metric], q)
+            frames.append(frame)
+        columns = ['PERIOD', 'TIER', 'COUNT', 'MEAN'] + [f"P{round(q * 100)}" for q in quantiles]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True).sort_values('PERIOD', kind='mergesort').reset_index(drop=True)[columns]
+
+    def stats(self):
+        """Nombre de lignes de chaque niveau et de lignes tardives écartées, par source."""
+        return pd.DataFrame([{'SOURCE': source, 'RAW': len(self.raw[source]), 'HOURLY': len(self.hourly[source]),
+                              'DAILY': len(self.daily[source]), 'REJECTED': self.rejected[source]}
+                             for source in self.sources])
+
+    def save(self, directory):
+        """Écrit chaque niveau (Parquet, sketches .npz) puis les horodatages ; chaque fichier est remplacé atomiquement."""
+        os.makedirs(directory, exist_ok=True)
+        for source in self.sources:
+            _replace_parquet(self.raw[source], os.path.join(directory, f"{source}.raw.parquet"))
+            for tier, rollup in (('hourly', self.hourly[source]), ('daily', self.daily[source])):
+                _replace_parquet(rollup.frame, os.path.join(directory, f"{source}.{tier}.parquet"))
+                sketch_path = os.path.join(directory, f"{source}.{tier}.sketches.npz")
+                with open(sketch_path + ".tmp", "wb") as sketch_file:
+                    np.savez_compressed(sketch_file, **rollup.sketches)
+                os.replace(sketch_path + ".tmp", sketch_path)
+        watermarks = {source: {system: mark.isoformat() for system, mark in marks.items()}
+                      for source, marks in self.watermarks.items()}
+        with open(os.path.join(directory, "watermarks.json.tmp"), "w", encoding="utf-8") as marks_file:
+            json.dump(watermarks, marks_file)
+        os.replace(os.path.join(directory, "watermarks.json.tmp"), os.path.join(directory, "watermarks.json"))
+        with open(os.path.join(directory, "rejected.json.tmp"), "w", encoding="utf-8") as rejected_file:
+            json.dump(self.rejected, rejected_file)
+        os.replace(os.path.join(directory, "rejected.json.tmp"), os.path.join(directory, "rejected.json"))
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        """Historique enregistré dans `directory` ; un historique vide si le dossier n'en contient pas."""
+        history = cls(**kwargs)
+        marks_path = os.path.join(directory, "watermarks.json")
+        if not os.path.exists(marks_path):
+            return history
+        with open(marks_path, encoding="utf-8") as marks_file:
+            history.watermarks.update({source: {system: pd.Timestamp(mark) for system, mark in marks.items()}
+                                       for source, marks in json.load(marks_file).items() if source in history.sources})
+        rejected_path = os.path.join(directory, "rejected.json")
+        if os.path.exists(rejected_path):
+            with open(rejected_path, encoding="utf-8") as rejected_file:
+                history.rejected.update({source: count for source, count in json.load(rejected_file).items()
+                                         if source in history.sources})
+        for source in history.sources:
+            raw_path = os.path.join(directory, f"{source}.raw.parquet")
+            if os.path.exists(raw_path):
+                history.raw[source] = _row_dtypes(pd.read_parquet(raw_path), history.sources[source])
+            for tier in ('hourly', 'daily'):
+                frame_path = os.path.join(directory, f"{source}.{tier}.parquet")
+                if os.path.exists(frame_path):
+                    with np.load(os.path.join(directory, f"{source}.{tier}.sketches.npz")) as sketches:
+                        rollup = Rollup(pd.read_parquet(frame_path), {metric: sketches[metric] for metric in sketches.files})
+                    getattr(history, tier)[source] = rollup
+        return history
+
+def _replace_parquet(df, path):
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def update_history(directory, dfs):
+    """
+    Charge l'historique de `directory`, y intègre les nouvelles lignes des sources, compacte puis enregistre.
+    Un verrou fichier sérialise les processus Streamlit d'un même hôte.
+    """
+    import fcntl  # POSIX uniquement, comme le stockage partagé des snapshots
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "history.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            history = TieredHistory.load(directory)
+            rejected = sum(history.rejected.values())
+            added = sum(history.ingest(source, dfs.get(source, pd.DataFrame())) for source in history.sources)
+            if added or sum(history.rejected.values()) != rejected:
+                history.compact()
+                history.save(directory)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return history
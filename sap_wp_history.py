@@ -0,0 +1,271 @@
+"""
+Série temporelle des snapshots AL_GET_PERFORMANCE successifs, indépendante de Streamlit.
+
+Chaque ingestion compare la table des processus de travail à l'état précédent de chaque (instance, WP_NO)
+et n'enregistre que les WPs qui ont changé (PID, statut, type, attente, temps CPU ou redémarrages).
+Le temps CPU et le compteur de redémarrages sont stockés en delta (CPU_DELTA, RESTART_DELTA) ; un
+changement de PID ou un compteur qui décroît signale un redémarrage du processus. Avec la liste des
+instants de snapshot par instance, le journal des changements suffit à reconstituer l'état de chaque WP
+à tout instant. Il est persisté en colonnes (Arrow IPC compressé) dans SAP_DASHBOARD_WP_HISTORY_DIR.
+
+Alimentation : à chaque reconstruction du snapshot (export de performance remplacé), ou en rattrapage :
+    python sap_wp_history.py DOSSIER_HISTORIQUE export_0800.xlsx export_0801.xlsx ...
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+WP_HISTORY_DIR = os.environ.get("SAP_DASHBOARD_WP_HISTORY_DIR", "")
+# Statuts où le processus est occupé (en traitement ou en attente d'une ressource tout en restant alloué).
+WP_BUSY_STATUSES = ('Running', 'On Hold', 'Hold')
+# Statut enregistré quand un WP disparaît d'un snapshot (instance redémarrée avec moins de processus).
+WP_ABSENT_STATUS = ''
+
+WP_STATE_COLUMNS = ['WP_TYP', 'WP_PID', 'WP_STATUS', 'WP_CPU_SECONDS', 'WP_IWAIT_SECONDS', 'WP_IRESTRT']
+CHANGE_DTYPES = {
+    'TIMESTAMP': 'datetime64[ns]', 'INSTANCE': object, 'WP_NO': 'int32', 'WP_TYP': object, 'WP_PID': 'float64',
+    'WP_STATUS': object, 'CPU_DELTA': 'float32', 'WP_IWAIT_SECONDS': 'float32', 'RESTART_DELTA': 'int32', 'PID_CHANGED': bool,
+}
+SNAPSHOT_DTYPES = {'INSTANCE': object, 'TIMESTAMP': 'datetime64[ns]', 'WPS': 'int32'}
+
+def _typed_frame(dtypes, data=None):
+    data = data or {}
+    return pd.DataFrame({col: pd.Series(data.get(col, []), dtype=dtype) for col, dtype in dtypes.items()})
+
+def wp_state(df_perf):
+    """État courant de chaque WP (index WP_NO entier) : type, PID, statut, CPU et attente en secondes, redémarrages."""
+    if df_perf.empty or 'WP_NO' not in df_perf.columns:
+        return pd.DataFrame({col: pd.Series(dtype=object if col in ('WP_TYP', 'WP_STATUS') else float) for col in WP_STATE_COLUMNS},
+                            index=pd.Index([], dtype='int32', name='WP_NO'))
+    df = df_perf.dropna(subset=['WP_NO']).drop_duplicates('WP_NO', keep='last')
+    state = pd.DataFrame(index=pd.Index(df['WP_NO'].astype('int32').to_numpy(), name='WP_NO'))
+    for col in ('WP_TYP', 'WP_STATUS'):
+        state[col] = df[col].fillna('').astype(str).to_numpy() if col in df.columns else ''
+    for col in ('WP_PID', 'WP_CPU_SECONDS', 'WP_IWAIT_SECONDS', 'WP_IRESTRT'):
+        state[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=float) if col in df.columns else 0.0
+    return state[WP_STATE_COLUMNS]
+
+class WorkProcessHistory:
+    """
+    Journal des changements des WPs (`changes`), instants de snapshot par instance (`snapshots`) et dernier
+    état connu par instance (`state`, conservé en valeurs absolues pour calculer les deltas suivants).
+    """
+
+    def __init__(self):
+        self._changes = [_typed_frame(CHANGE_DTYPES)]
+        self._snapshots = [_typed_frame(SNAPSHOT_DTYPES)]
+        self.state = {}
+        self._last_timestamps = {}
+
+    @property
+    def changes(self):
+        # Les ajouts sont accumulés puis concaténés à la lecture : une ingestion ne recopie pas tout le journal.
+        if len(self._changes) > 1:
+            self._changes = [pd.concat(self._changes, ignore_index=True)]
+        return self._changes[0]
+
+    @property
+    def snapshots(self):
+        if len(self._snapshots) > 1:
+            self._snapshots = [pd.concat(self._snapshots, ignore_index=True)]
+        return self._snapshots[0]
+
+    def last_timestamp(self, instance):
+        """Instant du dernier snapshot intégré pour `instance` (None si aucun)."""
+        return self._last_timestamps.get(instance)
+
+    def ingest(self, df_perf, timestamp, instance=''):
+        """
+        Intègre un snapshot pris à `timestamp` ; ignoré s'il n'est pas postérieur au dernier de l'instance.
+        Retourne le nombre de WPs enregistrés comme changés (None si le snapshot est ignoré).
+        """
+        timestamp = pd.Timestamp(timestamp)
+        last = self.last_timestamp(instance)
+        if last is not None and timestamp <= last:
+            return None
+        current = wp_state(df_perf)
+        previous = self.state.get(instance, wp_state(pd.DataFrame()))
+        cur = {col: current[col].to_numpy() for col in WP_STATE_COLUMNS}
+        positions = previous.index.get_indexer(current.index)
+        known = positions >= 0
+        # Un WP inconnu jusque-là sert de référence : ses compteurs absolus ne comptent pas comme delta.
+        prev = {col: np.where(known, previous[col].to_numpy()[positions.clip(0)] if len(previous) else cur[col], cur[col])
+                for col in WP_STATE_COLUMNS}
+
+        pid_changed = known & (cur['WP_PID'] != prev['WP_PID'])
+        cpu_delta = cur['WP_CPU_SECONDS'] - prev['WP_CPU_SECONDS']
+        cpu_delta = np.where(pid_changed | (cpu_delta < 0), cur['WP_CPU_SECONDS'], cpu_delta)
+        restart_delta = cur['WP_IRESTRT'] - prev['WP_IRESTRT']
+        restart_delta = np.where(restart_delta < 0, cur['WP_IRESTRT'], restart_delta)
+        changed = (~known | pid_changed | (cpu_delta != 0) | (restart_delta != 0) | (cur['WP_STATUS'] != prev['WP_STATUS'])
+                   | (cur['WP_TYP'] != prev['WP_TYP']) | (cur['WP_IWAIT_SECONDS'] != prev['WP_IWAIT_SECONDS']))
+        gone = previous[~previous.index.isin(current.index) & (previous['WP_STATUS'] != WP_ABSENT_STATUS)]
+        n_changes = int(changed.sum()) + len(gone)
+        self._changes.append(pd.DataFrame({
+            'TIMESTAMP': np.full(n_changes, timestamp.to_datetime64(), dtype='datetime64[ns]'),
+            'INSTANCE': np.full(n_changes, instance, dtype=object),
+            'WP_NO': np.concatenate([current.index.to_numpy()[changed], gone.index.to_numpy()]).astype('int32'),
+            'WP_TYP': np.concatenate([cur['WP_TYP'][changed], gone['WP_TYP'].to_numpy()]),
+            'WP_PID': np.concatenate([cur['WP_PID'][changed], gone['WP_PID'].to_numpy()]).astype('float64'),
+            'WP_STATUS': np.concatenate([cur['WP_STATUS'][changed], np.full(len(gone), WP_ABSENT_STATUS, dtype=object)]),
+            'CPU_DELTA': np.concatenate([cpu_delta[changed], np.zeros(len(gone))]).astype('float32'),
+            'WP_IWAIT_SECONDS': np.concatenate([cur['WP_IWAIT_SECONDS'][changed], np.zeros(len(gone))]).astype('float32'),
+            'RESTART_DELTA': np.concatenate([restart_delta[changed], np.zeros(len(gone))]).astype('int32'),
+            'PID_CHANGED': np.concatenate([pid_changed[changed], np.zeros(len(gone), dtype=bool)]),
+        }))
+        self._snapshots.append(pd.DataFrame({'INSTANCE': np.array([instance], dtype=object),
+                                             'TIMESTAMP': np.array([timestamp.to_datetime64()], dtype='datetime64[ns]'),
+                                             'WPS': np.array([len(current)], dtype='int32')}))
+        self.state[instance] = pd.concat([current, gone.assign(WP_STATUS=WP_ABSENT_STATUS)]) if len(gone) else current
+        self._last_timestamps[instance] = timestamp
+        return n_changes
+
+    def save(self, directory):
+        """Écrit journal, snapshots et derniers états (Arrow IPC zstd) ; chaque fichier est remplacé atomiquement."""
+        os.makedirs(directory, exist_ok=True)
+        states = [state.reset_index().assign(INSTANCE=instance) for instance, state in self.state.items()]
+        frames = {
+            'wp_changes.arrow': self.changes,
+            'wp_snapshots.arrow': self.snapshots,
+            'wp_state.arrow': pd.concat(states, ignore_index=True) if states else wp_state(pd.DataFrame()).reset_index().assign(INSTANCE=''),
+        }
+        for name, df in frames.items():
+            path = os.path.join(directory, name)
+            feather.write_feather(df, path + ".tmp", compression='zstd')
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory):
+        """Historique enregistré dans `directory` ; un historique vide s'il n'y en a pas."""
+        history = cls()
+        if not os.path.exists(os.path.join(directory, 'wp_state.arrow')):
+            return history
+        history._changes = [feather.read_feather(os.path.join(directory, 'wp_changes.arrow')).astype(CHANGE_DTYPES)]
+        history._snapshots = [feather.read_feather(os.path.join(directory, 'wp_snapshots.arrow')).astype(SNAPSHOT_DTYPES)]
+        states = feather.read_feather(os.path.join(directory, 'wp_state.arrow'))
+        history.state = {instance: state.drop(columns='INSTANCE').set_index('WP_NO')[WP_STATE_COLUMNS]
+                         for instance, state in states.groupby('INSTANCE', sort=False)}
+        history._last_timestamps = history.snapshots.groupby('INSTANCE')['TIMESTAMP'].max().to_dict()
+        return history
+
+def update_wp_history(directory, snapshots):
+    """
+    Charge l'historique de `directory`, y intègre les snapshots [(instance, horodatage, DataFrame performance)]
+    et l'enregistre s'il a changé. Un verrou fichier sérialise les processus Streamlit d'un même hôte.
+    """
+    import fcntl  # POSIX uniquement, comme le stockage partagé des snapshots
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "wp_history.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            history = WorkProcessHistory.load(directory)
+            ingested = [history.ingest(df, timestamp, instance) for instance, timestamp, df in sorted(snapshots, key=lambda s: s[1])]
+            if any(result is not None for result in ingested):
+                history.save(directory)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return history
+
+# --- Lectures : débit CPU, WPs occupés, redémarrages ---
+
+def _select(df, instances=None, wp_types=None):
+    if instances:
+        df = df[df['INSTANCE'].isin(instances)]
+    if wp_types is not None and 'WP_TYP' in df.columns and wp_types:
+        df = df[df['WP_TYP'].isin(wp_types)]
+    return df
+
+def wp_cpu_rate(history, freq='5min', instances=None, wp_types=None):
+    """
+    Temps CPU consommé par WP et période `freq` (CPU_SECONDS) et débit CPU (CPU_RATE, secondes CPU par seconde).
+    Le delta d'un changement est attribué au milieu de l'intervalle depuis le snapshot précédent de l'instance.
+    """
+    changes = _select(history.changes, instances, wp_types)
+    changes = changes[changes['CPU_DELTA'] > 0].sort_values('TIMESTAMP')
+    if changes.empty:
+        return pd.DataFrame(columns=['INSTANCE', 'WP_NO', 'WP_TYP', 'PERIOD', 'CPU_SECONDS', 'CPU_RATE'])
+    snapshots = history.snapshots[['INSTANCE', 'TIMESTAMP']].sort_values('TIMESTAMP').rename(columns={'TIMESTAMP': 'PREVIOUS'})
+    intervals = pd.merge_asof(changes, snapshots, left_on='TIMESTAMP', right_on='PREVIOUS', by='INSTANCE', allow_exact_matches=False)
+    start = intervals['PREVIOUS'].fillna(intervals['TIMESTAMP'])
+    intervals['PERIOD'] = (start + (intervals['TIMESTAMP'] - start) / 2).dt.floor(freq)
+    rate = (intervals.groupby(['INSTANCE', 'WP_NO', 'WP_TYP', 'PERIOD'], sort=False)['CPU_DELTA'].sum()
+                     .astype(float).rename('CPU_SECONDS').reset_index())
+    rate['CPU_RATE'] = rate['CPU_SECONDS'] / pd.Timedelta(freq).total_seconds()
+    return rate.sort_values(['INSTANCE', 'WP_NO', 'PERIOD']).reset_index(drop=True)
+
+def _ordered_changes(history, instances=None):
+    changes = _select(history.changes, instances).sort_values(['INSTANCE', 'WP_NO', 'TIMESTAMP'], kind='mergesort')
+    busy = changes['WP_STATUS'].isin(WP_BUSY_STATUSES).astype(int)
+    per_wp = changes.groupby(['INSTANCE', 'WP_NO'], sort=False)
+    return changes.assign(BUSY=busy, BUSY_BEFORE=busy.groupby([changes['INSTANCE'], changes['WP_NO']]).shift(fill_value=0),
+                          TYP_BEFORE=per_wp['WP_TYP'].shift().fillna(changes['WP_TYP']),
+                          NEXT_CHANGE=per_wp['TIMESTAMP'].shift(-1))
+
+def wp_busy_counts(history, instances=None, wp_types=None):
+    """Nombre de WPs occupés par (instance, WP_TYP) à chaque instant de snapshot, au format long."""
+    changes = _ordered_changes(history, instances)
+    delta = changes['BUSY'] - changes['BUSY_BEFORE']
+    # Une sortie d'occupation est comptée sur le type du WP au début de l'occupation.
+    events = changes[delta != 0].assign(DELTA=delta[delta != 0],
+                                        WP_TYP=lambda df: df['WP_TYP'].where(df['DELTA'] > 0, df['TYP_BEFORE']))
+    events = _select(events, wp_types=wp_types)
+    frames = []
+    for instance, snapshots in _select(history.snapshots, instances).groupby('INSTANCE', sort=False):
+        times = pd.DatetimeIndex(snapshots['TIMESTAMP'].sort_values().unique())
+        instance_events = events[events['INSTANCE'] == instance]
+        if instance_events.empty:
+            continue
+        levels = (instance_events.pivot_table(index='TIMESTAMP', columns='WP_TYP', values='DELTA', aggfunc='sum')
+                                 .fillna(0).cumsum())
+        levels = levels.reindex(levels.index.union(times)).ffill().fillna(0).loc[times]
+        frames.append(levels.rename_axis('TIMESTAMP').reset_index()
+                            .melt(id_vars='TIMESTAMP', var_name='WP_TYP', value_name='BUSY').assign(INSTANCE=instance))
+    if not frames:
+        return pd.DataFrame(columns=['INSTANCE', 'TIMESTAMP', 'WP_TYP', 'BUSY'])
+    return pd.concat(frames, ignore_index=True)[['INSTANCE', 'TIMESTAMP', 'WP_TYP', 'BUSY']]
+
+def wp_activity(history, instances=None, wp_types=None):
+    """
+    Bilan par WP sur la période couverte : temps CPU, temps occupé (somme des intervalles entre changements
+    passés dans un statut occupé, jusqu'au dernier snapshot de l'instance), redémarrages et changements de PID.
+    """
+    changes = _ordered_changes(history, instances)
+    if changes.empty:
+        return pd.DataFrame(columns=['INSTANCE', 'WP_NO', 'WP_TYP', 'CPU_SECONDS', 'BUSY_SECONDS', 'RESTARTS', 'PID_CHANGES'])
+    last_snapshot = history.snapshots.groupby('INSTANCE')['TIMESTAMP'].max()
+    end = changes['NEXT_CHANGE'].fillna(changes['INSTANCE'].map(last_snapshot))
+    changes = changes.assign(BUSY_SECONDS=(end - changes['TIMESTAMP']).dt.total_seconds() * changes['BUSY'])
+    activity = (changes.groupby(['INSTANCE', 'WP_NO'], sort=False)
+                       .agg(WP_TYP=('WP_TYP', 'last'), CPU_SECONDS=('CPU_DELTA', 'sum'), BUSY_SECONDS=('BUSY_SECONDS', 'sum'),
+                            RESTARTS=('RESTART_DELTA', 'sum'), PID_CHANGES=('PID_CHANGED', 'sum'))
+                       .reset_index())
+    activity['CPU_SECONDS'] = activity['CPU_SECONDS'].astype(float)
+    return _select(activity, wp_types=wp_types).sort_values('CPU_SECONDS', ascending=False).reset_index(drop=True)
+
+def wp_restart_events(history, instances=None, wp_types=None):
+    """Changements signalant un redémarrage : compteur WP_IRESTRT incrémenté ou nouveau PID."""
+    changes = _select(history.changes, instances, wp_types)
+    return changes[(changes['RESTART_DELTA'] > 0) | changes['PID_CHANGED']].sort_values('TIMESTAMP').reset_index(drop=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Intègre des exports AL_GET_PERFORMANCE successifs à l'historique des processus de travail.")
+    parser.add_argument('directory', help="Dossier de l'historique (SAP_DASHBOARD_WP_HISTORY_DIR).")
+    parser.add_argument('files', nargs='+', help="Exports de performance ; horodatés par leur date de modification.")
+    parser.add_argument('--instance', default='', help="Instance (système) des exports.")
+    args = parser.parse_args(argv)
+
+    import sap_analytics as sa  # nettoyage identique au dashboard ; import tardif (sap_analytics importe ce module)
+
+    snapshots = [(args.instance, pd.Timestamp.fromtimestamp(os.path.getmtime(path)),
+                  sa.clean_source_frame('performance', sa.read_source_file(path))) for path in args.files]
+    history = update_wp_history(args.directory, snapshots)
+    print(f"[wp-history] {len(history.snapshots)} snapshots, {len(history.changes)} changements enregistrés dans {args.directory}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""Les modules du dashboard sont à la racine du dépôt (pas de paquet) : la racine est ajoutée au chemin d'import."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,325 @@
+"""Tests des agrégations et caches de sap_analytics sur des données synthétiques (sans Streamlit)."""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import sap_analytics as sa
+
+# --- Prévision mémoire (memory_forecast) ---
+
+def synthetic_memory(n_series=30, days=21, seed=0):
+    """Séries horaires compte x type de tâche : niveau + croissance linéaire connue + saisonnalité journalière + bruit."""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range('2025-05-01', periods=24 * days, freq='h')
+    accounts = np.array([f"ACC{i:03d}" for i in range(n_series)])
+    tasktypes = np.array(['DIALOG', 'BACKGROUND', 'RFC'])[np.arange(n_series) % 3]
+    base = rng.uniform(1e6, 5e7, n_series)
+    growth = rng.normal(0, 2e5, n_series)
+    growth[7] = 5e6
+    t = np.arange(len(hours)) / 24
+    daily = np.sin(2 * np.pi * hours.hour.to_numpy() / 24)
+    values = base[:, None] + growth[:, None] * t + 0.2 * base[:, None] * daily + rng.normal(0, 1e5, (n_series, len(hours)))
+    observed = rng.random(values.shape) < 0.7
+    series, hour = np.nonzero(observed)
+    df = pd.DataFrame({'ACCOUNT': accounts[series], 'TASKTYPE': tasktypes[series],
+                       'FULL_DATETIME': hours[hour] + pd.Timedelta(minutes=5), 'USEDBYTES': values[series, hour]})
+    truth = pd.DataFrame({'ACCOUNT': accounts, 'TASKTYPE': tasktypes, 'TRUE_GROWTH': growth})
+    return df, truth
+
+def test_memory_forecast_recovers_growth_rates():
+    df, truth = synthetic_memory()
+    forecast = sa.memory_forecast(df, 'USEDBYTES', horizon_hours=168)
+    merged = forecast['series'].merge(truth, on=['ACCOUNT', 'TASKTYPE'])
+    assert len(merged) == len(truth)
+    assert np.corrcoef(merged['TRUE_GROWTH'], merged['GROWTH_PER_DAY'])[0, 1] > 0.999
+    assert (merged['GROWTH_PER_DAY'] - merged['TRUE_GROWTH']).abs().max() < 5e4
+    assert sa.memory_growth_drivers(forecast['series'])['ACCOUNT'].iloc[0] == 'ACC007'
+    assert set(forecast['total']['SERIE']) >= {'Observé', 'Ajusté', 'Prévu'}
+
+def test_memory_forecast_flags_limit_exhaustion():
+    df, _ = synthetic_memory()
+    forecast = sa.memory_forecast(df, 'USEDBYTES', horizon_hours=24 * 30, limit=df['USEDBYTES'].max() * 1.2)
+    exhausted = forecast['series'].dropna(subset=['EXHAUSTION_AT'])
+    assert 'ACC007' in set(exhausted['ACCOUNT'])
+    assert (exhausted['EXHAUSTION_AT'] > df['FULL_DATETIME'].max()).all()
+
+def test_memory_forecast_needs_timestamps():
+    # Extrait mémoire livré avec le dépôt : pas de colonnes de date, aucune prévision possible.
+    df, _ = synthetic_memory(days=2)
+    assert sa.memory_forecast(df.drop(columns='FULL_DATETIME'), 'USEDBYTES') is None
+
+# --- Normalisation SQL (normalize_sql_statements) ---
+
+def test_normalize_sql_statements_replaces_placeholders_and_literals():
+    statements = pd.Series(["SELECT * FROM T WHERE A=$1 AND B=:1 AND C=@p1 AND D=:A0",
+                            "SELECT  * FROM T WHERE A=$2 AND B=:2 AND C=@p2 AND D=:A1",
+                            "SELECT * FROM T WHERE E IN (1, 2,3) AND F='x''y' AND G=-2.5e3 AND H1=4"])
+    normalized = sa.normalize_sql_statements(statements)
+    assert list(normalized) == ["SELECT * FROM T WHERE A=? AND B=? AND C=? AND D=?"] * 2 + [
+        "SELECT * FROM T WHERE E IN (?) AND F=? AND G=? AND H1=?"]
+    assert len(normalized.categories) == 2
+
+# --- Regroupement des calculs simultanés (SingleFlight) et cache des figures (FigureCache) ---
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition non atteinte"
+        time.sleep(0.005)
+
+def run_blocked(flights, kind, key_parts, result):
+    """Lance dans un thread un calcul de `flights` bloqué jusqu'à `release.set()` ; retourne (thread, release, sorties)."""
+    started, release, outputs = threading.Event(), threading.Event(), []
+
+    def compute():
+        started.set()
+        release.wait(5)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def target():
+        try:
+            outputs.append(flights.do(kind, key_parts, compute))
+        except BaseException as e:
+            outputs.append(e)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    assert started.wait(5)
+    return thread, release, outputs
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = sa.SingleFlight()
+    df = pd.DataFrame({'A': [1, 2]})
+    leader, release, leader_outputs = run_blocked(flights, 'filter', (df, 'x'), object())
+    follower_outputs = []
+    follower = threading.Thread(target=lambda: follower_outputs.append(flights.do('filter', (df.copy(), 'x'), lambda: 'recalcul')))
+    follower.start()
+    wait_until(lambda: flights.stats()['filter']['coalesced'] == 1)
+    assert flights.stats()['filter'] == {'executions': 1, 'coalesced': 1, 'in_flight': 1}
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert leader_outputs[0][1] is False and follower_outputs[0][1] is True
+    assert follower_outputs[0][0] is leader_outputs[0][0]
+    assert flights.stats()['filter']['in_flight'] == 0
+    # Une fois terminé, rien n'est gardé : un nouvel appel recalcule.
+    assert flights.do('filter', (df, 'x'), lambda: 'recalcul') == ('recalcul', False)
+    assert flights.do('filter', (df, 'y'), lambda: 'autre clé') == ('autre clé', False)
+
+def test_single_flight_propagates_errors_to_waiters():
+    flights = sa.SingleFlight()
+    leader, release, leader_outputs = run_blocked(flights, 'load', ('paths',), ValueError("fichier illisible"))
+    follower_outputs = []
+
+    def follower_target():
+        try:
+            flights.do('load', ('paths',), lambda: 'recalcul')
+        except ValueError as e:
+            follower_outputs.append(e)
+
+    follower = threading.Thread(target=follower_target)
+    follower.start()
+    wait_until(lambda: flights.stats()['load']['coalesced'] == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert isinstance(leader_outputs[0], ValueError)
+    assert follower_outputs == [leader_outputs[0]]
+    assert flights.do('load', ('paths',), lambda: 'relu') == ('relu', False)
+
+def test_single_flight_reentrant_and_unhashable_calls_compute_directly():
+    flights = sa.SingleFlight()
+    inner = flights.do('figures', ('clé',), lambda: flights.do('figures', ('clé',), lambda: 'interne'))
+    assert inner == (('interne', False), False)
+    assert flights.stats()['figures'] == {'executions': 2, 'coalesced': 0, 'in_flight': 0}
+    assert flights.do('figures', (pd.DataFrame({'A': [[1], [2]]}),), lambda: 'direct') == ('direct', False)
+
+def test_figure_cache_hits_misses_and_lru_eviction():
+    cache = sa.FigureCache(max_entries=2, flights=sa.SingleFlight())
+    builds = []
+
+    def build(name):
+        def builder():
+            builds.append(name)
+            return {'figure': name}
+        return builder
+
+    df = pd.DataFrame({'A': [1, 2, 3]})
+    first, hit = cache.get_or_build(('bar', df), build('a'))
+    assert not hit
+    assert cache.get_or_build(('bar', df.copy()), build('a')) == (first, True)
+    cache.get_or_build(('line', df), build('b'))
+    cache.get_or_build(('bar', df), build('a'))       # 'a' redevient la plus récente
+    cache.get_or_build(('scatter', df), build('c'))   # évince 'b'
+    assert cache.get_or_build(('bar', df), build('a'))[1]
+    assert not cache.get_or_build(('line', df), build('b'))[1]
+    assert builds == ['a', 'b', 'c', 'b']
+    assert cache.stats() == {'entries': 2, 'max_entries': 2, 'hits': 3, 'misses': 4, 'coalesced': 0}
+
+def test_figure_cache_coalesces_concurrent_builds():
+    flights = sa.SingleFlight()
+    cache = sa.FigureCache(flights=flights, name='figures')
+    started, release, outputs = threading.Event(), threading.Event(), []
+
+    def slow_build():
+        started.set()
+        release.wait(5)
+        return {'figure': 'lente'}
+
+    threads = [threading.Thread(target=lambda: outputs.append(cache.get_or_build(('bar', 'clé'), slow_build)))]
+    threads[0].start()
+    assert started.wait(5)
+    threads.append(threading.Thread(target=lambda: outputs.append(cache.get_or_build(('bar', 'clé'), slow_build))))
+    threads[1].start()
+    wait_until(lambda: flights.stats()['figures']['coalesced'] == 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert outputs[0][0] is outputs[1][0]
+    assert sorted(hit for _, hit in outputs) == [False, True]
+    assert cache.stats()['misses'] == 1 and cache.stats()['coalesced'] == 1
+
+# --- Explorateur de données (table_page) ---
+
+def explorer_frame(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 50, n).astype(float)
+    values[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({'RESPTI': values,
+                         'ACCOUNT': pd.Categorical(rng.choice(['alice', 'BOB', 'Carol', 'dave'], n)),
+                         'REPORT': rng.choice(['ZSALES', 'zstock', 'SAPMV45A', None], n),
+                         'FLAG': rng.random(n) < 0.5}, index=np.arange(n) * 10)
+
+@pytest.mark.parametrize('ascending', [True, False])
+@pytest.mark.parametrize('sort_by', ['RESPTI', 'REPORT', 'FLAG'])
+def test_table_page_matches_a_full_stable_sort(sort_by, ascending):
+    df = explorer_frame()
+    expected = df.sort_values(sort_by, ascending=ascending, kind='stable', na_position='last')
+    for page in (0, 3, 9):
+        rows, total = sa.table_page(df, page=page, page_size=100, sort_by=sort_by, ascending=ascending)
+        assert total == len(df)
+        pd.testing.assert_frame_equal(rows, expected.iloc[page * 100:(page + 1) * 100])
+
+def test_table_page_filters_and_paginates():
+    df = explorer_frame()
+    rows, total = sa.table_page(df, page=1, page_size=50, filter_column='ACCOUNT', filter_text='bo')
+    matching = df[df['ACCOUNT'] == 'BOB']
+    assert total == len(matching)
+    pd.testing.assert_frame_equal(rows, matching.iloc[50:100])
+    rows, total = sa.table_page(df, filter_column='REPORT', filter_text='Z', sort_by='RESPTI', ascending=False)
+    matching = df[df['REPORT'].isin(['ZSALES', 'zstock'])]
+    assert total == len(matching)
+    pd.testing.assert_frame_equal(rows, matching.sort_values('RESPTI', ascending=False, kind='stable').iloc[:100])
+    # Page au-delà de la fin, colonne de tri ou de filtre inconnue.
+    assert sa.table_page(df, page=20, page_size=100)[0].empty
+    pd.testing.assert_frame_equal(sa.table_page(df, sort_by='ABSENT', filter_column='ABSENT', filter_text='x')[0],
+                                  df.iloc[:100])
+
+# --- KPIs d'en-tête : résumé par groupes (build_kpi_summary) contre parcours complet (compute_global_kpis) ---
+
+def kpi_frames(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    systems = rng.choice(['PRD', 'QAS'], n)
+    accounts = rng.choice(['ALICE', 'BOB', 'CAROL'], n)
+    hitlist = pd.DataFrame({'SYSTEM': systems, 'ACCOUNT': accounts, 'REPORT': rng.choice(['ZSALES', 'ZSTOCK'], n),
+                            'TASKTYPE': rng.choice(['DIALOG', 'RFC'], n), 'RESPTI': rng.lognormal(6, 1, n),
+                            'CPUTI': rng.lognormal(4, 1, n), 'DBCALLS': rng.integers(0, 500, n).astype(float)})
+    hitlist.loc[rng.random(n) < 0.05, 'RESPTI'] = np.nan
+    memory = pd.DataFrame({'SYSTEM': systems[:n // 2], 'ACCOUNT': accounts[:n // 2],
+                           'USEDBYTES': rng.integers(1_000_000, 50_000_000, n // 2).astype(float)})
+    sql = pd.DataFrame({'SYSTEM': systems[:50], 'TOTALEXEC': rng.integers(1, 1000, 50).astype(float)})
+    return {'hitlist_db': hitlist, 'memory': memory, 'sql_trace_summary': sql}
+
+SELECTIONS = [{}, {'accounts': ['BOB']}, {'systems': ['QAS'], 'tasktypes': ['RFC']},
+              {'accounts': ['ALICE', 'CAROL'], 'reports': ['ZSTOCK'], 'systems': ['PRD']}, {'accounts': ['INCONNU']}]
+
+def assert_kpis_equal(actual, expected):
+    assert actual.keys() == expected.keys()
+    for kpi, value in expected.items():
+        assert actual[kpi] == pytest.approx(value, rel=1e-9), kpi
+
+@pytest.mark.parametrize('selection', SELECTIONS)
+def test_kpis_from_summary_match_a_full_scan(selection):
+    dfs = kpi_frames()
+    summary = sa.build_kpi_summary(dfs)
+    assert_kpis_equal(sa.kpis_from_summary(summary, **selection),
+                      sa.compute_global_kpis(sa.apply_global_filters(dfs, **selection)))
+
+def test_add_to_kpi_summary_matches_a_rebuild():
+    dfs = kpi_frames()
+    head = {source: df.iloc[:len(df) // 3] for source, df in dfs.items()}
+    summary = sa.build_kpi_summary(head)
+    for source, df in dfs.items():
+        summary = sa.add_to_kpi_summary(summary, source, df.iloc[len(df) // 3:])
+    # Nouveau compte apparu dans un ajout ultérieur, et ajout vide sans effet.
+    extra = dfs['hitlist_db'].iloc[:10].assign(ACCOUNT='DAVE')
+    summary = sa.add_to_kpi_summary(summary, 'hitlist_db', extra)
+    assert sa.add_to_kpi_summary(summary, 'memory', dfs['memory'].iloc[0:0]) is summary
+    full = {**dfs, 'hitlist_db': pd.concat([dfs['hitlist_db'], extra], ignore_index=True)}
+    for selection in SELECTIONS + [{'accounts': ['DAVE']}]:
+        assert_kpis_equal(sa.kpis_from_summary(summary, **selection),
+                          sa.compute_global_kpis(sa.apply_global_filters(full, **selection)))
+
+# --- Comparaison de régression (Welch sur log1p, Benjamini-Hochberg) ---
+
+def comparison_frame(shift, n=400, seed=0, start='2025-05-01'):
+    """Pas de dialogue horodatés sur quatre programmes ; ZSLOW voit son RESPTI multiplié par `shift`."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'REPORT': np.array(['ZSLOW', 'ZSAME', 'ZFAST', 'ZBIG'])[np.arange(n) % 4],
+                       'TASKTYPE': 'DIALOG', 'FULL_DATETIME': pd.Timestamp(start) + pd.to_timedelta(np.arange(n) * 3, unit='min'),
+                       'RESPTI': rng.lognormal(6, 0.5, n), 'CPUTI': rng.lognormal(4, 0.5, n),
+                       'DBCALLS': rng.integers(0, 100, n).astype(float)})
+    df.loc[df['REPORT'] == 'ZSLOW', 'RESPTI'] *= shift
+    return df
+
+def test_benjamini_hochberg_matches_scipy():
+    p_values = np.array([0.01, 0.04, np.nan, 0.03, 0.5, 0.001, 0.04])
+    q_values = sa.benjamini_hochberg(p_values)
+    valid = ~np.isnan(p_values)
+    np.testing.assert_allclose(q_values[valid], stats.false_discovery_control(p_values[valid], method='bh'))
+    assert np.isnan(q_values[2])
+    assert sa.benjamini_hochberg([]).size == 0
+
+def test_compare_aggregates_matches_welch_on_log_values():
+    baseline, candidate = comparison_frame(1.0), comparison_frame(3.0, seed=1)
+    result = sa.compare_aggregates(sa.comparison_aggregates(baseline, 'REPORT', ['RESPTI', 'CPUTI']).groupby(level=0).sum(),
+                                   sa.comparison_aggregates(candidate, 'REPORT', ['RESPTI', 'CPUTI']).groupby(level=0).sum())
+    assert len(result) == 8
+    for row in result.itertuples():
+        base = baseline.loc[baseline['REPORT'] == row.KEY, row.METRIC]
+        cand = candidate.loc[candidate['REPORT'] == row.KEY, row.METRIC]
+        welch = stats.ttest_ind(np.log1p(cand), np.log1p(base), equal_var=False)
+        assert row.T_STAT == pytest.approx(welch.statistic, rel=1e-6)
+        assert row.P_VALUE == pytest.approx(welch.pvalue, rel=1e-6, abs=1e-300)
+        assert row.MEAN_CAND - row.MEAN_BASE == pytest.approx(cand.mean() - base.mean())
+    np.testing.assert_allclose(result['Q_VALUE'], stats.false_discovery_control(result['P_VALUE'], method='bh'))
+    statuses = result.set_index(['KEY', 'METRIC'])['STATUS']
+    assert statuses[('ZSLOW', 'RESPTI')] == 'régression'
+    assert (statuses.drop(('ZSLOW', 'RESPTI')) == 'stable').all()
+    assert result.iloc[0]['KEY'] == 'ZSLOW'
+
+def test_compare_snapshots_by_window_and_new_keys():
+    before = comparison_frame(1.0)
+    after = comparison_frame(0.3, seed=1, start='2025-05-02')
+    after.loc[after['REPORT'] == 'ZBIG', 'REPORT'] = 'ZNEW'
+    aggregates = sa.build_comparison_aggregates({'hitlist_db': pd.concat([before, after], ignore_index=True)})
+    assert aggregates['SQL_FINGERPRINT'] is None
+    first_hour, last_hour = sa.comparison_time_range(aggregates)
+    assert first_hour == pd.Timestamp('2025-05-01') and last_hour > pd.Timestamp('2025-05-02')
+    split = pd.Timestamp('2025-05-02')
+    comparison = sa.compare_snapshots(aggregates, aggregates, (None, split), (split, None))
+    assert comparison['SQL_FINGERPRINT'] is None
+    statuses = comparison['REPORT'].set_index(['KEY', 'METRIC'])['STATUS']
+    assert statuses[('ZSLOW', 'RESPTI')] == 'amélioration'
+    assert statuses[('ZNEW', 'RESPTI')] == 'nouveau' and statuses[('ZBIG', 'RESPTI')] == 'disparu'
+    assert comparison['TASKTYPE']['N_BASE'].sum() == len(before) * 3
+    # Deux snapshots sans fenêtre : toute la période de chacun.
+    whole = sa.compare_snapshots(sa.build_comparison_aggregates({'hitlist_db': before}),
+                                 sa.build_comparison_aggregates({'hitlist_db': after}))
+    pd.testing.assert_frame_equal(whole['REPORT'], comparison['REPORT'])
@@ -0,0 +1,128 @@
+"""Tests de l'historique hiérarchisé (sap_retention) : intégration, dédoublonnage, compactage, tendances et persistance."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import sap_retention as sr
+
+SOURCES = {'hitlist_db': ['RESPTI', 'CPUTI']}
+
+def synthetic_hitlist(days=6, seed=0, start='2025-05-01'):
+    """Pas de dialogue toutes les 10 minutes sur deux systèmes et trois comptes, métriques log-normales."""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=days * 24 * 6, freq='10min')
+    n = len(times)
+    return pd.DataFrame({'SYSTEM': np.where(np.arange(n) % 2, 'PRD', 'QAS'),
+                         'ACCOUNT': np.array(['ALICE', 'BOB', 'CAROL'])[np.arange(n) % 3],
+                         'REPORT': 'ZREPORT', 'TASKTYPE': 'DIALOG', 'FULL_DATETIME': times,
+                         'RESPTI': rng.lognormal(6, 1, n).round(), 'CPUTI': rng.lognormal(4, 1, n).round(),
+                         'WPID': 1})
+
+def make_history():
+    return sr.TieredHistory(SOURCES, raw_retention=pd.Timedelta(days=1), hourly_retention=pd.Timedelta(days=3))
+
+def test_history_rows_keeps_dimensions_timestamp_and_metrics():
+    rows = sr.history_rows(synthetic_hitlist(days=1).drop(columns='TASKTYPE'), SOURCES['hitlist_db'])
+    assert list(rows.columns) == sr.ROLLUP_DIMENSIONS + ['FULL_DATETIME', 'RESPTI', 'CPUTI']
+    assert rows['TASKTYPE'].isna().all()
+    assert rows['FULL_DATETIME'].dtype == 'datetime64[ns]'
+    assert sr.history_rows(pd.DataFrame(), SOURCES['hitlist_db']).empty
+
+def test_ingest_adds_each_row_once():
+    df = synthetic_hitlist()
+    history = make_history()
+    assert history.ingest('hitlist_db', df) == len(df)
+    assert history.ingest('hitlist_db', df) == 0
+    # Relecture du même export avec des horodatages en microsecondes (Parquet) : rien n'est ajouté.
+    assert history.ingest('hitlist_db', df.astype({'FULL_DATETIME': 'datetime64[us]'})) == 0
+    assert len(history.raw['hitlist_db']) == len(df)
+    assert history.latest() == df['FULL_DATETIME'].max()
+
+def test_ingest_keeps_late_and_repeated_rows_within_the_raw_window():
+    df = synthetic_hitlist(days=2)
+    history = make_history()
+    history.ingest('hitlist_db', df)
+    last = df.iloc[[-1]]
+    # Même horodatage que le dernier intégré : une ligne différente et une seconde occurrence de la dernière ligne.
+    late = pd.concat([last.assign(RESPTI=1.0), last, last, df.iloc[[-50]].assign(ACCOUNT='DAVE')])
+    assert history.ingest('hitlist_db', late) == 3
+    assert history.ingest('hitlist_db', late) == 0
+    assert history.rejected['hitlist_db'] == 0
+
+def test_ingest_rejects_rows_older_than_the_raw_window():
+    df = synthetic_hitlist()
+    history = make_history()
+    history.ingest('hitlist_db', df)
+    history.compact()
+    old = df.iloc[:10].assign(RESPTI=1.0)
+    assert history.ingest('hitlist_db', old) == 0
+    assert history.rejected['hitlist_db'] == 10
+    assert history.stats().loc[0, 'REJECTED'] == 10
+
+def test_compact_moves_rows_through_the_tiers_without_losing_counts():
+    df = synthetic_hitlist()
+    history = make_history()
+    history.ingest('hitlist_db', df)
+    history.compact()
+    latest = df['FULL_DATETIME'].max()
+    raw, hourly, daily = history.raw['hitlist_db'], history.hourly['hitlist_db'], history.daily['hitlist_db']
+    assert raw['FULL_DATETIME'].min() >= (latest - pd.Timedelta(days=1)).floor('h')
+    assert hourly.frame['PERIOD'].min() >= (latest - pd.Timedelta(days=3)).floor('D')
+    assert (daily.frame['PERIOD'] == daily.frame['PERIOD'].dt.floor('D')).all()
+    assert len(raw) + hourly.frame['RESPTI_COUNT'].sum() + daily.frame['RESPTI_COUNT'].sum() == len(df)
+    assert daily.frame['RESPTI_SUM'].sum() + hourly.frame['RESPTI_SUM'].sum() + raw['RESPTI'].sum() == pytest.approx(df['RESPTI'].sum())
+    assert daily.sketches['RESPTI'].sum() == daily.frame['RESPTI_COUNT'].sum()
+    # Un second compactage sans nouvelles lignes ne change rien.
+    stats = history.stats()
+    history.compact()
+    pd.testing.assert_frame_equal(history.stats(), stats)
+
+def test_trend_reads_all_tiers():
+    df = synthetic_hitlist()
+    history = make_history()
+    history.ingest('hitlist_db', df)
+    history.compact()
+    trend = history.trend('hitlist_db', 'RESPTI')
+    assert set(trend['TIER']) == {'daily', 'hourly', 'raw'}
+    assert trend['PERIOD'].is_monotonic_increasing
+    assert trend['COUNT'].sum() == len(df)
+
+    daily = trend[trend['TIER'] == 'daily'].set_index('PERIOD')
+    expected = df.groupby(df['FULL_DATETIME'].dt.floor('D'))['RESPTI'].agg(['count', 'mean', 'median']).loc[daily.index]
+    np.testing.assert_allclose(daily['MEAN'], expected['mean'])
+    # Les sketches garantissent une erreur relative d'environ 11 % sur les quantiles.
+    assert ((daily['P50'] / expected['median'] - 1).abs() < 0.15).all()
+
+    selected = history.trend('hitlist_db', 'RESPTI', selections={'SYSTEM': ['PRD'], 'ACCOUNT': ['BOB']})
+    assert selected['COUNT'].sum() == ((df['SYSTEM'] == 'PRD') & (df['ACCOUNT'] == 'BOB')).sum()
+    assert history.trend('hitlist_db', 'RESPTI', start=df['FULL_DATETIME'].max() + pd.Timedelta(hours=1)).empty
+
+def test_save_load_round_trip(tmp_path):
+    df = synthetic_hitlist()
+    history = make_history()
+    history.ingest('hitlist_db', df)
+    history.compact()
+    history.ingest('hitlist_db', df.iloc[:5].assign(RESPTI=1.0))
+    history.save(tmp_path)
+
+    loaded = sr.TieredHistory.load(tmp_path, sources=SOURCES, raw_retention=pd.Timedelta(days=1),
+                                   hourly_retention=pd.Timedelta(days=3))
+    pd.testing.assert_frame_equal(loaded.stats(), history.stats())
+    assert loaded.rejected == {'hitlist_db': 5}
+    assert loaded.watermarks == history.watermarks
+    pd.testing.assert_frame_equal(loaded.trend('hitlist_db', 'RESPTI'), history.trend('hitlist_db', 'RESPTI'))
+    for tier in ('hourly', 'daily'):
+        np.testing.assert_array_equal(getattr(loaded, tier)['hitlist_db'].sketches['RESPTI'],
+                                      getattr(history, tier)['hitlist_db'].sketches['RESPTI'])
+    # Les lignes brutes relues du Parquet se dédoublonnent contre l'export d'origine.
+    assert loaded.ingest('hitlist_db', df) == 0
+    assert sr.TieredHistory.load(tmp_path / 'absent', sources=SOURCES).stats()['RAW'].sum() == 0
+
+def test_update_history_is_idempotent(tmp_path):
+    dfs = {'hitlist_db': synthetic_hitlist(days=2), 'usertcode': synthetic_hitlist(days=2, seed=1)}
+    first = sr.update_history(tmp_path, dfs)
+    assert first.stats()['RAW'].sum() + sum(len(first.hourly[source]) for source in first.sources) > 0
+    mtime = (tmp_path / 'watermarks.json').stat().st_mtime_ns
+    second = sr.update_history(tmp_path, dfs)
+    pd.testing.assert_frame_equal(second.stats(), first.stats())
+    assert (tmp_path / 'watermarks.json').stat().st_mtime_ns == mtime
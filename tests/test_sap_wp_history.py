@@ -0,0 +1,103 @@
+"""Tests du journal des processus de travail (sap_wp_history) : deltas par WP, disparitions, lectures et persistance."""
+import pandas as pd
+import pytest
+
+import sap_wp_history as wh
+
+T0 = pd.Timestamp('2025-05-01 08:00')
+
+def perf(*wps):
+    """Table AL_GET_PERFORMANCE : un tuple (WP_NO, WP_TYP, WP_PID, WP_STATUS, CPU, IWAIT, IRESTRT) par WP."""
+    return pd.DataFrame(list(wps), columns=['WP_NO', 'WP_TYP', 'WP_PID', 'WP_STATUS', 'WP_CPU_SECONDS', 'WP_IWAIT_SECONDS',
+                                            'WP_IRESTRT'])
+
+SNAPSHOTS = [
+    perf((0, 'DIA', 100, 'Waiting', 10, 0, 0), (1, 'DIA', 101, 'Waiting', 20, 0, 0), (2, 'BTC', 102, 'Running', 30, 0, 0)),
+    # Aucun changement.
+    perf((0, 'DIA', 100, 'Waiting', 10, 0, 0), (1, 'DIA', 101, 'Waiting', 20, 0, 0), (2, 'BTC', 102, 'Running', 30, 0, 0)),
+    # WP 0 : CPU +5 ; WP 1 : occupé, redémarrage compté ; WP 2 : nouveau PID, compteur CPU repart de zéro.
+    perf((0, 'DIA', 100, 'Waiting', 15, 0, 0), (1, 'DIA', 101, 'Running', 20, 3, 1), (2, 'BTC', 202, 'Running', 2, 0, 0)),
+    # WP 2 disparaît ; WP 1 libéré après avoir consommé 4 s de CPU.
+    perf((0, 'DIA', 100, 'Waiting', 15, 0, 0), (1, 'DIA', 101, 'Waiting', 24, 0, 1)),
+    # WP 2 toujours absent : pas de nouvelle ligne.
+    perf((0, 'DIA', 100, 'Waiting', 15, 0, 0), (1, 'DIA', 101, 'Waiting', 24, 0, 1)),
+]
+
+def build_history(instance='PRD_00'):
+    history = wh.WorkProcessHistory()
+    results = [history.ingest(df, T0 + pd.Timedelta(minutes=i), instance) for i, df in enumerate(SNAPSHOTS)]
+    return history, results
+
+def test_ingest_records_only_changed_work_processes():
+    history, results = build_history()
+    assert results == [3, 0, 3, 2, 0]
+    changes = history.changes.set_index(['TIMESTAMP', 'WP_NO'])
+    t2, t3 = T0 + pd.Timedelta(minutes=2), T0 + pd.Timedelta(minutes=3)
+    # Première vue : référence sans delta.
+    assert (changes.loc[T0, 'CPU_DELTA'] == 0).all()
+    assert changes.loc[(t2, 0), 'CPU_DELTA'] == 5
+    assert changes.loc[(t2, 1), 'RESTART_DELTA'] == 1 and changes.loc[(t2, 1), 'WP_STATUS'] == 'Running'
+    assert changes.loc[(t2, 2), 'PID_CHANGED'] and changes.loc[(t2, 2), 'CPU_DELTA'] == 2
+    assert changes.loc[(t3, 1), 'CPU_DELTA'] == 4 and changes.loc[(t3, 1), 'RESTART_DELTA'] == 0
+    assert changes.loc[(t3, 2), 'WP_STATUS'] == wh.WP_ABSENT_STATUS
+    assert history.changes.dtypes.to_dict() == {col: pd.Series(dtype=dtype).dtype for col, dtype in wh.CHANGE_DTYPES.items()}
+    assert list(history.snapshots['WPS']) == [3, 3, 3, 2, 2]
+
+def test_ingest_ignores_snapshots_not_after_the_last_one():
+    history, _ = build_history()
+    last = history.last_timestamp('PRD_00')
+    assert history.ingest(SNAPSHOTS[0], last, 'PRD_00') is None
+    assert history.ingest(SNAPSHOTS[0], last - pd.Timedelta(minutes=1), 'PRD_00') is None
+    # Une autre instance a son propre état et sa propre chronologie.
+    assert history.ingest(SNAPSHOTS[0], T0, 'QAS_00') == 3
+    assert len(history.snapshots) == len(SNAPSHOTS) + 1
+
+def test_ingest_counts_a_decreasing_restart_counter_as_restarts():
+    history = wh.WorkProcessHistory()
+    history.ingest(perf((0, 'DIA', 100, 'Waiting', 10, 0, 5)), T0)
+    history.ingest(perf((0, 'DIA', 100, 'Waiting', 10, 0, 2)), T0 + pd.Timedelta(minutes=1))
+    assert history.changes['RESTART_DELTA'].iloc[-1] == 2
+    assert len(wh.wp_restart_events(history)) == 1
+
+def test_readers_rebuild_cpu_busy_and_restarts():
+    history, _ = build_history()
+    rate = wh.wp_cpu_rate(history, freq='1min')
+    assert rate['CPU_SECONDS'].sum() == pytest.approx(5 + 2 + 4)
+    assert rate['CPU_RATE'].max() == pytest.approx(5 / 60)
+
+    busy = wh.wp_busy_counts(history).set_index(['TIMESTAMP', 'WP_TYP'])['BUSY']
+    t2, t3 = T0 + pd.Timedelta(minutes=2), T0 + pd.Timedelta(minutes=3)
+    assert busy[(T0, 'BTC')] == 1 and busy[(T0, 'DIA')] == 0
+    assert busy[(t2, 'DIA')] == 1 and busy[(t3, 'DIA')] == 0 and busy[(t3, 'BTC')] == 0
+
+    activity = wh.wp_activity(history).set_index('WP_NO')
+    assert activity.loc[1, 'BUSY_SECONDS'] == 60
+    assert activity.loc[2, 'BUSY_SECONDS'] == 180
+    assert activity.loc[2, 'PID_CHANGES'] == 1 and activity.loc[1, 'RESTARTS'] == 1
+    assert set(wh.wp_activity(history, wp_types=['BTC'])['WP_NO']) == {2}
+
+    restarts = wh.wp_restart_events(history)
+    assert list(restarts['WP_NO']) == [1, 2]
+
+def test_save_load_round_trip_continues_the_deltas(tmp_path):
+    history, _ = build_history()
+    history.save(tmp_path)
+    loaded = wh.WorkProcessHistory.load(tmp_path)
+    pd.testing.assert_frame_equal(loaded.changes, history.changes)
+    pd.testing.assert_frame_equal(loaded.snapshots, history.snapshots)
+    assert loaded.last_timestamp('PRD_00') == history.last_timestamp('PRD_00')
+    following = perf((0, 'DIA', 100, 'Waiting', 18, 0, 0), (1, 'DIA', 101, 'Waiting', 24, 0, 1),
+                     (2, 'BTC', 302, 'Waiting', 1, 0, 0))
+    timestamp = T0 + pd.Timedelta(minutes=10)
+    assert loaded.ingest(following, timestamp, 'PRD_00') == history.ingest(following, timestamp, 'PRD_00') == 2
+    pd.testing.assert_frame_equal(loaded.changes, history.changes)
+    assert wh.WorkProcessHistory.load(tmp_path / 'absent').changes.empty
+
+def test_update_wp_history_sorts_snapshots_and_is_idempotent(tmp_path):
+    snapshots = [('PRD_00', T0 + pd.Timedelta(minutes=i), df) for i, df in enumerate(SNAPSHOTS)]
+    history = wh.update_wp_history(tmp_path, snapshots[::-1])
+    pd.testing.assert_frame_equal(history.changes, build_history()[0].changes)
+    mtime = (tmp_path / 'wp_changes.arrow').stat().st_mtime_ns
+    again = wh.update_wp_history(tmp_path, snapshots)
+    assert len(again.snapshots) == len(SNAPSHOTS)
+    assert (tmp_path / 'wp_changes.arrow').stat().st_mtime_ns == mtime